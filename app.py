@@ -1,7 +1,10 @@
 ﻿import os
+import bisect
+import itertools
+import time
 import traceback
 import click
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import (
@@ -12,6 +15,17 @@ from flask_login import (
     login_required,
     current_user,
 )
+from app_logging import configure_logging, get_logger
+import archive_store
+import perf_metrics
+import request_profiler
+
+# 日誌：經佇列非同步輸出，DEBUG 預設關閉，可用 LOG_LEVEL / LOG_LEVEL_<子系統> 個別開啟
+logger = configure_logging()
+fifo_logger = get_logger("fifo")
+cash_logger = get_logger("cash")
+settlement_logger = get_logger("settlement")
+profit_logger = get_logger("profit")
 
 def get_safe_operator_id():
     """安全獲取操作員ID，避免current_user訪問失敗"""
@@ -21,7 +35,7 @@ def get_safe_operator_id():
         else:
             return 1  # 默認系統用戶ID
     except Exception as e:
-        print(f"[WARNING] 獲取current_user.id失敗: {e}, 使用默認值1")
+        logger.warning("[WARNING] 獲取current_user.id失敗: %s, 使用默認值1", e)
         return 1
 
 
@@ -35,7 +49,7 @@ def fix_postgresql_columns():
         if 'postgresql' not in database_url:
             return True
         
-        print("[FIX] 檢查PostgreSQL欄位...")
+        logger.info("[FIX] 檢查PostgreSQL欄位...")
         
         # 檢查ledger_entries表格欄位
         columns_query = text("""
@@ -61,7 +75,7 @@ def fix_postgresql_columns():
         missing_columns = [col for col, _ in columns_to_add if col not in existing_columns]
         
         if missing_columns:
-            print(f"[FIX] 發現缺少欄位: {missing_columns}，正在修復...")
+            logger.info("[FIX] 發現缺少欄位: %s，正在修復...", missing_columns)
             
             for column_name, column_type in columns_to_add:
                 if column_name in missing_columns:
@@ -72,25 +86,26 @@ def fix_postgresql_columns():
                         """)
                         db.session.execute(alter_query)
                         db.session.commit()
-                        print(f"[OK] 添加欄位: {column_name}")
+                        logger.info("[OK] 添加欄位: %s", column_name)
                     except Exception as e:
                         if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print(f"ℹ️ 欄位已存在: {column_name}")
+                            logger.info("ℹ️ 欄位已存在: %s", column_name)
                         else:
-                            print(f"[ERROR] 添加欄位 {column_name} 失敗: {e}")
+                            logger.error("[ERROR] 添加欄位 %s 失敗: %s", column_name, e)
                             db.session.rollback()
         else:
-            print("[OK] PostgreSQL欄位檢查通過")
+            logger.info("[OK] PostgreSQL欄位檢查通過")
         
         return True
         
     except Exception as e:
-        print(f"[WARNING] PostgreSQL欄位修復失敗: {e}")
+        logger.warning("[WARNING] PostgreSQL欄位修復失敗: %s", e)
         return False
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from datetime import datetime, date, timezone
-from sqlalchemy import func, and_, text
+from types import SimpleNamespace
+from sqlalchemy import func, and_, text, event
 
 # ===================================================================
 # 2. App、資料庫、遷移與登入管理器的初始化
@@ -110,7 +125,7 @@ if os.environ.get('DATABASE_URL'):
         database_url = database_url.replace('postgresql://', 'postgresql+psycopg://', 1)
     
     
-    print(f"使用資料庫連接字串: {database_url[:50]}...")
+    logger.info("使用資料庫連接字串: %s...", database_url[:50])
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 else:
     # 本地開發環境 - 使用 SQLite
@@ -125,10 +140,16 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
+perf_metrics.init_app(app)
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 login_manager.login_message = "請先登入以存取此頁面。"
 login_manager.login_message_category = "info"
+request_profiler.init_app(
+    app,
+    lambda: current_user.is_authenticated and current_user.is_admin,
+    logger,
+)
 
 # 在應用程式啟動時初始化資料庫
 def init_database():
@@ -139,26 +160,26 @@ def init_database():
             inspector = db.inspect(db.engine)
             existing_tables = inspector.get_table_names()
             
-            print(f"檢查資料庫表格: {existing_tables}")
+            logger.info("檢查資料庫表格: %s", existing_tables)
             
             if 'user' not in existing_tables:
                 # 只有當表格不存在時才創建
-                print("創建資料庫表格...")
+                logger.info("創建資料庫表格...")
                 db.create_all()
-                print("資料庫表格已創建")
+                logger.info("資料庫表格已創建")
             else:
-                print("資料庫表格已存在")
+                logger.info("資料庫表格已存在")
                 
                 # 檢查現有數據
                 try:
                     user_count = User.query.count()
-                    print(f"現有用戶數量: {user_count}")
+                    logger.info("現有用戶數量: %s", user_count)
                     
                     if user_count > 0:
-                        print("資料庫中已有數據，跳過初始化")
+                        logger.info("資料庫中已有數據，跳過初始化")
                         return
                 except Exception as e:
-                    print(f"檢查用戶數據時出錯: {e}")
+                    logger.error("檢查用戶數據時出錯: %s", e)
             
             # 檢查是否已有管理員帳戶
             admin_user = User.query.filter_by(username='admin').first()
@@ -173,30 +194,70 @@ def init_database():
                 
                 db.session.add(admin_user)
                 db.session.commit()
-                print("預設管理員帳戶創建成功")
-                print("   用戶名: admin")
-                print("   密碼: admin123")
-                print("   請在首次登入後立即修改密碼！")
+                logger.info("預設管理員帳戶創建成功")
+                logger.info("   用戶名: admin")
+                logger.info("   密碼: admin123")
+                logger.info("   請在首次登入後立即修改密碼！")
             else:
-                print("管理員帳戶已存在")
+                logger.info("管理員帳戶已存在")
                 
     except Exception as e:
-        print(f"資料庫初始化失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("資料庫初始化失敗: %s", e)
         db.session.rollback()
 
-# 使用 Flask 3.x 兼容的方式初始化資料庫
-@app.before_request
-def before_request():
-    """在每個請求前檢查資料庫是否已初始化"""
-    if not hasattr(app, '_database_initialized'):
-        print("首次請求，初始化資料庫...")
-        init_database()
-        app._database_initialized = True
-        print("資料庫初始化完成")
-    else:
-        print("資料庫已初始化，跳過")
+class SchemaError(RuntimeError):
+    """資料庫結構與模型定義不符"""
+
+
+# 結構檢查結果快取：啟動後只檢查一次，請求路徑不再因缺欄位而臨時 ALTER TABLE
+_schema_status = {"checked": False, "missing": {}}
+
+
+def verify_schema(force=False):
+    """比對所有模型的資料表與欄位是否存在於資料庫
+
+    結果會快取，之後的呼叫不再查詢資料庫；有缺少時拋出 SchemaError，
+    請先執行 flask db upgrade（Render 部署會在啟動前執行 fix_postgresql_columns.py）。
+    """
+    if force or not _schema_status["checked"]:
+        inspector = db.inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+        missing = {}
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                missing[table.name] = None
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            absent = [column.name for column in table.columns if column.name not in existing_columns]
+            if absent:
+                missing[table.name] = absent
+        _schema_status.update(checked=True, missing=missing)
+
+    missing = _schema_status["missing"]
+    if missing:
+        details = "；".join(
+            f"{table_name}（資料表不存在）" if columns is None else f"{table_name}: {', '.join(columns)}"
+            for table_name, columns in missing.items()
+        )
+        raise SchemaError(f"資料庫結構缺少 {details}，請執行 flask db upgrade")
+    return True
+
+
+def startup():
+    """啟動時執行一次：初始化資料庫並檢查結構
+
+    由 gunicorn.conf.py 在 master 行程載入應用後呼叫（配合 preload_app，
+    fork 出的 worker 直接繼承結果），或在 python app.py 啟動前呼叫；請求路徑不再做任何初始化檢查。
+    """
+    if getattr(app, "_database_initialized", False):
+        return
+    init_database()
+    with app.app_context():
+        verify_schema()
+        # 關閉 master 行程的連線，避免 fork 後多個 worker 共用同一個資料庫連線
+        db.engine.dispose()
+    app._database_initialized = True
+    logger.info("資料庫初始化完成")
 
 # ===================================================================
 # 3. 資料庫模型 (Models) 定義 - 【V4.0 職責分離重構版】
@@ -275,6 +336,9 @@ class Channel(db.Model):
 
 class PurchaseRecord(db.Model):
     __tablename__ = "purchase_records"
+    __table_args__ = (
+        db.Index("ix_purchase_records_purchase_date", "purchase_date"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     payment_account_id = db.Column(
         db.Integer, db.ForeignKey("cash_accounts.id"), nullable=True
@@ -325,6 +389,15 @@ class PendingPayment(db.Model):
 class FIFOInventory(db.Model):
     """FIFO庫存模型 - 記錄每批貨物的庫存狀態"""
     __tablename__ = "fifo_inventory"
+    __table_args__ = (
+        # FIFO 分配只掃描仍有庫存的批次
+        db.Index(
+            "ix_fifo_inventory_available_purchase_date",
+            "purchase_date",
+            postgresql_where=text("remaining_rmb > 0"),
+            sqlite_where=text("remaining_rmb > 0"),
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     purchase_record_id = db.Column(db.Integer, db.ForeignKey("purchase_records.id"), nullable=False)
     
@@ -349,6 +422,10 @@ class FIFOInventory(db.Model):
 class FIFOSalesAllocation(db.Model):
     """FIFO銷售分配模型 - 記錄每次銷售從哪批庫存中扣除"""
     __tablename__ = "fifo_sales_allocations"
+    __table_args__ = (
+        db.Index("ix_fifo_sales_allocations_sales_record_id", "sales_record_id"),
+        db.Index("ix_fifo_sales_allocations_fifo_inventory_id", "fifo_inventory_id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     
     # 關聯ID
@@ -370,6 +447,10 @@ class FIFOSalesAllocation(db.Model):
 
 class SalesRecord(db.Model):
     __tablename__ = "sales_records"
+    __table_args__ = (
+        db.Index("ix_sales_records_customer_settled_created", "customer_id", "is_settled", "created_at"),
+        db.Index("ix_sales_records_created_at", "created_at"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(
         db.Integer, db.ForeignKey("customers.id"), nullable=False
@@ -411,8 +492,35 @@ class Transaction(db.Model):
     twd_account = db.relationship("CashAccount")
 
 
+# 系統利潤流水的類型（ProfitService.LEDGER_ENTRY_TYPES）與利潤歷史部分索引的條件。
+# SQLite 只在查詢條件逐字包含索引條件時才使用部分索引，查詢以 ProfitService.history_filter() 產生相同的字面值。
+PROFIT_LEDGER_ENTRY_TYPES = (
+    "PROFIT_EARNED",
+    "PROFIT_WITHDRAW",
+    "PROFIT_DEDUCT",
+    "PROFIT_REVERSAL",
+    "PROFIT_RECONCILE",
+)
+PROFIT_HISTORY_INDEX_WHERE = (
+    f"entry_type IN ({', '.join(repr(name) for name in PROFIT_LEDGER_ENTRY_TYPES)}) AND entry_date IS NOT NULL"
+)
+
+
 class LedgerEntry(db.Model):
     __tablename__ = "ledger_entries"
+    __table_args__ = (
+        db.Index("ix_ledger_entries_entry_type_entry_date", "entry_type", "entry_date"),
+        # 利潤歷史依 (entry_date, id) 游標分頁，每頁是這個索引上的一次範圍讀取
+        db.Index(
+            "ix_ledger_entries_profit_history",
+            "entry_date",
+            "id",
+            postgresql_where=text(PROFIT_HISTORY_INDEX_WHERE),
+            sqlite_where=text(PROFIT_HISTORY_INDEX_WHERE),
+        ),
+        db.Index("ix_ledger_entries_entry_date", "entry_date"),
+        db.Index("ix_ledger_entries_account_id_entry_date", "account_id", "entry_date"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     entry_type = db.Column(db.String(50), nullable=False, index=True)
     account_id = db.Column(
@@ -570,6 +678,55 @@ class ProfitTransaction(db.Model):
         return f'<ProfitTransaction {self.id}: {self.transaction_type} {self.amount} on account {self.account_id}>'
 
 
+class ProfitCubeCell(db.Model):
+    """利潤分析立方體 - 依 (日期, 客戶, 渠道, 出貨帳戶) 預先彙總的 FIFO 利潤
+
+    屬於衍生資料：由 ProfitCubeService 在售出寫入 / 回滾時依 (日期, 客戶) 增量重算，
+    可隨時以 flask rebuild-profit-cube 全量重建，因此不設外鍵。
+    """
+    __tablename__ = "profit_cube"
+    __table_args__ = (
+        db.Index("ix_profit_cube_day_customer", "day", "customer_id"),
+        db.Index("ix_profit_cube_channel_day", "channel_id", "day"),
+        db.Index("ix_profit_cube_account_day", "account_id", "day"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # 維度
+    day = db.Column(db.Date, nullable=False)
+    customer_id = db.Column(db.Integer, nullable=False)
+    channel_id = db.Column(db.Integer, nullable=True)  # 買入渠道（可能為空）
+    account_id = db.Column(db.Integer, nullable=True)  # 售出扣款的 RMB 帳戶
+
+    # 度量
+    profit_twd = db.Column(db.Float, nullable=False, default=0.0)
+    revenue_twd = db.Column(db.Float, nullable=False, default=0.0)
+    cost_twd = db.Column(db.Float, nullable=False, default=0.0)
+    rmb_volume = db.Column(db.Float, nullable=False, default=0.0)
+    margin = db.Column(db.Float, nullable=False, default=0.0)  # profit / revenue
+    sales_count = db.Column(db.Integer, nullable=False, default=0)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ProfitCubeCell {self.day} customer={self.customer_id} channel={self.channel_id} profit={self.profit_twd}>"
+
+
+class DataVersion(db.Model):
+    """資料版本計數器 - 每個名稱一列，相關資料寫入時在同一個交易內加一
+
+    各 worker 的快取以主鍵讀取這個計數器判斷是否失效，不必對大表做彙總查詢。
+    """
+    __tablename__ = "data_versions"
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DataVersion {self.name}={self.version}>"
+
+
 # ===================================================================
 # 應收帳款管理服務類
 # ===================================================================
@@ -578,6 +735,193 @@ class ProfitTransaction(db.Model):
 # 應收帳款應在業務邏輯中直接更新，而不是通過重新計算
 
 
+class ReceivablesAgingService:
+    """應收帳款帳齡服務類 - 以未結清銷售記錄計算每位客戶的帳齡區間"""
+
+    # (鍵值, 顯示名稱, 帳齡上限天數)；最後一個區間沒有上限
+    BUCKETS = [
+        ("days_0_7", "0–7 天", 7),
+        ("days_8_30", "8–30 天", 30),
+        ("days_31_60", "31–60 天", 60),
+        ("days_over_60", "60 天以上", None),
+    ]
+
+    _cache = {"key": None, "report": None}
+
+    @staticmethod
+    def get_ledger_version():
+        """以單一查詢取得帳本版本
+
+        流水與刪除審計的最大 ID 反映銷帳與回滾；未結清銷售的筆數、最大 ID 與金額加總、
+        客戶應收總額則反映新增、刪除（不論是否為最新一筆）與原地修改。
+        """
+        unsettled = db.select(
+            func.count(SalesRecord.id).label("unsettled_count"),
+            func.max(SalesRecord.id).label("unsettled_max_id"),
+            func.sum(SalesRecord.twd_amount).label("unsettled_twd"),
+        ).filter(SalesRecord.is_settled == False).subquery()
+        row = db.session.execute(
+            db.select(
+                unsettled,
+                db.select(func.max(LedgerEntry.id)).scalar_subquery(),
+                db.select(func.max(DeleteAuditLog.id)).scalar_subquery(),
+                db.select(func.sum(Customer.total_receivables_twd)).scalar_subquery(),
+            )
+        ).one()
+        return tuple(round(float(value or 0), 6) for value in row)
+
+    @staticmethod
+    def compute_aging(as_of=None):
+        """以單一 GROUP BY 查詢（CASE 判斷 created_at 帳齡）計算所有客戶的帳齡區間"""
+        from datetime import timedelta
+        from sqlalchemy import case
+
+        as_of = as_of or datetime.utcnow()
+        today = datetime(as_of.year, as_of.month, as_of.day)
+
+        bucket_columns = []
+        lower_cutoff = None
+        for key, _label, max_days in ReceivablesAgingService.BUCKETS:
+            if max_days is None:
+                condition = SalesRecord.created_at < lower_cutoff
+            else:
+                cutoff = today - timedelta(days=max_days)
+                condition = SalesRecord.created_at >= cutoff
+                if lower_cutoff is not None:
+                    condition = and_(condition, SalesRecord.created_at < lower_cutoff)
+                lower_cutoff = cutoff
+            bucket_columns.append(
+                func.coalesce(
+                    func.sum(case((condition, SalesRecord.twd_amount), else_=0.0)), 0.0
+                ).label(key)
+            )
+
+        rows = db.session.execute(
+            db.select(
+                Customer.id,
+                Customer.name,
+                Customer.total_receivables_twd,
+                func.count(SalesRecord.id).label("unsettled_count"),
+                func.min(SalesRecord.created_at).label("oldest_sale_at"),
+                *bucket_columns,
+            )
+            .join(SalesRecord, SalesRecord.customer_id == Customer.id)
+            .filter(SalesRecord.is_settled == False)
+            .group_by(Customer.id, Customer.name, Customer.total_receivables_twd)
+            .order_by(Customer.name)
+        ).all()
+
+        bucket_keys = [key for key, _label, _max_days in ReceivablesAgingService.BUCKETS]
+        customers = []
+        totals = {key: 0.0 for key in bucket_keys}
+        for row in rows:
+            buckets = {key: float(getattr(row, key) or 0) for key in bucket_keys}
+            for key in bucket_keys:
+                totals[key] += buckets[key]
+            customers.append({
+                "customer_id": row.id,
+                "customer_name": row.name,
+                "total_receivables_twd": row.total_receivables_twd,
+                "unsettled_total_twd": sum(buckets.values()),
+                "unsettled_count": row.unsettled_count,
+                "oldest_sale_at": row.oldest_sale_at.isoformat() if row.oldest_sale_at else None,
+                "buckets": buckets,
+            })
+
+        return {
+            "as_of": today.strftime("%Y-%m-%d"),
+            "buckets": [
+                {"key": key, "label": label} for key, label, _max_days in ReceivablesAgingService.BUCKETS
+            ],
+            "customers": customers,
+            "totals": totals,
+            "grand_total": sum(totals.values()),
+        }
+
+    @staticmethod
+    def get_aging_report():
+        """取得帳齡報表；帳本版本與日期未變時直接使用快取"""
+        cache = ReceivablesAgingService._cache
+        key = (ReceivablesAgingService.get_ledger_version(), datetime.utcnow().date())
+        if cache["key"] != key:
+            cache["report"] = ReceivablesAgingService.compute_aging()
+            cache["key"] = key
+        return cache["report"]
+
+
+# ===================================================================
+# 帳戶餘額服務類
+# ===================================================================
+class InsufficientBalanceError(ValueError):
+    """帳戶餘額不足（原子扣款的 WHERE 條件不成立）"""
+
+    def __init__(self, account_id, account_name, required, available):
+        self.account_id = account_id
+        self.account_name = account_name
+        self.required = required
+        self.available = available
+        super().__init__(
+            f"{account_name} 餘額不足！需要 {required:,.2f}，但僅剩 {available:,.2f}"
+        )
+
+
+class BalanceService:
+    """帳戶餘額服務類 - 以單一 SQL UPDATE 原子地異動 CashAccount.balance
+
+    UPDATE cash_accounts SET balance = balance + :delta
+    WHERE id = :id AND balance + :delta >= 0 RETURNING balance
+
+    餘額運算在資料庫內完成，多個 worker 同時寫入不會互相覆蓋，
+    扣款的餘額檢查與扣款在同一語句內，不會因競態而透支。
+    """
+
+    @staticmethod
+    def apply_delta(account, delta, allow_negative=False):
+        """將 delta 加到帳戶餘額並回傳新餘額（不提交交易）
+
+        account 可為 CashAccount 物件或帳戶 ID。delta 為負且 allow_negative=False 時，
+        若扣款後餘額會小於 0 則拋出 InsufficientBalanceError，餘額不變。
+        """
+        from sqlalchemy.orm.attributes import set_committed_value
+        from sqlalchemy.orm.util import identity_key
+
+        account_id = account.id if isinstance(account, CashAccount) else account
+        statement = (
+            db.update(CashAccount)
+            .where(CashAccount.id == account_id)
+            .values(balance=CashAccount.balance + delta)
+            .returning(CashAccount.balance)
+            .execution_options(synchronize_session=False)
+        )
+        if delta < 0 and not allow_negative:
+            statement = statement.where(CashAccount.balance + delta >= 0)
+
+        new_balance = db.session.execute(statement).scalar()
+        if new_balance is None:
+            row = db.session.execute(
+                db.select(CashAccount.name, CashAccount.balance).where(CashAccount.id == account_id)
+            ).first()
+            if row is None:
+                raise ValueError(f"帳戶不存在: {account_id}")
+            raise InsufficientBalanceError(account_id, row.name, -delta, row.balance)
+
+        new_balance = float(new_balance)
+        # 同步 session 中已載入的物件，避免之後 flush 以舊值覆蓋
+        instance = db.session.identity_map.get(identity_key(CashAccount, account_id))
+        if instance is not None:
+            set_committed_value(instance, "balance", new_balance)
+        return new_balance
+
+    @staticmethod
+    def apply_deltas(deltas, allow_negative=False):
+        """一次異動多個帳戶 {account_id: delta}，依帳戶 ID 順序更新以避免交叉鎖定"""
+        return {
+            account_id: BalanceService.apply_delta(account_id, delta, allow_negative=allow_negative)
+            for account_id, delta in sorted(deltas.items())
+            if delta
+        }
+
+
 # ===================================================================
 # 利潤管理服務類
 # ===================================================================
@@ -586,8 +930,8 @@ class ProfitService:
     
     @staticmethod
     def add_profit(account_id, amount, transaction_type, description=None, note=None, 
-                   related_transaction_id=None, related_transaction_type=None, operator_id=None):
-        """增加利潤到指定帳戶"""
+                   related_transaction_id=None, related_transaction_type=None, operator_id=None, commit=True):
+        """增加利潤到指定帳戶；commit=False 時只 flush，由呼叫端與其他變更一起提交"""
         try:
             account = db.session.get(CashAccount, account_id)
             if not account:
@@ -620,7 +964,10 @@ class ProfitService:
             )
             
             db.session.add(profit_transaction)
-            db.session.commit()
+            if commit:
+                db.session.commit()
+            else:
+                db.session.flush()
             
             return {
                 "success": True, 
@@ -735,6 +1082,281 @@ class ProfitService:
             db.session.rollback()
             return {"success": False, "message": f"利潤調整失敗: {str(e)}"}
     
+    @staticmethod
+    def post_batch(postings, operator_id=None, commit=True):
+        """批次寫入多筆利潤變動（單一交易）
+
+        postings 為 dict 列表，欄位同 add_profit：account_id, amount, transaction_type，
+        以及選填的 description, note, related_transaction_id, related_transaction_type。
+        每個帳戶只鎖定並讀取一次，依輸入順序在記憶體中計算 balance_before / balance_after，
+        再以單一 executemany 寫入所有 ProfitTransaction。任何一筆失敗則整批不寫入。
+        """
+        try:
+            if not postings:
+                return {"success": True, "message": "沒有需要寫入的利潤變動", "count": 0, "balances": {}}
+
+            if operator_id is None:
+                operator_id = get_safe_operator_id()
+
+            account_ids = sorted({posting["account_id"] for posting in postings})
+            # 依 ID 順序鎖定，避免與其他批次交叉鎖定造成死結；populate_existing 讓已在 session 中的帳戶
+            # 也以鎖定後讀到的 profit_balance 覆蓋，否則會沿用鎖定前的舊值
+            accounts = {
+                account.id: account
+                for account in db.session.execute(
+                    db.select(CashAccount)
+                    .where(CashAccount.id.in_(account_ids))
+                    .order_by(CashAccount.id)
+                    .with_for_update()
+                    .execution_options(populate_existing=True)
+                ).scalars()
+            }
+            missing = [account_id for account_id in account_ids if account_id not in accounts]
+            if missing:
+                db.session.rollback()
+                return {"success": False, "message": f"帳戶不存在: {', '.join(map(str, missing))}"}
+
+            balances = {account_id: accounts[account_id].profit_balance or 0.0 for account_id in account_ids}
+            created_at = datetime.utcnow()
+            rows = []
+            for index, posting in enumerate(postings):
+                account_id = posting["account_id"]
+                amount = posting["amount"]
+                transaction_type = posting["transaction_type"]
+                balance_before = balances[account_id]
+                balance_after = balance_before + amount
+
+                if transaction_type == "PROFIT_WITHDRAW" and balance_after < 0:
+                    db.session.rollback()
+                    return {
+                        "success": False,
+                        "message": f"第 {index + 1} 筆利潤提取失敗：{accounts[account_id].name} 利潤餘額不足，當前餘額: {balance_before:.2f}",
+                    }
+
+                balances[account_id] = balance_after
+                rows.append({
+                    "account_id": account_id,
+                    "transaction_type": transaction_type,
+                    "amount": amount,
+                    "balance_before": balance_before,
+                    "balance_after": balance_after,
+                    "related_transaction_id": posting.get("related_transaction_id"),
+                    "related_transaction_type": posting.get("related_transaction_type"),
+                    "description": posting.get("description"),
+                    "note": posting.get("note"),
+                    "operator_id": posting.get("operator_id") or operator_id,
+                    "created_at": created_at,
+                })
+
+            # 注意：不修改 account.balance，利潤應獨立於營運資金
+            for account_id, balance in balances.items():
+                accounts[account_id].profit_balance = balance
+            db.session.execute(db.insert(ProfitTransaction), rows)
+
+            if commit:
+                db.session.commit()
+
+            return {
+                "success": True,
+                "message": f"批次利潤變動成功：{len(rows)} 筆，{len(balances)} 個帳戶",
+                "count": len(rows),
+                "balances": balances,
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            return {"success": False, "message": f"批次利潤變動失敗: {str(e)}"}
+
+    # ---------------------------------------------------------------
+    # 系統利潤流水帳
+    # LedgerEntry 中以下類型的記錄帶有 profit_before / profit_after，
+    # 依 ID 順序構成一條連續的系統利潤流水，最新一筆的 profit_after 即為系統總利潤。
+    # ---------------------------------------------------------------
+    LEDGER_ENTRY_TYPES = PROFIT_LEDGER_ENTRY_TYPES
+    # PostgreSQL advisory lock 鍵值，序列化多個 worker 的利潤流水寫入
+    LEDGER_LOCK_KEY = 20251029
+    # 切換到利潤流水時寫入的期初校正（flask seed-profit-ledger），描述以此開頭
+    OPENING_DESCRIPTION = "利潤流水期初校正"
+    # 完整重算需要的資料表；任一張有資料被歸檔後，重算只看得到資料庫中剩下的部分
+    RECOMPUTE_SOURCE_TABLES = ("sales_records", "fifo_sales_allocations", "ledger_entries")
+
+    @staticmethod
+    def history_filter():
+        """利潤歷史的條件，與 ix_ledger_entries_profit_history 的部分索引條件逐字相同（類型以字面值寫入）"""
+        return and_(
+            LedgerEntry.entry_type.in_([db.literal_column(repr(name)) for name in ProfitService.LEDGER_ENTRY_TYPES]),
+            LedgerEntry.entry_date.isnot(None),
+        )
+
+    @staticmethod
+    def get_total_profit():
+        """O(1) 取得系統總利潤：利潤流水最新一筆的 profit_after"""
+        latest = db.session.execute(
+            db.select(LedgerEntry.profit_after)
+            .filter(LedgerEntry.entry_type.in_(ProfitService.LEDGER_ENTRY_TYPES))
+            .filter(LedgerEntry.profit_after.isnot(None))
+            .order_by(LedgerEntry.id.desc())
+            .limit(1)
+        ).scalar()
+        return float(latest or 0.0)
+
+    @staticmethod
+    def _lock_ledger():
+        """在 PostgreSQL 上取得交易層級的 advisory lock，避免並發寫入讀到相同的 profit_before"""
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"), {"key": ProfitService.LEDGER_LOCK_KEY}
+            )
+
+    @staticmethod
+    def post_ledger(entry_type, change, description, operator_id=None, account_id=None, commit=True):
+        """寫入一筆系統利潤流水，以最新的 profit_after 作為 profit_before"""
+        if operator_id is None:
+            operator_id = get_safe_operator_id()
+
+        ProfitService._lock_ledger()
+        profit_before = ProfitService.get_total_profit()
+        entry = LedgerEntry(
+            entry_type=entry_type,
+            account_id=account_id,
+            amount=change,
+            description=description,
+            operator_id=operator_id,
+            profit_before=profit_before,
+            profit_after=profit_before + change,
+            profit_change=change,
+        )
+        db.session.add(entry)
+        if commit:
+            db.session.commit()
+        return entry
+
+    @staticmethod
+    def record_sale_profit(sales_record, profit_amount, description, note=None, operator_id=None):
+        """記錄一筆售出的利潤：帳戶利潤餘額（ProfitTransaction）與系統利潤流水
+
+        與售出在同一個交易中寫入、不提交交易；任一筆寫不進去就拋出例外，由呼叫端回滾整筆售出。
+        """
+        if operator_id is None:
+            operator_id = get_safe_operator_id()
+
+        result = {"success": True}
+        if sales_record.rmb_account_id:
+            result = ProfitService.add_profit(
+                account_id=sales_record.rmb_account_id,
+                amount=profit_amount,
+                transaction_type="PROFIT_EARNED",
+                description=description,
+                note=note,
+                related_transaction_id=sales_record.id,
+                related_transaction_type="SALES",
+                operator_id=operator_id,
+                commit=False,
+            )
+            if not result["success"]:
+                raise RuntimeError(result["message"])
+
+        entry = ProfitService.post_ledger(
+            "PROFIT_EARNED", profit_amount, description, operator_id=operator_id, commit=False
+        )
+        db.session.flush()
+        result["ledger_entry_id"] = entry.id
+        result["profit_after"] = entry.profit_after
+        return result
+
+    @staticmethod
+    def reverse_sale_profit(sales_record, operator_id=None):
+        """回滾售出時沖銷其利潤（需在刪除 FIFO 分配前呼叫，不提交交易）"""
+        ProfitTimeSeriesService.invalidate()
+        profit_info = FIFOService.calculate_profit_for_sale(sales_record)
+        if not profit_info or not profit_info.get("profit_twd"):
+            return None
+
+        profit_amount = profit_info["profit_twd"]
+        customer_name = sales_record.customer.name if sales_record.customer else "N/A"
+        return ProfitService.post_ledger(
+            "PROFIT_REVERSAL",
+            -profit_amount,
+            f"回滾售出利潤：{customer_name}（售出ID {sales_record.id}）",
+            operator_id=operator_id,
+            commit=False,
+        )
+
+    @staticmethod
+    def withdraw_total_profit(amount, description, operator_id=None):
+        """從系統總利潤提款（寫入 PROFIT_WITHDRAW 流水）"""
+        try:
+            ProfitService._lock_ledger()
+            current_profit = ProfitService.get_total_profit()
+            if current_profit < amount:
+                db.session.rollback()
+                return {"success": False, "message": f"利潤餘額不足，當前可用利潤: NT$ {current_profit:.2f}"}
+
+            entry = ProfitService.post_ledger(
+                "PROFIT_WITHDRAW", -amount, description, operator_id=operator_id
+            )
+            return {
+                "success": True,
+                "message": f"利潤提款成功: NT$ {amount:.2f}",
+                "profit_before": entry.profit_before,
+                "profit_after": entry.profit_after,
+                "transaction_id": entry.id,
+            }
+        except Exception as e:
+            db.session.rollback()
+            return {"success": False, "message": f"提取利潤失敗: {str(e)}"}
+
+    @staticmethod
+    def recompute_total_profit():
+        """完整 FIFO 重算系統總利潤：所有售出的 FIFO 利潤 − 利潤提款（用於對帳）"""
+        sales_profit = 0.0
+        sales = db.session.execute(db.select(SalesRecord)).scalars().all()
+        profits = FIFOService.calculate_profits_for_sales(sales)
+        for sale in sales:
+            profit_info = profits.get(sale.id)
+            if profit_info:
+                sales_profit += profit_info.get("profit_twd", 0.0)
+
+        withdrawals = db.session.execute(
+            db.select(func.coalesce(func.sum(func.abs(LedgerEntry.amount)), 0.0))
+            .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
+        ).scalar()
+        return {
+            "sales_profit": sales_profit,
+            "withdrawals": float(withdrawals or 0.0),
+            "total_profit": sales_profit - float(withdrawals or 0.0),
+            "sales_count": len(sales),
+        }
+
+    @staticmethod
+    def archived_recompute_sources():
+        """已有資料歸檔出資料庫、使完整重算不再準確的資料表；無法讀取歸檔層時回傳 None
+
+        ARCHIVE_READ=0 表示此環境沒有歸檔層，回傳空 list。
+        """
+        if os.environ.get("ARCHIVE_READ", "1") == "0":
+            return []
+        reader = ArchiveHistoryService.reader()
+        if reader is None:
+            return None
+        try:
+            tables = reader.index()["tables"]
+        except Exception as e:
+            logger.warning("讀取歸檔索引失敗: %s", e)
+            return None
+        return [table for table in ProfitService.RECOMPUTE_SOURCE_TABLES
+                if tables.get(table, {}).get("partitions")]
+
+    @staticmethod
+    def recompute_blocker():
+        """完整重算不可信時回傳原因（字串），可信時回傳 None"""
+        sources = ProfitService.archived_recompute_sources()
+        if sources is None:
+            return "無法讀取歸檔索引，不確定是否已有資料歸檔（此環境沒有歸檔層時請設定 ARCHIVE_READ=0）"
+        if sources:
+            return f"{'、'.join(sources)} 已有資料歸檔，完整重算只涵蓋資料庫中剩下的資料"
+        return None
+    
     @staticmethod
     def get_profit_history(account_id=None, limit=50):
         """獲取利潤變動歷史"""
@@ -776,104 +1398,538 @@ class ProfitService:
 
 
 # ===================================================================
-# 刪除記錄審計服務類
+# 利潤時間序列服務類
 # ===================================================================
+class ProfitTimeSeriesService:
+    """利潤時間序列服務類 - 依日 / 週 / 月彙總每筆售出的 FIFO 利潤
+
+    利潤直接以 FIFO 分配在 SQL 中計算（與 FIFOService.calculate_profit_for_sale 相同公式），
+    尚未分配庫存的售出不列入。已結束的期間依資料版本（data_version，DataVersion 計數器）快取，只有當期每次重新查詢；
+    任何 worker 經 ORM 改動售出與分配資料、或歸檔刪除後，所有 worker 的快取都會在下一次請求時失效。
+    """
+
+    GRANULARITIES = ("day", "week", "month")
+    GROUP_BY_OPTIONS = ("customer", "account")
+    DEFAULT_PERIODS = {"day": 30, "week": 12, "month": 12}
+
+    # {"version": data_version(), "periods": {(granularity, group_by, period_start): period_dict}}
+    _closed_period_cache = {"version": None, "periods": {}}
+
+    # DataVersion 的名稱；SalesRecord / FIFOSalesAllocation 經 ORM 寫入時由 before_flush 加一
+    VERSION_NAME = "profit_series"
+    SOURCE_MODELS = (SalesRecord, FIFOSalesAllocation)
 
-class DeleteAuditService:
-    """刪除記錄審計服務類"""
-    
     @staticmethod
-    def collect_balance_changes(affected_accounts):
-        """收集帳戶餘額變化資訊"""
-        try:
-            import json
-            
-            balance_changes = []
-            for account in affected_accounts:
-                balance_changes.append({
-                    'account_id': account.id,
-                    'account_name': account.name,
-                    'currency': account.currency,
-                    'balance_before': getattr(account, '_balance_before', None),
-                    'balance_after': account.balance,
-                    'change': account.balance - getattr(account, '_balance_before', account.balance)
-                })
-            
-            return json.dumps(balance_changes, ensure_ascii=False) if balance_changes else None
-            
-        except Exception as e:
-            print(f"收集餘額變化失敗: {e}")
-            return None
-    
+    def invalidate():
+        """清除本 worker 已結束期間的快取（其他 worker 由 data_version 的變化得知）"""
+        ProfitTimeSeriesService._closed_period_cache = {"version": None, "periods": {}}
+
     @staticmethod
-    def log_deletion(table_name, record_id, deleted_data, operation_type, description=None, operator_id=None, request=None, balance_changes=None):
-        """記錄刪除操作"""
-        try:
-            # 獲取操作者資訊
-            operator_name = None
-            if operator_id:
-                operator = db.session.get(User, operator_id)
-                if operator:
-                    operator_name = operator.username
-            
-            # 獲取IP和用戶代理
-            ip_address = None
-            user_agent = None
-            if request:
-                ip_address = request.remote_addr
-                user_agent = request.headers.get('User-Agent', '')[:500]  # 限制長度
-            
-            # 創建審計記錄
-            audit_log = DeleteAuditLog(
-                table_name=table_name,
-                record_id=record_id,
-                deleted_data=deleted_data,
-                operation_type=operation_type,
-                description=description,
-                operator_id=operator_id,
-                operator_name=operator_name,
-                ip_address=ip_address,
-                user_agent=user_agent,
-                balance_changes=balance_changes
-            )
-            
-            db.session.add(audit_log)
-            db.session.commit()
-            
-            print(f"刪除記錄已記錄到審計日誌: {table_name}.{record_id}")
-            return True
-            
-        except Exception as e:
-            db.session.rollback()
-            print(f"記錄刪除審計日誌失敗: {e}")
-            return False
-    
+    def data_version():
+        """以主鍵讀取利潤計算所用資料的版本計數器（不論資料量都只讀一列）"""
+        version = db.session.execute(
+            db.select(DataVersion.version).filter_by(name=ProfitTimeSeriesService.VERSION_NAME)
+        ).scalar()
+        return version or 0
+
     @staticmethod
-    def get_deletion_logs(table_name=None, operator_id=None, limit=50):
-        """獲取刪除記錄"""
-        try:
-            query = db.session.execute(db.select(DeleteAuditLog))
-            
-            if table_name:
-                query = query.filter(DeleteAuditLog.table_name == table_name)
-            
-            if operator_id:
-                query = query.filter(DeleteAuditLog.operator_id == operator_id)
+    def bump_version(session=None):
+        """在目前的交易內把版本計數器加一，與資料寫入一起提交或回滾
+
+        不經 ORM 的寫入（SQL 腳本、批次清空）需自行呼叫。同一列的更新會互相等待到交易結束，
+        售出寫入本來就以利潤流水的 advisory lock 序列化，不會增加額外的等待。
+        """
+        session = session or db.session
+        updated = session.execute(
+            db.update(DataVersion)
+            .where(DataVersion.name == ProfitTimeSeriesService.VERSION_NAME)
+            .values(version=DataVersion.version + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            session.execute(db.insert(DataVersion).values(name=ProfitTimeSeriesService.VERSION_NAME, version=1))
+
+    @staticmethod
+    def period_start(value, granularity):
+        """回傳 value 所屬期間的起始日（週以星期一為起點）"""
+        from datetime import timedelta
+
+        day = value.date() if isinstance(value, datetime) else value
+        if granularity == "week":
+            return day - timedelta(days=day.weekday())
+        if granularity == "month":
+            return day.replace(day=1)
+        return day
+
+    @staticmethod
+    def next_period(start, granularity):
+        """回傳下一個期間的起始日"""
+        from datetime import timedelta
+
+        if granularity == "week":
+            return start + timedelta(days=7)
+        if granularity == "month":
+            return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start + timedelta(days=1)
+
+    @staticmethod
+    def previous_period(start, granularity):
+        """回傳上一個期間的起始日"""
+        from datetime import timedelta
+
+        return ProfitTimeSeriesService.period_start(start - timedelta(days=1), granularity)
+
+    @staticmethod
+    def _period_expression(granularity):
+        """依資料庫方言產生期間分組運算式：PostgreSQL 用 date_trunc，SQLite 用 strftime / date"""
+        if db.engine.dialect.name == "postgresql":
+            return func.date_trunc(granularity, SalesRecord.created_at)
+        if granularity == "week":
+            return func.date(SalesRecord.created_at, "weekday 0", "-6 days")
+        if granularity == "month":
+            return func.strftime("%Y-%m-01", SalesRecord.created_at)
+        return func.strftime("%Y-%m-%d", SalesRecord.created_at)
+
+    @staticmethod
+    def allocation_amounts():
+        """每筆 FIFO 分配的 (營收, 成本, 利潤) SQL 運算式
+
+        與 FIFOService.calculate_profit_for_sale 相同：零成本庫存整筆計為利潤，
+        其餘以 (售出匯率 - 買入匯率) × 分配 RMB 計算。
+        """
+        from sqlalchemy import case
+
+        revenue = SalesRecord.twd_amount * FIFOSalesAllocation.allocated_rmb / SalesRecord.rmb_amount
+        cost = case(
+            (FIFOSalesAllocation.allocated_cost_twd == 0, 0.0),
+            else_=FIFOInventory.exchange_rate * FIFOSalesAllocation.allocated_rmb,
+        )
+        return revenue, cost, revenue - cost
+
+    @staticmethod
+    def _query_periods(granularity, group_by, range_start, range_end):
+        """以單一 GROUP BY 查詢計算 [range_start, range_end) 內每個期間的利潤"""
+        revenue, _cost, profit = ProfitTimeSeriesService.allocation_amounts()
+        period = ProfitTimeSeriesService._period_expression(granularity).label("period")
+
+        columns = [
+            period,
+            func.sum(profit).label("profit_twd"),
+            func.sum(revenue).label("revenue_twd"),
+            func.sum(FIFOSalesAllocation.allocated_rmb).label("rmb_volume"),
+            func.count(func.distinct(SalesRecord.id)).label("sales_count"),
+        ]
+        group_columns = [period]
+        if group_by == "customer":
+            columns += [Customer.id.label("group_id"), Customer.name.label("group_name")]
+            group_columns += [Customer.id, Customer.name]
+        elif group_by == "account":
+            columns += [CashAccount.id.label("group_id"), CashAccount.name.label("group_name")]
+            group_columns += [CashAccount.id, CashAccount.name]
+
+        query = (
+            db.select(*columns)
+            .select_from(FIFOSalesAllocation)
+            .join(SalesRecord, SalesRecord.id == FIFOSalesAllocation.sales_record_id)
+            .join(FIFOInventory, FIFOInventory.id == FIFOSalesAllocation.fifo_inventory_id)
+            .filter(SalesRecord.rmb_amount > 0)
+            .filter(SalesRecord.created_at >= datetime.combine(range_start, datetime.min.time()))
+            .filter(SalesRecord.created_at < datetime.combine(range_end, datetime.min.time()))
+            .group_by(*group_columns)
+        )
+        if group_by == "customer":
+            query = query.join(Customer, Customer.id == SalesRecord.customer_id)
+        elif group_by == "account":
+            query = query.join(CashAccount, CashAccount.id == SalesRecord.rmb_account_id)
+
+        periods = {}
+        for row in db.session.execute(query).all():
+            row_period = row.period
+            if isinstance(row_period, str):
+                row_period = datetime.strptime(row_period[:10], "%Y-%m-%d").date()
+            elif isinstance(row_period, datetime):
+                row_period = row_period.date()
+            item = periods.setdefault(row_period, {
+                "profit_twd": 0.0,
+                "revenue_twd": 0.0,
+                "rmb_volume": 0.0,
+                "sales_count": 0,
+                "breakdown": [] if group_by else None,
+            })
+            item["profit_twd"] += float(row.profit_twd or 0)
+            item["revenue_twd"] += float(row.revenue_twd or 0)
+            item["rmb_volume"] += float(row.rmb_volume or 0)
+            item["sales_count"] += row.sales_count
+            if group_by:
+                item["breakdown"].append({
+                    "id": row.group_id,
+                    "name": row.group_name,
+                    "profit_twd": round(float(row.profit_twd or 0), 2),
+                    "revenue_twd": round(float(row.revenue_twd or 0), 2),
+                    "rmb_volume": round(float(row.rmb_volume or 0), 2),
+                    "sales_count": row.sales_count,
+                })
+        return periods
+
+    @staticmethod
+    def get_series(granularity="day", start=None, end=None, group_by=None):
+        """取得 [start, end] 期間的利潤時間序列（日期皆為 date）"""
+        if granularity not in ProfitTimeSeriesService.GRANULARITIES:
+            raise ValueError(f"不支援的期間單位: {granularity}")
+        if group_by and group_by not in ProfitTimeSeriesService.GROUP_BY_OPTIONS:
+            raise ValueError(f"不支援的分組方式: {group_by}")
+
+        today = datetime.utcnow().date()
+        current_period = ProfitTimeSeriesService.period_start(today, granularity)
+        end_period = ProfitTimeSeriesService.period_start(end or today, granularity)
+        if start:
+            start_period = ProfitTimeSeriesService.period_start(start, granularity)
+        else:
+            start_period = end_period
+            for _ in range(ProfitTimeSeriesService.DEFAULT_PERIODS[granularity] - 1):
+                start_period = ProfitTimeSeriesService.previous_period(start_period, granularity)
+        if start_period > end_period:
+            raise ValueError("起始日期不可晚於結束日期")
+
+        # 列出所有期間，並找出需要查詢資料庫的期間（未快取的已結束期間與當期）
+        period_starts = []
+        cursor = start_period
+        while cursor <= end_period:
+            period_starts.append(cursor)
+            cursor = ProfitTimeSeriesService.next_period(cursor, granularity)
+
+        version = ProfitTimeSeriesService.data_version()
+        if ProfitTimeSeriesService._closed_period_cache["version"] != version:
+            ProfitTimeSeriesService._closed_period_cache = {"version": version, "periods": {}}
+        cache = ProfitTimeSeriesService._closed_period_cache["periods"]
+        missing = [
+            p for p in period_starts
+            if p >= current_period or (granularity, group_by, p) not in cache
+        ]
+        fetched = {}
+        if missing:
+            fetched = ProfitTimeSeriesService._query_periods(
+                granularity,
+                group_by,
+                missing[0],
+                ProfitTimeSeriesService.next_period(missing[-1], granularity),
+            )
+
+        series = []
+        for p in period_starts:
+            key = (granularity, group_by, p)
+            if p < current_period and key in cache:
+                item = cache[key]
+            else:
+                item = fetched.get(p) or {
+                    "profit_twd": 0.0,
+                    "revenue_twd": 0.0,
+                    "rmb_volume": 0.0,
+                    "sales_count": 0,
+                    "breakdown": [] if group_by else None,
+                }
+                item = {
+                    "period": p.isoformat(),
+                    "profit_twd": round(item["profit_twd"], 2),
+                    "revenue_twd": round(item["revenue_twd"], 2),
+                    "rmb_volume": round(item["rmb_volume"], 2),
+                    "sales_count": item["sales_count"],
+                    "is_closed": p < current_period,
+                    **({"breakdown": sorted(item["breakdown"], key=lambda b: -b["profit_twd"])} if group_by else {}),
+                }
+                if p < current_period:
+                    cache[key] = item
+            series.append(item)
+
+        return {
+            "granularity": granularity,
+            "group_by": group_by,
+            "start": start_period.isoformat(),
+            "end": end_period.isoformat(),
+            "series": series,
+            "total_profit_twd": round(sum(item["profit_twd"] for item in series), 2),
+        }
+
+
+@event.listens_for(db.session, "before_flush")
+def _bump_profit_series_version(session, flush_context, instances):
+    """售出或 FIFO 分配有新增、修改或刪除時，在同一個交易內更新利潤時間序列的版本"""
+    changed = itertools.chain(session.new, session.dirty, session.deleted)
+    if any(isinstance(obj, ProfitTimeSeriesService.SOURCE_MODELS) for obj in changed):
+        ProfitTimeSeriesService.bump_version(session)
+
+
+# ===================================================================
+# 利潤分析立方體服務類
+# ===================================================================
+class ProfitCubeService:
+    """利潤分析立方體服務類 - 維護並查詢 profit_cube
+
+    每個 (日期, 客戶) 是一個重算單位：售出寫入或回滾後只重算該單位的所有儲存格，
+    查詢時僅掃描預先彙總的 profit_cube，不需再連接 FIFO 分配明細。
+    """
+
+    DIMENSIONS = ("day", "month", "customer", "channel", "account")
+
+    @staticmethod
+    def cell_key(sales_record):
+        """回傳售出記錄所屬的重算單位 (日期, 客戶ID)"""
+        created_at = sales_record.created_at or datetime.utcnow()
+        return created_at.date(), sales_record.customer_id
+
+    @staticmethod
+    def _source_query(day_column, extra_filters=()):
+        """由 FIFO 分配明細彙總出 profit_cube 欄位的 SELECT"""
+        revenue, cost, profit = ProfitTimeSeriesService.allocation_amounts()
+        query = (
+            db.select(
+                day_column,
+                SalesRecord.customer_id,
+                PurchaseRecord.channel_id,
+                SalesRecord.rmb_account_id,
+                func.sum(profit),
+                func.sum(revenue),
+                func.sum(cost),
+                func.sum(FIFOSalesAllocation.allocated_rmb),
+                func.coalesce(func.sum(profit) / func.nullif(func.sum(revenue), 0), 0.0),
+                func.count(func.distinct(SalesRecord.id)),
+                db.literal(datetime.utcnow(), db.DateTime),
+            )
+            .select_from(FIFOSalesAllocation)
+            .join(SalesRecord, SalesRecord.id == FIFOSalesAllocation.sales_record_id)
+            .join(FIFOInventory, FIFOInventory.id == FIFOSalesAllocation.fifo_inventory_id)
+            .join(PurchaseRecord, PurchaseRecord.id == FIFOInventory.purchase_record_id)
+            .filter(SalesRecord.rmb_amount > 0)
+        )
+        for condition in extra_filters:
+            query = query.filter(condition)
+        return query
+
+    @staticmethod
+    def _insert_from(query):
+        table = ProfitCubeCell.__table__
+        db.session.execute(
+            db.insert(ProfitCubeCell).from_select(
+                [
+                    table.c.day, table.c.customer_id, table.c.channel_id, table.c.account_id,
+                    table.c.profit_twd, table.c.revenue_twd, table.c.cost_twd, table.c.rmb_volume,
+                    table.c.margin, table.c.sales_count, table.c.updated_at,
+                ],
+                query,
+            )
+        )
+
+    @staticmethod
+    def refresh(keys):
+        """重算指定 (日期, 客戶ID) 單位的儲存格（不提交交易，由呼叫端 commit）"""
+        from datetime import timedelta
+
+        keys = {key for key in keys if key and key[1] is not None}
+        if not keys:
+            return 0
+
+        db.session.flush()
+        for day, customer_id in keys:
+            day_start = datetime.combine(day, datetime.min.time())
+            db.session.execute(
+                db.delete(ProfitCubeCell)
+                .where(ProfitCubeCell.day == day)
+                .where(ProfitCubeCell.customer_id == customer_id)
+            )
+            query = ProfitCubeService._source_query(
+                db.literal(day, db.Date),
+                (
+                    SalesRecord.customer_id == customer_id,
+                    SalesRecord.created_at >= day_start,
+                    SalesRecord.created_at < day_start + timedelta(days=1),
+                ),
+            ).group_by(SalesRecord.customer_id, PurchaseRecord.channel_id, SalesRecord.rmb_account_id)
+            ProfitCubeService._insert_from(query)
+        return len(keys)
+
+    @staticmethod
+    def refresh_for_sale(sales_record):
+        """售出寫入後重算其所在單位"""
+        return ProfitCubeService.refresh([ProfitCubeService.cell_key(sales_record)])
+
+    @staticmethod
+    def rebuild():
+        """清空並以單一 INSERT ... SELECT 全量重建 profit_cube（不提交交易）"""
+        db.session.execute(db.delete(ProfitCubeCell))
+        day_column = ProfitTimeSeriesService._period_expression("day")
+        query = ProfitCubeService._source_query(day_column).group_by(
+            day_column, SalesRecord.customer_id, PurchaseRecord.channel_id, SalesRecord.rmb_account_id
+        )
+        ProfitCubeService._insert_from(query)
+        return db.session.execute(db.select(func.count(ProfitCubeCell.id))).scalar()
+
+    @staticmethod
+    def query(dimensions, start=None, end=None, filters=None, limit=500):
+        """依指定維度切片彙總 profit_cube
+
+        dimensions 為 DIMENSIONS 的子集；filters 可含 customer_id / channel_id / account_id。
+        sales_count 為各儲存格筆數加總，同一筆售出跨渠道分配時會分別計入。
+        """
+        unknown = [d for d in dimensions if d not in ProfitCubeService.DIMENSIONS]
+        if unknown:
+            raise ValueError(f"不支援的維度: {', '.join(unknown)}")
+        if "day" in dimensions and "month" in dimensions:
+            raise ValueError("day 與 month 維度不可同時使用")
+
+        columns, group_columns = [], []
+        query_joins = []
+        if "day" in dimensions:
+            columns.append(ProfitCubeCell.day.label("day"))
+            group_columns.append(ProfitCubeCell.day)
+        if "month" in dimensions:
+            if db.engine.dialect.name == "postgresql":
+                month = func.to_char(ProfitCubeCell.day, "YYYY-MM")
+            else:
+                month = func.strftime("%Y-%m", ProfitCubeCell.day)
+            columns.append(month.label("month"))
+            group_columns.append(month)
+        if "customer" in dimensions:
+            columns += [ProfitCubeCell.customer_id, Customer.name.label("customer_name")]
+            group_columns += [ProfitCubeCell.customer_id, Customer.name]
+            query_joins.append((Customer, Customer.id == ProfitCubeCell.customer_id))
+        if "channel" in dimensions:
+            columns += [ProfitCubeCell.channel_id, Channel.name.label("channel_name")]
+            group_columns += [ProfitCubeCell.channel_id, Channel.name]
+            query_joins.append((Channel, Channel.id == ProfitCubeCell.channel_id))
+        if "account" in dimensions:
+            columns += [ProfitCubeCell.account_id, CashAccount.name.label("account_name")]
+            group_columns += [ProfitCubeCell.account_id, CashAccount.name]
+            query_joins.append((CashAccount, CashAccount.id == ProfitCubeCell.account_id))
+
+        profit_sum = func.sum(ProfitCubeCell.profit_twd)
+        revenue_sum = func.sum(ProfitCubeCell.revenue_twd)
+        columns += [
+            profit_sum.label("profit_twd"),
+            revenue_sum.label("revenue_twd"),
+            func.sum(ProfitCubeCell.cost_twd).label("cost_twd"),
+            func.sum(ProfitCubeCell.rmb_volume).label("rmb_volume"),
+            func.sum(ProfitCubeCell.sales_count).label("sales_count"),
+        ]
+
+        query = db.select(*columns).select_from(ProfitCubeCell)
+        for model, condition in query_joins:
+            query = query.outerjoin(model, condition)
+        if start:
+            query = query.filter(ProfitCubeCell.day >= start)
+        if end:
+            query = query.filter(ProfitCubeCell.day <= end)
+        for field, value in (filters or {}).items():
+            query = query.filter(getattr(ProfitCubeCell, field) == value)
+        if group_columns:
+            query = query.group_by(*group_columns)
+        query = query.order_by(profit_sum.desc()).limit(limit)
+
+        rows = []
+        for row in db.session.execute(query).all():
+            item = dict(row._mapping)
+            if isinstance(item.get("day"), (date, datetime)):
+                item["day"] = item["day"].isoformat()
+            revenue_value = float(item["revenue_twd"] or 0)
+            for field in ("profit_twd", "revenue_twd", "cost_twd", "rmb_volume"):
+                item[field] = round(float(item[field] or 0), 2)
+            item["margin"] = round(float(item["profit_twd"]) / revenue_value, 4) if revenue_value else 0.0
+            rows.append(item)
+        return rows
+
+
+# ===================================================================
+# 刪除記錄審計服務類
+# ===================================================================
+
+class DeleteAuditService:
+    """刪除記錄審計服務類"""
+    
+    @staticmethod
+    def collect_balance_changes(affected_accounts):
+        """收集帳戶餘額變化資訊"""
+        try:
+            import json
+            
+            balance_changes = []
+            for account in affected_accounts:
+                balance_changes.append({
+                    'account_id': account.id,
+                    'account_name': account.name,
+                    'currency': account.currency,
+                    'balance_before': getattr(account, '_balance_before', None),
+                    'balance_after': account.balance,
+                    'change': account.balance - getattr(account, '_balance_before', account.balance)
+                })
+            
+            return json.dumps(balance_changes, ensure_ascii=False) if balance_changes else None
+            
+        except Exception as e:
+            logger.error("收集餘額變化失敗: %s", e)
+            return None
+    
+    @staticmethod
+    def log_deletion(table_name, record_id, deleted_data, operation_type, description=None, operator_id=None, request=None, balance_changes=None):
+        """記錄刪除操作"""
+        try:
+            # 獲取操作者資訊
+            operator_name = None
+            if operator_id:
+                operator = db.session.get(User, operator_id)
+                if operator:
+                    operator_name = operator.username
+            
+            # 獲取IP和用戶代理
+            ip_address = None
+            user_agent = None
+            if request:
+                ip_address = request.remote_addr
+                user_agent = request.headers.get('User-Agent', '')[:500]  # 限制長度
+            
+            # 創建審計記錄
+            audit_log = DeleteAuditLog(
+                table_name=table_name,
+                record_id=record_id,
+                deleted_data=deleted_data,
+                operation_type=operation_type,
+                description=description,
+                operator_id=operator_id,
+                operator_name=operator_name,
+                ip_address=ip_address,
+                user_agent=user_agent,
+                balance_changes=balance_changes
+            )
+            
+            db.session.add(audit_log)
+            db.session.commit()
+            
+            logger.debug("刪除記錄已記錄到審計日誌: %s.%s", table_name, record_id)
+            return True
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error("記錄刪除審計日誌失敗: %s", e)
+            return False
+    
+    @staticmethod
+    def get_deletion_logs(table_name=None, operator_id=None, limit=50):
+        """獲取刪除記錄"""
+        try:
+            query = db.session.execute(db.select(DeleteAuditLog))
+            
+            if table_name:
+                query = query.filter(DeleteAuditLog.table_name == table_name)
+            
+            if operator_id:
+                query = query.filter(DeleteAuditLog.operator_id == operator_id)
             
             query = query.order_by(DeleteAuditLog.deleted_at.desc()).limit(limit)
             
             logs = query.scalars().all()
             return [log.to_dict() for log in logs]
-            
         except Exception as e:
-            if "does not exist" in str(e) and "delete_audit_logs" in str(e):
-                print("警告: delete_audit_logs 表格不存在，返回空結果")
-                db.session.rollback()
-                return []
-            else:
-                print(f"獲取刪除記錄失敗: {e}")
-                db.session.rollback()
-                return []
+            logger.error("獲取刪除記錄失敗: %s", e)
+            db.session.rollback()
+            return []
     
     @staticmethod
     def get_deletion_log_by_id(log_id):
@@ -882,14 +1938,93 @@ class DeleteAuditService:
             log = db.session.get(DeleteAuditLog, log_id)
             return log.to_dict() if log else None
         except Exception as e:
-            if "does not exist" in str(e) and "delete_audit_logs" in str(e):
-                print("警告: delete_audit_logs 表格不存在，返回空結果")
-                db.session.rollback()
+            logger.error("獲取刪除記錄失敗: %s", e)
+            db.session.rollback()
+            return None
+
+
+# ===================================================================
+# 歷史歸檔查詢服務類
+# ===================================================================
+
+class ArchiveHistoryService:
+    """合併資料庫中的近期資料與歸檔層（archive_store 的月份分區檔）中的歷史資料
+
+    歸檔層未設定或讀取失敗時只回傳資料庫中的列，頁面照常運作；ARCHIVE_READ=0 可完全關閉。
+    """
+
+    MODELS = {
+        "sales_records": SalesRecord,
+        "purchase_records": PurchaseRecord,
+        "ledger_entries": LedgerEntry,
+        "cash_logs": CashLog,
+    }
+    RETRY_SECONDS = 300
+
+    _reader = None
+    _failed_at = None
+
+    @classmethod
+    def reader(cls):
+        """共用的 ArchiveReader；建立失敗後 RETRY_SECONDS 內不再重試"""
+        if os.environ.get("ARCHIVE_READ", "1") == "0":
+            return None
+        if cls._reader is None:
+            if cls._failed_at is not None and time.monotonic() - cls._failed_at < cls.RETRY_SECONDS:
                 return None
-            else:
-                print(f"獲取刪除記錄失敗: {e}")
-                db.session.rollback()
+            try:
+                import object_store
+
+                cls._reader = archive_store.ArchiveReader(object_store.from_env())
+            except Exception as e:
+                logger.warning("歸檔層無法使用，只查詢資料庫: %s", e)
+                cls._failed_at = time.monotonic()
                 return None
+        return cls._reader
+
+    @classmethod
+    def archived_rows(cls, table, start=None, end=None, limit=None, **filters):
+        """歸檔層中 [start, end) 內符合 filters 的列（dict），指定 limit 時只取最早的 limit 筆；無法讀取時回傳空 list"""
+        reader = cls.reader()
+        if reader is None:
+            return []
+        try:
+            return reader.query(table, start, end, limit=limit, **filters)
+        except Exception as e:
+            logger.warning("讀取歸檔資料 %s 失敗: %s", table, e)
+            return []
+
+    @classmethod
+    def history(cls, table, start=None, end=None, limit=None, **filters):
+        """資料庫與歸檔合併後 [start, end) 內符合 filters 的列，依日期排序；指定 limit 時只回傳最早的 limit 筆
+
+        limit 同時套用在資料庫查詢（ORDER BY ... LIMIT）與歸檔分區的掃描，兩邊各取最早的 limit 筆再合併，
+        不會把整個區間載入記憶體。同一個 id 同時存在時以資料庫為準（歸檔後、刪除前的短暫期間兩邊都有）；
+        歸檔列帶有 archived=True。
+        """
+        model = cls.MODELS[table]
+        date_column = archive_store.ARCHIVE_TABLES[table]
+        column = getattr(model, date_column)
+        query = db.select(model).filter_by(**filters)
+        if start is not None:
+            query = query.filter(column >= start)
+        if end is not None:
+            query = query.filter(column < end)
+        if limit is not None:
+            query = query.order_by(column.asc().nulls_last(), model.id).limit(limit)
+        columns = model.__table__.columns
+        rows = [
+            {**{c.name: getattr(record, c.key) for c in columns}, "archived": False}
+            for record in db.session.execute(query).scalars()
+        ]
+        hot_ids = {row["id"] for row in rows}
+        rows.extend(
+            {**row, "archived": True}
+            for row in cls.archived_rows(table, start, end, limit=limit, **filters)
+            if row["id"] not in hot_ids
+        )
+        rows.sort(key=lambda row: (row[date_column] is None, row[date_column] or datetime.min, row["id"]))
+        return rows if limit is None else rows[:limit]
 
 
 # ===================================================================
@@ -915,12 +2050,12 @@ class FIFOService:
             
             db.session.add(fifo_inventory)
             db.session.commit()
-            print(f"已創建FIFO庫存記錄: {fifo_inventory}")
+            fifo_logger.debug("已創建FIFO庫存記錄: %s", fifo_inventory)
             return fifo_inventory
             
         except Exception as e:
             db.session.rollback()
-            print(f"創建FIFO庫存失敗: {e}")
+            fifo_logger.error("創建FIFO庫存失敗: %s", e)
             raise
     
     @staticmethod
@@ -984,26 +2119,26 @@ class FIFOService:
                 allocations.append(allocation)
                 db.session.add(allocation)
                 
-                print(f" 從庫存批次 {inventory.id} 分配 {allocate_from_this_batch} RMB，成本 {allocation.allocated_cost_twd} TWD")
+                fifo_logger.debug(" 從庫存批次 %s 分配 %s RMB，成本 %s TWD", inventory.id, allocate_from_this_batch, allocation.allocated_cost_twd)
             
             if remaining_to_allocate > 0:
                 raise ValueError(f"庫存不足，還需要 {remaining_to_allocate} RMB")
             
             # 關鍵修正：從售出的扣款戶統一扣款（不是從庫存來源帳戶）
             old_balance = deduction_account.balance
-            deduction_account.balance -= rmb_amount
-            new_balance = deduction_account.balance
-            print(f"[MONEY] 從售出扣款戶 {deduction_account.name} 扣款: {old_balance:.2f} -> {new_balance:.2f} (-{rmb_amount:.2f} RMB)")
+            new_balance = BalanceService.apply_delta(deduction_account, -rmb_amount)
+            fifo_logger.debug("[MONEY] 從售出扣款戶 %s 扣款: %.2f -> %.2f (-%.2f RMB)", deduction_account.name, old_balance, new_balance, rmb_amount)
             
             # 注意：不創建 WITHDRAW LedgerEntry，因為售出記錄已經會在流水頁面顯示完整的扣款信息
             # 避免重複顯示造成混淆
             
             db.session.flush()  # 改為flush，讓上層控制commit
-            print(f"FIFO分配完成，總成本: {total_cost} TWD")
+            fifo_logger.debug("FIFO分配完成，總成本: %s TWD", total_cost)
+            ProfitCubeService.refresh_for_sale(sales_record)
             
             # 計算利潤
             profit_twd = sales_record.twd_amount - total_cost
-            print(f"利潤計算: 售價 {sales_record.twd_amount} TWD - 成本 {total_cost} TWD = 利潤 {profit_twd} TWD")
+            fifo_logger.debug("利潤計算: 售價 %s TWD - 成本 %s TWD = 利潤 %s TWD", sales_record.twd_amount, total_cost, profit_twd)
             
             return {
                 'allocations': allocations,
@@ -1014,7 +2149,7 @@ class FIFOService:
             
         except Exception as e:
             db.session.rollback()
-            print(f"FIFO分配失敗: {e}")
+            fifo_logger.error("FIFO分配失敗: %s", e)
             raise
     
     @staticmethod
@@ -1073,7 +2208,7 @@ class FIFOService:
             return inventory_summary
             
         except Exception as e:
-            print(f"獲取庫存狀態失敗: {e}")
+            fifo_logger.error("獲取庫存狀態失敗: %s", e)
             return []
     
     # ===================================================================
@@ -1084,15 +2219,15 @@ class FIFOService:
     def simple_reverse_sale_allocation(sales_record_id):
         """簡化的回滾銷售記錄方法，用於診斷問題"""
         try:
-            print(f"開始簡化回滾銷售記錄 {sales_record_id}")
+            fifo_logger.debug("開始簡化回滾銷售記錄 %s", sales_record_id)
             
             # 查找該銷售記錄
             sales_record = db.session.get(SalesRecord, sales_record_id)
             if not sales_record:
-                print(f"找不到銷售記錄 {sales_record_id}")
+                fifo_logger.debug("找不到銷售記錄 %s", sales_record_id)
                 return False
             
-            print(f"找到銷售記錄: 客戶ID={sales_record.customer_id}, RMB={sales_record.rmb_amount}")
+            fifo_logger.debug("找到銷售記錄: 客戶ID=%s, RMB=%s", sales_record.customer_id, sales_record.rmb_amount)
             
             # 查找該銷售記錄的所有FIFO分配
             allocations = db.session.execute(
@@ -1100,18 +2235,22 @@ class FIFOService:
                 .filter(FIFOSalesAllocation.sales_record_id == sales_record_id)
             ).scalars().all()
             
-            print(f"找到 {len(allocations)} 個FIFO分配記錄")
+            fifo_logger.debug("找到 %s 個FIFO分配記錄", len(allocations))
+            
+            # 沖銷該筆售出的利潤（必須在刪除FIFO分配之前計算）
+            ProfitService.reverse_sale_profit(sales_record)
+            cube_key = ProfitCubeService.cell_key(sales_record)
             
             # 簡化的回滾邏輯
             for allocation in allocations:
                 # 恢復庫存數量
                 if allocation.fifo_inventory:
                     allocation.fifo_inventory.remaining_rmb += allocation.allocated_rmb
-                    print(f"恢復庫存批次 {allocation.fifo_inventory.id} 的數量: +{allocation.allocated_rmb} RMB")
+                    fifo_logger.debug("恢復庫存批次 %s 的數量: +%s RMB", allocation.fifo_inventory.id, allocation.allocated_rmb)
                 
                 # 刪除分配記錄
                 db.session.delete(allocation)
-                print(f"刪除FIFO分配記錄 {allocation.id}")
+                fifo_logger.debug("刪除FIFO分配記錄 %s", allocation.id)
             
             # 更新客戶應收帳款
             if sales_record.customer:
@@ -1119,33 +2258,32 @@ class FIFOService:
                 customer.total_receivables_twd -= sales_record.twd_amount
                 if customer.total_receivables_twd < 0:
                     customer.total_receivables_twd = 0
-                print(f"更新客戶 {customer.name} 的應收帳款: -{sales_record.twd_amount} TWD")
+                fifo_logger.debug("更新客戶 %s 的應收帳款: -%s TWD", customer.name, sales_record.twd_amount)
             
             # 恢復RMB帳戶餘額
             if sales_record.rmb_account:
-                sales_record.rmb_account.balance += sales_record.rmb_amount
-                print(f"恢復RMB帳戶 {sales_record.rmb_account.name} 的餘額: +{sales_record.rmb_amount} RMB")
+                BalanceService.apply_delta(sales_record.rmb_account, sales_record.rmb_amount)
+                fifo_logger.debug("恢復RMB帳戶 %s 的餘額: +%s RMB", sales_record.rmb_account.name, sales_record.rmb_amount)
             
             # 刪除銷售記錄本身
             db.session.delete(sales_record)
-            print(f"刪除銷售記錄 {sales_record_id}")
+            fifo_logger.debug("刪除銷售記錄 %s", sales_record_id)
             
+            ProfitCubeService.refresh([cube_key])
             db.session.commit()
-            print(f"簡化回滾銷售記錄 {sales_record_id} 成功")
+            fifo_logger.debug("簡化回滾銷售記錄 %s 成功", sales_record_id)
             return True
             
         except Exception as e:
             db.session.rollback()
-            print(f"簡化回滾銷售記錄失敗: {e}")
-            import traceback
-            traceback.print_exc()
+            fifo_logger.exception("簡化回滾銷售記錄失敗: %s", e)
             return False
 
     @staticmethod
     def reverse_sale_allocation(sales_record_id):
         """完全回滾銷售記錄（包括FIFO分配和銷售記錄本身）"""
         try:
-            print(f"開始回滾銷售記錄 {sales_record_id}")
+            fifo_logger.debug("開始回滾銷售記錄 %s", sales_record_id)
             
             # 查找該銷售記錄
             sales_record = (
@@ -1158,10 +2296,10 @@ class FIFOService:
             )
             
             if not sales_record:
-                print(f"找不到銷售記錄 {sales_record_id}")
+                fifo_logger.debug("找不到銷售記錄 %s", sales_record_id)
                 return False
             
-            print(f"找到銷售記錄: 客戶ID={sales_record.customer_id}, RMB={sales_record.rmb_amount}, TWD={sales_record.twd_amount}")
+            fifo_logger.debug("找到銷售記錄: 客戶ID=%s, RMB=%s, TWD=%s", sales_record.customer_id, sales_record.rmb_amount, sales_record.twd_amount)
             
             # 查找該銷售記錄的所有FIFO分配
             allocations = (
@@ -1173,7 +2311,11 @@ class FIFOService:
                 .all()
             )
             
-            print(f"找到 {len(allocations)} 個FIFO分配記錄")
+            fifo_logger.debug("找到 %s 個FIFO分配記錄", len(allocations))
+            
+            # 沖銷該筆售出的利潤（必須在刪除FIFO分配之前計算）
+            ProfitService.reverse_sale_profit(sales_record)
+            cube_key = ProfitCubeService.cell_key(sales_record)
             
             # --- 關鍵修正：更新客戶的應收帳款 ---
             # 在刪除銷售記錄之前，先更新客戶的應收帳款
@@ -1181,12 +2323,12 @@ class FIFOService:
                 customer = sales_record.customer
                 # 減少客戶的應收帳款
                 customer.total_receivables_twd -= sales_record.twd_amount
-                print(f"更新客戶 {customer.name} 的應收帳款: -{sales_record.twd_amount} TWD")
+                fifo_logger.debug("更新客戶 %s 的應收帳款: -%s TWD", customer.name, sales_record.twd_amount)
                 
                 # 確保應收帳款不會變成負數
                 if customer.total_receivables_twd < 0:
                     customer.total_receivables_twd = 0
-                    print(f"客戶 {customer.name} 的應收帳款已調整為 0")
+                    fifo_logger.debug("客戶 %s 的應收帳款已調整為 0", customer.name)
             
             # --- 關鍵修正：恢復RMB帳戶的餘額 ---
             # 先記錄所有受影響帳戶的原始餘額
@@ -1204,13 +2346,13 @@ class FIFOService:
                             affected_accounts.append(deposit_account)
                         
                         # 如果是RMB帳戶，直接恢復RMB餘額
-                        deposit_account.balance += allocation.allocated_rmb
-                        print(f"恢復RMB帳戶 {deposit_account.name} 的餘額: +{allocation.allocated_rmb} RMB")
+                        BalanceService.apply_delta(deposit_account, allocation.allocated_rmb)
+                        fifo_logger.debug("恢復RMB帳戶 %s 的餘額: +%s RMB", deposit_account.name, allocation.allocated_rmb)
                     else:
                         # 如果不是RMB帳戶，需要找到對應的RMB帳戶
                         # 根據買入記錄的邏輯，RMB餘額應該在deposit_account中
                         # 但這裡需要檢查是否有其他RMB帳戶需要恢復
-                        print(f"警告：庫存來源帳戶 {deposit_account.name} 不是RMB帳戶")
+                        fifo_logger.warning("警告：庫存來源帳戶 %s 不是RMB帳戶", deposit_account.name)
                         
                         # 嘗試找到對應的RMB帳戶
                         # 這裡需要根據業務邏輯來確定如何恢復RMB餘額
@@ -1224,9 +2366,9 @@ class FIFOService:
                         # 方案2：如果沒有明確的RMB帳戶，則記錄這個問題
                         
                         # 暫時記錄這個問題，讓管理員手動處理
-                        print(f"需要手動檢查RMB餘額恢復邏輯")
-                        print(f"   分配RMB: {allocation.allocated_rmb}")
-                        print(f"   庫存來源帳戶: {deposit_account.name} (非RMB帳戶)")
+                        fifo_logger.debug("需要手動檢查RMB餘額恢復邏輯")
+                        fifo_logger.debug("   分配RMB: %s", allocation.allocated_rmb)
+                        fifo_logger.debug("   庫存來源帳戶: %s (非RMB帳戶)", deposit_account.name)
                         
                         # TODO: 實現更智能的RMB餘額恢復邏輯
                         # 可能需要檢查是否有其他RMB帳戶需要恢復
@@ -1238,11 +2380,11 @@ class FIFOService:
                 inventory = allocation.fifo_inventory
                 if inventory:
                     inventory.remaining_rmb += allocation.allocated_rmb
-                    print(f"恢復庫存批次 {inventory.id} 的數量: +{allocation.allocated_rmb} RMB")
+                    fifo_logger.debug("恢復庫存批次 %s 的數量: +%s RMB", inventory.id, allocation.allocated_rmb)
                 
                 # 刪除分配記錄
                 db.session.delete(allocation)
-                print(f"刪除FIFO分配記錄 {allocation.id}")
+                fifo_logger.debug("刪除FIFO分配記錄 %s", allocation.id)
             
             # 記錄刪除審計日誌（在刪除前記錄完整資料）
             try:
@@ -1285,37 +2427,38 @@ class FIFOService:
                     balance_changes=balance_changes
                 )
             except Exception as audit_error:
-                print(f"記錄審計日誌失敗: {audit_error}")
+                fifo_logger.error("記錄審計日誌失敗: %s", audit_error)
                 # 不讓審計日誌失敗影響主要操作
             
             # 刪除銷售記錄本身
             db.session.delete(sales_record)
-            print(f"刪除銷售記錄 {sales_record_id}")
+            fifo_logger.debug("刪除銷售記錄 %s", sales_record_id)
             
+            ProfitCubeService.refresh([cube_key])
             db.session.commit()
-            print(f"成功完全回滾銷售記錄 {sales_record_id}")
+            fifo_logger.debug("成功完全回滾銷售記錄 %s", sales_record_id)
             
             # 調用全局數據同步，確保帳戶餘額和庫存一致
             try:
                 from global_sync import sync_entire_database
                 sync_entire_database(db.session)
-                print(f"全局數據同步完成，帳戶餘額和庫存已重新整理")
+                fifo_logger.debug("全局數據同步完成，帳戶餘額和庫存已重新整理")
             except Exception as sync_error:
-                print(f"全局數據同步失敗: {sync_error}")
+                fifo_logger.error("全局數據同步失敗: %s", sync_error)
                 # 不讓全局同步失敗影響主要操作
             
             return True
             
         except Exception as e:
             db.session.rollback()
-            print(f"回滾銷售記錄失敗: {e}")
+            fifo_logger.error("回滾銷售記錄失敗: %s", e)
             return False
     
     @staticmethod
     def reverse_purchase_inventory(purchase_record_id):
         """完全回滾買入記錄（包括FIFO庫存和買入記錄本身）"""
         try:
-            print(f"開始回滾買入記錄 {purchase_record_id}")
+            fifo_logger.debug("開始回滾買入記錄 %s", purchase_record_id)
             
             # 查找該買入記錄
             purchase_record = (
@@ -1328,10 +2471,10 @@ class FIFOService:
             )
             
             if not purchase_record:
-                print(f"找不到買入記錄 {purchase_record_id}")
+                fifo_logger.debug("找不到買入記錄 %s", purchase_record_id)
                 return False
             
-            print(f"找到買入記錄: channel={purchase_record.channel_id}, payment_account={purchase_record.payment_account_id}, twd_cost={purchase_record.twd_cost}")
+            fifo_logger.debug("找到買入記錄: channel=%s, payment_account=%s, twd_cost=%s", purchase_record.channel_id, purchase_record.payment_account_id, purchase_record.twd_cost)
             
             # 查找該買入記錄的FIFO庫存
             inventory = (
@@ -1343,7 +2486,7 @@ class FIFOService:
                 .first()
             )
             
-            print(f"查找FIFO庫存: inventory_id={inventory.id if inventory else None}")
+            fifo_logger.debug("查找FIFO庫存: inventory_id=%s", inventory.id if inventory else None)
             
             # 檢查是否有銷售分配
             if inventory:
@@ -1356,19 +2499,19 @@ class FIFOService:
                     .all()
                 )
                 
-                print(f"檢查銷售分配: 找到 {len(allocations)} 個分配記錄")
+                fifo_logger.debug("檢查銷售分配: 找到 %s 個分配記錄", len(allocations))
                 
                 if allocations:
-                    print(f"庫存批次 {inventory.id} 已有銷售分配，無法直接回滾")
+                    fifo_logger.debug("庫存批次 %s 已有銷售分配，無法直接回滾", inventory.id)
                     for alloc in allocations:
-                        print(f"  分配記錄: {alloc.id}, 銷售記錄: {alloc.sales_record_id}, 分配RMB: {alloc.allocated_rmb}")
+                        fifo_logger.debug("  分配記錄: %s, 銷售記錄: %s, 分配RMB: %s", alloc.id, alloc.sales_record_id, alloc.allocated_rmb)
                     return False
                 
                 # 刪除庫存記錄
                 db.session.delete(inventory)
-                print(f"刪除FIFO庫存記錄 {inventory.id}")
+                fifo_logger.debug("刪除FIFO庫存記錄 %s", inventory.id)
             else:
-                print(f"找不到對應的FIFO庫存記錄，purchase_record_id: {purchase_record_id}")
+                fifo_logger.debug("找不到對應的FIFO庫存記錄，purchase_record_id: %s", purchase_record_id)
                 # 即使沒有庫存記錄，我們仍然可以繼續處理買入記錄的回滾
             
             # 回滾帳戶餘額：根據買入記錄類型進行不同的處理
@@ -1385,8 +2528,8 @@ class FIFOService:
                     deposit_account._balance_before = deposit_account.balance
                     affected_accounts.append(deposit_account)
                     
-                    deposit_account.balance -= purchase_record.rmb_amount
-                    print(f"從帳戶 {deposit_account.name} 扣除手續費: -{purchase_record.rmb_amount} RMB")
+                    BalanceService.apply_delta(deposit_account, -purchase_record.rmb_amount, allow_negative=True)
+                    fifo_logger.debug("從帳戶 %s 扣除手續費: -%s RMB", deposit_account.name, purchase_record.rmb_amount)
                     
                     # 創建提款流水記錄（使用系統用戶ID，避免current_user問題）
                     try:
@@ -1395,42 +2538,15 @@ class FIFOService:
                     except:
                         operator_id = 1  # 默認系統用戶ID
                     
-                    try:
-                        entry = LedgerEntry(
-                            entry_type="WITHDRAW",
-                            account_id=deposit_account.id,
-                            amount=purchase_record.rmb_amount,
-                            description="獨立儲值頁面：刪除儲值紀錄回退純利潤庫存",
-                            operator_id=operator_id,
-                        )
-                        db.session.add(entry)
-                    except Exception as e:
-                        if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                            print("警告: 儲值頁面創建LedgerEntry時缺少欄位，嘗試修復...")
-                            db.session.rollback()
-                            
-                            # 嘗試添加缺失的欄位
-                            try:
-                                db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                                db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                                db.session.commit()
-                                print("[OK] 儲值頁面欄位修復完成，重新創建記錄...")
-                                
-                                # 重新創建記錄
-                                entry = LedgerEntry(
-                                    entry_type="WITHDRAW",
-                                    account_id=deposit_account.id,
-                                    amount=purchase_record.rmb_amount,
-                                    description="獨立儲值頁面：刪除儲值紀錄回退純利潤庫存",
-                                    operator_id=operator_id,
-                                )
-                                db.session.add(entry)
-                            except Exception as fix_error:
-                                print(f"[ERROR] 儲值頁面修復欄位失敗: {fix_error}")
-                                raise fix_error
-                        else:
-                            raise e
-                    print(f"創建提款流水記錄: -{purchase_record.rmb_amount} RMB")
+                    entry = LedgerEntry(
+                        entry_type="WITHDRAW",
+                        account_id=deposit_account.id,
+                        amount=purchase_record.rmb_amount,
+                        description="獨立儲值頁面：刪除儲值紀錄回退純利潤庫存",
+                        operator_id=operator_id,
+                    )
+                    db.session.add(entry)
+                    fifo_logger.debug("創建提款流水記錄: -%s RMB", purchase_record.rmb_amount)
             else:
                 # 正常買入記錄：回滾帳戶餘額
                 # RMB帳戶刪除款項（減少RMB餘額）
@@ -1440,8 +2556,8 @@ class FIFOService:
                     deposit_account._balance_before = deposit_account.balance
                     affected_accounts.append(deposit_account)
                     
-                    deposit_account.balance -= purchase_record.rmb_amount
-                    print(f"回滾RMB帳戶 {deposit_account.name}: -{purchase_record.rmb_amount} RMB")
+                    BalanceService.apply_delta(deposit_account, -purchase_record.rmb_amount, allow_negative=True)
+                    fifo_logger.debug("回滾RMB帳戶 %s: -%s RMB", deposit_account.name, purchase_record.rmb_amount)
                 
                 # 台幣帳戶回補款項（增加台幣餘額）
                 if purchase_record.payment_account:
@@ -1450,8 +2566,8 @@ class FIFOService:
                     payment_account._balance_before = payment_account.balance
                     affected_accounts.append(payment_account)
                     
-                    payment_account.balance += purchase_record.twd_cost
-                    print(f"回補台幣帳戶 {payment_account.name}: +{purchase_record.twd_cost} TWD")
+                    BalanceService.apply_delta(payment_account, purchase_record.twd_cost)
+                    fifo_logger.debug("回補台幣帳戶 %s: +%s TWD", payment_account.name, purchase_record.twd_cost)
             
             # 記錄刪除審計日誌（在刪除前記錄完整資料）
             try:
@@ -1493,21 +2609,21 @@ class FIFOService:
                     balance_changes=balance_changes
                 )
             except Exception as audit_error:
-                print(f"記錄審計日誌失敗: {audit_error}")
+                fifo_logger.error("記錄審計日誌失敗: %s", audit_error)
             
             # 刪除買入記錄本身
             db.session.delete(purchase_record)
-            print(f"刪除買入記錄 {purchase_record_id}")
+            fifo_logger.debug("刪除買入記錄 %s", purchase_record_id)
             
             db.session.commit()
-            print(f"成功完全回滾買入記錄 {purchase_record_id}")
+            fifo_logger.debug("成功完全回滾買入記錄 %s", purchase_record_id)
             return True
             
         except Exception as e:
             db.session.rollback()
-            print(f"回滾買入記錄失敗: {e}")
+            fifo_logger.error("回滾買入記錄失敗: %s", e)
             import traceback
-            print(f"詳細錯誤信息: {traceback.format_exc()}")
+            fifo_logger.error("詳細錯誤信息: %s", traceback.format_exc())
             return False
     
     @staticmethod
@@ -1545,7 +2661,7 @@ class FIFOService:
             return issues
             
         except Exception as e:
-            print(f"庫存一致性審計失敗: {e}")
+            fifo_logger.error("庫存一致性審計失敗: %s", e)
             return [f"審計過程發生錯誤: {e}"]
     
     @staticmethod
@@ -1574,12 +2690,12 @@ class FIFOService:
                 fixed_issues.append(f"修復庫存批次 {inv.id} 的負數數量")
             
             db.session.commit()
-            print(f"修復了 {len(fixed_issues)} 個庫存一致性问题")
+            fifo_logger.debug("修復了 %s 個庫存一致性问题", len(fixed_issues))
             return fixed_issues
             
         except Exception as e:
             db.session.rollback()
-            print(f"修復庫存一致性失敗: {e}")
+            fifo_logger.error("修復庫存一致性失敗: %s", e)
             return []
     
     @staticmethod
@@ -1626,24 +2742,25 @@ class FIFOService:
                     'remaining_after': inventory.remaining_rmb
                 })
                 
-                print(f" 從庫存批次 {inventory.id} 扣減 {reduce_from_this_batch} RMB，剩餘 {inventory.remaining_rmb} RMB")
+                fifo_logger.debug(" 從庫存批次 %s 扣減 %s RMB，剩餘 %s RMB", inventory.id, reduce_from_this_batch, inventory.remaining_rmb)
             
             db.session.flush()  # 確保更新被保存
-            print(f"成功按FIFO扣減庫存 {amount} RMB，原因：{reason}")
+            fifo_logger.debug("成功按FIFO扣減庫存 %s RMB，原因：%s", amount, reason)
             return reduced_items
             
         except Exception as e:
-            print(f"扣減庫存失敗: {e}")
+            fifo_logger.error("扣減庫存失敗: %s", e)
             raise
     
     @staticmethod
     def calculate_profit_for_sale(sales_record):
         """計算某筆銷售的利潤（使用FIFO方法）"""
         try:
-            # 獲取該銷售記錄的所有FIFO分配
+            # 獲取該銷售記錄的所有FIFO分配（連同對應的庫存批次一次載入）
             allocations = (
                 db.session.execute(
                     db.select(FIFOSalesAllocation)
+                    .options(db.joinedload(FIFOSalesAllocation.fifo_inventory))
                     .filter(FIFOSalesAllocation.sales_record_id == sales_record.id)
                 )
                 .scalars()
@@ -1654,99 +2771,161 @@ class FIFOService:
                 # 如果沒有FIFO分配，使用預覽計算
                 return FIFOService.calculate_profit_preview_for_sale(sales_record)
             
-            # 使用FIFO分配計算利潤
-            total_profit_twd = 0
-            total_cost_twd = 0
-            sales_exchange_rate = sales_record.twd_amount / sales_record.rmb_amount  # 售出匯率
-            
-            # 遍歷每個FIFO分配，計算每批的利潤
-            pure_profit_twd = 0  # 純利潤庫存的絕對利潤
-            regular_profit_twd = 0  # 一般庫存的利潤
-            
-            for allocation in allocations:
-                # 獲取對應的庫存記錄
-                inventory = allocation.fifo_inventory
-                if not inventory:
-                    continue
-                
-                # 該批次的買入匯率
-                purchase_exchange_rate = inventory.exchange_rate
-                
-                # 該批次的售出金額（RMB）
-                allocated_rmb = allocation.allocated_rmb
-                
-                # 該批次的成本（TWD）
-                allocated_cost_twd = allocation.allocated_cost_twd
-                
-                # 檢查是否為純利潤庫存（成本為0）
-                is_pure_profit = allocated_cost_twd == 0
-                
-                if is_pure_profit:
-                    # 純利潤庫存：售出金額全部為利潤
-                    pure_profit_twd += sales_record.twd_amount * (allocated_rmb / sales_record.rmb_amount)
-                    print(f"純利潤庫存：批次 {inventory.id}，分配RMB {allocated_rmb}，純利潤 {pure_profit_twd} TWD")
-                else:
-                    # 一般庫存：按匯率差計算利潤
-                    batch_profit_twd = (sales_exchange_rate - purchase_exchange_rate) * allocated_rmb
-                    regular_profit_twd += batch_profit_twd
-                    total_cost_twd += allocated_cost_twd
-                    print(f"一般庫存：批次 {inventory.id}，買入匯率 {purchase_exchange_rate}，售出匯率 {sales_exchange_rate}，分配RMB {allocated_rmb}，批次利潤 {batch_profit_twd} TWD")
-            
-            # 總利潤 = 一般庫存利潤 + 純利潤庫存利潤
-            total_profit_twd = regular_profit_twd + pure_profit_twd
-            
-            # 計算利潤率
-            profit_margin = (total_profit_twd / sales_record.twd_amount * 100) if sales_record.twd_amount > 0 else 0
-            
-            return {
-                'sales_amount': sales_record.twd_amount,
-                'total_cost_twd': total_cost_twd,
-                'profit_twd': total_profit_twd,
-                'profit_margin': profit_margin,
-                'pure_profit_twd': pure_profit_twd,  # 純利潤庫存產生的絕對利潤
-                'regular_profit_twd': regular_profit_twd,  # 一般庫存產生的利潤
-                'regular_profit_margin': (regular_profit_twd / (sales_record.twd_amount - pure_profit_twd) * 100) if (sales_record.twd_amount - pure_profit_twd) > 0 else 0,  # 一般庫存的利潤率
-                'allocations': [
-                    {
-                        'inventory_id': allocation.fifo_inventory_id,
-                        'allocated_rmb': allocation.allocated_rmb,
-                        'allocated_cost': allocation.allocated_cost_twd,
-                        'purchase_date': allocation.fifo_inventory.purchase_date.strftime('%Y-%m-%d'),
-                        'purchase_exchange_rate': allocation.fifo_inventory.exchange_rate,
-                        'is_pure_profit': allocation.allocated_cost_twd == 0,
-                        'batch_profit': (sales_record.twd_amount * (allocation.allocated_rmb / sales_record.rmb_amount)) if allocation.allocated_cost_twd == 0 else (sales_exchange_rate - allocation.fifo_inventory.exchange_rate) * allocation.allocated_rmb
-                    }
-                    for allocation in allocations
-                ]
-            }
+            return FIFOService._profit_from_allocations(sales_record, allocations)
             
         except Exception as e:
-            print(f"計算利潤失敗: {e}")
+            fifo_logger.error("計算利潤失敗: %s", e)
             return None
     
     @staticmethod
-    def calculate_profit_preview_for_sale(sales_record):
-        """為銷售記錄計算利潤預覽（基於FIFO庫存）"""
+    def calculate_profits_for_sales(sales_records):
+        """批次計算多筆銷售的利潤，回傳 {sales_record_id: 利潤資訊}
+        
+        與逐筆呼叫 calculate_profit_for_sale 結果相同，但 FIFO 分配與庫存批次分塊一次載入，
+        查詢數不隨銷售筆數增加（列表頁逐筆計算會產生 N+1 查詢）。
+        """
+        sales_records = [sale for sale in sales_records if sale is not None]
+        if not sales_records:
+            return {}
+        
+        allocations_by_sale = {}
         try:
-            rmb_amount = sales_record.rmb_amount
-            sales_exchange_rate = sales_record.twd_amount / sales_record.rmb_amount  # 售出匯率
+            sale_ids = [sale.id for sale in sales_records]
+            # 分塊查詢，避免 IN 清單超過 SQLite 的綁定參數上限（32766）
+            for offset in range(0, len(sale_ids), 10_000):
+                chunk = sale_ids[offset:offset + 10_000]
+                rows = (
+                    db.session.execute(
+                        db.select(FIFOSalesAllocation)
+                        .options(db.joinedload(FIFOSalesAllocation.fifo_inventory))
+                        .filter(FIFOSalesAllocation.sales_record_id.in_(chunk))
+                        .order_by(FIFOSalesAllocation.id)
+                    )
+                    .scalars()
+                    .all()
+                )
+                for allocation in rows:
+                    allocations_by_sale.setdefault(allocation.sales_record_id, []).append(allocation)
+        except Exception as e:
+            fifo_logger.error("批次計算利潤失敗: %s", e)
+            return {sale.id: None for sale in sales_records}
+        
+        # 沒有FIFO分配的銷售使用預覽計算，可用庫存只查詢一次
+        available_inventory = None
+        profits = {}
+        for sale in sales_records:
+            allocations = allocations_by_sale.get(sale.id)
+            if allocations:
+                try:
+                    profits[sale.id] = FIFOService._profit_from_allocations(sale, allocations)
+                except Exception as e:
+                    fifo_logger.error("計算利潤失敗: %s", e)
+                    profits[sale.id] = None
+                continue
+            if available_inventory is None:
+                available_inventory = FIFOService._available_inventory()
+            profits[sale.id] = FIFOService.calculate_profit_preview_for_sale(sale, available_inventory)
+        return profits
+    
+    @staticmethod
+    def _profit_from_allocations(sales_record, allocations):
+        """依已載入的FIFO分配計算一筆銷售的利潤"""
+        # 使用FIFO分配計算利潤
+        total_profit_twd = 0
+        total_cost_twd = 0
+        sales_exchange_rate = sales_record.twd_amount / sales_record.rmb_amount  # 售出匯率
+        
+        # 遍歷每個FIFO分配，計算每批的利潤
+        pure_profit_twd = 0  # 純利潤庫存的絕對利潤
+        regular_profit_twd = 0  # 一般庫存的利潤
+        
+        for allocation in allocations:
+            # 獲取對應的庫存記錄
+            inventory = allocation.fifo_inventory
+            if not inventory:
+                continue
             
-            remaining_to_calculate = rmb_amount
-            total_cost_twd = 0
-            cost_breakdown = []
+            # 該批次的買入匯率
+            purchase_exchange_rate = inventory.exchange_rate
             
-            # 按買入時間順序獲取有庫存的記錄（FIFO原則）
-            available_inventory = (
-                db.session.execute(
-                    db.select(FIFOInventory)
-                    .filter(FIFOInventory.remaining_rmb > 0)
-                    .order_by(FIFOInventory.purchase_date.asc())  # 最早的優先
-                )
-                .scalars()
-                .all()
-            )
+            # 該批次的售出金額（RMB）
+            allocated_rmb = allocation.allocated_rmb
             
-            if not available_inventory:
+            # 該批次的成本（TWD）
+            allocated_cost_twd = allocation.allocated_cost_twd
+            
+            # 檢查是否為純利潤庫存（成本為0）
+            is_pure_profit = allocated_cost_twd == 0
+            
+            if is_pure_profit:
+                # 純利潤庫存：售出金額全部為利潤
+                pure_profit_twd += sales_record.twd_amount * (allocated_rmb / sales_record.rmb_amount)
+                fifo_logger.debug("純利潤庫存：批次 %s，分配RMB %s，純利潤 %s TWD", inventory.id, allocated_rmb, pure_profit_twd)
+            else:
+                # 一般庫存：按匯率差計算利潤
+                batch_profit_twd = (sales_exchange_rate - purchase_exchange_rate) * allocated_rmb
+                regular_profit_twd += batch_profit_twd
+                total_cost_twd += allocated_cost_twd
+                fifo_logger.debug("一般庫存：批次 %s，買入匯率 %s，售出匯率 %s，分配RMB %s，批次利潤 %s TWD", inventory.id, purchase_exchange_rate, sales_exchange_rate, allocated_rmb, batch_profit_twd)
+        
+        # 總利潤 = 一般庫存利潤 + 純利潤庫存利潤
+        total_profit_twd = regular_profit_twd + pure_profit_twd
+        
+        # 計算利潤率
+        profit_margin = (total_profit_twd / sales_record.twd_amount * 100) if sales_record.twd_amount > 0 else 0
+        
+        return {
+            'sales_amount': sales_record.twd_amount,
+            'total_cost_twd': total_cost_twd,
+            'profit_twd': total_profit_twd,
+            'profit_margin': profit_margin,
+            'pure_profit_twd': pure_profit_twd,  # 純利潤庫存產生的絕對利潤
+            'regular_profit_twd': regular_profit_twd,  # 一般庫存產生的利潤
+            'regular_profit_margin': (regular_profit_twd / (sales_record.twd_amount - pure_profit_twd) * 100) if (sales_record.twd_amount - pure_profit_twd) > 0 else 0,  # 一般庫存的利潤率
+            'allocations': [
+                {
+                    'inventory_id': allocation.fifo_inventory_id,
+                    'allocated_rmb': allocation.allocated_rmb,
+                    'allocated_cost': allocation.allocated_cost_twd,
+                    'purchase_date': allocation.fifo_inventory.purchase_date.strftime('%Y-%m-%d'),
+                    'purchase_exchange_rate': allocation.fifo_inventory.exchange_rate,
+                    'is_pure_profit': allocation.allocated_cost_twd == 0,
+                    'batch_profit': (sales_record.twd_amount * (allocation.allocated_rmb / sales_record.rmb_amount)) if allocation.allocated_cost_twd == 0 else (sales_exchange_rate - allocation.fifo_inventory.exchange_rate) * allocation.allocated_rmb
+                }
+                for allocation in allocations
+            ]
+        }
+    
+    @staticmethod
+    def _available_inventory():
+        """按買入時間順序取得仍有庫存的批次（連同買入紀錄與渠道）"""
+        return (
+            db.session.execute(
+                db.select(FIFOInventory)
+                .options(db.selectinload(FIFOInventory.purchase_record).selectinload(PurchaseRecord.channel))
+                .filter(FIFOInventory.remaining_rmb > 0)
+                .order_by(FIFOInventory.purchase_date.asc())  # 最早的優先
+            )
+            .scalars()
+            .all()
+        )
+    
+    @staticmethod
+    def calculate_profit_preview_for_sale(sales_record, available_inventory=None):
+        """為銷售記錄計算利潤預覽（基於FIFO庫存）；批次計算時可傳入已載入的可用庫存"""
+        try:
+            rmb_amount = sales_record.rmb_amount
+            sales_exchange_rate = sales_record.twd_amount / sales_record.rmb_amount  # 售出匯率
+            
+            remaining_to_calculate = rmb_amount
+            total_cost_twd = 0
+            cost_breakdown = []
+            
+            # 按買入時間順序獲取有庫存的記錄（FIFO原則）
+            if available_inventory is None:
+                available_inventory = FIFOService._available_inventory()
+            
+            if not available_inventory:
                 return None
             
             for inventory in available_inventory:
@@ -1773,7 +2952,7 @@ class FIFOService:
                     'purchase_exchange_rate': inventory.exchange_rate
                 })
                 
-                print(f"預覽：從庫存批次 {inventory.id} 分配 {allocate_from_this_batch} RMB，成本 {batch_cost_twd} TWD")
+                fifo_logger.debug("預覽：從庫存批次 %s 分配 %s RMB，成本 %s TWD", inventory.id, allocate_from_this_batch, batch_cost_twd)
             
             if remaining_to_calculate > 0:
                 return None  # 庫存不足
@@ -1795,7 +2974,7 @@ class FIFOService:
                 # 累計利潤
                 total_profit_twd += batch_profit_twd
                 
-                print(f"FIFO預覽利潤計算：批次 {item['purchase_date']}，買入匯率 {purchase_exchange_rate}，售出匯率 {sales_exchange_rate}，RMB {batch_rmb}，批次利潤 {batch_profit_twd} TWD")
+                fifo_logger.debug("FIFO預覽利潤計算：批次 %s，買入匯率 %s，售出匯率 %s，RMB %s，批次利潤 %s TWD", item['purchase_date'], purchase_exchange_rate, sales_exchange_rate, batch_rmb, batch_profit_twd)
             
             # 計算利潤率
             revenue_twd = rmb_amount * sales_exchange_rate
@@ -1810,7 +2989,7 @@ class FIFOService:
             }
             
         except Exception as e:
-            print(f"計算銷售利潤預覽失敗: {e}")
+            fifo_logger.error("計算銷售利潤預覽失敗: %s", e)
             return None
     
     @staticmethod
@@ -1822,15 +3001,8 @@ class FIFOService:
             cost_breakdown = []
             
             # 按買入時間順序獲取有庫存的記錄（FIFO原則）
-            available_inventory = (
-                db.session.execute(
-                    db.select(FIFOInventory)
-                    .filter(FIFOInventory.remaining_rmb > 0)
-                    .order_by(FIFOInventory.purchase_date.asc())  # 最早的優先
-                )
-                .scalars()
-                .all()
-            )
+            if available_inventory is None:
+                available_inventory = FIFOService._available_inventory()
             
             if not available_inventory:
                 return None
@@ -1858,7 +3030,7 @@ class FIFOService:
                     'batch_cost_twd': batch_cost_twd
                 })
                 
-                print(f"預覽：從庫存批次 {inventory.id} 分配 {allocate_from_this_batch} RMB，成本 {batch_cost_twd} TWD")
+                fifo_logger.debug("預覽：從庫存批次 %s 分配 %s RMB，成本 %s TWD", inventory.id, allocate_from_this_batch, batch_cost_twd)
             
             if remaining_to_calculate > 0:
                 return None  # 庫存不足
@@ -1876,7 +3048,7 @@ class FIFOService:
             }
             
         except Exception as e:
-            print(f"計算利潤預覽失敗: {e}")
+            fifo_logger.error("計算利潤預覽失敗: %s", e)
             return None
 
 
@@ -1915,6 +3087,17 @@ def create_admin_command():
     print("管理員 'admin' 已創建，密碼為 'password'。")
 
 
+@app.cli.command("verify-schema")
+def verify_schema_command():
+    """檢查資料庫結構是否與模型定義一致（缺少資料表或欄位時以非零狀態結束）"""
+    try:
+        verify_schema(force=True)
+        print("✅ 資料庫結構與模型定義一致。")
+    except SchemaError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+
+
 @app.cli.command("sync-profit-balance")
 def sync_profit_balance_command():
     """將所有 CashAccount.profit_balance 的累積利潤從 CashAccount.balance 中扣除"""
@@ -1925,6 +3108,7 @@ def sync_profit_balance_command():
         accounts = db.session.execute(db.select(CashAccount)).scalars().all()
         total_adjustments = 0
         processed_accounts = 0
+        profit_postings = []
         
         for account in accounts:
             if account.profit_balance > 0:
@@ -1937,14 +3121,18 @@ def sync_profit_balance_command():
                 profit_before = account.profit_balance
                 
                 # 從總金額中扣除利潤餘額
-                account.balance = account.balance - account.profit_balance
-                balance_after = account.balance
-                
-                # 將利潤餘額設置為 0
-                account.profit_balance = 0
+                balance_after = BalanceService.apply_delta(account, -profit_before, allow_negative=True)
+                
+                # 將利潤餘額設置為 0（由 ProfitService.post_batch 統一寫入並記錄 ProfitTransaction）
+                profit_postings.append({
+                    "account_id": account.id,
+                    "amount": -profit_before,
+                    "transaction_type": "PROFIT_ADJUSTMENT",
+                    "description": f"利潤調整: {profit_before:.2f} → 0.00",
+                })
                 
                 print(f"  調整後總金額: {account.balance:.2f}")
-                print(f"  調整後利潤餘額: {account.profit_balance:.2f}")
+                print(f"  調整後利潤餘額: 0.00")
                 print(f"  總金額變動: {balance_after - balance_before:.2f}")
                 
                 # 創建 LedgerEntry 記錄
@@ -1965,6 +3153,10 @@ def sync_profit_balance_command():
                 print(f"  已創建 LedgerEntry 記錄 (ID: {ledger_entry.id})")
                 print("  ---")
         
+        batch_result = ProfitService.post_batch(profit_postings, commit=False)
+        if not batch_result["success"]:
+            raise RuntimeError(batch_result["message"])
+        
         # 提交所有變更
         db.session.commit()
         
@@ -1993,6 +3185,7 @@ def cleanup_profit_balance_command():
         accounts = db.session.execute(db.select(CashAccount)).scalars().all()
         total_adjustments = 0
         processed_accounts = 0
+        profit_postings = []
         
         for account in accounts:
             if account.profit_balance > 0:
@@ -2005,14 +3198,18 @@ def cleanup_profit_balance_command():
                 profit_before = account.profit_balance
                 
                 # 從總金額中扣除利潤餘額
-                account.balance -= account.profit_balance
-                balance_after = account.balance
-                
-                # 將利潤餘額設置為 0
-                account.profit_balance = 0
+                balance_after = BalanceService.apply_delta(account, -profit_before, allow_negative=True)
+                
+                # 將利潤餘額設置為 0（由 ProfitService.post_batch 統一寫入並記錄 ProfitTransaction）
+                profit_postings.append({
+                    "account_id": account.id,
+                    "amount": -profit_before,
+                    "transaction_type": "PROFIT_ADJUSTMENT",
+                    "description": f"利潤調整: {profit_before:.2f} → 0.00",
+                })
                 
                 print(f"  調整後總金額: {account.balance:.2f}")
-                print(f"  調整後利潤餘額: {account.profit_balance:.2f}")
+                print(f"  調整後利潤餘額: 0.00")
                 print(f"  總金額變動: {balance_after - balance_before:.2f}")
                 
                 # 創建 LedgerEntry 記錄
@@ -2033,6 +3230,10 @@ def cleanup_profit_balance_command():
                 print(f"  已創建 LedgerEntry 記錄 (ID: {ledger_entry.id})")
                 print("  ---")
         
+        batch_result = ProfitService.post_batch(profit_postings, commit=False)
+        if not batch_result["success"]:
+            raise RuntimeError(batch_result["message"])
+        
         # 提交所有變更
         db.session.commit()
         
@@ -2051,42 +3252,382 @@ def cleanup_profit_balance_command():
     return 0
 
 
-@app.cli.command("recalculate-all-receivables")
-def recalculate_all_receivables_command():
-    """強制重新計算所有客戶的應收帳款總額（以未結清銷售記錄為準）"""
-    from sqlalchemy import func
-    
-    print("\n🚀 開始執行所有客戶應收帳款校正...")
+@app.cli.command("reconcile-profit-ledger")
+@click.option('--fix', is_flag=True, help='差額超過容許值時寫入 PROFIT_RECONCILE 流水以校正')
+@click.option('--tolerance', type=float, default=0.01, show_default=True, help='容許差額 (TWD)')
+def reconcile_profit_ledger_command(fix, tolerance):
+    """核對系統利潤流水（最新 profit_after）與完整 FIFO 重算的總利潤"""
+    print("\n🚀 開始核對利潤流水...")
     
     try:
-        db.session.begin()
+        blocker = ProfitService.recompute_blocker()
+        if blocker:
+            print(f"⚠️ {blocker}，重算結果會偏低。")
+            if fix:
+                print("❌ 為避免寫入錯誤的校正流水，已拒絕 --fix。")
+                raise SystemExit(1)
+        
+        ledger_total = ProfitService.get_total_profit()
+        recomputed = ProfitService.recompute_total_profit()
+        difference = recomputed["total_profit"] - ledger_total
+        
+        print(f"利潤流水總利潤: NT$ {ledger_total:,.2f}")
+        print(f"FIFO 重算總利潤: NT$ {recomputed['total_profit']:,.2f}")
+        print(f"   (售出利潤: NT$ {recomputed['sales_profit']:,.2f}，共 {recomputed['sales_count']} 筆 - 利潤提款: NT$ {recomputed['withdrawals']:,.2f})")
+        print(f"差額: NT$ {difference:,.2f}")
+        
+        if abs(difference) <= tolerance:
+            print("\n✅ 利潤流水與 FIFO 重算一致。")
+            return 0
         
-        # 遍歷所有客戶
-        customers = db.session.execute(db.select(Customer)).scalars().all()
-        total_corrected = 0
+        if not fix:
+            print("\n❌ 利潤流水與 FIFO 重算不一致，可使用 --fix 寫入校正流水。")
+            raise SystemExit(1)
         
-        for customer in customers:
-            # 1. 查詢該客戶所有 '未結清' 的 SalesRecord 總和
-            total_receivables = db.session.execute(
-                db.select(func.sum(SalesRecord.twd_amount))
-                .filter(SalesRecord.customer_id == customer.id)
-                .filter(SalesRecord.is_settled == False) 
-            ).scalar()
-            
-            new_total_receivables = total_receivables if total_receivables is not None else 0.0
-            
-            # 2. 更新客戶記錄
-            old_receivables = customer.total_receivables_twd
-            customer.total_receivables_twd = new_total_receivables
-            
-            if old_receivables != new_total_receivables:
-                print(f"✅ 客戶 {customer.name} AR 已校正: NT$ {old_receivables:,.2f} -> NT$ {new_total_receivables:,.2f}")
-                total_corrected += 1
-            else:
-                print(f"   客戶 {customer.name} AR 無需校正: NT$ {old_receivables:,.2f}")
+        entry = ProfitService.post_ledger(
+            "PROFIT_RECONCILE",
+            difference,
+            f"利潤流水對帳校正：{ledger_total:,.2f} -> {recomputed['total_profit']:,.2f}",
+        )
+        print(f"\n✅ 已寫入校正流水 (ID: {entry.id})，總利潤: NT$ {entry.profit_after:,.2f}")
+        
+    except SystemExit:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ 利潤流水核對失敗: {e}")
+        import traceback
+        traceback.print_exc()
+        raise SystemExit(1)
+    
+    return 0
+
+
+@app.cli.command("seed-profit-ledger")
+def seed_profit_ledger_command():
+    """切換到利潤流水時寫入一次期初校正，讓總利潤等於完整 FIFO 重算（部署時執行，已寫入則略過）
+
+    舊版程式寫入的 profit_after 不一致（提款曾以負數再相減），沒有 RMB 帳戶的售出也沒有 PROFIT_EARNED 流水，
+    所以切換當下的最新 profit_after 不能直接當作總利潤。本指令不會讓部署失敗：無法安全重算時只印出警告。
+    """
+    seeded = db.session.execute(
+        db.select(LedgerEntry.id)
+        .filter(LedgerEntry.entry_type == "PROFIT_RECONCILE")
+        .filter(LedgerEntry.description.like(f"{ProfitService.OPENING_DESCRIPTION}%"))
+        .limit(1)
+    ).scalar()
+    if seeded:
+        print(f"✅ 利潤流水已有期初校正 (ID: {seeded})，略過。")
+        return 0
+    
+    blocker = ProfitService.recompute_blocker()
+    if blocker:
+        print(f"⚠️ {blocker}，未寫入期初校正；請確認後手動執行 flask seed-profit-ledger。")
+        return 0
+    
+    try:
+        ledger_total = ProfitService.get_total_profit()
+        recomputed = ProfitService.recompute_total_profit()
+        entry = ProfitService.post_ledger(
+            "PROFIT_RECONCILE",
+            recomputed["total_profit"] - ledger_total,
+            f"{ProfitService.OPENING_DESCRIPTION}：{ledger_total:,.2f} -> {recomputed['total_profit']:,.2f}",
+        )
+        print(f"✅ 已寫入期初校正 (ID: {entry.id})，總利潤: NT$ {entry.profit_after:,.2f}")
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ 寫入期初校正失敗，下次部署會再試: {e}")
+    return 0
+
+
+@app.cli.command("rebuild-profit-cube")
+def rebuild_profit_cube_command():
+    """全量重建利潤分析立方體（profit_cube）"""
+    print("\n🚀 開始重建利潤分析立方體...")
+    
+    try:
+        cell_count = ProfitCubeService.rebuild()
+        db.session.commit()
+        print(f"✅ 重建完成，共 {cell_count} 個儲存格。")
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ 重建利潤分析立方體失敗: {e}")
+        import traceback
+        traceback.print_exc()
+        raise SystemExit(1)
     
+    return 0
+
+
+@app.cli.command("seed-profit-cube")
+def seed_profit_cube_command():
+    """profit_cube 為空而已有售出時全量重建一次（部署時執行，已有資料則略過）
+
+    profit_cube 只在售出寫入 / 回滾時增量更新，建立資料表之前的售出需要回填，否則 /api/profit/cube
+    只會看到部署後的售出。本指令不會讓部署失敗：無法安全重建時只印出警告。
+    """
+    if db.session.execute(db.select(ProfitCubeCell.id).limit(1)).scalar():
+        print("✅ 利潤分析立方體已有資料，略過。")
+        return 0
+    if not db.session.execute(db.select(FIFOSalesAllocation.id).limit(1)).scalar():
+        print("✅ 尚無已分配庫存的售出，略過。")
+        return 0
+    
+    sources = ProfitService.archived_recompute_sources()
+    archived = None if sources is None else [t for t in sources if t in ("sales_records", "fifo_sales_allocations")]
+    if archived is None or archived:
+        reason = "無法讀取歸檔索引" if archived is None else f"{'、'.join(archived)} 已有資料歸檔"
+        print(f"⚠️ {reason}，重建只涵蓋資料庫中剩下的售出；請確認後手動執行 flask rebuild-profit-cube。")
+        return 0
+    
+    try:
+        cell_count = ProfitCubeService.rebuild()
         db.session.commit()
-        print(f"\n✅ 所有客戶應收帳款校正完成。共校正 {total_corrected} 個客戶。")
+        print(f"✅ 已回填利潤分析立方體，共 {cell_count} 個儲存格。")
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ 回填利潤分析立方體失敗，下次部署會再試: {e}")
+    return 0
+
+
+def _hot_query_statements():
+    """主要頁面 / API 的熱門查詢（名稱, SQLAlchemy 語句），供 explain-hot-queries 檢查"""
+    sample_customer_id = db.session.execute(db.select(func.min(Customer.id))).scalar() or 1
+    sample_account_id = db.session.execute(db.select(func.min(CashAccount.id))).scalar() or 1
+    sample_sale_id = db.session.execute(db.select(func.max(SalesRecord.id))).scalar() or 1
+    sample_inventory_id = db.session.execute(db.select(func.max(FIFOInventory.id))).scalar() or 1
+    # 利潤歷史的下一頁：游標停在最新一筆（以游標讀取其後的列）
+    sample_profit_position = db.session.execute(
+        _profit_history_page_query(None, 1).with_only_columns(LedgerEntry.entry_date, LedgerEntry.id)
+    ).first() or (datetime.utcnow(), 1)
+
+    return [
+        ("銷帳：客戶未結清售出", db.select(SalesRecord.id, SalesRecord.twd_amount)
+            .where(SalesRecord.customer_id == sample_customer_id)
+            .where(SalesRecord.is_settled.is_(False))
+            .order_by(SalesRecord.created_at)),
+        ("最近售出記錄", db.select(SalesRecord.id)
+            .order_by(SalesRecord.created_at.desc()).limit(20)),
+        ("最近買入記錄", db.select(PurchaseRecord.id)
+            .order_by(PurchaseRecord.purchase_date.desc()).limit(20)),
+        ("現金流水", db.select(LedgerEntry.id)
+            .order_by(LedgerEntry.entry_date.desc()).limit(20)),
+        ("帳戶流水", db.select(LedgerEntry.id)
+            .where(LedgerEntry.account_id == sample_account_id)
+            .order_by(LedgerEntry.entry_date.desc()).limit(20)),
+        ("利潤歷史", _profit_history_page_query(None, 11)),
+        ("利潤歷史（下一頁）", _profit_history_page_query(tuple(sample_profit_position), 11)),
+        ("售出的 FIFO 分配", db.select(FIFOSalesAllocation.id)
+            .where(FIFOSalesAllocation.sales_record_id == sample_sale_id)),
+        ("庫存批次的 FIFO 分配", db.select(FIFOSalesAllocation.id)
+            .where(FIFOSalesAllocation.fifo_inventory_id == sample_inventory_id)),
+        ("FIFO 可用庫存", db.select(FIFOInventory.id)
+            .where(FIFOInventory.remaining_rmb > 0)
+            .order_by(FIFOInventory.purchase_date.asc())),
+    ]
+
+
+def _explain_plan(statement):
+    """執行 EXPLAIN 並回傳 (計畫摘要列表, 被全表掃描的資料表列表, 額外排序的步驟列表)
+
+    額外排序（PostgreSQL 的 Sort 節點、SQLite 的 USE TEMP B-TREE）表示索引順序沒有被用上，
+    LIMIT 查詢要先讀出所有符合條件的列再排序，成本隨資料量增加。
+    """
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+
+    if db.engine.dialect.name == "postgresql":
+        plan = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        if isinstance(plan, str):
+            import json
+            plan = json.loads(plan)
+
+        lines, scanned, sorts = [], [], []
+        def walk(node, depth=0):
+            relation = node.get("Relation Name")
+            index = node.get("Index Name")
+            detail = node["Node Type"]
+            if relation:
+                detail += f" on {relation}"
+            if index:
+                detail += f" using {index}"
+            lines.append("  " * depth + f"{detail} (cost={node.get('Total Cost')})")
+            if node["Node Type"] == "Seq Scan":
+                scanned.append(relation)
+            if node["Node Type"] in ("Sort", "Incremental Sort"):
+                sorts.append(f"{node['Node Type']} ({', '.join(node.get('Sort Key', []))})")
+            for child in node.get("Plans", []):
+                walk(child, depth + 1)
+        walk(plan[0]["Plan"])
+        return lines, scanned, sorts
+
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    lines = [row[-1] for row in rows]
+    scanned = [
+        detail.split()[1]
+        for detail in lines
+        if detail.startswith("SCAN ") and " USING " not in detail
+    ]
+    sorts = [detail for detail in lines if detail.startswith("USE TEMP B-TREE")]
+    return lines, scanned, sorts
+
+
+@app.cli.command("explain-hot-queries")
+@click.option('--strict', is_flag=True, help='有任何全表掃描或額外排序時以非零狀態結束（適用於 CI）')
+def explain_hot_queries_command(strict):
+    """對主要頁面 / API 的查詢執行 EXPLAIN，標示出全表掃描與額外排序"""
+    print(f"\n🚀 檢查熱門查詢的執行計畫（{db.engine.dialect.name}）...")
+    
+    flagged = 0
+    try:
+        for name, statement in _hot_query_statements():
+            lines, scanned, sorts = _explain_plan(statement)
+            if scanned or sorts:
+                flagged += 1
+                problems = ([f"全表掃描 {', '.join(scanned)}"] if scanned else []) + \
+                           ([f"額外排序 {', '.join(sorts)}"] if sorts else [])
+                print(f"\n⚠️  {name}：{'；'.join(problems)}")
+            else:
+                print(f"\n✅ {name}")
+            for line in lines:
+                print(f"     {line}")
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ 檢查執行計畫失敗: {e}")
+        import traceback
+        traceback.print_exc()
+        raise SystemExit(1)
+    
+    print(f"\n共 {flagged} 個查詢使用全表掃描或額外排序。")
+    if flagged:
+        print("提示：資料量很小時 PostgreSQL 仍可能選擇全表掃描，請在接近正式資料量的資料庫上檢查，"
+              "並確認已執行 flask db upgrade。")
+    if flagged and strict:
+        raise SystemExit(1)
+    return 0
+
+
+def _receivables_target_subquery(formula):
+    """以單一 GROUP BY 查詢計算每位客戶應有的應收帳款（customer_id, total）
+
+    formula="unsettled"：AR = SUM(未結清售出金額)
+    formula="ledger"   ：AR = SUM(所有售出金額) - SUM(描述含客戶名稱的銷帳金額)
+    """
+    if formula == "unsettled":
+        sales = (
+            db.select(
+                SalesRecord.customer_id.label("customer_id"),
+                func.sum(SalesRecord.twd_amount).label("total"),
+            )
+            .filter(SalesRecord.is_settled == False)
+            .group_by(SalesRecord.customer_id)
+            .subquery()
+        )
+        expected = func.coalesce(sales.c.total, 0.0)
+        return (
+            db.select(Customer.id.label("customer_id"), expected.label("total"))
+            .outerjoin(sales, sales.c.customer_id == Customer.id)
+            .subquery()
+        )
+
+    sales = (
+        db.select(
+            SalesRecord.customer_id.label("customer_id"),
+            func.sum(SalesRecord.twd_amount).label("total"),
+        )
+        .group_by(SalesRecord.customer_id)
+        .subquery()
+    )
+    settlement_customer = db.aliased(Customer)
+    settlements = (
+        db.select(
+            settlement_customer.id.label("customer_id"),
+            func.sum(LedgerEntry.amount).label("total"),
+        )
+        .join(
+            LedgerEntry,
+            and_(
+                LedgerEntry.entry_type == "SETTLEMENT",
+                LedgerEntry.description.contains(settlement_customer.name),
+            ),
+        )
+        .group_by(settlement_customer.id)
+        .subquery()
+    )
+    expected = func.coalesce(sales.c.total, 0.0) - func.coalesce(settlements.c.total, 0.0)
+    return (
+        db.select(Customer.id.label("customer_id"), expected.label("total"))
+        .outerjoin(sales, sales.c.customer_id == Customer.id)
+        .outerjoin(settlements, settlements.c.customer_id == Customer.id)
+        .subquery()
+    )
+
+
+def recalculate_receivables_bulk(formula="unsettled", dry_run=False):
+    """集合式重算所有客戶的應收帳款，回傳有變動的客戶清單
+
+    無論客戶數量多少，都只需固定次數的資料庫往返：
+    一次差異查詢，加上一次 UPDATE（PostgreSQL 使用 UPDATE ... FROM，
+    SQLite 則以 executemany 批次更新差異列）。
+    """
+    target = _receivables_target_subquery(formula)
+    changed_filter = func.abs(Customer.total_receivables_twd - target.c.total) > 0.005
+
+    changes = db.session.execute(
+        db.select(
+            Customer.id,
+            Customer.name,
+            Customer.total_receivables_twd,
+            target.c.total,
+        )
+        .join(target, target.c.customer_id == Customer.id)
+        .filter(changed_filter)
+        .order_by(Customer.id)
+    ).all()
+
+    if dry_run or not changes:
+        return changes
+
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(
+            db.update(Customer)
+            .values(total_receivables_twd=target.c.total)
+            .where(Customer.id == target.c.customer_id)
+            .where(changed_filter)
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        db.session.execute(
+            db.update(Customer.__table__)
+            .where(Customer.__table__.c.id == db.bindparam("b_id"))
+            .values(total_receivables_twd=db.bindparam("b_total")),
+            [{"b_id": row.id, "b_total": row.total} for row in changes],
+        )
+    return changes
+
+
+def _print_receivables_changes(changes, dry_run):
+    """輸出應收帳款差異（僅列出有變動的客戶）"""
+    prefix = "[DRY-RUN] " if dry_run else "✅ "
+    for customer_id, name, old_total, new_total in changes:
+        print(f"{prefix}客戶 {name} (ID: {customer_id}) AR: NT$ {old_total:,.2f} -> NT$ {new_total:,.2f}")
+
+
+@app.cli.command("recalculate-all-receivables")
+@click.option('--dry-run', is_flag=True, help='僅列出會變動的客戶，不寫入資料庫')
+def recalculate_all_receivables_command(dry_run):
+    """強制重新計算所有客戶的應收帳款總額（以未結清銷售記錄為準）"""
+    print("\n🚀 開始執行所有客戶應收帳款校正...")
+    
+    try:
+        changes = recalculate_receivables_bulk("unsettled", dry_run=dry_run)
+        _print_receivables_changes(changes, dry_run)
+        
+        if dry_run:
+            db.session.rollback()
+            print(f"\n[DRY-RUN] 共 {len(changes)} 個客戶需要校正，未寫入任何變更。")
+        else:
+            db.session.commit()
+            print(f"\n✅ 所有客戶應收帳款校正完成。共校正 {len(changes)} 個客戶。")
         
     except Exception as e:
         db.session.rollback()
@@ -2105,13 +3646,13 @@ def force_set_receivables(customer_id: int, correct_amount: float):
     try:
         customer = db.session.get(Customer, customer_id)
         if not customer:
-            print(f"❌ 錯誤: 找不到客戶 ID {customer_id}")
+            settlement_logger.error("❌ 錯誤: 找不到客戶 ID %s", customer_id)
             return False
 
         old_receivables = customer.total_receivables_twd
         
         if old_receivables == correct_amount:
-            print(f"✅ 客戶 {customer.name} AR 已經是正確值: NT$ {correct_amount:,.2f}")
+            settlement_logger.debug("✅ 客戶 %s AR 已經是正確值: NT$ %.2f", customer.name, correct_amount)
             return True
             
         # 1. 設置正確的應收帳款數字
@@ -2130,15 +3671,13 @@ def force_set_receivables(customer_id: int, correct_amount: float):
         db.session.add(ledger_entry)
         
         db.session.commit()
-        print(f"🎉 客戶 {customer.name} AR 數據已強制修正!")
-        print(f"   變動: NT$ {old_receivables:,.2f} -> NT$ {correct_amount:,.2f}")
+        settlement_logger.debug("🎉 客戶 %s AR 數據已強制修正!", customer.name)
+        settlement_logger.debug("   變動: NT$ %.2f -> NT$ %.2f", old_receivables, correct_amount)
         return True
         
     except Exception as e:
         db.session.rollback()
-        print(f"❌ 數據修正失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        settlement_logger.exception("❌ 數據修正失敗: %s", e)
         return False
 
 
@@ -2153,48 +3692,22 @@ def fix_ar_command(customer_id, correct_amount):
 
 
 @app.cli.command("rebuild-customer-ar")
-def rebuild_customer_ar_command():
+@click.option('--dry-run', is_flag=True, help='僅列出會變動的客戶，不寫入資料庫')
+def rebuild_customer_ar_command(dry_run):
     """使用新公式重建所有客戶的應收帳款總額：AR = SUM(售出) - SUM(銷帳)"""
-    from sqlalchemy import func
-    
     print("\n🚀 開始執行所有客戶應收帳款強制重建...")
     print("使用新公式：AR = SUM(所有售出金額) - SUM(所有銷帳金額)")
     
     try:
-        # 遍歷所有客戶
-        customers = db.session.execute(db.select(Customer)).scalars().all()
-        total_rebuilt = 0
+        changes = recalculate_receivables_bulk("ledger", dry_run=dry_run)
+        _print_receivables_changes(changes, dry_run)
         
-        for customer in customers:
-            # 1. 計算所有售出金額
-            total_sales = db.session.execute(
-                db.select(func.sum(SalesRecord.twd_amount))
-                .filter(SalesRecord.customer_id == customer.id)
-            ).scalar() or 0.0
-            
-            # 2. 計算所有銷帳金額（從 LedgerEntry）
-            total_settlements = db.session.execute(
-                db.select(func.sum(LedgerEntry.amount))
-                .filter(LedgerEntry.entry_type == "SETTLEMENT")
-                .filter(LedgerEntry.description.like(f"%{customer.name}%"))
-            ).scalar() or 0.0
-            
-            # 3. AR = 售出 - 銷帳
-            new_total_receivables = total_sales - total_settlements
-            
-            # 更新客戶記錄
-            old_receivables = customer.total_receivables_twd
-            customer.total_receivables_twd = new_total_receivables
-            
-            if old_receivables != new_total_receivables:
-                print(f"✅ 客戶 {customer.name} AR 已重建: NT$ {old_receivables:,.2f} -> NT$ {new_total_receivables:,.2f}")
-                print(f"   (售出: NT$ {total_sales:,.2f} - 銷帳: NT$ {total_settlements:,.2f})")
-                total_rebuilt += 1
-            else:
-                print(f"   客戶 {customer.name} AR 無需重建: NT$ {old_receivables:,.2f}")
-    
-        db.session.commit()
-        print(f"\n✅ 所有客戶應收帳款重建完成。共重建 {total_rebuilt} 個客戶。")
+        if dry_run:
+            db.session.rollback()
+            print(f"\n[DRY-RUN] 共 {len(changes)} 個客戶需要重建，未寫入任何變更。")
+        else:
+            db.session.commit()
+            print(f"\n✅ 所有客戶應收帳款重建完成。共重建 {len(changes)} 個客戶。")
         
     except Exception as e:
         db.session.rollback()
@@ -2392,7 +3905,7 @@ def cleanup_sales_withdraw_command(dry_run, force, no_reimbursement):
                 account = stats['account']
                 if account:
                     old_balance = account.balance
-                    account.balance += stats['total_amount']
+                    BalanceService.apply_delta(account, stats['total_amount'])
                     new_balance = account.balance
                     print(f"\n✅ 帳戶 {account.name}: 回補 {stats['total_amount']:.2f} RMB")
                     print(f"   餘額變化: {old_balance:.2f} -> {new_balance:.2f}")
@@ -2659,18 +4172,18 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        print(f"登入嘗試: username={username}")  # 調試日誌
+        logger.debug("登入嘗試: username=%s", username)  # 調試日誌
         
         user = User.query.filter_by(username=username).first()
-        print(f"用戶查詢結果: {user}")  # 調試日誌
+        logger.debug("用戶查詢結果: %s", user)  # 調試日誌
         
         if user and user.check_password(password):
-            print(f"登入成功: {username}")  # 調試日誌
+            logger.debug("登入成功: %s", username)  # 調試日誌
             login_user(user, remember=True)
             flash(f"歡迎回來，{username}！", "success")
             return redirect(url_for("dashboard"))
         else:
-            print(f"登入失敗: {username}")  # 調試日誌
+            logger.warning("登入失敗: %s", username)
             flash("無效的使用者名稱或密碼。", "danger")
     return render_template("login.html")
 
@@ -2742,109 +4255,8 @@ def dashboard():
             .all()
         )
 
-        # 計算總利潤（從所有銷售記錄計算，並扣除利潤提款）
-        total_profit_twd = 0.0
-        all_sales = (
-            db.session.execute(
-                db.select(SalesRecord)
-            )
-            .scalars()
-            .all()
-        )
-        
-        for sale in all_sales:
-            profit_info = FIFOService.calculate_profit_for_sale(sale)
-            if profit_info:
-                total_profit_twd += profit_info.get('profit_twd', 0.0)
-        
-        # 扣除利潤提款記錄
-        try:
-            profit_withdrawals = (
-                db.session.execute(
-                    db.select(LedgerEntry)
-                    .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                )
-                .scalars()
-                .all()
-            )
-        except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 儀表板查詢 PROFIT_WITHDRAW 記錄時缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 儀表板添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 儀表板添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 儀表板添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 儀表板添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 儀表板添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 儀表板欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    profit_withdrawals = (
-                        db.session.execute(
-                            db.select(LedgerEntry)
-                            .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                        )
-                        .scalars()
-                        .all()
-                    )
-                except Exception as fix_error:
-                    print(f"[ERROR] 儀表板修復欄位失敗: {fix_error}")
-                    db.session.rollback()
-                    profit_withdrawals = []
-            else:
-                print(f"[ERROR] 儀表板查詢LedgerEntry失敗: {e}")
-                profit_withdrawals = []
-        
-        total_profit_withdrawals = sum(abs(entry.amount) for entry in profit_withdrawals)  # 提款記錄的amount是負數
-        total_profit_twd -= total_profit_withdrawals
-        
-        print(f"DEBUG: 普通用戶儀表板利潤計算 - 銷售利潤: {total_profit_twd + total_profit_withdrawals:.2f}, 利潤提款: {total_profit_withdrawals:.2f}, 最終利潤: {total_profit_twd:.2f}")
+        # 總利潤：系統利潤流水最新一筆的 profit_after（O(1)）
+        total_profit_twd = ProfitService.get_total_profit()
 
         return render_template(
             "dashboard.html",
@@ -2898,31 +4310,11 @@ def admin_delete_audit_logs():
         query = query.order_by(DeleteAuditLog.deleted_at.desc())
         
         # 獲取總數
-        try:
-            total_logs = db.session.execute(db.select(db.func.count(DeleteAuditLog.id))).scalar()
-        except Exception as e:
-            if "does not exist" in str(e) and "delete_audit_logs" in str(e):
-                print("警告: delete_audit_logs 表格不存在，返回空結果")
-                db.session.rollback()
-                total_logs = 0
-                audit_logs = []
-            else:
-                db.session.rollback()
-                raise e
-        else:
-            # 重新執行查詢以獲取分頁結果
-            try:
-                audit_logs = db.session.execute(
-                    query.offset((page - 1) * per_page).limit(per_page)
-                ).scalars().all()
-            except Exception as e:
-                if "does not exist" in str(e) and "delete_audit_logs" in str(e):
-                    print("警告: delete_audit_logs 表格不存在，返回空結果")
-                    db.session.rollback()
-                    audit_logs = []
-                else:
-                    db.session.rollback()
-                    raise e
+        total_logs = db.session.execute(db.select(db.func.count(DeleteAuditLog.id))).scalar()
+        # 重新執行查詢以獲取分頁結果
+        audit_logs = db.session.execute(
+            query.offset((page - 1) * per_page).limit(per_page)
+        ).scalars().all()
         
         # 轉換為字典格式
         logs_data = []
@@ -2981,9 +4373,7 @@ def admin_delete_audit_logs():
         )
         
     except Exception as e:
-        print(f"載入刪除記錄審計頁面失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("載入刪除記錄審計頁面失敗: %s", e)
         flash("載入刪除記錄審計頁面時發生錯誤", "danger")
         return render_template(
             "admin/delete_audit_logs.html",
@@ -3041,109 +4431,8 @@ def admin_dashboard():
         # 只計算台幣資產，不包含人民幣估值
         twd_assets = total_twd_cash
 
-        # 計算總利潤（從所有銷售記錄計算，並扣除利潤提款）
-        total_profit_twd = 0.0
-        all_sales = (
-            db.session.execute(
-                db.select(SalesRecord)
-            )
-            .scalars()
-            .all()
-        )
-        
-        for sale in all_sales:
-            profit_info = FIFOService.calculate_profit_for_sale(sale)
-            if profit_info:
-                total_profit_twd += profit_info.get('profit_twd', 0.0)
-        
-        # 扣除利潤提款記錄
-        try:
-            profit_withdrawals = (
-                db.session.execute(
-                    db.select(LedgerEntry)
-                    .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                )
-                .scalars()
-                .all()
-            )
-        except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 儀表板查詢 PROFIT_WITHDRAW 記錄時缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 儀表板添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 儀表板添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 儀表板添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 儀表板添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 儀表板添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 儀表板 to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 儀表板欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    profit_withdrawals = (
-                        db.session.execute(
-                            db.select(LedgerEntry)
-                            .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                        )
-                        .scalars()
-                        .all()
-                    )
-                except Exception as fix_error:
-                    print(f"[ERROR] 儀表板修復欄位失敗: {fix_error}")
-                    db.session.rollback()
-                    profit_withdrawals = []
-            else:
-                print(f"[ERROR] 儀表板查詢LedgerEntry失敗: {e}")
-                profit_withdrawals = []
-        
-        total_profit_withdrawals = sum(abs(entry.amount) for entry in profit_withdrawals)  # 提款記錄的amount是負數
-        total_profit_twd -= total_profit_withdrawals
-        
-        print(f"DEBUG: 管理員儀表板利潤計算 - 銷售利潤: {total_profit_twd + total_profit_withdrawals:.2f}, 利潤提款: {total_profit_withdrawals:.2f}, 最終利潤: {total_profit_twd:.2f}")
+        # 總利潤：系統利潤流水最新一筆的 profit_after（O(1)）
+        total_profit_twd = ProfitService.get_total_profit()
         
         # 设置变量别名以保持模板兼容性
         total_unsettled_amount_twd = total_receivables
@@ -3241,6 +4530,69 @@ def admin_dashboard():
         )
 
 
+@app.route("/admin/perf")
+@admin_required
+def admin_perf():
+    """各端點的延遲、查詢次數與資料庫耗時（目前 worker 行程的統計）"""
+    snapshot = perf_metrics.perf_store.snapshot()
+    return render_template(
+        "admin/perf.html",
+        snapshot=snapshot,
+        enabled=getattr(app, "_perf_metrics_installed", False),
+        started_at=datetime.fromtimestamp(snapshot["started_at"]),
+    )
+
+
+@app.route("/admin/perf/export")
+@admin_required
+def admin_perf_export():
+    """以 JSON 匯出效能統計"""
+    response = jsonify(perf_metrics.perf_store.snapshot())
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=perf_{os.getpid()}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    return response
+
+
+@app.route("/admin/perf/reset", methods=["POST"])
+@admin_required
+def admin_perf_reset():
+    """清除目前 worker 行程的效能統計"""
+    perf_metrics.perf_store.reset()
+    flash("效能統計已清除。", "success")
+    return redirect(url_for("admin_perf"))
+
+
+@app.route("/admin/profiles")
+@admin_required
+def admin_profiles():
+    """已儲存的請求剖析結果（在網址加上 ?_profile=1 產生）"""
+    profiles = request_profiler.list_profiles(request_profiler.profile_dir(app))
+    return render_template("admin/profiles.html", profiles=profiles)
+
+
+@app.route("/admin/profiles/<profile_id>")
+@admin_required
+def admin_profile_detail(profile_id):
+    """單一剖析結果：依累計時間排序的函式"""
+    profile = request_profiler.load_profile(request_profiler.profile_dir(app), profile_id)
+    if profile is None:
+        flash("找不到指定的剖析結果。", "danger")
+        return redirect(url_for("admin_profiles"))
+    return render_template("admin/profile_detail.html", profile=profile)
+
+
+@app.route("/admin/profiles/<profile_id>/download")
+@admin_required
+def admin_profile_download(profile_id):
+    """下載 .prof 檔，可用 snakeviz 或 pstats 檢視"""
+    path = request_profiler.profile_stats_path(request_profiler.profile_dir(app), profile_id)
+    if path is None:
+        flash("找不到指定的剖析結果。", "danger")
+        return redirect(url_for("admin_profiles"))
+    return send_file(path, as_attachment=True, download_name=f"{profile_id}.prof")
+
+
 @app.route("/sales-entry")
 @login_required
 def sales_entry():
@@ -3315,7 +4667,7 @@ def sales_entry():
         offset = (page - 1) * per_page
         
         # 查詢當前頁的銷售記錄
-        print(f"[DEBUG] DEBUG: 查詢未結清銷售記錄 - 頁面: {page}, 每頁: {per_page}, 偏移: {offset}")
+        fifo_logger.debug("[DEBUG] DEBUG: 查詢未結清銷售記錄 - 頁面: %s, 每頁: %s, 偏移: %s", page, per_page, offset)
         recent_unsettled_sales = (
             db.session.execute(
                 db.select(SalesRecord)
@@ -3327,13 +4679,14 @@ def sales_entry():
             .scalars()
             .all()
         )
-        print(f"[DEBUG] DEBUG: 查詢到 {len(recent_unsettled_sales)} 筆未結清銷售記錄")
+        fifo_logger.debug("[DEBUG] DEBUG: 查詢到 %s 筆未結清銷售記錄", len(recent_unsettled_sales))
         for sale in recent_unsettled_sales:
-            print(f"  - ID: {sale.id}, 客戶: {sale.customer.name if sale.customer else 'N/A'}, RMB: {sale.rmb_amount}, 時間: {sale.created_at}")
+            fifo_logger.debug("  - ID: %s, 客戶: %s, RMB: %s, 時間: %s", sale.id, sale.customer.name if sale.customer else 'N/A', sale.rmb_amount, sale.created_at)
         
         # 4. 為每個銷售記錄計算利潤信息
+        profits = FIFOService.calculate_profits_for_sales(recent_unsettled_sales)
         for sale in recent_unsettled_sales:
-            profit_info = FIFOService.calculate_profit_for_sale(sale)
+            profit_info = profits.get(sale.id)
             if profit_info:
                 sale.profit_info = profit_info
             else:
@@ -3377,20 +4730,20 @@ def api_sales_entry():
     處理來自「售出錄入頁面」的訂單創建請求。
     """
     data = request.get_json()
-    print(f"[DEBUG] DEBUG: 收到api_sales_entry請求，數據: {data}")
+    fifo_logger.debug("[DEBUG] DEBUG: 收到api_sales_entry請求，數據: %s", data)
     
     if not data:
         return jsonify({"status": "error", "message": "無效的請求格式。"}), 400
 
     try:
         # 1. 獲取並驗證資料 - 使用更穩健的參數解析邏輯
-        print(f"DEBUG: 開始解析請求參數...")
+        fifo_logger.debug("DEBUG: 開始解析請求參數...")
         
         # 安全地獲取字符串參數
         customer_id = data.get("customer_id", "").strip() if data.get("customer_id") else ""
         customer_name_manual = data.get("customer_name_manual", "").strip() if data.get("customer_name_manual") else ""
         
-        print(f"DEBUG: 客戶參數 - customer_id: '{customer_id}', customer_name_manual: '{customer_name_manual}'")
+        fifo_logger.debug("DEBUG: 客戶參數 - customer_id: '%s', customer_name_manual: '%s'", customer_id, customer_name_manual)
         
         # 安全地轉換數值參數，處理空字符串和無效格式
         def safe_convert_to_int(value, field_name):
@@ -3404,7 +4757,7 @@ def api_sales_entry():
                     return None
                 return int(str_value)
             except (ValueError, TypeError) as e:
-                print(f"DEBUG: {field_name} 轉換失敗: '{value}' -> {e}")
+                fifo_logger.error("DEBUG: %s 轉換失敗: '%s' -> %s", field_name, value, e)
                 return None
         
         def safe_convert_to_float(value, field_name):
@@ -3433,7 +4786,7 @@ def api_sales_entry():
                     
                 return float(str_value)
             except (ValueError, TypeError) as e:
-                print(f"DEBUG: {field_name} 轉換失敗: '{value}' -> {e}")
+                fifo_logger.error("DEBUG: %s 轉換失敗: '%s' -> %s", field_name, value, e)
                 return None
         
         # 轉換數值參數
@@ -3441,11 +4794,11 @@ def api_sales_entry():
         rmb_amount = safe_convert_to_float(data.get("rmb_amount"), "rmb_amount")
         exchange_rate = safe_convert_to_float(data.get("exchange_rate"), "exchange_rate")
         
-        print(f"DEBUG: 數值參數 - rmb_account_id: {rmb_account_id}, rmb_amount: {rmb_amount}, exchange_rate: {exchange_rate}")
+        fifo_logger.debug("DEBUG: 數值參數 - rmb_account_id: %s, rmb_amount: %s, exchange_rate: %s", rmb_account_id, rmb_amount, exchange_rate)
 
         # 驗證客戶信息：必須有客戶ID或客戶名稱
         if not customer_id and not customer_name_manual:
-            print(f"DEBUG: 客戶信息驗證失敗 - 兩個客戶欄位都為空")
+            fifo_logger.warning("DEBUG: 客戶信息驗證失敗 - 兩個客戶欄位都為空")
             return (
                 jsonify(
                     {
@@ -3475,8 +4828,8 @@ def api_sales_entry():
             validation_errors.append("匯率必須大於0")
             
         if validation_errors:
-            print(f"DEBUG: 欄位驗證失敗 - 錯誤: {validation_errors}")
-            print(f"DEBUG: 原始數據: {data}")
+            fifo_logger.warning("DEBUG: 欄位驗證失敗 - 錯誤: %s", validation_errors)
+            fifo_logger.debug("DEBUG: 原始數據: %s", data)
             return (
                 jsonify(
                     {
@@ -3487,7 +4840,7 @@ def api_sales_entry():
                 400,
             )
         
-        print(f"DEBUG: 所有參數驗證通過，開始業務邏輯處理...")
+        fifo_logger.debug("DEBUG: 所有參數驗證通過，開始業務邏輯處理...")
 
         # 2. 處理客戶信息
         customer = None
@@ -3495,28 +4848,28 @@ def api_sales_entry():
             # 使用現有客戶ID - customer_id 已經在安全轉換函數中處理為 int 類型
             customer = db.session.get(Customer, customer_id)
             if not customer:
-                print(f"DEBUG: 找不到客戶 ID: {customer_id}")
+                fifo_logger.debug("DEBUG: 找不到客戶 ID: %s", customer_id)
                 return jsonify({"status": "error", "message": "找不到指定的客戶。"}), 404
         else:
             # 使用手動輸入的客戶名稱
             customer_name = customer_name_manual.strip()
             if not customer_name:
-                print(f"DEBUG: 客戶名稱為空")
+                fifo_logger.debug("DEBUG: 客戶名稱為空")
                 return jsonify({"status": "error", "message": "客戶名稱不能為空。"}), 400
             
             # 查找或創建客戶
             customer = Customer.query.filter_by(name=customer_name).first()
             if not customer:
-                print(f"DEBUG: 創建新客戶: {customer_name}")
+                fifo_logger.debug("DEBUG: 創建新客戶: %s", customer_name)
                 customer = Customer(name=customer_name)
                 db.session.add(customer)
                 db.session.flush()  # 獲取ID
             else:
-                print(f"DEBUG: 找到現有客戶: {customer_name} (ID: {customer.id})")
+                fifo_logger.debug("DEBUG: 找到現有客戶: %s (ID: %s)", customer_name, customer.id)
         
         # rmb_account_id 已經在安全轉換函數中處理為 int 類型
         rmb_account = db.session.get(CashAccount, rmb_account_id)
-        print(f"DEBUG: 查找RMB帳戶 ID: {rmb_account_id}")
+        fifo_logger.debug("DEBUG: 查找RMB帳戶 ID: %s", rmb_account_id)
 
         if not customer:
             return jsonify({"status": "error", "message": "找不到指定的客戶。"}), 404
@@ -3541,7 +4894,7 @@ def api_sales_entry():
         # AR 會在後續直接更新，避免使用 recalculate_customer_receivables() 導致遞歸
 
         # 創建銷售紀錄
-        print(f"[DEBUG] DEBUG: 創建SalesRecord - 客戶: {customer.name}, RMB帳戶: {rmb_account.name}")
+        fifo_logger.debug("[DEBUG] DEBUG: 創建SalesRecord - 客戶: %s, RMB帳戶: %s", customer.name, rmb_account.name)
         
         new_sale = SalesRecord(
             customer_id=customer.id,
@@ -3552,10 +4905,10 @@ def api_sales_entry():
             is_settled=False,
             operator_id=get_safe_operator_id(),
         )
-        print(f"[DEBUG] DEBUG: SalesRecord創建完成 - ID: {new_sale.id if hasattr(new_sale, 'id') else 'N/A'}")
+        fifo_logger.debug("[DEBUG] DEBUG: SalesRecord創建完成 - ID: %s", new_sale.id if hasattr(new_sale, 'id') else 'N/A')
         db.session.add(new_sale)
         db.session.flush()  # 先獲取ID，但不提交
-        print(f"[DEBUG] DEBUG: SalesRecord已添加到資料庫，ID: {new_sale.id}")
+        fifo_logger.debug("[DEBUG] DEBUG: SalesRecord已添加到資料庫，ID: %s", new_sale.id)
         
         # 檢查是否有ID衝突
         try:
@@ -3564,22 +4917,20 @@ def api_sales_entry():
                 db.select(SalesRecord).filter(SalesRecord.id == new_sale.id)
             ).scalar_one_or_none()
             if existing_sale and existing_sale.id != new_sale.id:
-                print(f"[WARNING] DEBUG: 檢測到ID衝突！新記錄ID: {new_sale.id}, 現有記錄ID: {existing_sale.id}")
+                fifo_logger.warning("[WARNING] DEBUG: 檢測到ID衝突！新記錄ID: %s, 現有記錄ID: %s", new_sale.id, existing_sale.id)
                 # 強制重新分配ID
                 db.session.flush()
-                print(f"[OK] DEBUG: 重新分配ID後: {new_sale.id}")
+                fifo_logger.debug("[OK] DEBUG: 重新分配ID後: %s", new_sale.id)
         except Exception as e:
-            print(f"DEBUG: 檢查ID衝突時發生錯誤: {e}")
+            fifo_logger.error("DEBUG: 檢查ID衝突時發生錯誤: %s", e)
         
         # 4. 更新FIFO庫存（關鍵修正！）
         try:
             # 使用FIFO服務分配庫存
             fifo_result = FIFOService.allocate_inventory_for_sale(new_sale)
-            print(f"FIFO庫存分配成功: {fifo_result}")
+            fifo_logger.debug("FIFO庫存分配成功: %s", fifo_result)
         except Exception as e:
-            print(f"[ERROR] FIFO庫存分配失敗: {e}")
-            import traceback
-            traceback.print_exc()
+            fifo_logger.exception("[ERROR] FIFO庫存分配失敗: %s", e)
             # 如果FIFO分配失敗，回滾整個交易
             db.session.rollback()
             return jsonify({
@@ -3590,118 +4941,32 @@ def api_sales_entry():
         # 5. 更新客戶應收帳款（直接累加，避免遞歸）
         customer.total_receivables_twd += twd_amount
         
-        # 6. 提交主事務 (SalesRecord, FIFOSalesAllocation, Customer AR update)
-        db.session.commit()
-        print(f"[OK] DEBUG: 資料庫提交成功，SalesRecord ID: {new_sale.id}")
-        print(f"[AR_FIX] 客戶 {customer.name} 應收帳款已更新: +NT$ {twd_amount:,.2f}")
-        
-        # ====== 新增：利潤記錄隔離 ======
-        # 6. 獨立提交利潤交易 (允許失敗，不回滾 SalesRecord)
+        # 6. 記錄售出利潤：帳戶利潤餘額與系統利潤流水和售出寫在同一個交易，寫不進去就整筆售出失敗
         if fifo_result and 'profit_twd' in fifo_result:
             profit_amount = fifo_result['profit_twd']
-            print(f"DEBUG: 售出利潤金額: {profit_amount} TWD")
+            fifo_logger.debug("DEBUG: 售出利潤金額: %s TWD", profit_amount)
             
             try:
-                # 找到對應的RMB帳戶
-                rmb_account = new_sale.rmb_account
-                print(f"DEBUG: RMB帳戶 = {rmb_account}")
-                if rmb_account:
-                    # 記錄到ProfitService（保持原有邏輯）
-                    profit_result = ProfitService.add_profit(
-                        account_id=rmb_account.id,
-                        amount=profit_amount,
-                        transaction_type="PROFIT_EARNED",
-                        description=f"銷售利潤：客戶「{customer.name}」",
-                        note=f"RMB {new_sale.rmb_amount}，匯率 {new_sale.twd_amount/new_sale.rmb_amount:.4f}",
-                        related_transaction_id=new_sale.id,
-                        related_transaction_type="SALES",
-                        operator_id=get_safe_operator_id()
-                    )
-                    
-                    # 同時記錄到LedgerEntry中，用於利潤管理歷史
-                    try:
-                        # 計算當前總利潤（不包含當前銷售記錄）
-                        existing_sales = db.session.execute(
-                            db.select(SalesRecord)
-                            .filter(SalesRecord.id != new_sale.id)
-                        ).scalars().all()
-                        
-                        current_total_profit = 0.0
-                        for sale in existing_sales:
-                            sale_profit_info = FIFOService.calculate_profit_for_sale(sale)
-                            if sale_profit_info:
-                                current_total_profit += sale_profit_info.get('profit_twd', 0.0)
-                        
-                        # 扣除之前的利潤提款
-                        try:
-                            profit_withdrawals = db.session.execute(
-                                db.select(LedgerEntry)
-                                .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                            ).scalars().all()
-                            total_withdrawals = sum(entry.amount for entry in profit_withdrawals)
-                            current_total_profit -= total_withdrawals
-                        except:
-                            pass  # 如果查詢失敗，忽略
-                        
-                        # 創建利潤記錄
-                        try:
-                            profit_entry = LedgerEntry(
-                                entry_type="PROFIT_EARNED",
-                                amount=profit_amount,
-                                description=f"售出利潤：{customer.name}",
-                                operator_id=get_safe_operator_id(),
-                                profit_before=current_total_profit,
-                                profit_after=current_total_profit + profit_amount,
-                                profit_change=profit_amount
-                            )
-                        except Exception as e:
-                            if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                                print("警告: 銷售記錄創建利潤LedgerEntry時缺少欄位，嘗試修復...")
-                                db.session.rollback()
-                                
-                                # 嘗試添加缺失的欄位
-                                try:
-                                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                                    db.session.commit()
-                                    print("[OK] 銷售記錄欄位修復完成，重新創建記錄...")
-                                    
-                                    # 重新創建記錄
-                                    profit_entry = LedgerEntry(
-                                        entry_type="PROFIT_EARNED",
-                                        amount=profit_amount,
-                                        description=f"售出利潤：{customer.name}",
-                                        operator_id=get_safe_operator_id(),
-                                        profit_before=current_total_profit,
-                                        profit_after=current_total_profit + profit_amount,
-                                        profit_change=profit_amount
-                                    )
-                                except Exception as fix_error:
-                                    print(f"[ERROR] 銷售記錄修復欄位失敗: {fix_error}")
-                                    raise fix_error
-                            else:
-                                raise e
-                        db.session.add(profit_entry)
-                        db.session.flush()  # 確保記錄被添加到會話中
-                        print(f"[OK] 記錄售出利潤到LedgerEntry成功: {profit_amount:.2f} TWD")
-                        print(f"DEBUG: 利潤記錄 - 前: {current_total_profit:.2f}, 後: {current_total_profit + profit_amount:.2f}, 變動: {profit_amount:.2f}")
-                        print(f"DEBUG: LedgerEntry ID: {profit_entry.id}")
-                    except Exception as ledger_error:
-                        print(f"[WARNING] 記錄售出利潤到LedgerEntry失敗: {ledger_error}")
-                        import traceback
-                        traceback.print_exc()
-                    
-                    if profit_result["success"]:
-                        print(f"[OK] 自動記錄銷售利潤成功: {profit_amount:.2f} TWD")
-                    else:
-                        print(f"[WARNING] 自動記錄銷售利潤失敗: {profit_result['message']}")
-                else:
-                    print("[WARNING] 找不到RMB帳戶，跳過利潤記錄")
+                ProfitService.record_sale_profit(
+                    new_sale,
+                    profit_amount,
+                    description=f"售出利潤：{customer.name}",
+                    note=f"RMB {new_sale.rmb_amount}，匯率 {new_sale.twd_amount/new_sale.rmb_amount:.4f}",
+                    operator_id=get_safe_operator_id()
+                )
             except Exception as profit_error:
-                print(f"[WARNING] 記錄銷售利潤時發生錯誤: {profit_error}")
-                print(f"[WARNING] 利潤記錄失敗不影響銷售記錄創建，繼續執行...")
-                # 不影響銷售記錄的創建，只記錄警告
-        # ====== 結束：利潤記錄隔離 ======
+                fifo_logger.exception("[ERROR] 記錄銷售利潤失敗，售出不成立: %s", profit_error)
+                db.session.rollback()
+                return jsonify({
+                    "status": "error",
+                    "message": f"利潤記錄失敗: {profit_error}"
+                }), 500
+            fifo_logger.debug("[OK] 自動記錄銷售利潤成功: %.2f TWD", profit_amount)
+        
+        # 7. 提交主事務 (SalesRecord, FIFOSalesAllocation, Customer AR update, 利潤記錄)
+        db.session.commit()
+        fifo_logger.debug("[OK] DEBUG: 資料庫提交成功，SalesRecord ID: %s", new_sale.id)
+        fifo_logger.debug("[AR_FIX] 客戶 %s 應收帳款已更新: +NT$ %.2f", customer.name, twd_amount)
         
         # 立即驗證記錄是否真的被保存
         try:
@@ -3709,19 +4974,19 @@ def api_sales_entry():
                 db.select(SalesRecord).filter(SalesRecord.id == new_sale.id)
             ).scalar_one_or_none()
             if immediate_check:
-                print(f"[OK] DEBUG: 立即驗證成功，記錄確實存在，ID: {immediate_check.id}")
+                fifo_logger.debug("[OK] DEBUG: 立即驗證成功，記錄確實存在，ID: %s", immediate_check.id)
             else:
-                print(f"ERROR DEBUG: 立即驗證失敗，記錄不存在，ID: {new_sale.id}")
+                fifo_logger.error("ERROR DEBUG: 立即驗證失敗，記錄不存在，ID: %s", new_sale.id)
         except Exception as immediate_error:
-            print(f"ERROR DEBUG: 立即驗證時發生錯誤: {immediate_error}")
+            fifo_logger.error("ERROR DEBUG: 立即驗證時發生錯誤: %s", immediate_error)
 
         # 觸發全局數據同步（重新整理整個資料庫）
         try:
             from global_sync import sync_entire_database
             sync_entire_database(db.session)
-            print("[OK] 銷售記錄創建後全局數據同步完成")
+            fifo_logger.debug("[OK] 銷售記錄創建後全局數據同步完成")
         except Exception as sync_error:
-            print(f"[WARNING] 全局數據同步失敗（不影響銷售記錄）: {sync_error}")
+            fifo_logger.warning("[WARNING] 全局數據同步失敗（不影響銷售記錄）: %s", sync_error)
 
         # 驗證記錄是否正確保存
         try:
@@ -3731,35 +4996,33 @@ def api_sales_entry():
             ).scalar_one_or_none()
             
             if saved_sale:
-                print(f"[OK] DEBUG: 驗證成功，售出記錄已保存:")
-                print(f"  ID: {saved_sale.id}")
-                print(f"  客戶: {saved_sale.customer.name if saved_sale.customer else 'N/A'}")
-                print(f"  RMB帳戶: {saved_sale.rmb_account.name if saved_sale.rmb_account else 'N/A'}")
-                print(f"  是否結清: {saved_sale.is_settled}")
-                print(f"  建立時間: {saved_sale.created_at}")
+                fifo_logger.debug("[OK] DEBUG: 驗證成功，售出記錄已保存:")
+                fifo_logger.debug("  ID: %s", saved_sale.id)
+                fifo_logger.debug("  客戶: %s", saved_sale.customer.name if saved_sale.customer else 'N/A')
+                fifo_logger.debug("  RMB帳戶: %s", saved_sale.rmb_account.name if saved_sale.rmb_account else 'N/A')
+                fifo_logger.debug("  是否結清: %s", saved_sale.is_settled)
+                fifo_logger.debug("  建立時間: %s", saved_sale.created_at)
             else:
-                print(f"ERROR DEBUG: 售出記錄保存後找不到，ID: {new_sale.id}")
+                fifo_logger.error("ERROR DEBUG: 售出記錄保存後找不到，ID: %s", new_sale.id)
                 # 嘗試查詢所有最近的售出記錄
                 recent_sales = db.session.execute(
                     db.select(SalesRecord).order_by(SalesRecord.created_at.desc()).limit(10)
                 ).scalars().all()
-                print(f"DEBUG: 最近10筆售出記錄: {[s.id for s in recent_sales]}")
+                fifo_logger.debug("DEBUG: 最近10筆售出記錄: %s", [s.id for s in recent_sales])
                 
                 # 檢查是否有相同ID的記錄
                 same_id_sales = db.session.execute(
                     db.select(SalesRecord).filter(SalesRecord.id == new_sale.id)
                 ).scalars().all()
-                print(f"DEBUG: 查詢ID {new_sale.id} 的記錄數量: {len(same_id_sales)}")
+                fifo_logger.debug("DEBUG: 查詢ID %s 的記錄數量: %s", new_sale.id, len(same_id_sales))
                 
                 # 檢查所有售出記錄的ID範圍
                 all_sales = db.session.execute(
                     db.select(SalesRecord.id).order_by(SalesRecord.id.desc()).limit(20)
                 ).scalars().all()
-                print(f"DEBUG: 最近20筆售出記錄ID: {all_sales}")
+                fifo_logger.debug("DEBUG: 最近20筆售出記錄ID: %s", all_sales)
         except Exception as verify_error:
-            print(f"ERROR DEBUG: 驗證售出記錄時發生錯誤: {verify_error}")
-            import traceback
-            traceback.print_exc()
+            fifo_logger.exception("ERROR DEBUG: 驗證售出記錄時發生錯誤: %s", verify_error)
 
         return jsonify(
             {
@@ -3772,10 +5035,7 @@ def api_sales_entry():
         return jsonify({"status": "error", "message": "輸入的資料格式不正確。"}), 400
     except Exception as e:
         db.session.rollback()
-        print(f"!! Error in api_sales_entry: {e}")
-        import traceback
-
-        traceback.print_exc()
+        fifo_logger.exception("!! Error in api_sales_entry: %s", e)
         return (
             jsonify({"status": "error", "message": "伺服器內部錯誤，操作失敗。"}),
             500,
@@ -3834,7 +5094,7 @@ def cash_management_operator():
             
             total_receivables = sum(c.total_receivables_twd for c in customers_with_receivables)
         except Exception as customer_error:
-            print(f"Customer表查詢失敗，可能表不存在: {customer_error}")
+            cash_logger.error("Customer表查詢失敗，可能表不存在: %s", customer_error)
             customers_with_receivables = []
             total_receivables = 0.0
 
@@ -3866,12 +5126,19 @@ def cash_management_operator():
                 elif acc.currency == "RMB":
                     accounts_by_holder[acc.holder_id]["total_rmb"] += acc.balance
 
-        purchases = db.session.execute(db.select(PurchaseRecord)).scalars().all()
+        purchases = db.session.execute(
+            db.select(PurchaseRecord)
+            .options(
+                db.selectinload(PurchaseRecord.channel),
+                db.selectinload(PurchaseRecord.operator)
+            )
+        ).scalars().all()
         sales = db.session.execute(
             db.select(SalesRecord)
             .options(
                 db.selectinload(SalesRecord.customer),
-                db.selectinload(SalesRecord.rmb_account)
+                db.selectinload(SalesRecord.rmb_account),
+                db.selectinload(SalesRecord.operator)
             )
         ).scalars().all()
         # 安全地查詢 LedgerEntry，處理可能缺少的欄位
@@ -3885,78 +5152,13 @@ def cash_management_operator():
                 )
             ).scalars().all()
         except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 現金管理頁面 ledger_entries 表格缺少欄位，嘗試修復...")
-                db.session.rollback()  # 回滾失敗的事務
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 現金管理頁面欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    misc_entries = db.session.execute(
-                        db.select(LedgerEntry)
-                        .options(db.selectinload(LedgerEntry.account))
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 現金管理頁面修復欄位失敗: {fix_error}")
-                    misc_entries = []
-            else:
-                print(f"[ERROR] 現金管理頁面查詢LedgerEntry失敗: {e}")
-                misc_entries = []
+            cash_logger.error("[ERROR] 現金管理頁面查詢LedgerEntry失敗: %s", e)
+            misc_entries = []
         # 確保在乾淨的事務中查詢 cash_logs
         try:
             cash_logs = db.session.execute(db.select(CashLog)).scalars().all()
         except Exception as e:
-            print(f"警告: cash_logs 查詢失敗: {e}")
+            cash_logger.error("警告: cash_logs 查詢失敗: %s", e)
             db.session.rollback()
             cash_logs = []
 
@@ -3983,10 +5185,11 @@ def cash_management_operator():
                         "note": p.note if hasattr(p, 'note') and p.note else None,
                     }
                 )
+        profits = FIFOService.calculate_profits_for_sales(sales)
         for s in sales:
             if s.customer:
                 # 計算銷售利潤
-                profit_info = FIFOService.calculate_profit_for_sale(s)
+                profit_info = profits.get(s.id)
                 profit_twd = profit_info.get('profit_twd', 0.0) if profit_info else 0.0
                 
                 unified_stream.append(
@@ -4130,7 +5333,7 @@ def cash_management_operator():
                 .all()
             )
         except Exception as pending_error:
-            print(f"PendingPayment表查詢失敗，可能表不存在: {pending_error}")
+            cash_logger.error("PendingPayment表查詢失敗，可能表不存在: %s", pending_error)
             pending_payments = []
 
         # 準備 owner_accounts 數據
@@ -4230,7 +5433,7 @@ def cash_management():
             
             total_receivables = sum(c.total_receivables_twd for c in customers_with_receivables)
         except Exception as customer_error:
-            print(f"Customer表查詢失敗，可能表不存在: {customer_error}")
+            cash_logger.error("Customer表查詢失敗，可能表不存在: %s", customer_error)
             customers_with_receivables = []
             total_receivables = 0.0
 
@@ -4262,12 +5465,19 @@ def cash_management():
                 elif acc.currency == "RMB":
                     accounts_by_holder[acc.holder_id]["total_rmb"] += acc.balance
 
-        purchases = db.session.execute(db.select(PurchaseRecord)).scalars().all()
+        purchases = db.session.execute(
+            db.select(PurchaseRecord)
+            .options(
+                db.selectinload(PurchaseRecord.channel),
+                db.selectinload(PurchaseRecord.operator)
+            )
+        ).scalars().all()
         sales = db.session.execute(
             db.select(SalesRecord)
             .options(
                 db.selectinload(SalesRecord.customer),
-                db.selectinload(SalesRecord.rmb_account)
+                db.selectinload(SalesRecord.rmb_account),
+                db.selectinload(SalesRecord.operator)
             )
         ).scalars().all()
         # 安全地查詢 LedgerEntry，處理可能缺少的欄位
@@ -4281,78 +5491,13 @@ def cash_management():
                 )
             ).scalars().all()
         except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 現金管理頁面 ledger_entries 表格缺少欄位，嘗試修復...")
-                db.session.rollback()  # 回滾失敗的事務
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 現金管理頁面欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    misc_entries = db.session.execute(
-                        db.select(LedgerEntry)
-                        .options(db.selectinload(LedgerEntry.account))
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 現金管理頁面修復欄位失敗: {fix_error}")
-                    misc_entries = []
-            else:
-                print(f"[ERROR] 現金管理頁面查詢LedgerEntry失敗: {e}")
-                misc_entries = []
+            cash_logger.error("[ERROR] 現金管理頁面查詢LedgerEntry失敗: %s", e)
+            misc_entries = []
         # 確保在乾淨的事務中查詢 cash_logs
         try:
             cash_logs = db.session.execute(db.select(CashLog)).scalars().all()
         except Exception as e:
-            print(f"警告: cash_logs 查詢失敗: {e}")
+            cash_logger.error("警告: cash_logs 查詢失敗: %s", e)
             db.session.rollback()
             cash_logs = []
 
@@ -4379,10 +5524,11 @@ def cash_management():
                         "note": p.note if hasattr(p, 'note') and p.note else None,
                     }
                 )
+        profits = FIFOService.calculate_profits_for_sales(sales)
         for s in sales:
             if s.customer:
                 # 計算銷售利潤
-                profit_info = FIFOService.calculate_profit_for_sale(s)
+                profit_info = profits.get(s.id)
                 profit = profit_info['profit_twd'] if profit_info else 0
                 
                 unified_stream.append(
@@ -4404,7 +5550,7 @@ def cash_management():
             rmb_change = 0
             
             # 調試信息：檢查每個記帳記錄
-            print(f"DEBUG: 處理記帳記錄 - 類型: {entry.entry_type}, 帳戶: {entry.account.name if entry.account else 'N/A'}, 金額: {entry.amount}")
+            cash_logger.debug("DEBUG: 處理記帳記錄 - 類型: %s, 帳戶: %s, 金額: %s", entry.entry_type, entry.account.name if entry.account else 'N/A', entry.amount)
             
             # 優化：移除對BUY_IN_DEBIT和BUY_IN_CREDIT的特殊處理
             # 因為買入交易現在只使用PurchaseRecord，不需要額外的LedgerEntry
@@ -4418,7 +5564,7 @@ def cash_management():
                     # 其他類型（如提款、轉出）是減少TWD餘額
                     twd_change = -entry.amount
                 
-                print(f"  TWD帳戶變動: {twd_change} (類型: {entry.entry_type})")
+                cash_logger.debug("  TWD帳戶變動: %s (類型: %s)", twd_change, entry.entry_type)
                 
             elif entry.account and entry.account.currency == "RMB":
                 # 關鍵修正：WITHDRAW 類型應該顯示為負數（扣款）
@@ -4430,7 +5576,7 @@ def cash_management():
                 else:
                     rmb_change = -entry.amount  # 其他類型：反向
                 
-                print(f"  RMB帳戶變動: {rmb_change} (類型: {entry.entry_type}, 原始amount: {entry.amount})")
+                cash_logger.debug("  RMB帳戶變動: %s (類型: %s, 原始amount: %s)", rmb_change, entry.entry_type, entry.amount)
             
             # 顯示所有記帳記錄，包括提款記錄
             # 移除過濾，確保提款記錄被包含在內
@@ -4497,7 +5643,7 @@ def cash_management():
                     deposit_account = "N/A"
                 
                 # 調試信息：檢查添加到流水記錄的數據
-                print(f"  添加到流水記錄: 類型={entry.entry_type}, TWD變動={twd_change}, RMB變動={rmb_change}")
+                cash_logger.debug("  添加到流水記錄: 類型=%s, TWD變動=%s, RMB變動=%s", entry.entry_type, twd_change, rmb_change)
                 
                 unified_stream.append(
                     {
@@ -4699,7 +5845,7 @@ def cash_management():
                 .all()
             )
         except Exception as pending_error:
-            print(f"PendingPayment表查詢失敗，可能表不存在: {pending_error}")
+            cash_logger.error("PendingPayment表查詢失敗，可能表不存在: %s", pending_error)
             pending_payments = []
 
         # --- 關鍵修正：確保您傳遞的是正確的分頁後數據 ---
@@ -4726,10 +5872,7 @@ def cash_management():
             ],
         )
     except Exception as e:
-        print(f"!! 現金管理頁面發生錯誤: {e}")
-        import traceback
-
-        traceback.print_exc()
+        cash_logger.exception("!! 現金管理頁面發生錯誤: %s", e)
         flash("載入現金管理數據時發生嚴重錯誤。", "danger")
         return render_template(
             "cash_management.html",
@@ -5114,12 +6257,11 @@ def api_buy_in():
                 final_channel_id = channel.id
 
             # 更新帳戶餘額
+            balance_deltas = {deposit_account.id: rmb_amount}  # 入庫（無論付款狀態如何都要入庫）
             if payment_status == "paid" and payment_account:
                 # 已付款：立即扣款
-                payment_account.balance -= twd_cost
-            
-            # 入庫（無論付款狀態如何都要入庫）
-            deposit_account.balance += rmb_amount
+                balance_deltas[payment_account.id] = balance_deltas.get(payment_account.id, 0) - twd_cost
+            BalanceService.apply_deltas(balance_deltas)
 
             # 創建採購紀錄
             new_purchase = PurchaseRecord(
@@ -5138,9 +6280,9 @@ def api_buy_in():
             # 創建FIFO庫存記錄
             try:
                 FIFOService.create_inventory_from_purchase(new_purchase)
-                print(f"已為買入記錄 {new_purchase.id} 創建FIFO庫存")
+                cash_logger.debug("已為買入記錄 %s 創建FIFO庫存", new_purchase.id)
             except Exception as e:
-                print(f"創建FIFO庫存失敗: {e}")
+                cash_logger.error("創建FIFO庫存失敗: %s", e)
                 # 即使FIFO創建失敗，也不影響主要交易
                 pass
             
@@ -5152,9 +6294,9 @@ def api_buy_in():
                         amount_twd=twd_cost
                     )
                     db.session.add(pending_payment)
-                    print(f"已為買入記錄 {new_purchase.id} 創建待付款項: NT$ {twd_cost:,.2f}")
+                    cash_logger.debug("已為買入記錄 %s 創建待付款項: NT$ %.2f", new_purchase.id, twd_cost)
                 except Exception as e:
-                    print(f"創建待付款項失敗: {e}")
+                    cash_logger.error("創建待付款項失敗: %s", e)
                     # 即使待付款項創建失敗，也不影響主要交易
                 pass
 
@@ -5167,9 +6309,9 @@ def api_buy_in():
             try:
                 from global_sync import sync_entire_database
                 sync_entire_database(db.session)
-                print(" 買入記錄創建後全局數據同步完成")
+                cash_logger.debug(" 買入記錄創建後全局數據同步完成")
             except Exception as sync_error:
-                print(f"全局數據同步失敗（不影響買入記錄）: {sync_error}")
+                cash_logger.warning("全局數據同步失敗（不影響買入記錄）: %s", sync_error)
 
             # 根據付款狀態返回不同的成功訊息
             if payment_status == "paid":
@@ -5193,12 +6335,12 @@ def api_buy_in():
                 400,
             )
 
+    except InsufficientBalanceError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         db.session.rollback()
-        print(f"!! Error in api_buy_in: {e}")  # 在後端印出詳細錯誤
-        import traceback
-
-        traceback.print_exc()
+        cash_logger.exception("!! Error in api_buy_in: %s", e)
         return (
             jsonify({"status": "error", "message": "伺服器內部錯誤，操作失敗。"}),
             500,
@@ -5214,10 +6356,7 @@ def settle_pending_payment_api():
     try:
         # === Debug: 請求原始資料 ===
         data = request.get_json() or {}
-        try:
-            print("[SETTLE] Incoming JSON:", data)
-        except Exception:
-            pass
+        settlement_logger.debug("[SETTLE] Incoming JSON: %s", data)
         # 強制型別轉換，避免字串/None 造成隱性錯誤
         try:
             pending_id = int(data.get("pending_id"))
@@ -5232,10 +6371,10 @@ def settle_pending_payment_api():
         except Exception:
             settlement_amount = None
         note = (data.get("note") or "").strip()
-        print("[SETTLE] Parsed -> pending_id=", pending_id, 
-              " payment_account_id=", payment_account_id, 
-              " settlement_amount=", settlement_amount, 
-              " note=", note)
+        settlement_logger.debug(
+            "[SETTLE] Parsed -> pending_id=%s payment_account_id=%s settlement_amount=%s note=%s",
+            pending_id, payment_account_id, settlement_amount, note,
+        )
         
         # 驗證必填欄位
         if not all([pending_id, payment_account_id, settlement_amount]):
@@ -5262,15 +6401,16 @@ def settle_pending_payment_api():
             return jsonify({"status": "error", "message": "銷帳金額不能超過待付金額"}), 400
         
         # 檢查帳戶餘額
-        print("[SETTLE] Balances -> account=", payment_account.balance, 
-              " settlement=", settlement_amount, 
-              " pending_amount_twd=", pending_payment.amount_twd)
+        settlement_logger.debug(
+            "[SETTLE] Balances -> account=%s settlement=%s pending_amount_twd=%s",
+            payment_account.balance, settlement_amount, pending_payment.amount_twd,
+        )
         if payment_account.balance < settlement_amount:
             return jsonify({"status": "error", "message": f"付款帳戶餘額不足，需要 {settlement_amount:,.2f}，但僅剩 {payment_account.balance:,.2f}"}), 400
         
         # 執行銷帳
         # 1. 扣除付款帳戶餘額
-        payment_account.balance -= settlement_amount
+        BalanceService.apply_delta(payment_account, -settlement_amount)
         
         # 2. 更新待付款項狀態
         pending_payment.amount_twd -= settlement_amount
@@ -5300,46 +6440,17 @@ def settle_pending_payment_api():
             description += f" | {note}"
         
         # 創建流水記錄
-        try:
-            # 記錄為「付款」型別，金額為負數，並標示出款帳戶
-            ledger_entry = LedgerEntry(
-                entry_type="PAYMENT",  # 類型：付款
-                account_id=payment_account.id,  # 主關聯帳戶
-                from_account_id=payment_account.id,  # 出款帳戶
-                to_account_id=None,
-                amount=-settlement_amount,  # 負數表示支出
-                description=description,
-                operator_id=get_safe_operator_id()
-            )
-            db.session.add(ledger_entry)
-        except Exception as e:
-            if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                print("警告: 待付款項銷帳創建LedgerEntry時缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                    db.session.commit()
-                    print("[OK] 待付款項銷帳欄位修復完成，重新創建記錄...")
-                    
-                    # 重新創建記錄
-                    ledger_entry = LedgerEntry(
-                        entry_type="PAYMENT",
-                        account_id=payment_account.id,
-                        from_account_id=payment_account.id,
-                        to_account_id=None,
-                        amount=-settlement_amount,  # 負數表示支出
-                        description=description,
-                        operator_id=get_safe_operator_id()
-                    )
-                    db.session.add(ledger_entry)
-                except Exception as fix_error:
-                    print(f"[ERROR] 待付款項銷帳修復欄位失敗: {fix_error}")
-                    raise fix_error
-            else:
-                raise e
+        # 記錄為「付款」型別，金額為負數，並標示出款帳戶
+        ledger_entry = LedgerEntry(
+            entry_type="PAYMENT",  # 類型：付款
+            account_id=payment_account.id,  # 主關聯帳戶
+            from_account_id=payment_account.id,  # 出款帳戶
+            to_account_id=None,
+            amount=-settlement_amount,  # 負數表示支出
+            description=description,
+            operator_id=get_safe_operator_id()
+        )
+        db.session.add(ledger_entry)
         
         # 提交所有變更
         db.session.commit()
@@ -5379,7 +6490,7 @@ def settle_pending_payment_api():
                 balance_changes=balance_changes
             )
         except Exception as audit_error:
-            print(f"記錄銷帳審計日誌失敗: {audit_error}")
+            settlement_logger.error("記錄銷帳審計日誌失敗: %s", audit_error)
         
         # 返回成功訊息
         if pending_payment.is_settled:
@@ -5392,11 +6503,12 @@ def settle_pending_payment_api():
             "message": message
         })
         
+    except InsufficientBalanceError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         db.session.rollback()
-        import traceback
-        traceback.print_exc()
-        print(f"待付款項銷帳失敗: {e}")
+        settlement_logger.exception("待付款項銷帳失敗: %s", e)
         # 將詳細錯誤回傳給前端以利除錯（僅管理端使用）
         return jsonify({"status": "error", "message": f"銷帳操作失敗: {str(e)}"}), 500
 
@@ -5448,7 +6560,7 @@ def process_payment_api():
 
         # --- 3. 執行付款處理 ---
         # 更新收款帳戶餘額
-        twd_account.balance += payment_amount
+        BalanceService.apply_delta(twd_account, payment_amount)
 
         # 更新客戶應收帳款
         customer.total_receivables_twd -= payment_amount
@@ -5458,41 +6570,14 @@ def process_payment_api():
         if note:
             description += f" - {note}"
         
-        try:
-            ledger_entry = LedgerEntry(
-                entry_type="SETTLEMENT",
-                description=description,
-                amount=payment_amount,
-                account_id=twd_account_id,
-                                    operator_id=get_safe_operator_id(),
-            )
-            db.session.add(ledger_entry)
-        except Exception as e:
-            if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                print("警告: 客戶銷帳創建LedgerEntry時缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                    db.session.commit()
-                    print("[OK] 客戶銷帳欄位修復完成，重新創建記錄...")
-                    
-                    # 重新創建記錄
-                    ledger_entry = LedgerEntry(
-                        entry_type="SETTLEMENT",
-                        description=description,
-                        amount=payment_amount,
-                        account_id=twd_account_id,
-                                    operator_id=get_safe_operator_id(),
-                    )
-                    db.session.add(ledger_entry)
-                except Exception as fix_error:
-                    print(f"[ERROR] 客戶銷帳修復欄位失敗: {fix_error}")
-                    raise fix_error
-            else:
-                raise e
+        ledger_entry = LedgerEntry(
+            entry_type="SETTLEMENT",
+            description=description,
+            amount=payment_amount,
+            account_id=twd_account_id,
+                                operator_id=get_safe_operator_id(),
+        )
+        db.session.add(ledger_entry)
 
         # 自動沖銷最早的未付訂單
         unpaid_sales = (
@@ -5551,10 +6636,7 @@ def process_payment_api():
 
     except Exception as e:
         db.session.rollback()
-        print(f"!! Error in process_payment_api: {e}")
-        import traceback
-
-        traceback.print_exc()
+        cash_logger.exception("!! Error in process_payment_api: %s", e)
         return jsonify({"status": "error", "message": "伺服器內部錯誤，操作失敗。"}), 500
 
 
@@ -5625,8 +6707,7 @@ def admin_fix_history_settle_pending():
         })
     except Exception as e:
         db.session.rollback()
-        import traceback
-        traceback.print_exc()
+        logger.exception("修復歷史資料失敗: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/fifo-inventory")
@@ -5651,9 +6732,10 @@ def fifo_inventory():
         
         # 計算每筆銷售的利潤
         sales_with_profit = []
+        profits = FIFOService.calculate_profits_for_sales(recent_sales)
         for sale in recent_sales:
             try:
-                profit_info = FIFOService.calculate_profit_for_sale(sale)
+                profit_info = profits.get(sale.id)
                 if profit_info:
                     sales_with_profit.append({
                         'id': sale.id,
@@ -5666,7 +6748,7 @@ def fifo_inventory():
                         'total_cost': profit_info['total_cost_twd']
                     })
             except Exception as sale_error:
-                print(f"計算銷售 {sale.id} 利潤時發生錯誤: {sale_error}")
+                fifo_logger.error("計算銷售 %s 利潤時發生錯誤: %s", sale.id, sale_error)
                 continue
         
         return render_template(
@@ -5676,7 +6758,7 @@ def fifo_inventory():
         )
         
     except Exception as e:
-        print(f"載入FIFO庫存頁面時發生錯誤: {e}")
+        fifo_logger.error("載入FIFO庫存頁面時發生錯誤: %s", e)
         flash(f"載入FIFO庫存頁面時發生錯誤: {e}", "danger")
         return render_template(
             "fifo_inventory.html",
@@ -5706,9 +6788,10 @@ def api_fifo_inventory_status():
         
         # 計算每筆銷售的利潤
         sales_with_profit = []
+        profits = FIFOService.calculate_profits_for_sales(recent_sales)
         for sale in recent_sales:
             try:
-                profit_info = FIFOService.calculate_profit_for_sale(sale)
+                profit_info = profits.get(sale.id)
                 if profit_info:
                     sales_with_profit.append({
                         'id': sale.id,
@@ -5721,7 +6804,7 @@ def api_fifo_inventory_status():
                         'total_cost': profit_info['total_cost_twd']
                     })
             except Exception as sale_error:
-                print(f"API計算銷售 {sale.id} 利潤時發生錯誤: {sale_error}")
+                fifo_logger.error("API計算銷售 %s 利潤時發生錯誤: %s", sale.id, sale_error)
                 continue
         
         return jsonify({
@@ -5731,7 +6814,7 @@ def api_fifo_inventory_status():
         })
         
     except Exception as e:
-        print(f"獲取FIFO庫存狀態失敗: {e}")
+        fifo_logger.error("獲取FIFO庫存狀態失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'獲取庫存狀態失敗: {e}'
@@ -5753,7 +6836,7 @@ def api_audit_inventory():
             'issues': issues
         })
     except Exception as e:
-        print(f"審計庫存一致性失敗: {e}")
+        fifo_logger.error("審計庫存一致性失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'審計失敗: {e}'
@@ -5771,7 +6854,7 @@ def api_fix_inventory():
             'fixed_issues': fixed_issues
         })
     except Exception as e:
-        print(f"修復庫存一致性失敗: {e}")
+        fifo_logger.error("修復庫存一致性失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'修復失敗: {e}'
@@ -5806,7 +6889,7 @@ def api_inventory_status():
         })
         
     except Exception as e:
-        print(f"獲取庫存狀態報告失敗: {e}")
+        fifo_logger.error("獲取庫存狀態報告失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'獲取狀態報告失敗: {e}'
@@ -5830,7 +6913,7 @@ def api_reverse_sale_allocation(sales_record_id):
                 'message': f'取消銷售記錄 {sales_record_id} 失敗'
             }), 400
     except Exception as e:
-        print(f"取消銷售記錄失敗: {e}")
+        fifo_logger.error("取消銷售記錄失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'取消失敗: {e}'
@@ -5841,23 +6924,23 @@ def api_reverse_sale_allocation(sales_record_id):
 def api_user_reverse_sale(sales_record_id):
     """API端點：普通用戶取消自己的銷售記錄"""
     try:
-        print(f"收到取消銷售記錄請求: {sales_record_id}")
+        fifo_logger.debug("收到取消銷售記錄請求: %s", sales_record_id)
         
         # 檢查銷售記錄是否存在
         sales_record = db.session.get(SalesRecord, sales_record_id)
         if not sales_record:
-            print(f"找不到銷售記錄 {sales_record_id}")
+            fifo_logger.debug("找不到銷售記錄 %s", sales_record_id)
             return jsonify({
                 'status': 'error',
                 'message': f'找不到銷售記錄 {sales_record_id}'
             }), 404
         
-        print(f"找到銷售記錄: 客戶ID={sales_record.customer_id}, RMB={sales_record.rmb_amount}")
+        fifo_logger.debug("找到銷售記錄: 客戶ID=%s, RMB=%s", sales_record.customer_id, sales_record.rmb_amount)
         
         # 檢查用戶權限（只能取消自己的記錄或管理員可以取消所有記錄）
         current_operator_id = get_safe_operator_id()
         if not current_user.is_admin and sales_record.operator_id != current_operator_id:
-            print(f"權限檢查失敗: 用戶ID={current_operator_id}, 記錄操作者ID={sales_record.operator_id}")
+            fifo_logger.warning("權限檢查失敗: 用戶ID=%s, 記錄操作者ID=%s", current_operator_id, sales_record.operator_id)
             return jsonify({
                 'status': 'error',
                 'message': '您只能取消自己的銷售記錄'
@@ -5869,20 +6952,20 @@ def api_user_reverse_sale(sales_record_id):
             .filter(FIFOSalesAllocation.sales_record_id == sales_record_id)
         ).scalars().all()
         
-        print(f"找到 {len(allocations)} 個FIFO分配記錄")
+        fifo_logger.debug("找到 %s 個FIFO分配記錄", len(allocations))
         
         # 執行簡化的取消操作
         try:
             # 先嘗試簡化的取消邏輯
             success = FIFOService.simple_reverse_sale_allocation(sales_record_id)
             if success:
-                print(f"簡化取消成功")
+                fifo_logger.debug("簡化取消成功")
                 return jsonify({
                     'status': 'success',
                     'message': f'成功取消銷售記錄 {sales_record_id}，已完全刪除相關數據'
                 })
             else:
-                print(f"簡化取消失敗，嘗試完整取消")
+                fifo_logger.warning("簡化取消失敗，嘗試完整取消")
                 # 如果簡化取消失敗，嘗試完整的取消邏輯
                 success = FIFOService.reverse_sale_allocation(sales_record_id)
                 if success:
@@ -5896,17 +6979,13 @@ def api_user_reverse_sale(sales_record_id):
                         'message': f'取消銷售記錄 {sales_record_id} 失敗，可能是因為該記錄已有相關分配或無法回滾'
                     }), 400
         except Exception as reverse_error:
-            print(f"取消銷售記錄時發生錯誤: {reverse_error}")
-            import traceback
-            traceback.print_exc()
+            fifo_logger.exception("取消銷售記錄時發生錯誤: %s", reverse_error)
             return jsonify({
                 'status': 'error',
                 'message': f'取消銷售記錄時發生錯誤: {str(reverse_error)}'
             }), 400
     except Exception as e:
-        print(f"用戶取消銷售記錄失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        fifo_logger.exception("用戶取消銷售記錄失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'取消失敗: {e}'
@@ -5930,7 +7009,7 @@ def api_reverse_purchase_inventory(purchase_record_id):
                 'message': f'取消買入記錄 {purchase_record_id} 失敗，可能已有銷售分配'
             }), 400
     except Exception as e:
-        print(f"取消買入記錄失敗: {e}")
+        fifo_logger.error("取消買入記錄失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'取消失敗: {e}'
@@ -5961,7 +7040,7 @@ def api_reverse_card_purchase(card_purchase_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"回滾刷卡記錄失敗: {e}")
+        fifo_logger.error("回滾刷卡記錄失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'回滾失敗: {e}'
@@ -6069,7 +7148,12 @@ def admin_update_cash_account():
                         return redirect(url_for('cash_management'))
                     else:
                         # 處理提款
-                        account.balance -= amount
+                        try:
+                            BalanceService.apply_delta(account, -amount)
+                        except InsufficientBalanceError as e:
+                            db.session.rollback()
+                            flash(f"餘額不足，無法提出 {amount:,.2f}。當前可用餘額: {e.available:,.2f}", "danger")
+                            return redirect(url_for('cash_management'))
                         
                         # 根據提款類型設置描述
                         if withdraw_type == "profit":
@@ -6089,118 +7173,47 @@ def admin_update_cash_account():
                                 description += f" | 已按FIFO扣減庫存"
                             except ValueError as e:
                                 # 庫存不足，回滾帳戶餘額變更
-                                account.balance += amount
+                                db.session.rollback()
                                 flash(f"庫存不足，無法提款: {e}", "danger")
                                 return redirect(url_for('cash_management'))
                             except Exception as e:
                                 # 其他錯誤，回滾帳戶餘額變更
-                                account.balance += amount
+                                db.session.rollback()
                                 flash(f"扣減庫存失敗: {e}", "danger")
                                 return redirect(url_for('cash_management'))
                         
-                        # 計算當前總利潤（用於記錄變動前後利潤）
-                        current_total_profit = 0.0
                         if withdraw_type == "profit":
-                            # 計算當前銷售利潤總和
-                            all_sales = (
-                                db.session.execute(db.select(SalesRecord))
-                                .scalars()
-                                .all()
+                            # 利潤提款經由 ProfitService 寫入系統利潤流水（金額為負、並檢查可用利潤）
+                            ProfitService._lock_ledger()
+                            current_total_profit = ProfitService.get_total_profit()
+                            if current_total_profit < amount:
+                                db.session.rollback()
+                                flash(f"利潤餘額不足，無法提出 {amount:,.2f}。當前可用利潤: {current_total_profit:,.2f}", "danger")
+                                return redirect(url_for('cash_management'))
+                            ProfitService.post_ledger(
+                                "PROFIT_WITHDRAW", -amount, description, account_id=account.id, commit=False
                             )
-                            
-                            for sale in all_sales:
-                                profit_info = FIFOService.calculate_profit_for_sale(sale)
-                                if profit_info:
-                                    current_total_profit += profit_info.get('profit_twd', 0.0)
-                            
-                            # 扣除之前的利潤提款
-                            try:
-                                previous_profit_withdrawals = (
-                                    db.session.execute(
-                                        db.select(LedgerEntry)
-                                        .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                                        .filter(LedgerEntry.id != None)  # 排除當前記錄
-                                    )
-                                    .scalars()
-                                    .all()
-                                )
-                            except Exception as e:
-                                if "profit_before does not exist" in str(e):
-                                    print("警告: 查詢之前的利潤提款記錄時缺少欄位，跳過查詢")
-                                    db.session.rollback()
-                                    previous_profit_withdrawals = []
-                                else:
-                                    db.session.rollback()
-                                    raise e
-                            
-                            previous_withdrawals = sum(entry.amount for entry in previous_profit_withdrawals)
-                            current_total_profit -= previous_withdrawals
-                        
-                        # 創建流水記錄
-                        entry_type = "PROFIT_WITHDRAW" if withdraw_type == "profit" else "ASSET_WITHDRAW"
-                        try:
-                            entry = LedgerEntry(
-                                entry_type=entry_type,
+                        else:
+                            # 資產提款不影響利潤
+                            db.session.add(LedgerEntry(
+                                entry_type="ASSET_WITHDRAW",
                                 account_id=account.id,
                                 amount=amount,  # 提款金額
                                 description=description,
                                 operator_id=get_safe_operator_id(),
-                            )
-                        except Exception as e:
-                            if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                                print("警告: 提款操作創建LedgerEntry時缺少欄位，嘗試修復...")
-                                db.session.rollback()
-                                
-                                # 嘗試添加缺失的欄位
-                                try:
-                                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                                    db.session.commit()
-                                    print("[OK] 提款操作欄位修復完成，重新創建記錄...")
-                                    
-                                    # 重新創建記錄
-                                    entry = LedgerEntry(
-                                        entry_type=entry_type,
-                                        account_id=account.id,
-                                        amount=amount,  # 提款金額
-                                        description=description,
-                                        operator_id=get_safe_operator_id(),
-                                    )
-                                except Exception as fix_error:
-                                    print(f"[ERROR] 提款操作修復欄位失敗: {fix_error}")
-                                    raise fix_error
-                            else:
-                                raise e
-                        
-                        # 如果是利潤提款，記錄詳細利潤信息（如果欄位存在）
-                        if withdraw_type == "profit":
-                            # 安全地設置利潤詳細信息
-                            if hasattr(entry, 'profit_before'):
-                                entry.profit_before = current_total_profit
-                                entry.profit_after = current_total_profit - amount
-                                entry.profit_change = -amount  # 負數表示減少
-                                print(f"DEBUG: 利潤提款記錄 - 變動前: {entry.profit_before:.2f}, 變動後: {entry.profit_after:.2f}, 變動: {entry.profit_change:.2f}")
-                            else:
-                                print("WARNING: 利潤詳細欄位不存在，跳過詳細記錄")
-                        else:
-                            # 資產提款不影響利潤，設為 None（如果欄位存在）
-                            if hasattr(entry, 'profit_before'):
-                                entry.profit_before = None
-                                entry.profit_after = None
-                                entry.profit_change = None
+                            ))
                         
                         # 調試信息：檢查提款記錄
-                        print(f"DEBUG: 創建提款記錄 - 金額: {amount}, 帳戶: {account.name}, 類型: WITHDRAW")
-                        db.session.add(entry)
+                        cash_logger.debug("DEBUG: 創建提款記錄 - 金額: %s, 帳戶: %s, 類型: WITHDRAW", amount, account.name)
                         db.session.commit()
                         
                         # 觸發全局數據同步（重新整理整個資料庫）
                         try:
                             from global_sync import sync_entire_database
                             sync_entire_database(db.session)
-                            print(" 提款操作後全局數據同步完成")
+                            cash_logger.debug(" 提款操作後全局數據同步完成")
                         except Exception as sync_error:
-                            print(f"全局數據同步失敗: {sync_error}")
+                            cash_logger.error("全局數據同步失敗: %s", sync_error)
                         
                         success_msg = f'已從 "{account.name}" 提出 {amount:,.2f}'
                         if account.currency == "RMB":
@@ -6211,7 +7224,7 @@ def admin_update_cash_account():
                         return redirect(url_for('cash_management'))
                 else:
                     # 處理存款
-                    account.balance += amount
+                    BalanceService.apply_delta(account, amount)
                     
                     # 獲取成本匯率（僅RMB帳戶需要）
                     rmb_cost_rate = request.form.get("rmb_cost_rate")
@@ -6270,51 +7283,23 @@ def admin_update_cash_account():
                         return redirect(url_for('cash_management'))
                     
                     # 創建流水記錄
-                    try:
-                        entry = LedgerEntry(
-                            entry_type="DEPOSIT",
-                            account_id=account.id,
-                            amount=amount,
-                            description=description,
-                            operator_id=get_safe_operator_id(),
-                        )
-                        db.session.add(entry)
-                        db.session.commit()
-                    except Exception as e:
-                        if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                            print("警告: 存款操作創建LedgerEntry時缺少欄位，嘗試修復...")
-                            db.session.rollback()
-                            
-                            # 嘗試添加缺失的欄位
-                            try:
-                                db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                                db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                                db.session.commit()
-                                print("[OK] 存款操作欄位修復完成，重新創建記錄...")
-                                
-                                # 重新創建記錄
-                                entry = LedgerEntry(
-                                    entry_type="DEPOSIT",
-                                    account_id=account.id,
-                                    amount=amount,
-                                    description=description,
-                                    operator_id=get_safe_operator_id(),
-                                )
-                                db.session.add(entry)
-                                db.session.commit()
-                            except Exception as fix_error:
-                                print(f"[ERROR] 存款操作修復欄位失敗: {fix_error}")
-                                raise fix_error
-                        else:
-                            raise e
+                    entry = LedgerEntry(
+                        entry_type="DEPOSIT",
+                        account_id=account.id,
+                        amount=amount,
+                        description=description,
+                        operator_id=get_safe_operator_id(),
+                    )
+                    db.session.add(entry)
+                    db.session.commit()
                     
                     # 觸發全局數據同步（重新整理整個資料庫）
                     try:
                         from global_sync import sync_entire_database
                         sync_entire_database(db.session)
-                        print(" 存款操作後全局數據同步完成")
+                        cash_logger.debug(" 存款操作後全局數據同步完成")
                     except Exception as sync_error:
-                        print(f"全局數據同步失敗: {sync_error}")
+                        cash_logger.error("全局數據同步失敗: %s", sync_error)
                     
                     success_msg = f'已向 "{account.name}" 存入 {amount:,.2f}'
                     if account.currency == "RMB" and rmb_cost_rate:
@@ -6349,14 +7334,14 @@ def admin_update_cash_account():
                 return jsonify({'status': 'error', 'message': '缺少 purchase_record_id'}), 400
 
             try:
-                print(f"開始回滾純利潤庫存，purchase_record_id: {purchase_record_id}")
+                cash_logger.debug("開始回滾純利潤庫存，purchase_record_id: %s", purchase_record_id)
                 
                 # 先檢查買入記錄是否存在
                 purchase_record = db.session.get(PurchaseRecord, purchase_record_id)
                 if not purchase_record:
                     return jsonify({'status': 'error', 'message': f'找不到買入記錄 {purchase_record_id}'}), 404
                 
-                print(f"找到買入記錄: channel={purchase_record.channel_id}, payment_account={purchase_record.payment_account_id}, twd_cost={purchase_record.twd_cost}")
+                cash_logger.debug("找到買入記錄: channel=%s, payment_account=%s, twd_cost=%s", purchase_record.channel_id, purchase_record.payment_account_id, purchase_record.twd_cost)
                 
                 # 檢查是否為純利潤庫存
                 is_pure_profit = (purchase_record.channel is None and 
@@ -6387,7 +7372,7 @@ def admin_update_cash_account():
                         .all()
                     )
                     
-                    print(f"檢查銷售分配: 找到 {len(allocations)} 個分配記錄")
+                    cash_logger.debug("檢查銷售分配: 找到 %s 個分配記錄", len(allocations))
                     
                     if allocations:
                         return jsonify({'status': 'error', 'message': f'該批庫存已有 {len(allocations)} 個銷售分配，無法回滾'}), 400
@@ -6400,7 +7385,7 @@ def admin_update_cash_account():
                     return jsonify({'status': 'error', 'message': '回滾失敗，請檢查日誌'}), 500
                     
             except Exception as e:
-                print(f"回滾純利潤庫存失敗: {e}")
+                cash_logger.error("回滾純利潤庫存失敗: %s", e)
                 return jsonify({'status': 'error', 'message': f'回滾失敗: {e}'}), 500
 
         elif action == "transfer_funds":
@@ -6417,49 +7402,24 @@ def admin_update_cash_account():
                 flash(f'來源帳戶 "{from_account.name}" 餘額不足。', "danger")
                 return redirect(url_for('cash_management'))
             else:
-                    from_account.balance -= amount
-                    to_account.balance += amount
+                    try:
+                        BalanceService.apply_deltas({from_account.id: -amount, to_account.id: amount})
+                    except InsufficientBalanceError:
+                        db.session.rollback()
+                        flash(f'來源帳戶 "{from_account.name}" 餘額不足。', "danger")
+                        return redirect(url_for('cash_management'))
 
                     # 創建單一轉帳記錄
-                    try:
-                        transfer_entry = LedgerEntry(
-                            entry_type="TRANSFER",
-                            account_id=None,  # 轉帳記錄不需要單一帳戶ID
-                            amount=amount,
-                            description=f"從 {from_account.name} 轉入至 {to_account.name}",
-                            operator_id=get_safe_operator_id(),
-                            from_account_id=from_account.id,
-                            to_account_id=to_account.id,
-                        )
-                        db.session.add(transfer_entry)
-                    except Exception as e:
-                        if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                            print("警告: 轉帳操作創建LedgerEntry時缺少欄位，嘗試修復...")
-                            db.session.rollback()
-                            
-                            # 嘗試添加缺失的欄位
-                            try:
-                                db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                                db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                                db.session.commit()
-                                print("[OK] 轉帳操作欄位修復完成，重新創建記錄...")
-                                
-                                # 重新創建記錄
-                                transfer_entry = LedgerEntry(
-                                    entry_type="TRANSFER",
-                                    account_id=None,  # 轉帳記錄不需要單一帳戶ID
-                                    amount=amount,
-                                    description=f"從 {from_account.name} 轉入至 {to_account.name}",
-                                    operator_id=get_safe_operator_id(),
-                                    from_account_id=from_account.id,
-                                    to_account_id=to_account.id,
-                                )
-                                db.session.add(transfer_entry)
-                            except Exception as fix_error:
-                                print(f"[ERROR] 轉帳操作修復欄位失敗: {fix_error}")
-                                raise fix_error
-                        else:
-                            raise e
+                    transfer_entry = LedgerEntry(
+                        entry_type="TRANSFER",
+                        account_id=None,  # 轉帳記錄不需要單一帳戶ID
+                        amount=amount,
+                        description=f"從 {from_account.name} 轉入至 {to_account.name}",
+                        operator_id=get_safe_operator_id(),
+                        from_account_id=from_account.id,
+                        to_account_id=to_account.id,
+                    )
+                    db.session.add(transfer_entry)
 
                     db.session.commit()
                     flash(
@@ -6474,10 +7434,7 @@ def admin_update_cash_account():
 
     except Exception as e:
         db.session.rollback()
-        print(f"!! 現金帳戶更新失敗: {e}")
-        import traceback
-
-        traceback.print_exc()
+        cash_logger.exception("!! 現金帳戶更新失敗: %s", e)
         flash("操作失敗，發生未知錯誤或輸入格式不正確。", "danger")
 
     return redirect(url_for("cash_management"))
@@ -6591,8 +7548,7 @@ def record_purchase_api():
                 final_channel_id = new_channel_obj.id
 
         # --- 核心操作 ---
-        payment_account.balance -= twd_cost
-        deposit_account.balance += rmb_amount
+        BalanceService.apply_deltas({payment_account.id: -twd_cost, deposit_account.id: rmb_amount})
 
         new_purchase = PurchaseRecord(
             payment_account_id=payment_account.id,
@@ -6613,12 +7569,12 @@ def record_purchase_api():
             {"status": "success", "message": "交易成功！資金與庫存皆已更新。"}
         )
 
+    except InsufficientBalanceError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         db.session.rollback()
-        print(f"!! 買入 API 發生錯誤: {e}")
-        import traceback
-
-        traceback.print_exc()
+        fifo_logger.exception("!! 買入 API 發生錯誤: %s", e)
         return (
             jsonify({"status": "error", "message": "資料庫儲存失敗，請聯繫管理員。"}),
             500,
@@ -6710,7 +7666,7 @@ def record_sale_cost(sale_rmb_amount):
 def get_frequent_customers():
     """獲取常用客戶列表"""
     try:
-        print(f"API調用: get_frequent_customers by user {current_user.username}")
+        logger.debug("API調用: get_frequent_customers by user %s", current_user.username)
         
         # 先檢查Customer表
         frequent_customers = (
@@ -6721,9 +7677,9 @@ def get_frequent_customers():
             .all()
         )
         
-        print(f"Customer表中找到 {len(frequent_customers)} 個客戶:")
+        logger.debug("Customer表中找到 %s 個客戶:", len(frequent_customers))
         for customer in frequent_customers:
-            print(f"  - {customer.name} (ID: {customer.id})")
+            logger.debug("  - %s (ID: %s)", customer.name, customer.id)
         
 
         
@@ -6755,79 +7711,40 @@ def get_frequent_customers():
 @app.route("/api/total-profit", methods=["GET"])
 @login_required
 def api_total_profit():
-    """計算系統總利潤的API，使用FIFO計算邏輯確保準確性"""
+    """系統總利潤API：直接讀取利潤流水最新一筆的 profit_after（O(1)）
+
+    加上 ?breakdown=1 時，另以彙總查詢附上總收入、總成本與利潤提款。
+    完整 FIFO 重算請使用 `flask reconcile-profit-ledger` 對帳。
+    """
     try:
-        # 使用FIFO計算邏輯，確保與實際銷售和成本數據一致
-        
-        # 獲取所有銷售記錄
-        all_sales = (
-            db.session.execute(
-                db.select(SalesRecord)
-                .order_by(SalesRecord.created_at.desc())
-            )
-            .scalars()
-            .all()
-        )
-        
-        if len(all_sales) == 0:
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'total_profit_twd': 0.0,
-                    'message': '系統中沒有銷售記錄，無法計算利潤'
-                }
-            })
-        
-        # 使用FIFO計算每筆銷售的利潤
-        total_profit_twd = 0.0
-        total_revenue_twd = 0.0
-        total_cost_twd = 0.0
-        
-        for sale in all_sales:
-            profit_info = FIFOService.calculate_profit_for_sale(sale)
-            
-            if profit_info:
-                sale_profit = profit_info.get('profit_twd', 0.0)
-                sale_cost = profit_info.get('total_cost_twd', 0.0)
-                
-                total_profit_twd += sale_profit
-                total_cost_twd += sale_cost
-                total_revenue_twd += sale.twd_amount
-        
-        # 扣除利潤提款記錄
-        try:
-            profit_withdrawals = (
-                db.session.execute(
-                    db.select(LedgerEntry)
-                    .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                )
-                .scalars()
-                .all()
-            )
-            total_profit_withdrawals = sum(abs(entry.amount) for entry in profit_withdrawals)  # 提款記錄的amount是負數
-            total_profit_twd -= total_profit_withdrawals
-            print(f"DEBUG: 利潤提款總計: {total_profit_withdrawals:.2f}")
-        except Exception as e:
-            print(f"DEBUG: 查詢利潤提款記錄失敗: {e}")
-            total_profit_withdrawals = 0.0
-        
-        print(f"DEBUG: 最終利潤計算 - 銷售利潤: {total_profit_twd + total_profit_withdrawals:.2f}, 利潤提款: {total_profit_withdrawals:.2f}, 最終利潤: {total_profit_twd:.2f}")
+        total_profit_twd = ProfitService.get_total_profit()
+        data = {
+            'total_profit_twd': round(total_profit_twd, 2),
+            'message': f'系統總利潤：{total_profit_twd:.2f} TWD',
+        }
         
-        return jsonify({
-            'status': 'success',
-            'data': {
-                'total_profit_twd': round(total_profit_twd, 2),
+        if request.args.get("breakdown", type=int):
+            total_revenue_twd = db.session.execute(
+                db.select(func.coalesce(func.sum(SalesRecord.twd_amount), 0.0))
+            ).scalar()
+            total_cost_twd = db.session.execute(
+                db.select(func.coalesce(func.sum(FIFOSalesAllocation.allocated_cost_twd), 0.0))
+            ).scalar()
+            total_profit_withdrawals = db.session.execute(
+                db.select(func.coalesce(func.sum(func.abs(LedgerEntry.amount)), 0.0))
+                .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
+            ).scalar()
+            data.update({
                 'total_revenue_twd': round(total_revenue_twd, 2),
                 'total_cost_twd': round(total_cost_twd, 2),
                 'total_profit_withdrawals': round(total_profit_withdrawals, 2),
                 'message': f'系統總利潤：{total_profit_twd:.2f} TWD（收入：{total_revenue_twd:.2f} TWD，成本：{total_cost_twd:.2f} TWD，提款：{total_profit_withdrawals:.2f} TWD）'
-            }
-        })
+            })
+        
+        return jsonify({'status': 'success', 'data': data})
         
     except Exception as e:
-        print(f"計算總利潤失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        profit_logger.exception("計算總利潤失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'計算總利潤時發生錯誤: {str(e)}'
@@ -6884,151 +7801,22 @@ def api_profit_withdraw():
         if amount <= 0:
             return jsonify({"status": "error", "message": "無效的提款金額"}), 400
         
-        # 計算當前總利潤（與總利潤API保持一致的邏輯）
-        total_profit = 0.0
-        all_sales = db.session.execute(db.select(SalesRecord)).scalars().all()
-        
-        for sale in all_sales:
-            profit_info = FIFOService.calculate_profit_for_sale(sale)
-            if profit_info:
-                total_profit += profit_info.get('profit_twd', 0.0)
-        
-        # 扣除之前的利潤提款
-        try:
-            previous_withdrawals = db.session.execute(
-                db.select(LedgerEntry)
-                .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-            ).scalars().all()
-        except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 利潤提款API查詢 PROFIT_WITHDRAW 記錄時缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 利潤提款API添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤提款API profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 利潤提款API添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤提款API profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 利潤提款API添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤提款API profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 利潤提款API添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤提款API from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 利潤提款API添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤提款API to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 利潤提款API欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    previous_withdrawals = db.session.execute(
-                        db.select(LedgerEntry)
-                        .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 修復欄位失敗: {fix_error}")
-                    db.session.rollback()
-                    previous_withdrawals = []
-            else:
-                db.session.rollback()
-                raise e
-        
-        total_withdrawals = sum(entry.amount for entry in previous_withdrawals)
-        current_profit = total_profit - total_withdrawals
-        
-        print(f"DEBUG: 利潤提款檢查 - 總銷售利潤: {total_profit:.2f}, 已提款: {total_withdrawals:.2f}, 可用利潤: {current_profit:.2f}, 提款金額: {amount:.2f}")
-        
-        if current_profit < amount:
-            print(f"DEBUG: 提款失敗 - 餘額不足: 可用 {current_profit:.2f} < 提款 {amount:.2f}")
-            return jsonify({"status": "error", "message": f"利潤餘額不足，當前可用利潤: NT$ {current_profit:.2f}"}), 400
-        
-        # 創建利潤提款記錄
-        try:
-            entry = LedgerEntry(
-                entry_type="PROFIT_WITHDRAW",
-                amount=-amount,  # 負數表示扣除
-                description=f"{description} - {note}" if note else description,
-                                    operator_id=get_safe_operator_id(),
-                profit_before=current_profit,
-                profit_after=current_profit - amount,
-                profit_change=-amount
-            )
-            db.session.add(entry)
-            db.session.commit()
-        except Exception as e:
-            if "from_account_id does not exist" in str(e) or "to_account_id does not exist" in str(e):
-                print("警告: 利潤提款創建LedgerEntry時缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                    db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                    db.session.commit()
-                    print("[OK] 利潤提款欄位修復完成，重新創建記錄...")
-                    
-                    # 重新創建記錄
-                    entry = LedgerEntry(
-                        entry_type="PROFIT_WITHDRAW",
-                        amount=-amount,  # 負數表示扣除
-                        description=f"{description} - {note}" if note else description,
-                                    operator_id=get_safe_operator_id(),
-                        profit_before=current_profit,
-                        profit_after=current_profit - amount,
-                        profit_change=-amount
-                    )
-                    db.session.add(entry)
-                    db.session.commit()
-                except Exception as fix_error:
-                    print(f"[ERROR] 利潤提款修復欄位失敗: {fix_error}")
-                    raise fix_error
-            else:
-                raise e
+        result = ProfitService.withdraw_total_profit(
+            amount,
+            f"{description} - {note}" if note else description,
+            operator_id=get_safe_operator_id(),
+        )
+        if not result["success"]:
+            return jsonify({"status": "error", "message": result["message"]}), 400
         
         return jsonify({
             "status": "success", 
-            "message": f"利潤提款成功: NT$ {amount:.2f}",
+            "message": result["message"],
             "data": {
                 "amount": amount,
-                "profit_before": current_profit,
-                "profit_after": current_profit - amount,
-                "transaction_id": entry.id
+                "profit_before": result["profit_before"],
+                "profit_after": result["profit_after"],
+                "transaction_id": result["transaction_id"]
             }
         })
             
@@ -7068,326 +7856,204 @@ def api_profit_adjust():
         return jsonify({"status": "error", "message": f"調整利潤失敗: {str(e)}"}), 500
 
 
+def _estimate_row_count(count_filter_query):
+    """估算查詢結果筆數：PostgreSQL 讀取 EXPLAIN 的預估列數，其他資料庫直接計數"""
+    if db.engine.dialect.name == "postgresql":
+        compiled = count_filter_query.compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+        plan = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        if isinstance(plan, str):
+            import json
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return db.session.execute(
+        db.select(func.count()).select_from(count_filter_query.subquery())
+    ).scalar()
+
+
+def _profit_history_page_query(position, limit):
+    """利潤歷史一頁的查詢：position 為 (entry_date, id) 游標，None 時從最新一筆開始
+
+    以列值比較 (entry_date, id) < (:d, :id) 表示游標，配合部分索引 ix_ledger_entries_profit_history，
+    每頁都是同一個索引上的一次反向範圍讀取，不需要額外排序。
+    """
+    query = db.select(LedgerEntry).filter(ProfitService.history_filter())
+    if position:
+        query = query.filter(db.tuple_(LedgerEntry.entry_date, LedgerEntry.id) < tuple(position))
+    return query.order_by(LedgerEntry.entry_date.desc(), LedgerEntry.id.desc()).limit(limit)
+
+
+def _parse_profit_history_cursor(cursor):
+    """解析利潤歷史游標（格式：<entry_date ISO>|<id>），無效時回傳 None"""
+    try:
+        entry_date_text, entry_id_text = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(entry_date_text), int(entry_id_text)
+    except (AttributeError, ValueError):
+        return None
+
+
 @app.route("/api/profit/history", methods=["GET"])
 @login_required
 def api_profit_history():
-    """API: 獲取利潤變動歷史 - 從LedgerEntry中獲取利潤提款記錄"""
+    """API: 獲取利潤變動歷史 - 以游標分頁讀取系統利潤流水
+
+    參數：
+      per_page  每頁筆數（最多 100）
+      cursor    上一頁回傳的 next_cursor；省略時從最新一筆開始
+      count     "approx" 回傳預估總筆數，"exact" 回傳精確總筆數，省略則不計數
+    利潤記錄只依 entry_type 分類（舊資料已由遷移回填），
+    每頁是部分索引 ix_ledger_entries_profit_history (entry_date, id) 上的一次範圍讀取，成本與頁碼、資料量無關。
+    """
     try:
-        page = request.args.get("page", 1, type=int)
-        per_page = request.args.get("per_page", 10, type=int)  # 每頁10筆
-        limit = per_page
-        
-        # 查詢所有利潤相關記錄（包含利潤提款和利潤扣除）
-        try:
-            # 先查詢總數
-            total_query = (
-                db.select(db.func.count(LedgerEntry.id))
-                .filter(
-                    (LedgerEntry.entry_type == "PROFIT_WITHDRAW") |
-                    (LedgerEntry.entry_type == "PROFIT_DEDUCT") |
-                    (LedgerEntry.entry_type == "PROFIT_EARNED") |
-                    (LedgerEntry.description.like("%利潤提款%")) |
-                    (LedgerEntry.description.like("%利潤扣除%")) |
-                    (LedgerEntry.description.like("%售出利潤%"))
-                )
-            )
-            total_count = db.session.execute(total_query).scalar()
-            
-            # 計算分頁
-            total_pages = (total_count + per_page - 1) // per_page
-            offset = (page - 1) * per_page
-            
-            # 查詢分頁數據
-            profit_entries = (
-                db.session.execute(
-                    db.select(LedgerEntry)
-                    .filter(
-                        (LedgerEntry.entry_type == "PROFIT_WITHDRAW") |
-                        (LedgerEntry.entry_type == "PROFIT_DEDUCT") |
-                        (LedgerEntry.entry_type == "PROFIT_EARNED") |
-                        (LedgerEntry.description.like("%利潤提款%")) |
-                        (LedgerEntry.description.like("%利潤扣除%")) |
-                        (LedgerEntry.description.like("%售出利潤%"))
-                    )
-                    .order_by(LedgerEntry.entry_date.desc())
-                    .offset(offset)
-                    .limit(per_page)
-                )
-                .scalars()
-                .all()
-            )
-            
-            print(f"DEBUG: api_profit_history 查詢到 {len(profit_entries)} 筆記錄")
-            for entry in profit_entries:
-                print(f"DEBUG: 記錄 - 類型: {entry.entry_type}, 金額: {entry.amount}, 描述: {entry.description}")
-                print(f"DEBUG: 利潤欄位 - profit_before: {getattr(entry, 'profit_before', 'None')}, profit_after: {getattr(entry, 'profit_after', 'None')}, profit_change: {getattr(entry, 'profit_change', 'None')}")
-        except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 利潤歷史API查詢 PROFIT_WITHDRAW 記錄時缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 利潤歷史API添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤歷史API profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 利潤歷史API添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤歷史API profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 利潤歷史API添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤歷史API profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 利潤歷史API添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤歷史API from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 利潤歷史API添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 利潤歷史API to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 利潤歷史API欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    profit_entries = (
-                        db.session.execute(
-                            db.select(LedgerEntry)
-                            .filter(
-                                (LedgerEntry.entry_type == "PROFIT_WITHDRAW") |
-                                (LedgerEntry.entry_type == "PROFIT_DEDUCT") |
-                                (LedgerEntry.entry_type == "PROFIT_EARNED") |
-                                (LedgerEntry.description.like("%利潤提款%")) |
-                                (LedgerEntry.description.like("%利潤扣除%")) |
-                                (LedgerEntry.description.like("%售出利潤%"))
-                            )
-                            .order_by(LedgerEntry.entry_date.desc())
-                            .offset(offset)
-                            .limit(per_page)
-                        )
-                        .scalars()
-                        .all()
-                    )
-                except Exception as fix_error:
-                    print(f"[ERROR] 修復欄位失敗: {fix_error}")
-                    profit_entries = []
-            else:
-                db.session.rollback()
-                raise e
-        
-        # 構建返回數據
-        transactions = []
-        print(f"DEBUG: 找到 {len(profit_entries)} 筆利潤記錄")
-        
-        # 計算當前總利潤（用於餘額計算）
-        try:
-            # 使用FIFO計算當前總利潤
-            all_sales = (
-                db.session.execute(
-                    db.select(SalesRecord)
-                )
-                .scalars()
-                .all()
-            )
-            
-            fifo_total_profit = 0.0
-            for sale in all_sales:
-                profit_info = FIFOService.calculate_profit_for_sale(sale)
-                if profit_info:
-                    fifo_total_profit += profit_info.get('profit_twd', 0.0)
-            
-            # 扣除利潤提款
-            profit_withdraw_entries = (
-                db.session.execute(
-                    db.select(LedgerEntry)
-                    .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-                )
-                .scalars()
-                .all()
-            )
-            total_profit_withdrawals = sum(abs(entry.amount) for entry in profit_withdraw_entries)
-            
-            current_total_profit = fifo_total_profit - total_profit_withdrawals
-            print(f"DEBUG: 當前總利潤 (FIFO計算): {current_total_profit:.2f}")
-        except Exception as e:
-            print(f"DEBUG: 計算當前總利潤失敗: {e}")
-            current_total_profit = 0.0
+        per_page = min(max(request.args.get("per_page", 10, type=int), 1), 100)
+        cursor = request.args.get("cursor")
+        count_mode = request.args.get("count")
         
-        # 獲取所有利潤記錄並按時間正序排列，用於正確計算累積餘額
-        all_profit_entries_ordered = (
-            db.session.execute(
-                db.select(LedgerEntry)
-                .filter(
-                    (LedgerEntry.entry_type == "PROFIT_WITHDRAW") |
-                    (LedgerEntry.entry_type == "PROFIT_DEDUCT") |
-                    (LedgerEntry.entry_type == "PROFIT_EARNED") |
-                    (LedgerEntry.description.like("%利潤提款%")) |
-                    (LedgerEntry.description.like("%利潤扣除%")) |
-                    (LedgerEntry.description.like("%售出利潤%"))
-                )
-                .order_by(LedgerEntry.entry_date.asc())  # 按時間正序
-            )
-            .scalars()
-            .all()
-        )
-        
-        # 計算每筆記錄的正確餘額（按時間順序累積）
-        entry_balances = {}  # 用字典存儲每筆記錄的餘額
+        # 游標以 (entry_date, id) 定位，沒有日期的流水無法排入游標順序
+        # （遷移 backfill_ledger_entry_date 已補上舊資料的日期，新資料由欄位預設值保證）
+        base_query = db.select(LedgerEntry.id).filter(ProfitService.history_filter())
         
-        # 先計算當前總利潤作為基準
-        fifo_total_profit = 0.0
-        for sale in all_sales:
-            profit_info = FIFOService.calculate_profit_for_sale(sale)
-            if profit_info:
-                fifo_total_profit += profit_info.get('profit_twd', 0.0)
+        position = _parse_profit_history_cursor(cursor) if cursor else None
+        if cursor and position is None:
+            return jsonify({"status": "error", "message": "無效的分頁游標"}), 400
         
-        # 扣除利潤提款
-        profit_withdraw_entries = (
+        profit_entries = (
             db.session.execute(
-                db.select(LedgerEntry)
-                .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
+                _profit_history_page_query(position, per_page + 1)
+                .options(db.selectinload(LedgerEntry.operator))
             )
             .scalars()
             .all()
         )
-        total_profit_withdrawals = sum(abs(entry.amount) for entry in profit_withdraw_entries)
-        current_total_profit = fifo_total_profit - total_profit_withdrawals
-        
-        # 從當前總利潤開始，逆向計算每筆記錄的餘額
-        running_balance = current_total_profit
-        
-        # 按時間倒序處理記錄，從最新到最舊
-        for entry in reversed(all_profit_entries_ordered):
-            # 判斷是否為提款或扣除
-            is_withdrawal = (
-                entry.entry_type == "PROFIT_WITHDRAW" or
-                entry.entry_type == "PROFIT_DEDUCT" or
-                "利潤提款" in (entry.description or "") or
-                "利潤扣除" in (entry.description or "")
-            )
-            
-            # 計算變動前餘額（逆向計算）
-            if is_withdrawal:
-                # 提款記錄：變動前餘額 = 當前餘額 + 提款金額
-                balance_before = running_balance + abs(entry.amount)
-                balance_after = running_balance
-            else:
-                # 利潤入庫：變動前餘額 = 當前餘額 - 利潤金額
-                balance_before = running_balance - abs(entry.amount)
-                balance_after = running_balance
-            
-            # 更新運行餘額（逆向）
-            running_balance = balance_before
-            
-            # 存儲這筆記錄的餘額信息
-            entry_balances[entry.id] = {
-                'balance_before': balance_before,
-                'balance_after': balance_after
-            }
-            
-            # 同時更新資料庫中的profit_before和profit_after欄位
-            if hasattr(entry, 'profit_before'):
-                entry.profit_before = balance_before
-                entry.profit_after = balance_after
-                entry.profit_change = balance_after - balance_before
+        has_next = len(profit_entries) > per_page
+        profit_entries = profit_entries[:per_page]
         
-        # 提交餘額更新
-        try:
-            db.session.commit()
-            print(f"DEBUG: 已更新所有利潤記錄的餘額欄位")
-        except Exception as commit_error:
-            print(f"WARNING: 更新餘額欄位失敗: {commit_error}")
-            db.session.rollback()
-        
-        # 構建返回數據（使用計算好的餘額）
+        transactions = []
         for entry in profit_entries:
-            print(f"DEBUG: 處理記錄 - 類型: {entry.entry_type}, 描述: {entry.description}, 金額: {entry.amount}")
-            
-            # 判斷是否為提款或扣除（應該顯示為負數）
-            is_withdrawal = (
-                entry.entry_type == "PROFIT_WITHDRAW" or
-                entry.entry_type == "PROFIT_DEDUCT" or
-                "利潤提款" in (entry.description or "") or
-                "利潤扣除" in (entry.description or "")
-            )
-            
-            # 根據記錄類型確定金額正負
-            if is_withdrawal:
-                display_amount = -abs(entry.amount)  # 提款和扣除顯示為負數
+            # 提款與扣除顯示為負數，其餘依流水記錄的變動金額
+            if entry.profit_change is not None:
+                display_amount = entry.profit_change
+            elif entry.entry_type in ("PROFIT_WITHDRAW", "PROFIT_DEDUCT"):
+                display_amount = -abs(entry.amount)
             else:
-                display_amount = abs(entry.amount)  # 利潤入庫顯示為正數
-            
-            print(f"DEBUG: 記錄處理結果 - 是否提款: {is_withdrawal}, 顯示金額: {display_amount}")
-            
-            # 從字典中獲取正確的餘額
-            balance_info = entry_balances.get(entry.id, {})
-            balance_before = balance_info.get('balance_before', 0.0)
-            balance_after = balance_info.get('balance_after', 0.0)
+                display_amount = entry.amount
             
             transactions.append({
                 "id": entry.id,
                 "transaction_type": entry.entry_type or "利潤變動",
-                "amount": display_amount,  # 根據類型調整正負
-                "balance_before": balance_before,
-                "balance_after": balance_after,
+                "amount": display_amount,
+                "balance_before": entry.profit_before,
+                "balance_after": entry.profit_after,
                 "description": entry.description,
                 "note": getattr(entry, 'note', None),
                 "operator_name": entry.operator.username if entry.operator else "未知",
-                "created_at": entry.entry_date.isoformat()
+                "created_at": entry.entry_date.isoformat() if entry.entry_date else None
             })
         
+        next_cursor = None
+        if has_next and profit_entries:
+            last_entry = profit_entries[-1]
+            next_cursor = f"{last_entry.entry_date.isoformat()}|{last_entry.id}"
+        
+        pagination = {
+            "per_page": per_page,
+            "has_next": has_next,
+            "next_cursor": next_cursor,
+        }
+        if count_mode == "exact":
+            pagination["total_count"] = db.session.execute(
+                db.select(func.count()).select_from(base_query.subquery())
+            ).scalar()
+        elif count_mode == "approx":
+            pagination["approx_total_count"] = _estimate_row_count(base_query)
+        
         return jsonify({
             "status": "success", 
             "data": {
                 "success": True,
                 "transactions": transactions,
-                "pagination": {
-                    "current_page": page,
-                    "per_page": per_page,
-                    "total_count": total_count,
-                    "total_pages": total_pages,
-                    "has_next": page < total_pages,
-                    "has_prev": page > 1
-                }
+                "pagination": pagination
             }
         })
             
     except Exception as e:
-        print(f"獲取利潤歷史失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        profit_logger.exception("獲取利潤歷史失敗: %s", e)
         return jsonify({"status": "error", "message": f"獲取利潤歷史失敗: {str(e)}"}), 500
 
 
+@app.route("/api/profit/timeseries", methods=["GET"])
+@login_required
+def api_profit_timeseries():
+    """API: 利潤時間序列 - 依日 / 週 / 月彙總 FIFO 利潤
+
+    參數：
+      granularity  day / week / month（預設 day）
+      start, end   YYYY-MM-DD；省略 start 時回傳最近 30 天 / 12 週 / 12 個月
+      group_by     customer 或 account，額外回傳每個期間的明細
+    """
+    try:
+        granularity = request.args.get("granularity", "day")
+        group_by = request.args.get("group_by") or None
+        start = request.args.get("start")
+        end = request.args.get("end")
+        try:
+            start = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+            end = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+        except ValueError:
+            return jsonify({"status": "error", "message": "日期格式錯誤，請使用 YYYY-MM-DD"}), 400
+
+        try:
+            report = ProfitTimeSeriesService.get_series(granularity, start, end, group_by)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        return jsonify({"status": "success", **report})
+
+    except Exception as e:
+        profit_logger.exception("獲取利潤時間序列失敗: %s", e)
+        return jsonify({"status": "error", "message": f"獲取利潤時間序列失敗: {str(e)}"}), 500
+
+
+@app.route("/api/profit/cube", methods=["GET"])
+@login_required
+def api_profit_cube():
+    """API: 利潤分析立方體 - 依客戶 / 渠道 / 出貨帳戶 / 日期切片
+
+    參數：
+      dims         以逗號分隔的維度：day, month, customer, channel, account（預設 channel）
+      start, end   YYYY-MM-DD，含起訖日
+      customer_id, channel_id, account_id  篩選條件
+      limit        最多回傳筆數（預設 500，最多 5000），依利潤由高至低排序
+    """
+    try:
+        dims = [d.strip() for d in request.args.get("dims", "channel").split(",") if d.strip()]
+        limit = min(max(request.args.get("limit", 500, type=int), 1), 5000)
+        filters = {}
+        for field in ("customer_id", "channel_id", "account_id"):
+            value = request.args.get(field, type=int)
+            if value is not None:
+                filters[field] = value
+        try:
+            start = request.args.get("start")
+            end = request.args.get("end")
+            start = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+            end = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+        except ValueError:
+            return jsonify({"status": "error", "message": "日期格式錯誤，請使用 YYYY-MM-DD"}), 400
+
+        try:
+            rows = ProfitCubeService.query(dims, start, end, filters, limit)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        return jsonify({"status": "success", "dimensions": dims, "rows": rows})
+
+    except Exception as e:
+        profit_logger.exception("查詢利潤分析立方體失敗: %s", e)
+        return jsonify({"status": "error", "message": f"查詢利潤分析立方體失敗: {str(e)}"}), 500
+
+
 @app.route("/api/calculate_profit", methods=["POST"])
 @login_required
 def api_calculate_profit():
@@ -7431,9 +8097,7 @@ def api_calculate_profit():
     except (ValueError, TypeError):
         return jsonify({"status": "error", "message": "輸入的資料格式不正確。"}), 400
     except Exception as e:
-        print(f"!! Error in api_calculate_profit: {e}")
-        import traceback
-        traceback.print_exc()
+        fifo_logger.exception("!! Error in api_calculate_profit: %s", e)
         return jsonify({"status": "error", "message": "伺服器內部錯誤，計算失敗。"}), 500
 
 
@@ -7456,7 +8120,7 @@ def api_clear_all_data():
         return jsonify({"status": "error", "message": "確認碼錯誤，操作已取消。"}), 400
     
     try:
-        print(f"管理員 {current_user.username} 開始執行數據清空操作...")
+        logger.info("管理員 %s 開始執行數據清空操作...", current_user.username)
         
         # 關鍵修復：按照外鍵依賴關係的正確順序清空數據
         
@@ -7465,81 +8129,82 @@ def api_clear_all_data():
         try:
             transactions_count = db.session.execute(db.select(func.count()).select_from(db.text('transactions'))).scalar()
             db.session.execute(db.text('DELETE FROM transactions'))
-            print(f"已清空 {transactions_count} 筆交易記錄")
+            logger.info("已清空 %s 筆交易記錄", transactions_count)
         except Exception as transactions_error:
-            print(f"Transactions表清空失敗或不存在: {transactions_error}")
+            logger.error("Transactions表清空失敗或不存在: %s", transactions_error)
         
         # 2. 清空 FIFO 銷售分配記錄 (引用 fifo_inventory)
         fifo_sales_allocations_count = 0
         try:
             fifo_sales_allocations_count = db.session.execute(db.select(func.count()).select_from(db.text('fifo_sales_allocations'))).scalar()
             db.session.execute(db.text('DELETE FROM fifo_sales_allocations'))
-            print(f"已清空 {fifo_sales_allocations_count} 筆FIFO銷售分配記錄")
+            logger.info("已清空 %s 筆FIFO銷售分配記錄", fifo_sales_allocations_count)
         except Exception as fifo_sales_error:
-            print(f"FIFO銷售分配表清空失敗或不存在: {fifo_sales_error}")
+            logger.error("FIFO銷售分配表清空失敗或不存在: %s", fifo_sales_error)
         
         # 3. 清空 FIFO 庫存記錄 (引用 purchase_records)
         fifo_count = 0
         try:
             fifo_count = db.session.execute(db.select(func.count()).select_from(db.text('fifo_inventory'))).scalar()
             db.session.execute(db.text('DELETE FROM fifo_inventory'))
-            print(f"已清空 {fifo_count} 筆FIFO庫存記錄")
+            logger.info("已清空 %s 筆FIFO庫存記錄", fifo_count)
         except Exception as fifo_error:
-            print(f"FIFO庫存表清空失敗或不存在: {fifo_error}")
+            logger.error("FIFO庫存表清空失敗或不存在: %s", fifo_error)
         
         # 4. 清空售出訂單 (被 transactions 引用)
         sales_count = db.session.execute(db.select(func.count(SalesRecord.id))).scalar()
         db.session.execute(db.delete(SalesRecord))
-        print(f"已清空 {sales_count} 筆售出訂單")
+        ProfitTimeSeriesService.bump_version()
+        logger.info("已清空 %s 筆售出訂單", sales_count)
         
         # 5. 清空買入訂單 (現在沒有外鍵依賴了)
         purchase_count = db.session.execute(db.select(func.count(PurchaseRecord.id))).scalar()
         db.session.execute(db.delete(PurchaseRecord))
-        print(f"已清空 {purchase_count} 筆買入訂單")
+        logger.info("已清空 %s 筆買入訂單", purchase_count)
         
         # 6. 清空現金流水記錄 (LedgerEntry, CashLog)
         ledger_count = db.session.execute(db.select(func.count(LedgerEntry.id))).scalar()
         db.session.execute(db.delete(LedgerEntry))
-        print(f"已清空 {ledger_count} 筆帳本記錄")
+        logger.info("已清空 %s 筆帳本記錄", ledger_count)
         
         cash_log_count = db.session.execute(db.select(func.count(CashLog.id))).scalar()
         db.session.execute(db.delete(CashLog))
-        print(f"已清空 {cash_log_count} 筆現金日誌")
+        logger.info("已清空 %s 筆現金日誌", cash_log_count)
         
         # 7. 清空刷卡記錄 (如果存在)
         card_purchase_count = 0
         try:
             card_purchase_count = db.session.execute(db.select(func.count(CardPurchase.id))).scalar()
             db.session.execute(db.delete(CardPurchase))
-            print(f"已清空 {card_purchase_count} 筆刷卡記錄")
+            logger.info("已清空 %s 筆刷卡記錄", card_purchase_count)
         except Exception as card_error:
-            print(f"刷卡記錄表清空失敗或不存在: {card_error}")
+            logger.error("刷卡記錄表清空失敗或不存在: %s", card_error)
         
         # 8. 清空所有帳戶金額 (將餘額設為0，但保留帳戶結構)
         accounts = db.session.execute(db.select(CashAccount)).scalars().all()
         account_count = 0
         for account in accounts:
             if account.balance != 0:
-                print(f"  清空帳戶: {account.name} ({account.currency}) 餘額: {account.balance} -> 0")
+                logger.info("  清空帳戶: %s (%s) 餘額: %s -> 0", account.name, account.currency, account.balance)
                 account.balance = 0
                 account_count += 1
-        print(f"已清空 {account_count} 個帳戶的餘額")
+        logger.info("已清空 %s 個帳戶的餘額", account_count)
         
         # 9. 清空應收帳款 (將客戶的應收帳款設為0，但保留客戶記錄)
         customers = db.session.execute(db.select(Customer)).scalars().all()
         receivable_count = 0
         for customer in customers:
             if customer.total_receivables_twd > 0:
-                print(f"  清空客戶應收: {customer.name} 應收款: {customer.total_receivables_twd} -> 0")
+                logger.info("  清空客戶應收: %s 應收款: %s -> 0", customer.name, customer.total_receivables_twd)
                 customer.total_receivables_twd = 0
                 receivable_count += 1
-        print(f"已清空 {receivable_count} 位客戶的應收帳款")
+        logger.info("已清空 %s 位客戶的應收帳款", receivable_count)
         
         # 提交所有更改
         db.session.commit()
         
         total_message = f"數據清空完成！清空了 {purchase_count} 筆買入、{sales_count} 筆售出、{account_count} 個帳戶餘額、{ledger_count} 筆帳本記錄、{cash_log_count} 筆現金日誌、{receivable_count} 位客戶應收帳款、{fifo_count} 筆FIFO庫存、{fifo_sales_allocations_count} 筆FIFO分配、{transactions_count} 筆交易記錄、{card_purchase_count} 筆刷卡記錄。"
-        print(f" {total_message}")
+        logger.info(" %s", total_message)
         
         return jsonify({
             "status": "success", 
@@ -7561,9 +8226,7 @@ def api_clear_all_data():
     except Exception as e:
         db.session.rollback()
         error_msg = f"數據清空失敗: {e}"
-        print(f"{error_msg}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("%s", error_msg)
         return jsonify({"status": "error", "message": error_msg}), 500
 
 
@@ -7585,7 +8248,7 @@ def api_users():
         })
         
     except Exception as e:
-        print(f"獲取用戶列表失敗: {e}")
+        logger.error("獲取用戶列表失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'獲取用戶列表失敗: {e}'
@@ -7622,16 +8285,7 @@ def api_delete_audit_logs():
         query = query.order_by(DeleteAuditLog.deleted_at.desc()).limit(limit)
         
         # 執行查詢
-        try:
-            audit_logs = db.session.execute(query).scalars().all()
-        except Exception as e:
-            if "does not exist" in str(e) and "delete_audit_logs" in str(e):
-                print("警告: delete_audit_logs 表格不存在，返回空結果")
-                db.session.rollback()
-                audit_logs = []
-            else:
-                db.session.rollback()
-                raise e
+        audit_logs = db.session.execute(query).scalars().all()
         
         # 轉換為字典格式
         logs_data = []
@@ -7662,16 +8316,7 @@ def api_delete_audit_logs():
             logs_data.append(log_dict)
         
         # 獲取總數（用於計數）
-        try:
-            total_count = db.session.execute(db.select(func.count(DeleteAuditLog.id))).scalar()
-        except Exception as e:
-            if "does not exist" in str(e) and "delete_audit_logs" in str(e):
-                print("警告: delete_audit_logs 表格不存在，總數設為0")
-                db.session.rollback()
-                total_count = 0
-            else:
-                db.session.rollback()
-                raise e
+        total_count = db.session.execute(db.select(func.count(DeleteAuditLog.id))).scalar()
         
         return jsonify({
             'status': 'success',
@@ -7681,7 +8326,7 @@ def api_delete_audit_logs():
         })
         
     except Exception as e:
-        print(f"獲取刪除記錄審計失敗: {e}")
+        logger.error("獲取刪除記錄審計失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'獲取刪除記錄失敗: {e}'
@@ -7743,7 +8388,7 @@ def api_delete_account():
             # 這裡可以根據實際的資料庫結構添加更多檢查
             
         except Exception as check_error:
-            print(f"檢查外鍵約束時出錯: {check_error}")
+            cash_logger.error("檢查外鍵約束時出錯: %s", check_error)
             # 如果檢查失敗，我們不應該繼續，而是返回錯誤
             return jsonify({
                 "status": "error",
@@ -7763,7 +8408,7 @@ def api_delete_account():
             
         except Exception as delete_error:
             db.session.rollback()
-            print(f"刪除帳戶時出錯: {delete_error}")
+            cash_logger.error("刪除帳戶時出錯: %s", delete_error)
             
             # 檢查是否是外鍵約束錯誤
             if "ForeignKeyViolation" in str(delete_error) or "foreign key constraint" in str(delete_error).lower():
@@ -7782,7 +8427,7 @@ def api_delete_account():
         except:
             pass  # 如果回滾也失敗，我們無能為力
         
-        print(f"刪除帳戶時發生嚴重錯誤: {e}")
+        cash_logger.error("刪除帳戶時發生嚴重錯誤: %s", e)
         return jsonify({"status": "error", "message": "刪除帳戶時發生嚴重錯誤，請稍後重試。"}), 500
 
 
@@ -7790,12 +8435,12 @@ def api_delete_account():
 @login_required
 def api_settlement():
     """處理應收帳款銷帳"""
-    print(f"\n[FIX] 銷帳API開始執行 - 時間: {datetime.utcnow()}")
-    print(f"[FIX] 請求數據: {request.get_json()}")
+    settlement_logger.debug("\n[FIX] 銷帳API開始執行 - 時間: %s", datetime.utcnow())
+    settlement_logger.debug("[FIX] 請求數據: %s", request.get_json())
     
     data = request.get_json()
     if not data:
-        print("[ERROR] 銷帳API: 無效的請求格式")
+        settlement_logger.error("[ERROR] 銷帳API: 無效的請求格式")
         return jsonify({"status": "error", "message": "無效的請求格式。"}), 400
 
     try:
@@ -7805,49 +8450,49 @@ def api_settlement():
         account_id = int(data.get("account_id"))
         note = data.get("note", "")
         
-        print(f"[FIX] 銷帳API參數解析:")
-        print(f"   - 客戶ID: {customer_id} (類型: {type(customer_id)})")
-        print(f"   - 銷帳金額: {amount} (類型: {type(amount)})")
-        print(f"   - 帳戶ID: {account_id} (類型: {type(account_id)})")
-        print(f"   - 備註: '{note}' (類型: {type(note)})")
+        settlement_logger.debug("[FIX] 銷帳API參數解析:")
+        settlement_logger.debug("   - 客戶ID: %s (類型: %s)", customer_id, type(customer_id))
+        settlement_logger.debug("   - 銷帳金額: %s (類型: %s)", amount, type(amount))
+        settlement_logger.debug("   - 帳戶ID: %s (類型: %s)", account_id, type(account_id))
+        settlement_logger.debug("   - 備註: '%s' (類型: %s)", note, type(note))
 
         if not all([customer_id, amount > 0, account_id]):
-            print("[ERROR] 銷帳API: 參數驗證失敗")
+            settlement_logger.error("[ERROR] 銷帳API: 參數驗證失敗")
             return jsonify({"status": "error", "message": "客戶ID、銷帳金額和收款帳戶都必須正確填寫。"}), 400
 
         # 2. 查詢資料庫物件
-        print(f"[FIX] 銷帳API: 查詢資料庫物件...")
+        settlement_logger.debug("[FIX] 銷帳API: 查詢資料庫物件...")
         customer = db.session.get(Customer, customer_id)
         account = db.session.get(CashAccount, account_id)
         
-        print(f"[FIX] 銷帳API: 客戶查詢結果: {customer}")
-        print(f"[FIX] 銷帳API: 帳戶查詢結果: {account}")
+        settlement_logger.debug("[FIX] 銷帳API: 客戶查詢結果: %s", customer)
+        settlement_logger.debug("[FIX] 銷帳API: 帳戶查詢結果: %s", account)
 
         if not customer:
-            print("[ERROR] 銷帳API: 找不到指定的客戶")
+            settlement_logger.error("[ERROR] 銷帳API: 找不到指定的客戶")
             return jsonify({"status": "error", "message": "找不到指定的客戶。"}), 400
         if not account:
-            print(f"[ERROR] 銷帳API: 找不到帳戶 ID {account_id}")
+            settlement_logger.error("[ERROR] 銷帳API: 找不到帳戶 ID %s", account_id)
             return jsonify({"status": "error", "message": f"找不到帳戶 ID {account_id}，該帳戶可能已被刪除。"}), 400
         if not account.is_active:
-            print(f"[ERROR] 銷帳API: 帳戶「{account.name}」已停用")
+            settlement_logger.error("[ERROR] 銷帳API: 帳戶「%s」已停用", account.name)
             return jsonify({"status": "error", "message": f"帳戶「{account.name}」已停用，無法使用。"}), 400
         if account.currency != "TWD":
-            print(f"[ERROR] 銷帳API: 帳戶「{account.name}」幣種錯誤: {account.currency}")
+            settlement_logger.error("[ERROR] 銷帳API: 帳戶「%s」幣種錯誤: %s", account.name, account.currency)
             return jsonify({"status": "error", "message": f"帳戶「{account.name}」的幣種是 {account.currency}，不是台幣帳戶。"}), 400
         if amount > customer.total_receivables_twd:
-            print(f"[ERROR] 銷帳API: 銷帳金額超過應收帳款 - 客戶應收: {customer.total_receivables_twd}, 銷帳: {amount}")
+            settlement_logger.error("[ERROR] 銷帳API: 銷帳金額超過應收帳款 - 客戶應收: %s, 銷帳: %s", customer.total_receivables_twd, amount)
             return jsonify({
                 "status": "error", 
                 "message": f"銷帳金額超過應收帳款！客戶應收 {customer.total_receivables_twd:,.2f}，但銷帳 {amount:,.2f}。"
             }), 400
         
-        print(f"[OK] 銷帳API: 資料驗證通過")
-        print(f"   - 客戶: {customer.name}, 應收帳款: {customer.total_receivables_twd}")
-        print(f"   - 帳戶: {account.name}, 餘額: {account.balance}, 幣種: {account.currency}")
+        settlement_logger.debug("[OK] 銷帳API: 資料驗證通過")
+        settlement_logger.debug("   - 客戶: %s, 應收帳款: %s", customer.name, customer.total_receivables_twd)
+        settlement_logger.debug("   - 帳戶: %s, 餘額: %s, 幣種: %s", account.name, account.balance, account.currency)
 
         # 3. 核心業務邏輯
-        print(f"[FIX] 銷帳API: 開始核心業務邏輯...")
+        settlement_logger.debug("[FIX] 銷帳API: 開始核心業務邏輯...")
         
         # [CRITICAL FIX: 標記 SalesRecord 為已結清]
         # 查詢該客戶所有未結清的銷售記錄，按時間順序（先進先出）
@@ -7858,7 +8503,7 @@ def api_settlement():
             .order_by(SalesRecord.created_at.asc())
         ).scalars().all()
         
-        print(f"[AR_FIX] 銷帳API: 找到 {len(unsettled_sales)} 筆未結清銷售記錄")
+        settlement_logger.debug("[AR_FIX] 銷帳API: 找到 %s 筆未結清銷售記錄", len(unsettled_sales))
         
         # 使用 FIFO 方式標記銷售記錄為已結清
         remaining_amount = amount
@@ -7873,34 +8518,31 @@ def api_settlement():
                 sale.is_settled = True
                 remaining_amount -= sale.twd_amount
                 settled_count += 1
-                print(f"[AR_FIX] 銷帳API: 完全結清訂單 ID {sale.id}, 金額: NT$ {sale.twd_amount:,.2f}")
+                settlement_logger.debug("[AR_FIX] 銷帳API: 完全結清訂單 ID %s, 金額: NT$ %.2f", sale.id, sale.twd_amount)
             else:
                 # 部分結清（這種情況下不標記為已結清，因為還有餘額）
-                print(f"[AR_FIX] 銷帳API: 訂單 ID {sale.id} 部分結清, 剩餘: NT$ {remaining_amount:,.2f}")
+                settlement_logger.debug("[AR_FIX] 銷帳API: 訂單 ID %s 部分結清, 剩餘: NT$ %.2f", sale.id, remaining_amount)
                 # 注意：當前系統不支持部分結清，如果需要支持，需要拆分訂單
                 break
         
-        print(f"[AR_FIX] 銷帳API: 共標記 {settled_count} 筆訂單為已結清")
+        settlement_logger.debug("[AR_FIX] 銷帳API: 共標記 %s 筆訂單為已結清", settled_count)
         
         # 更新客戶應收帳款（在銷帳時直接扣減）
         old_receivables = customer.total_receivables_twd
         customer.total_receivables_twd -= amount
-        print(f"[FIX] 銷帳API: 更新客戶應收帳款 - 原: {old_receivables}, 新: {customer.total_receivables_twd}")
+        settlement_logger.debug("[FIX] 銷帳API: 更新客戶應收帳款 - 原: %s, 新: %s", old_receivables, customer.total_receivables_twd)
         
         # 更新收款帳戶餘額
         old_balance = account.balance
-        account.balance += amount
-        print(f"[FIX] 銷帳API: 更新帳戶餘額 - 原: {old_balance}, 新: {account.balance}")
+        BalanceService.apply_delta(account, amount)
+        settlement_logger.debug("[FIX] 銷帳API: 更新帳戶餘額 - 原: %s, 新: %s", old_balance, account.balance)
         
         # 創建銷帳記錄（LedgerEntry）
-        print(f"[FIX] 銷帳API: 創建LedgerEntry記錄...")
+        settlement_logger.debug("[FIX] 銷帳API: 創建LedgerEntry記錄...")
         
         # 安全獲取操作員ID
         operator_id = get_safe_operator_id()
-        print(f"[FIX] 銷帳API: 操作員ID: {operator_id}")
-        
-        # 確保PostgreSQL欄位存在
-        fix_postgresql_columns()
+        settlement_logger.debug("[FIX] 銷帳API: 操作員ID: %s", operator_id)
         
         # 構建描述：如果有備註，將備註加到描述中（向後兼容）
         if note:
@@ -7916,12 +8558,12 @@ def api_settlement():
             description=description,
             operator_id=operator_id
         )
-        print(f"[FIX] 銷帳API: LedgerEntry物件創建成功: {settlement_entry}")
+        settlement_logger.debug("[FIX] 銷帳API: LedgerEntry物件創建成功: %s", settlement_entry)
         db.session.add(settlement_entry)
-        print(f"[FIX] 銷帳API: LedgerEntry已添加到session")
+        settlement_logger.debug("[FIX] 銷帳API: LedgerEntry已添加到session")
         
         # 創建現金流水記錄（CashLog）- 暫時不設置 account_id
-        print(f"[FIX] 銷帳API: 創建CashLog記錄...")
+        settlement_logger.debug("[FIX] 銷帳API: 創建CashLog記錄...")
         try:
             settlement_cash_log = CashLog(
                 type="SETTLEMENT",
@@ -7930,12 +8572,12 @@ def api_settlement():
                 description=f"客戶「{customer.name}」銷帳收款 - {note}" if note else f"客戶「{customer.name}」銷帳收款",
                 operator_id=operator_id
             )
-            print(f"[FIX] 銷帳API: CashLog物件創建成功: {settlement_cash_log}")
+            settlement_logger.debug("[FIX] 銷帳API: CashLog物件創建成功: %s", settlement_cash_log)
             db.session.add(settlement_cash_log)
-            print(f"[FIX] 銷帳API: CashLog已添加到session")
+            settlement_logger.debug("[FIX] 銷帳API: CashLog已添加到session")
         except Exception as e:
-            print(f"[ERROR] 銷帳API: 創建CashLog時發生錯誤: {e}")
-            print(f"[ERROR] 銷帳API: 錯誤詳情: {traceback.format_exc()}")
+            settlement_logger.error("[ERROR] 銷帳API: 創建CashLog時發生錯誤: %s", e)
+            settlement_logger.error("[ERROR] 銷帳API: 錯誤詳情: %s", traceback.format_exc())
             raise e
         
         # [已移除重複扣減] 客戶應收帳款已在第7739行扣減，此處不需要重複扣減
@@ -7944,34 +8586,192 @@ def api_settlement():
             customer.total_receivables_twd = 0
         
         # 提交事務
-        print(f"[FIX] 銷帳API: 準備提交事務...")
+        settlement_logger.debug("[FIX] 銷帳API: 準備提交事務...")
         db.session.commit()
-        print(f"[OK] 銷帳API: 事務提交成功")
-        print(f"[AR_FIX] 客戶 {customer.name} 應收帳款已更新: -NT$ {amount:,.2f}")
+        settlement_logger.debug("[OK] 銷帳API: 事務提交成功")
+        settlement_logger.debug("[AR_FIX] 客戶 %s 應收帳款已更新: -NT$ %.2f", customer.name, amount)
         
         # 強制刷新對象狀態
-        print(f"[FIX] 銷帳API: 刷新對象狀態...")
+        settlement_logger.debug("[FIX] 銷帳API: 刷新對象狀態...")
         db.session.refresh(customer)
         db.session.refresh(account)
-        print(f"[FIX] 銷帳API: 對象狀態刷新完成")
+        settlement_logger.debug("[FIX] 銷帳API: 對象狀態刷新完成")
+
+        success_message = f"銷帳成功！客戶「{customer.name}」已收款 NT$ {amount:,.2f}，應收帳款餘額：NT$ {customer.total_receivables_twd:,.2f}。"
+        settlement_logger.debug("[OK] 銷帳API: 操作完成 - %s", success_message)
+        
+        return jsonify({
+            "status": "success",
+            "message": success_message
+        })
+
+    except (ValueError, TypeError) as e:
+        settlement_logger.error("[ERROR] 銷帳API: 資料格式錯誤: %s", e)
+        settlement_logger.error("[ERROR] 銷帳API: 錯誤詳情: %s", traceback.format_exc())
+        return jsonify({"status": "error", "message": "輸入的資料格式不正確。"}), 400
+    except Exception as e:
+        db.session.rollback()
+        settlement_logger.error("[ERROR] 銷帳API: 發生未預期錯誤: %s", e)
+        settlement_logger.error("[ERROR] 銷帳API: 錯誤詳情: %s", traceback.format_exc())
+        return jsonify({"status": "error", "message": "伺服器內部錯誤，操作失敗。"}), 500
+
+
+@app.route("/api/settlement/batch", methods=["POST"])
+@login_required
+def api_settlement_batch():
+    """批次銷帳：一次處理多位客戶的收款（單一交易）
+
+    請求格式：{"items": [{"customer_id", "amount", "account_id", "note"}, ...]}
+    客戶、帳戶與未結清售出記錄皆一次預先載入；流水與現金日誌批次寫入，
+    每個帳戶與客戶只更新一次餘額。驗證失敗的項目會在結果中標示並略過，
+    其餘項目在同一交易內提交。
+    """
+    from collections import defaultdict
+
+    data = request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "請提供銷帳項目列表（items）。"}), 400
+
+    # 1. 解析輸入
+    parsed = []
+    results = []
+    for index, item in enumerate(items):
+        try:
+            customer_id = int(item.get("customer_id"))
+            amount = float(item.get("amount"))
+            account_id = int(item.get("account_id"))
+            note = item.get("note", "") or ""
+        except (AttributeError, ValueError, TypeError):
+            results.append({"index": index, "status": "error", "message": "輸入的資料格式不正確。"})
+            continue
+        if not all([customer_id, amount > 0, account_id]):
+            results.append({"index": index, "status": "error", "message": "客戶ID、銷帳金額和收款帳戶都必須正確填寫。"})
+            continue
+        parsed.append((index, customer_id, amount, account_id, note))
+
+    try:
+        # 2. 一次預先載入所有客戶、帳戶與未結清售出記錄
+        customer_ids = {p[1] for p in parsed}
+        account_ids = {p[3] for p in parsed}
+        customers = {
+            c.id: c for c in db.session.execute(
+                db.select(Customer).filter(Customer.id.in_(customer_ids))
+            ).scalars()
+        } if customer_ids else {}
+        accounts = {
+            a.id: a for a in db.session.execute(
+                db.select(CashAccount).filter(CashAccount.id.in_(account_ids))
+            ).scalars()
+        } if account_ids else {}
+        unsettled_sales = defaultdict(list)
+        if customer_ids:
+            sales_rows = db.session.execute(
+                db.select(SalesRecord.id, SalesRecord.customer_id, SalesRecord.twd_amount)
+                .filter(SalesRecord.customer_id.in_(customer_ids))
+                .filter(SalesRecord.is_settled == False)
+                .order_by(SalesRecord.created_at.asc())
+            ).all()
+            for sale_id, sale_customer_id, twd_amount in sales_rows:
+                unsettled_sales[sale_customer_id].append((sale_id, twd_amount))
+
+        # 3. 在記憶體中逐項驗證並套用（同一客戶的多筆項目依序扣減）
+        operator_id = get_safe_operator_id()
+        now = datetime.utcnow()
+        receivables = {cid: c.total_receivables_twd for cid, c in customers.items()}
+        account_deltas = defaultdict(float)
+        settled_sale_ids = []
+        ledger_rows = []
+        cash_log_rows = []
+
+        for index, customer_id, amount, account_id, note in parsed:
+            customer = customers.get(customer_id)
+            account = accounts.get(account_id)
+            error = None
+            if not customer:
+                error = "找不到指定的客戶。"
+            elif not account:
+                error = f"找不到帳戶 ID {account_id}，該帳戶可能已被刪除。"
+            elif not account.is_active:
+                error = f"帳戶「{account.name}」已停用，無法使用。"
+            elif account.currency != "TWD":
+                error = f"帳戶「{account.name}」的幣種是 {account.currency}，不是台幣帳戶。"
+            elif amount > receivables[customer_id]:
+                error = f"銷帳金額超過應收帳款！客戶應收 {receivables[customer_id]:,.2f}，但銷帳 {amount:,.2f}。"
+            if error:
+                results.append({"index": index, "customer_id": customer_id, "status": "error", "message": error})
+                continue
+
+            # 依先進先出標記完整結清的售出記錄（與單筆銷帳相同，不支援部分結清）
+            remaining_amount = amount
+            pending = unsettled_sales[customer_id]
+            settled_count = 0
+            while pending and pending[0][1] <= remaining_amount:
+                sale_id, twd_amount = pending.pop(0)
+                settled_sale_ids.append(sale_id)
+                remaining_amount -= twd_amount
+                settled_count += 1
 
-        success_message = f"銷帳成功！客戶「{customer.name}」已收款 NT$ {amount:,.2f}，應收帳款餘額：NT$ {customer.total_receivables_twd:,.2f}。"
-        print(f"[OK] 銷帳API: 操作完成 - {success_message}")
-        
+            receivables[customer_id] = max(receivables[customer_id] - amount, 0)
+            account_deltas[account_id] += amount
+
+            description = f"客戶「{customer.name}」銷帳收款 - {note}" if note else f"客戶「{customer.name}」銷帳收款"
+            ledger_rows.append({
+                "account_id": account_id,
+                "entry_type": "SETTLEMENT",
+                "amount": amount,
+                "entry_date": now,
+                "description": description,
+                "operator_id": operator_id,
+            })
+            cash_log_rows.append({
+                "type": "SETTLEMENT",
+                "amount": amount,
+                "time": now,
+                "description": description,
+                "operator_id": operator_id,
+            })
+            results.append({
+                "index": index,
+                "customer_id": customer_id,
+                "status": "success",
+                "settled_sales": settled_count,
+                "receivables_after": receivables[customer_id],
+            })
+
+        # 4. 批次寫入：每個帳戶、每位客戶只更新一次
+        if ledger_rows:
+            if settled_sale_ids:
+                db.session.execute(
+                    db.update(SalesRecord)
+                    .where(SalesRecord.id.in_(settled_sale_ids))
+                    .values(is_settled=True)
+                    .execution_options(synchronize_session=False)
+                )
+            for customer_id, new_total in receivables.items():
+                if customers[customer_id].total_receivables_twd != new_total:
+                    customers[customer_id].total_receivables_twd = new_total
+            BalanceService.apply_deltas(account_deltas)
+            db.session.execute(db.insert(LedgerEntry), ledger_rows)
+            db.session.execute(db.insert(CashLog), cash_log_rows)
+            db.session.commit()
+
+        results.sort(key=lambda r: r["index"])
+        succeeded = sum(1 for r in results if r["status"] == "success")
+        settlement_logger.info("[OK] 批次銷帳完成：成功 %s 筆，失敗 %s 筆", succeeded, len(results) - succeeded)
         return jsonify({
-            "status": "success",
-            "message": success_message
-        })
+            "status": "success" if succeeded == len(results) else ("partial" if succeeded else "error"),
+            "message": f"批次銷帳完成：成功 {succeeded} 筆，失敗 {len(results) - succeeded} 筆。",
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results,
+        }), (200 if succeeded else 400)
 
-    except (ValueError, TypeError) as e:
-        print(f"[ERROR] 銷帳API: 資料格式錯誤: {e}")
-        print(f"[ERROR] 銷帳API: 錯誤詳情: {traceback.format_exc()}")
-        return jsonify({"status": "error", "message": "輸入的資料格式不正確。"}), 400
     except Exception as e:
         db.session.rollback()
-        print(f"[ERROR] 銷帳API: 發生未預期錯誤: {e}")
-        print(f"[ERROR] 銷帳API: 錯誤詳情: {traceback.format_exc()}")
-        return jsonify({"status": "error", "message": "伺服器內部錯誤，操作失敗。"}), 500
+        settlement_logger.error("[ERROR] 批次銷帳API: 發生未預期錯誤: %s", e)
+        settlement_logger.error("[ERROR] 批次銷帳API: 錯誤詳情: %s", traceback.format_exc())
+        return jsonify({"status": "error", "message": "伺服器內部錯誤，批次銷帳未執行。"}), 500
 
 
 @app.route("/api/settlement/rollback/<int:ledger_entry_id>", methods=["POST"])
@@ -7980,18 +8780,18 @@ def api_rollback_settlement(ledger_entry_id):
     """回滾銷帳記錄（防呆措施）"""
     from datetime import timedelta
     
-    print(f"\n[ROLLBACK] 銷帳回滾API開始執行 - LedgerEntry ID: {ledger_entry_id}")
+    settlement_logger.debug("\n[ROLLBACK] 銷帳回滾API開始執行 - LedgerEntry ID: %s", ledger_entry_id)
     
     try:
         # 1. 查找銷帳記錄
         settlement_entry = db.session.get(LedgerEntry, ledger_entry_id)
         
         if not settlement_entry:
-            print(f"[ERROR] 銷帳回滾API: 找不到 LedgerEntry ID {ledger_entry_id}")
+            settlement_logger.error("[ERROR] 銷帳回滾API: 找不到 LedgerEntry ID %s", ledger_entry_id)
             return jsonify({"status": "error", "message": "找不到指定的銷帳記錄。"}), 404
         
         if settlement_entry.entry_type != "SETTLEMENT":
-            print(f"[ERROR] 銷帳回滾API: LedgerEntry ID {ledger_entry_id} 不是銷帳記錄（類型: {settlement_entry.entry_type}）")
+            settlement_logger.error("[ERROR] 銷帳回滾API: LedgerEntry ID %s 不是銷帳記錄（類型: %s）", ledger_entry_id, settlement_entry.entry_type)
             return jsonify({"status": "error", "message": "該記錄不是銷帳記錄，無法回滾。"}), 400
         
         # 2. 獲取相關數據
@@ -8011,7 +8811,7 @@ def api_rollback_settlement(ledger_entry_id):
                 pass
         
         if not customer_name:
-            print(f"[ERROR] 銷帳回滾API: 無法從描述提取客戶名稱: {description}")
+            settlement_logger.error("[ERROR] 銷帳回滾API: 無法從描述提取客戶名稱: %s", description)
             return jsonify({"status": "error", "message": "無法從銷帳記錄中提取客戶信息，無法執行回滾。"}), 400
         
         # 查找客戶
@@ -8020,42 +8820,42 @@ def api_rollback_settlement(ledger_entry_id):
         ).scalar_one_or_none()
         
         if not customer:
-            print(f"[ERROR] 銷帳回滾API: 找不到客戶（名稱: {customer_name}）")
+            settlement_logger.error("[ERROR] 銷帳回滾API: 找不到客戶（名稱: %s）", customer_name)
             return jsonify({"status": "error", "message": f"找不到客戶「{customer_name}」，無法執行回滾。"}), 400
         
         account = db.session.get(CashAccount, account_id) if account_id else None
         
         if not account:
-            print(f"[ERROR] 銷帳回滾API: 找不到帳戶 ID {account_id}")
+            settlement_logger.error("[ERROR] 銷帳回滾API: 找不到帳戶 ID %s", account_id)
             return jsonify({"status": "error", "message": f"找不到帳戶 ID {account_id}，無法執行回滾。"}), 400
         
-        print(f"[ROLLBACK] 銷帳回滾API: 找到相關數據")
-        print(f"   - 客戶: {customer.name}, 當前應收帳款: {customer.total_receivables_twd}")
-        print(f"   - 帳戶: {account.name}, 當前餘額: {account.balance}")
-        print(f"   - 銷帳金額: NT$ {amount:,.2f}")
+        settlement_logger.debug("[ROLLBACK] 銷帳回滾API: 找到相關數據")
+        settlement_logger.debug("   - 客戶: %s, 當前應收帳款: %s", customer.name, customer.total_receivables_twd)
+        settlement_logger.debug("   - 帳戶: %s, 當前餘額: %s", account.name, account.balance)
+        settlement_logger.debug("   - 銷帳金額: NT$ %.2f", amount)
         
         # 3. 保存回滾前的狀態（用於審計）
         old_receivables = customer.total_receivables_twd
         old_balance = account.balance
         
         # 4. 執行回滾邏輯
-        print(f"[ROLLBACK] 開始執行回滾邏輯...")
+        settlement_logger.debug("[ROLLBACK] 開始執行回滾邏輯...")
         
         # 4.1 恢復客戶應收帳款
         customer.total_receivables_twd += amount
         if customer.total_receivables_twd < 0:
             customer.total_receivables_twd = 0
-        print(f"[ROLLBACK] 客戶應收帳款已恢復: {old_receivables} -> {customer.total_receivables_twd}")
+        settlement_logger.debug("[ROLLBACK] 客戶應收帳款已恢復: %s -> %s", old_receivables, customer.total_receivables_twd)
         
         # 4.2 恢復帳戶餘額（扣減）
         if account.balance < amount:
-            print(f"[WARNING] 帳戶餘額不足回滾: 當前餘額 {account.balance}, 需要扣減 {amount}")
+            settlement_logger.warning("[WARNING] 帳戶餘額不足回滾: 當前餘額 %s, 需要扣減 %s", account.balance, amount)
             # 仍然執行回滾，但記錄警告
-        account.balance -= amount
+        BalanceService.apply_delta(account, -amount, allow_negative=True)
         if account.balance < 0:
-            print(f"[WARNING] 帳戶餘額回滾後變負數: {account.balance}")
+            settlement_logger.warning("[WARNING] 帳戶餘額回滾後變負數: %s", account.balance)
         
-        print(f"[ROLLBACK] 帳戶餘額已恢復: {old_balance} -> {account.balance}")
+        settlement_logger.debug("[ROLLBACK] 帳戶餘額已恢復: %s -> %s", old_balance, account.balance)
         
         # 4.3 將相關的銷售記錄標記為未結清
         # 查找該客戶在銷帳時間附近的銷售記錄，按時間順序倒推
@@ -8084,13 +8884,13 @@ def api_rollback_settlement(ledger_entry_id):
                 sale.is_settled = False
                 remaining_amount -= sale.twd_amount
                 unsettled_count += 1
-                print(f"[ROLLBACK] 恢復訂單 ID {sale.id} 為未結清, 金額: NT$ {sale.twd_amount:,.2f}")
+                settlement_logger.debug("[ROLLBACK] 恢復訂單 ID %s 為未結清, 金額: NT$ %.2f", sale.id, sale.twd_amount)
             else:
                 # 部分結清的情況（這種情況下不恢復，因為可能影響其他銷帳記錄）
-                print(f"[ROLLBACK] 訂單 ID {sale.id} 可能部分結清，跳過恢復")
+                settlement_logger.debug("[ROLLBACK] 訂單 ID %s 可能部分結清，跳過恢復", sale.id)
                 break
         
-        print(f"[ROLLBACK] 共恢復 {unsettled_count} 筆訂單為未結清")
+        settlement_logger.debug("[ROLLBACK] 共恢復 %s 筆訂單為未結清", unsettled_count)
         
         # 4.4 記錄刪除前的數據（用於審計）
         import json
@@ -8137,7 +8937,7 @@ def api_rollback_settlement(ledger_entry_id):
         
         # 刪除 LedgerEntry
         db.session.delete(settlement_entry)
-        print(f"[ROLLBACK] LedgerEntry ID {settlement_entry.id} 已刪除")
+        settlement_logger.debug("[ROLLBACK] LedgerEntry ID %s 已刪除", settlement_entry.id)
         
         # 4.5 刪除對應的 CashLog（如果存在）
         # 查找相同時間、相同類型的 CashLog
@@ -8154,11 +8954,11 @@ def api_rollback_settlement(ledger_entry_id):
         
         for cash_log in cash_logs_to_delete:
             db.session.delete(cash_log)
-            print(f"[ROLLBACK] CashLog ID {cash_log.id} 已刪除")
+            settlement_logger.debug("[ROLLBACK] CashLog ID %s 已刪除", cash_log.id)
         
         # 5. 提交事務
         db.session.commit()
-        print(f"[OK] 銷帳回滾完成")
+        settlement_logger.debug("[OK] 銷帳回滾完成")
         
         success_message = f"銷帳回滾成功！客戶「{customer.name}」的銷帳記錄 NT$ {amount:,.2f} 已回滾，應收帳款已恢復為 NT$ {customer.total_receivables_twd:,.2f}。"
         
@@ -8176,8 +8976,8 @@ def api_rollback_settlement(ledger_entry_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"[ERROR] 銷帳回滾API: 發生錯誤: {e}")
-        print(f"[ERROR] 銷帳回滾API: 錯誤詳情: {traceback.format_exc()}")
+        settlement_logger.error("[ERROR] 銷帳回滾API: 發生錯誤: %s", e)
+        settlement_logger.error("[ERROR] 銷帳回滾API: 錯誤詳情: %s", traceback.format_exc())
         return jsonify({"status": "error", "message": f"回滾失敗: {str(e)}"}), 500
 
 
@@ -8211,7 +9011,7 @@ def api_customers_manage():
         })
         
     except Exception as e:
-        print(f"獲取客戶管理數據失敗: {e}")
+        logger.error("獲取客戶管理數據失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'獲取客戶數據失敗: {e}'
@@ -8245,7 +9045,7 @@ def api_customer_delete(customer_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"刪除客戶失敗: {e}")
+        logger.error("刪除客戶失敗: %s", e)
         return jsonify({
             "status": "error",
             "message": f"刪除客戶失敗: {e}"
@@ -8272,7 +9072,7 @@ def api_customer_restore(customer_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"恢復客戶失敗: {e}")
+        logger.error("恢復客戶失敗: %s", e)
         return jsonify({
             "status": "error",
             "message": f"恢復客戶失敗: {e}"
@@ -8302,24 +9102,15 @@ def api_customer_transactions(customer_id):
         
         # 獲取該客戶的應收帳款變動記錄（通過LedgerEntry）
         # 查詢所有銷帳記錄，然後在Python中過濾包含客戶名稱的記錄
-        try:
-            all_settlements = (
-                db.session.execute(
-                    db.select(LedgerEntry)
-                    .filter(LedgerEntry.entry_type == "SETTLEMENT")
-                    .order_by(LedgerEntry.entry_date.desc())
-                )
-                .scalars()
-                .all()
+        all_settlements = (
+            db.session.execute(
+                db.select(LedgerEntry)
+                .filter(LedgerEntry.entry_type == "SETTLEMENT")
+                .order_by(LedgerEntry.entry_date.desc())
             )
-        except Exception as e:
-            if "profit_before does not exist" in str(e):
-                print("警告: 查詢 SETTLEMENT 記錄時缺少欄位，跳過查詢")
-                db.session.rollback()
-                all_settlements = []
-            else:
-                db.session.rollback()
-                raise e
+            .scalars()
+            .all()
+        )
         
         # 在Python中過濾包含客戶名稱的記錄
         receivable_entries = [
@@ -8327,6 +9118,34 @@ def api_customer_transactions(customer_id):
             if customer.name in entry.description
         ]
         
+        # 以已載入的售出紀錄累計「某時間點之前」的售出總額，不再每筆交易各查一次資料庫（與原查詢相同，只計資料庫中的售出）
+        hot_sales = sorted(sales_records, key=lambda s: s.created_at)
+        hot_sale_times = [s.created_at for s in hot_sales]
+        hot_sale_totals = list(itertools.accumulate((s.twd_amount for s in hot_sales), initial=0))
+        
+        def sales_total_before(moment):
+            return hot_sale_totals[bisect.bisect_left(hot_sale_times, moment)]
+        
+        # include_archived=1 時一併列入已歸檔（移出資料庫）的售出與銷帳；需讀取歸檔分區，預設只看資料庫
+        if request.args.get("include_archived") == "1":
+            hot_sale_ids = {sale.id for sale in sales_records}
+            sales_records += [
+                SimpleNamespace(**row, archived=True)
+                for row in ArchiveHistoryService.archived_rows("sales_records", customer_id=customer_id)
+                if row["id"] not in hot_sale_ids
+            ]
+            # 銷帳不會早於客戶的第一筆售出，只讀取該日之後的 SETTLEMENT 分區
+            first_sale_at = min((sale.created_at for sale in sales_records if sale.created_at), default=None)
+            if first_sale_at is not None:
+                hot_entry_ids = {entry.id for entry in receivable_entries}
+                receivable_entries += [
+                    SimpleNamespace(**row, archived=True)
+                    for row in ArchiveHistoryService.archived_rows(
+                        "ledger_entries", start=first_sale_at, entry_type="SETTLEMENT"
+                    )
+                    if row["id"] not in hot_entry_ids and customer.name in (row["description"] or "")
+                ]
+        
         # 已移除調試輸出
         
         # 直接使用數據庫中存儲的應收帳款值，確保與現金管理頁面一致
@@ -8336,28 +9155,16 @@ def api_customer_transactions(customer_id):
         transactions = []
         
         # 添加銷售記錄
+        profits = FIFOService.calculate_profits_for_sales(hot_sales)
         for sale in sales_records:
-            # 計算銷售利潤
-            profit_info = FIFOService.calculate_profit_for_sale(sale)
+            # 計算銷售利潤（已歸檔的售出其 FIFO 分配不在資料庫中，不重新計算）
+            archived = getattr(sale, "archived", False)
+            profit_info = None if archived else profits.get(sale.id)
             profit_twd = profit_info['profit_twd'] if profit_info else 0
             
             # 計算該筆銷售的應收帳款餘額變化
             # 需要計算在該筆銷售之前，該客戶的應收帳款餘額（售出 - 銷帳）
             try:
-                # 獲取該筆銷售之前的所有銷售記錄
-                previous_sales = (
-                    db.session.execute(
-                        db.select(SalesRecord)
-                        .filter(
-                            SalesRecord.customer_id == customer_id,
-                            SalesRecord.created_at < sale.created_at
-                        )
-                        .order_by(SalesRecord.created_at.desc())
-                    )
-                    .scalars()
-                    .all()
-                )
-                
                 # 獲取該筆銷售之前的所有銷帳記錄
                 settlements_before_sale = [
                     e for e in receivable_entries 
@@ -8365,7 +9172,7 @@ def api_customer_transactions(customer_id):
                 ]
                 
                 # 計算該筆銷售之前的應收帳款餘額 = 售出總額 - 銷帳總額
-                total_sales_before = sum(s.twd_amount for s in previous_sales)
+                total_sales_before = sales_total_before(sale.created_at)
                 total_settlements_before = sum(e.amount for e in settlements_before_sale)
                 receivable_before = total_sales_before - total_settlements_before
                 
@@ -8391,6 +9198,7 @@ def api_customer_transactions(customer_id):
                 'profit_twd': profit_twd,
                 'status': '已售出',
                 'category': 'sales',
+                'archived': archived,
                 # 新增：應收帳款餘額變化
                 'receivable_balance': {
                     'before': round(receivable_before, 2),
@@ -8404,19 +9212,6 @@ def api_customer_transactions(customer_id):
         for entry in receivable_entries:
             # 計算該筆銷帳時的應收帳款餘額變化
             try:
-                # 獲取該筆銷帳之前的所有銷售記錄總和
-                sales_before_settlement = (
-                    db.session.execute(
-                        db.select(SalesRecord)
-                        .filter(
-                            SalesRecord.customer_id == customer_id,
-                            SalesRecord.created_at < entry.entry_date
-                        )
-                    )
-                    .scalars()
-                    .all()
-                )
-                
                 # 獲取該筆銷帳之前的所有銷帳記錄總和
                 settlements_before_current = [
                     e for e in receivable_entries 
@@ -8424,7 +9219,7 @@ def api_customer_transactions(customer_id):
                 ]
                 
                 # 計算銷帳前的應收帳款
-                total_sales_before = sum(s.twd_amount for s in sales_before_settlement)
+                total_sales_before = sales_total_before(entry.entry_date)
                 total_settlements_before = sum(e.amount for e in settlements_before_current)
                 receivable_before = total_sales_before - total_settlements_before
                 
@@ -8434,10 +9229,10 @@ def api_customer_transactions(customer_id):
                 # 銷帳後的應收帳款
                 receivable_after = receivable_before + receivable_change
                 
-                print(f"DEBUG: 客戶 {customer.name} 銷帳 {entry.id} 應收帳款變化 - 變動前: {receivable_before:.2f}, 變動: {receivable_change:.2f}, 變動後: {receivable_after:.2f}")
+                settlement_logger.debug("DEBUG: 客戶 %s 銷帳 %s 應收帳款變化 - 變動前: %.2f, 變動: %.2f, 變動後: %.2f", customer.name, entry.id, receivable_before, receivable_change, receivable_after)
                 
             except Exception as e:
-                print(f"DEBUG: 計算客戶 {customer.name} 銷帳 {entry.id} 應收帳款變化失敗: {e}")
+                settlement_logger.error("DEBUG: 計算客戶 %s 銷帳 %s 應收帳款變化失敗: %s", customer.name, entry.id, e)
                 receivable_before = 0
                 receivable_change = -entry.amount
                 receivable_after = receivable_change
@@ -8452,6 +9247,7 @@ def api_customer_transactions(customer_id):
                 'profit_twd': 0,
                 'status': '已收款',
                 'category': 'settlement',
+                'archived': getattr(entry, "archived", False),
                 # 新增：應收帳款餘額變化
                 'receivable_balance': {
                     'before': round(receivable_before, 2),
@@ -8491,44 +9287,120 @@ def api_customer_transactions(customer_id):
         })
         
     except Exception as e:
-        print(f"獲取客戶交易紀錄失敗: {e}")
+        settlement_logger.error("獲取客戶交易紀錄失敗: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'獲取交易紀錄失敗: {e}'
         }), 500
 
 
+@app.route("/accounts-receivable")
+@login_required
+def accounts_receivable():
+    """應收帳款帳齡報表頁面"""
+    try:
+        report = ReceivablesAgingService.get_aging_report()
+    except Exception as e:
+        settlement_logger.error("載入應收帳款帳齡報表失敗: %s", e)
+        db.session.rollback()
+        flash("載入應收帳款帳齡報表失敗。", "danger")
+        report = None
+    return render_template("accounts_receivable.html", report=report)
+
+
+@app.route("/api/accounts-receivable/aging", methods=["GET"])
+@login_required
+def api_accounts_receivable_aging():
+    """API端點：每位客戶的應收帳款帳齡區間"""
+    try:
+        report = ReceivablesAgingService.get_aging_report()
+        return jsonify({"status": "success", **report})
+    except Exception as e:
+        settlement_logger.error("獲取應收帳款帳齡失敗: %s", e)
+        db.session.rollback()
+        return jsonify({"status": "error", "message": f"獲取應收帳款帳齡失敗: {e}"}), 500
+
+
+@app.route("/api/archive/history", methods=["GET"])
+@login_required
+def api_archive_history():
+    """API: 依日期區間查詢歷史資料，資料庫與歸檔層自動合併
+
+    參數：
+      table        sales_records / purchase_records / ledger_entries / cash_logs
+      start, end   YYYY-MM-DD，查詢區間 [start, end)；可省略
+      customer_id  只查此客戶（sales_records）
+      entry_type   只查此流水類型（ledger_entries）
+      limit        最多回傳筆數（預設 1000，最多 10000）；回傳區間內最早的 limit 筆，truncated 表示還有更多
+    歸檔層依月份分區，只讀取與區間重疊的分區，取滿 limit 筆後不再讀取之後的分區。
+    """
+    table = request.args.get("table")
+    if table not in ArchiveHistoryService.MODELS:
+        return jsonify({"status": "error", "message": f"不支援的資料表: {table}"}), 400
+    try:
+        start = datetime.strptime(request.args["start"], "%Y-%m-%d") if request.args.get("start") else None
+        end = datetime.strptime(request.args["end"], "%Y-%m-%d") if request.args.get("end") else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "日期格式應為 YYYY-MM-DD"}), 400
+    limit = min(max(request.args.get("limit", 1000, type=int), 1), 10000)
+    filters = {}
+    if table == "sales_records" and request.args.get("customer_id"):
+        filters["customer_id"] = request.args.get("customer_id", type=int)
+    if table == "ledger_entries" and request.args.get("entry_type"):
+        filters["entry_type"] = request.args["entry_type"]
+    try:
+        # 多取一筆用來判斷是否還有更多資料
+        rows = ArchiveHistoryService.history(table, start, end, limit=limit + 1, **filters)
+        truncated = len(rows) > limit
+        rows = rows[:limit]
+        return jsonify({
+            "status": "success",
+            "table": table,
+            "total": len(rows),
+            "archived": sum(1 for row in rows if row["archived"]),
+            "truncated": truncated,
+            "rows": [
+                {key: value.isoformat() if isinstance(value, (datetime, date)) else value for key, value in row.items()}
+                for row in rows
+            ],
+        })
+    except Exception as e:
+        logger.error("查詢歷史資料失敗: %s", e)
+        db.session.rollback()
+        return jsonify({"status": "error", "message": f"查詢歷史資料失敗: {e}"}), 500
+
+
 @app.route("/sales_action", methods=["POST"])
 @admin_required
 def sales_action():
     action = request.form.get("action")
     
-    print(f"[DEBUG] DEBUG: 收到sales_action請求，action={action}")
-    print(f"[DEBUG] DEBUG: 表單數據: {dict(request.form)}")
+    fifo_logger.debug("[DEBUG] DEBUG: 收到sales_action請求，action=%s", action)
+    fifo_logger.debug("[DEBUG] DEBUG: 表單數據: %s", dict(request.form))
 
     try:
         if action == "create_order":
             customer_name = request.form.get("customer_name")
             customer_id = request.form.get("user_id")
             
-            print(f"[DEBUG] DEBUG: 客戶信息 - customer_name={customer_name}, customer_id={customer_id}")
+            fifo_logger.debug("[DEBUG] DEBUG: 客戶信息 - customer_name=%s, customer_id=%s", customer_name, customer_id)
 
             target_customer = None
             if customer_id:
                 target_customer = db.session.get(Customer, int(customer_id))
-                print(f"[DEBUG] DEBUG: 通過ID找到客戶: {target_customer.name if target_customer else 'None'}")
+                fifo_logger.debug("[DEBUG] DEBUG: 通過ID找到客戶: %s", target_customer.name if target_customer else 'None')
             elif customer_name:
                 target_customer = Customer.query.filter_by(name=customer_name).first()
-                print(f"[DEBUG] DEBUG: 通過名稱找到客戶: {target_customer.name if target_customer else 'None'}")
+                fifo_logger.debug("[DEBUG] DEBUG: 通過名稱找到客戶: %s", target_customer.name if target_customer else 'None')
                 if not target_customer:
-                    print(f"[DEBUG] DEBUG: 客戶不存在，創建新客戶: {customer_name}")
+                    fifo_logger.debug("[DEBUG] DEBUG: 客戶不存在，創建新客戶: %s", customer_name)
                     target_customer = Customer(name=customer_name, is_active=True)
                     db.session.add(target_customer)
                     db.session.flush()  # 取得 ID
-                    print(f"[DEBUG] DEBUG: 新客戶已創建，ID: {target_customer.id}")
+                    fifo_logger.debug("[DEBUG] DEBUG: 新客戶已創建，ID: %s", target_customer.id)
 
             if not target_customer:
-                print(f"[ERROR] ERROR: 無法找到或創建客戶")
+                fifo_logger.error("[ERROR] ERROR: 無法找到或創建客戶")
                 return (
                     jsonify({"status": "error", "message": "客戶名稱或ID為必填"}),
                     400,
@@ -8540,12 +9412,12 @@ def sales_action():
             rmb_account_id = request.form.get("rmb_account_id")
             twd = rmb * rate
             
-            print(f"[DEBUG] DEBUG: 銷售數據 - RMB={rmb}, 匯率={rate}, 台幣={twd}")
-            print(f"[DEBUG] DEBUG: 訂單日期={order_date_str}, RMB帳戶ID={rmb_account_id}")
+            fifo_logger.debug("[DEBUG] DEBUG: 銷售數據 - RMB=%s, 匯率=%s, 台幣=%s", rmb, rate, twd)
+            fifo_logger.debug("[DEBUG] DEBUG: 訂單日期=%s, RMB帳戶ID=%s", order_date_str, rmb_account_id)
             
             # 驗證RMB帳戶
             if not rmb_account_id:
-                print(f"[ERROR] ERROR: RMB出貨帳戶為空")
+                fifo_logger.error("[ERROR] ERROR: RMB出貨帳戶為空")
                 return (
                     jsonify({"status": "error", "message": "RMB出貨帳戶為必填"}),
                     400,
@@ -8553,17 +9425,17 @@ def sales_action():
             
             rmb_account = db.session.get(CashAccount, int(rmb_account_id))
             if not rmb_account:
-                print(f"[ERROR] ERROR: 找不到RMB帳戶 ID {rmb_account_id}")
+                fifo_logger.error("[ERROR] ERROR: 找不到RMB帳戶 ID %s", rmb_account_id)
                 return (
                     jsonify({"status": "error", "message": "找不到指定的RMB帳戶"}),
                     400,
                 )
             
-            print(f"[DEBUG] DEBUG: 找到RMB帳戶: {rmb_account.name}")
+            fifo_logger.debug("[DEBUG] DEBUG: 找到RMB帳戶: %s", rmb_account.name)
 
             # 更新客戶應收帳款
             target_customer.total_receivables_twd += twd
-            print(f"[DEBUG] DEBUG: 更新客戶應收帳款，新餘額: {target_customer.total_receivables_twd}")
+            fifo_logger.debug("[DEBUG] DEBUG: 更新客戶應收帳款，新餘額: %s", target_customer.total_receivables_twd)
 
             new_sale = SalesRecord(
                 customer_id=target_customer.id,
@@ -8575,67 +9447,62 @@ def sales_action():
                 operator_id=get_safe_operator_id(),  # 記錄操作者
             )
             
-            print(f"[DEBUG] DEBUG: 創建SalesRecord:")
-            print(f"  客戶ID: {new_sale.customer_id}")
-            print(f"  RMB帳戶ID: {new_sale.rmb_account_id}")
-            print(f"  RMB金額: {new_sale.rmb_amount}")
-            print(f"  台幣金額: {new_sale.twd_amount}")
-            print(f"  是否結清: {new_sale.is_settled}")
-            print(f"  操作者ID: {new_sale.operator_id}")
+            fifo_logger.debug("[DEBUG] DEBUG: 創建SalesRecord:")
+            fifo_logger.debug("  客戶ID: %s", new_sale.customer_id)
+            fifo_logger.debug("  RMB帳戶ID: %s", new_sale.rmb_account_id)
+            fifo_logger.debug("  RMB金額: %s", new_sale.rmb_amount)
+            fifo_logger.debug("  台幣金額: %s", new_sale.twd_amount)
+            fifo_logger.debug("  是否結清: %s", new_sale.is_settled)
+            fifo_logger.debug("  操作者ID: %s", new_sale.operator_id)
             
             db.session.add(new_sale)
-            print(f"[DEBUG] DEBUG: SalesRecord已添加到資料庫")
+            fifo_logger.debug("[DEBUG] DEBUG: SalesRecord已添加到資料庫")
             
             # 分配FIFO庫存
             try:
                 db.session.flush()  # 獲取 new_sale.id
-                print(f"[DEBUG] DEBUG: SalesRecord ID已獲取: {new_sale.id}")
+                fifo_logger.debug("[DEBUG] DEBUG: SalesRecord ID已獲取: %s", new_sale.id)
                 
                 FIFOService.allocate_inventory_for_sale(new_sale)
-                print(f"[DEBUG] DEBUG: FIFO庫存分配完成")
+                fifo_logger.debug("[DEBUG] DEBUG: FIFO庫存分配完成")
                 
                 # 計算並記錄利潤
                 profit_info = FIFOService.calculate_profit_for_sale(new_sale)
-                print(f"[DEBUG] DEBUG: 利潤計算結果: {profit_info}")
+                fifo_logger.debug("[DEBUG] DEBUG: 利潤計算結果: %s", profit_info)
                 
                 if profit_info and profit_info.get('profit_twd', 0) > 0:
                     profit_amount = profit_info.get('profit_twd', 0)
-                    print(f"[DEBUG] DEBUG: 計算到利潤 {profit_amount} TWD")
+                    fifo_logger.debug("[DEBUG] DEBUG: 計算到利潤 %s TWD", profit_amount)
                     
-                    # 記錄到ProfitService
-                    profit_result = ProfitService.add_profit(
-                        account_id=rmb_account.id,
-                        amount=profit_amount,
-                        transaction_type="PROFIT_EARNED",
+                    # 記錄到ProfitService（帳戶利潤餘額與系統利潤流水）
+                    profit_result = ProfitService.record_sale_profit(
+                        new_sale,
+                        profit_amount,
                         description=f"售出利潤：{target_customer.name}",
                         note=f"RMB {new_sale.rmb_amount}，匯率 {new_sale.exchange_rate:.4f}",
-                        related_transaction_id=new_sale.id,
-                        related_transaction_type="SALES",
                         operator_id=get_safe_operator_id()
                     )
-                    print(f"[DEBUG] DEBUG: 利潤記錄結果: {profit_result}")
+                    fifo_logger.debug("[DEBUG] DEBUG: 利潤記錄結果: %s", profit_result)
                 else:
-                    print(f"[WARNING] WARNING: 沒有計算到利潤或利潤為0")
+                    fifo_logger.warning("[WARNING] WARNING: 沒有計算到利潤或利潤為0")
                 
                 db.session.commit()
-                print(f"[OK] DEBUG: 資料庫提交成功")
+                fifo_logger.debug("[OK] DEBUG: 資料庫提交成功")
                 
                 # 驗證記錄是否正確保存
                 saved_sale = db.session.get(SalesRecord, new_sale.id)
                 if saved_sale:
-                    print(f"[OK] DEBUG: 驗證成功，售出記錄已保存:")
-                    print(f"  ID: {saved_sale.id}")
-                    print(f"  客戶: {saved_sale.customer.name if saved_sale.customer else 'N/A'}")
-                    print(f"  RMB帳戶: {saved_sale.rmb_account.name if saved_sale.rmb_account else 'N/A'}")
-                    print(f"  是否結清: {saved_sale.is_settled}")
-                    print(f"  建立時間: {saved_sale.created_at}")
+                    fifo_logger.debug("[OK] DEBUG: 驗證成功，售出記錄已保存:")
+                    fifo_logger.debug("  ID: %s", saved_sale.id)
+                    fifo_logger.debug("  客戶: %s", saved_sale.customer.name if saved_sale.customer else 'N/A')
+                    fifo_logger.debug("  RMB帳戶: %s", saved_sale.rmb_account.name if saved_sale.rmb_account else 'N/A')
+                    fifo_logger.debug("  是否結清: %s", saved_sale.is_settled)
+                    fifo_logger.debug("  建立時間: %s", saved_sale.created_at)
                 else:
-                    print(f"[ERROR] ERROR: 售出記錄保存後找不到")
+                    fifo_logger.error("[ERROR] ERROR: 售出記錄保存後找不到")
                 
             except Exception as e:
-                print(f"[ERROR] ERROR: 庫存分配或利潤計算失敗: {e}")
-                import traceback
-                traceback.print_exc()
+                fifo_logger.exception("[ERROR] ERROR: 庫存分配或利潤計算失敗: %s", e)
                 db.session.rollback()
                 return jsonify({"status": "error", "message": f"庫存分配失敗: {e}"}), 500
 
@@ -8667,7 +9534,10 @@ def sales_action():
                 if customer:
                     customer.total_receivables_twd -= sale_to_delete.twd_amount
                 
-                # 2. 回滾FIFO庫存分配
+                # 2. 沖銷該筆售出的利潤（必須在刪除FIFO分配之前計算）
+                ProfitService.reverse_sale_profit(sale_to_delete)
+                
+                # 3. 回滾FIFO庫存分配
                 allocations = db.session.execute(
                     db.select(FIFOSalesAllocation).filter_by(sales_record_id=sale_to_delete.id)
                 ).scalars().all()
@@ -8680,8 +9550,10 @@ def sales_action():
                     # 刪除分配記錄
                     db.session.delete(allocation)
                 
-                # 3. 刪除銷售記錄
+                # 4. 刪除銷售記錄
+                cube_key = ProfitCubeService.cell_key(sale_to_delete)
                 db.session.delete(sale_to_delete)
+                ProfitCubeService.refresh([cube_key])
                 db.session.commit()
                 
                 return jsonify(
@@ -9051,6 +9923,7 @@ def fix_database_api():
     try:
         # 確保所有表都存在
         db.create_all()
+        verify_schema(force=True)
         
         # 檢查並創建基本數據
         result = {
@@ -9449,7 +10322,7 @@ def get_cash_management_transactions():
         page = request.args.get("page", 1, type=int)
         per_page = min(request.args.get("per_page", 20, type=int), 50)  # 限制每頁最多50筆
         
-        print(f"DEBUG: 現金管理API請求 - 頁碼: {page}, 每頁: {per_page}")
+        cash_logger.debug("DEBUG: 現金管理API請求 - 頁碼: %s, 每頁: %s", page, per_page)
         
         # 優化：限制查詢數量，避免一次性載入所有數據
         limit = per_page * 5  # 增加查詢數量以確保包含所有記錄類型
@@ -9477,16 +10350,16 @@ def get_cash_management_transactions():
             .limit(limit)
         ).scalars().all()
         
-        print(f"DEBUG: 查詢到 {len(purchases)} 筆買入記錄, {len(sales)} 筆銷售記錄")
-        print(f"DEBUG: SalesRecord 查詢到的總記錄數: {len(sales)}")
+        cash_logger.debug("DEBUG: 查詢到 %s 筆買入記錄, %s 筆銷售記錄", len(purchases), len(sales))
+        cash_logger.debug("DEBUG: SalesRecord 查詢到的總記錄數: %s", len(sales))
         
         # 詳細調試：顯示查詢到的售出記錄
         if sales:
-            print(f"DEBUG: 查詢到的售出記錄ID列表: {[s.id for s in sales]}")
+            cash_logger.debug("DEBUG: 查詢到的售出記錄ID列表: %s", [s.id for s in sales])
             for s in sales[:3]:  # 顯示前3筆記錄的詳細信息
-                print(f"DEBUG: 售出記錄 {s.id} - 客戶: {s.customer.name if s.customer else 'N/A'}, 建立時間: {s.created_at}")
+                cash_logger.debug("DEBUG: 售出記錄 %s - 客戶: %s, 建立時間: %s", s.id, s.customer.name if s.customer else 'N/A', s.created_at)
         else:
-            print("DEBUG: 沒有查詢到任何售出記錄")
+            cash_logger.debug("DEBUG: 沒有查詢到任何售出記錄")
         
         # 安全地查詢 LedgerEntry，處理可能缺少的欄位
         try:
@@ -9499,82 +10372,16 @@ def get_cash_management_transactions():
                 )
             ).scalars().all()
         except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: ledger_entries 表格缺少欄位，嘗試修復...")
-                db.session.rollback()  # 回滾失敗的事務
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    misc_entries = db.session.execute(
-                        db.select(LedgerEntry)
-                        .options(db.selectinload(LedgerEntry.account))
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 修復欄位失敗: {fix_error}")
-                    db.session.rollback()
-                    misc_entries = []
-            else:
-                print(f"[ERROR] 查詢LedgerEntry失敗: {e}")
-                misc_entries = []
+            cash_logger.error("[ERROR] 查詢LedgerEntry失敗: %s", e)
+            misc_entries = []
         
         # 確保在乾淨的事務中查詢 cash_logs
         try:
             cash_logs = db.session.execute(db.select(CashLog)).scalars().all()
         except Exception as e:
-            print(f"警告: cash_logs 查詢失敗: {e}")
+            cash_logger.error("警告: cash_logs 查詢失敗: %s", e)
             if "InFailedSqlTransaction" in str(e):
-                print("檢測到失敗的事務，嘗試重新開始...")
+                cash_logger.warning("檢測到失敗的事務，嘗試重新開始...")
                 db.session.rollback()
                 # 重新開始會話
                 db.session.close()
@@ -9583,7 +10390,7 @@ def get_cash_management_transactions():
                 try:
                     cash_logs = db.session.execute(db.select(CashLog)).scalars().all()
                 except Exception as retry_error:
-                    print(f"重新查詢 cash_logs 仍然失敗: {retry_error}")
+                    cash_logger.error("重新查詢 cash_logs 仍然失敗: %s", retry_error)
                     cash_logs = []
             else:
                 db.session.rollback()
@@ -9635,42 +10442,22 @@ def get_cash_management_transactions():
                 })
 
         # 優化：批量計算所有銷售的利潤，使用與利潤管理頁面一致的計算方式
-        print("DEBUG: 開始批量計算銷售利潤...")
+        cash_logger.debug("DEBUG: 開始批量計算銷售利潤...")
         
         # 預計算所有銷售的利潤
         sales_profits = {}
         
-        # 計算當前總利潤（與利潤管理頁面一致）
-        current_total_profit = 0.0
-        all_sales = db.session.execute(db.select(SalesRecord)).scalars().all()
-        
-        for sale in all_sales:
-            try:
-                profit_info = FIFOService.calculate_profit_for_sale(sale)
-                if profit_info:
-                    current_total_profit += profit_info.get('profit_twd', 0.0)
-            except Exception as e:
-                print(f"DEBUG: 計算總利潤時銷售{sale.id}失敗: {e}")
-        
-        # 扣除利潤提款記錄
-        try:
-            profit_withdrawals = db.session.execute(
-                db.select(LedgerEntry)
-                .filter(LedgerEntry.entry_type == "PROFIT_WITHDRAW")
-            ).scalars().all()
-            total_withdrawals = sum(abs(entry.amount) for entry in profit_withdrawals)
-            current_total_profit -= total_withdrawals
-            print(f"DEBUG: 當前總利潤: {current_total_profit:.2f}, 利潤提款: {total_withdrawals:.2f}")
-        except Exception as e:
-            print(f"DEBUG: 查詢利潤提款失敗: {e}")
+        # 當前總利潤：系統利潤流水最新一筆的 profit_after（與利潤管理頁面一致）
+        current_total_profit = ProfitService.get_total_profit()
         
         # 按時間順序處理銷售記錄，計算每筆的利潤變動
         sorted_sales = sorted(sales, key=lambda x: x.created_at)
+        profits = FIFOService.calculate_profits_for_sales(sorted_sales)
         
         for s in sorted_sales:
             if s.customer:
                 try:
-                    profit_info = FIFOService.calculate_profit_for_sale(s)
+                    profit_info = profits.get(s.id)
                     profit = profit_info['profit_twd'] if profit_info else 0
                     
                     # 計算變動前的利潤（從總利潤中減去當前銷售的利潤）
@@ -9684,22 +10471,40 @@ def get_cash_management_transactions():
                     }
                     
                 except Exception as e:
-                    print(f"DEBUG: 計算銷售{s.id}利潤失敗: {e}")
+                    cash_logger.error("DEBUG: 計算銷售%s利潤失敗: %s", s.id, e)
                     sales_profits[s.id] = {
                         'profit': 0,
                         'profit_before': current_total_profit,
                         'profit_after': current_total_profit
                     }
         
-        print(f"DEBUG: 批量計算完成，處理了 {len(sales_profits)} 筆銷售記錄")
+        cash_logger.debug("DEBUG: 批量計算完成，處理了 %s 筆銷售記錄", len(sales_profits))
+        
+        # 預先載入客戶應收帳款變化所需的資料：本頁客戶的售出金額與所有銷帳各查一次，不在迴圈中逐筆查詢
+        page_customer_ids = {s.customer_id for s in sales if s.customer_id}
+        customer_sale_history = {}  # customer_id → (售出時間, 該時間之前的售出累計)
+        if page_customer_ids:
+            for customer_id, sale_created_at, sale_twd_amount in db.session.execute(
+                db.select(SalesRecord.customer_id, SalesRecord.created_at, SalesRecord.twd_amount)
+                .filter(SalesRecord.customer_id.in_(page_customer_ids))
+                .order_by(SalesRecord.created_at)
+            ):
+                sale_times, sale_totals = customer_sale_history.setdefault(customer_id, ([], [0]))
+                sale_times.append(sale_created_at)
+                sale_totals.append(sale_totals[-1] + sale_twd_amount)
+        all_settlements = db.session.execute(
+            db.select(LedgerEntry)
+            .filter(LedgerEntry.entry_type == "SETTLEMENT")
+            .order_by(LedgerEntry.entry_date.desc())
+        ).scalars().all()
         
         # 處理售出記錄
-        print(f"DEBUG: 開始處理 {len(sales)} 筆銷售記錄")
+        cash_logger.debug("DEBUG: 開始處理 %s 筆銷售記錄", len(sales))
         sales_processed_count = 0
         sales_error_count = 0
         
         for i, s in enumerate(sales):
-            print(f"DEBUG: 處理銷售記錄 {i+1}/{len(sales)} - ID: {getattr(s, 'id', 'N/A')}")
+            cash_logger.debug("DEBUG: 處理銷售記錄 %s/%s - ID: %s", i + 1, len(sales), getattr(s, 'id', 'N/A'))
             
             # 使用 try-except 包住整個 SalesRecord 處理邏輯
             try:
@@ -9713,15 +10518,15 @@ def get_cash_management_transactions():
                 rmb_amount = getattr(s, 'rmb_amount', 0)
                 twd_amount = getattr(s, 'twd_amount', 0)
                 
-                print(f"DEBUG: 銷售記錄 {sale_id} 基本屬性 - RMB: {rmb_amount}, TWD: {twd_amount}, 結清: {is_settled}")
+                cash_logger.debug("DEBUG: 銷售記錄 %s 基本屬性 - RMB: %s, TWD: %s, 結清: %s", sale_id, rmb_amount, twd_amount, is_settled)
                 
                 # 安全地獲取關聯數據
                 try:
                     if hasattr(s, 'customer') and s.customer:
                         customer_name = getattr(s.customer, 'name', '未知客戶')
-                    print(f"DEBUG: 客戶: {customer_name}")
+                    cash_logger.debug("DEBUG: 客戶: %s", customer_name)
                 except Exception as e:
-                    print(f"DEBUG: [WARNING] 獲取客戶信息失敗: {e}")
+                    cash_logger.warning("DEBUG: [WARNING] 獲取客戶信息失敗: %s", e)
                 
                 try:
                     if hasattr(s, 'rmb_account') and s.rmb_account:
@@ -9729,17 +10534,17 @@ def get_cash_management_transactions():
                         rmb_balance = getattr(s.rmb_account, 'balance', 0)
                     else:
                         rmb_balance = 0
-                    print(f"DEBUG: RMB帳戶: {rmb_account_name}, 餘額: {rmb_balance}")
+                    cash_logger.debug("DEBUG: RMB帳戶: %s, 餘額: %s", rmb_account_name, rmb_balance)
                 except Exception as e:
-                    print(f"DEBUG: [WARNING] 獲取RMB帳戶信息失敗: {e}")
+                    cash_logger.warning("DEBUG: [WARNING] 獲取RMB帳戶信息失敗: %s", e)
                     rmb_balance = 0
                 
                 try:
                     if hasattr(s, 'operator') and s.operator:
                         operator_name = getattr(s.operator, 'username', '未知')
-                    print(f"DEBUG: 操作者: {operator_name}")
+                    cash_logger.debug("DEBUG: 操作者: %s", operator_name)
                 except Exception as e:
-                    print(f"DEBUG: [WARNING] 獲取操作者信息失敗: {e}")
+                    cash_logger.warning("DEBUG: [WARNING] 獲取操作者信息失敗: %s", e)
                 
                 # 使用預計算的利潤數據
                 profit_data = sales_profits.get(sale_id, {'profit': 0, 'profit_before': 0, 'profit_after': 0})
@@ -9747,7 +10552,7 @@ def get_cash_management_transactions():
                 profit_before = profit_data.get('profit_before', 0)
                 profit_after = profit_data.get('profit_after', 0)
                 
-                print(f"DEBUG: 利潤數據 - 利潤: {profit}, 變動前: {profit_before}, 變動後: {profit_after}")
+                cash_logger.debug("DEBUG: 利潤數據 - 利潤: %s, 變動前: %s, 變動後: %s", profit, profit_before, profit_after)
                 
                 # 安全地計算RMB帳戶餘額變化
                 try:
@@ -9760,9 +10565,9 @@ def get_cash_management_transactions():
                     
                     rmb_balance_change = -rmb_amount if rmb_amount else 0
                     
-                    print(f"DEBUG: RMB餘額變化 - 變動前: {rmb_balance_before}, 變動後: {rmb_balance_after}, 變動: {rmb_balance_change}")
+                    cash_logger.debug("DEBUG: RMB餘額變化 - 變動前: %s, 變動後: %s, 變動: %s", rmb_balance_before, rmb_balance_after, rmb_balance_change)
                 except Exception as e:
-                    print(f"DEBUG: [WARNING] 計算RMB餘額變化失敗: {e}")
+                    cash_logger.warning("DEBUG: [WARNING] 計算RMB餘額變化失敗: %s", e)
                     rmb_balance_before = rmb_amount if rmb_amount else 0
                     rmb_balance_after = 0
                     rmb_balance_change = -rmb_amount if rmb_amount else 0
@@ -9774,7 +10579,7 @@ def get_cash_management_transactions():
                     else:
                         date_str = "未知時間"
                 except Exception as e:
-                    print(f"DEBUG: [WARNING] 處理日期失敗: {e}")
+                    cash_logger.warning("DEBUG: [WARNING] 處理日期失敗: %s", e)
                     date_str = "未知時間"
                 
                 # 計算客戶個人應收帳款餘額變化（使用與客戶交易紀錄頁面相同的邏輯）
@@ -9785,26 +10590,9 @@ def get_cash_management_transactions():
                         customer = s.customer
                     
                     if customer:
-                        # 獲取該筆銷售之前的所有銷售記錄（與客戶交易紀錄頁面相同的邏輯）
-                        previous_sales = (
-                            db.session.execute(
-                                db.select(SalesRecord)
-                                .filter(
-                                    SalesRecord.customer_id == customer.id,
-                                    SalesRecord.created_at < s.created_at
-                                )
-                                .order_by(SalesRecord.created_at.desc())
-                            )
-                            .scalars()
-                            .all()
-                        )
-                        
-                        # 獲取該筆銷售之前的所有銷帳記錄（計算應收帳款餘額需要扣除銷帳）
-                        all_settlements = db.session.execute(
-                            db.select(LedgerEntry)
-                            .filter(LedgerEntry.entry_type == "SETTLEMENT")
-                            .order_by(LedgerEntry.entry_date.desc())
-                        ).scalars().all()
+                        # 該筆銷售之前的售出總額（與客戶交易紀錄頁面相同的邏輯），取自預先載入的累計
+                        sale_times, sale_totals = customer_sale_history.get(customer.id, ([], [0]))
+                        total_sales_before = sale_totals[bisect.bisect_left(sale_times, s.created_at)]
                         
                         # 過濾出該客戶的銷帳記錄
                         customer_settlements = [
@@ -9819,22 +10607,21 @@ def get_cash_management_transactions():
                         ]
                         
                         # 計算該筆銷售之前的應收帳款餘額 = 售出總額 - 銷帳總額（與客戶交易紀錄頁面相同的邏輯）
-                        total_sales_before = sum(sale.twd_amount for sale in previous_sales)
                         total_settlements_before = sum(e.amount for e in settlements_before_sale)
                         customer_receivable_before = total_sales_before - total_settlements_before
                         customer_receivable_after = customer_receivable_before + twd_amount
                         customer_receivable_change = twd_amount
                         
-                        print(f"DEBUG: 客戶 {customer.name} 銷售 {sale_id} 應收帳款變化 - 售出前總額: {total_sales_before:.2f}, 銷帳前總額: {total_settlements_before:.2f}")
-                        print(f"DEBUG: 變動前: {customer_receivable_before:.2f}, 變動: {customer_receivable_change:.2f}, 變動後: {customer_receivable_after:.2f}")
+                        cash_logger.debug("DEBUG: 客戶 %s 銷售 %s 應收帳款變化 - 售出前總額: %.2f, 銷帳前總額: %.2f", customer.name, sale_id, total_sales_before, total_settlements_before)
+                        cash_logger.debug("DEBUG: 變動前: %.2f, 變動: %.2f, 變動後: %.2f", customer_receivable_before, customer_receivable_change, customer_receivable_after)
                     else:
                         customer_receivable_before = 0
                         customer_receivable_after = twd_amount if twd_amount else 0
                         customer_receivable_change = twd_amount if twd_amount else 0
-                        print(f"DEBUG: 客戶對象不存在，使用預設值")
+                        cash_logger.debug("DEBUG: 客戶對象不存在，使用預設值")
                         
                 except Exception as e:
-                    print(f"DEBUG: [WARNING] 計算客戶應收帳款變化失敗: {e}")
+                    cash_logger.warning("DEBUG: [WARNING] 計算客戶應收帳款變化失敗: %s", e)
                     customer_receivable_before = 0
                     customer_receivable_after = twd_amount if twd_amount else 0
                     customer_receivable_change = twd_amount if twd_amount else 0
@@ -9885,14 +10672,14 @@ def get_cash_management_transactions():
                 # 添加到統一流水
                 unified_stream.append(sales_record)
                 sales_processed_count += 1
-                print(f"DEBUG: [OK] 銷售記錄 {sale_id} 已添加到unified_stream")
+                cash_logger.debug("DEBUG: [OK] 銷售記錄 %s 已添加到unified_stream", sale_id)
                 
             except Exception as e:
                 sales_error_count += 1
-                print(f"DEBUG: [ERROR] 處理銷售記錄 {getattr(s, 'id', 'N/A')} 時發生錯誤: {e}")
-                print(f"DEBUG: [ERROR] 錯誤詳情: {type(e).__name__}: {str(e)}")
+                cash_logger.error("DEBUG: [ERROR] 處理銷售記錄 %s 時發生錯誤: %s", getattr(s, 'id', 'N/A'), e)
+                cash_logger.error("DEBUG: [ERROR] 錯誤詳情: %s: %s", type(e).__name__, str(e))
                 import traceback
-                print(f"DEBUG: [ERROR] 錯誤堆疊: {traceback.format_exc()}")
+                cash_logger.error("DEBUG: [ERROR] 錯誤堆疊: %s", traceback.format_exc())
                 
                 # 即使發生錯誤，也嘗試添加一個基本的記錄
                 try:
@@ -9909,11 +10696,11 @@ def get_cash_management_transactions():
                         "note": f"處理錯誤: {str(e)}"
                     }
                     unified_stream.append(basic_record)
-                    print(f"DEBUG: [OK] 銷售記錄 {getattr(s, 'id', 'N/A')} 已添加基本記錄到unified_stream")
+                    cash_logger.debug("DEBUG: [OK] 銷售記錄 %s 已添加基本記錄到unified_stream", getattr(s, 'id', 'N/A'))
                 except Exception as basic_error:
-                    print(f"DEBUG: [ERROR] 添加基本記錄也失敗: {basic_error}")
+                    cash_logger.error("DEBUG: [ERROR] 添加基本記錄也失敗: %s", basic_error)
         
-        print(f"DEBUG: 銷售記錄處理完成 - 成功: {sales_processed_count}, 錯誤: {sales_error_count}")
+        cash_logger.debug("DEBUG: 銷售記錄處理完成 - 成功: %s, 錯誤: %s", sales_processed_count, sales_error_count)
 
         # 處理其他記帳記錄（包含利潤提款）
         for entry in misc_entries:
@@ -10369,7 +11156,7 @@ def get_cash_management_transactions():
         profit_count = sum(1 for record in unified_stream if record.get("type") == "利潤入庫")
         other_count = len(unified_stream) - sales_count - profit_count
         
-        print(f"DEBUG: 流水記錄統計 - 總計: {len(unified_stream)}, 售出: {sales_count}, 利潤入庫: {profit_count}, 其他: {other_count}")
+        cash_logger.debug("DEBUG: 流水記錄統計 - 總計: %s, 售出: %s, 利潤入庫: %s, 其他: %s", len(unified_stream), sales_count, profit_count, other_count)
         
         # 計算分頁
         total_records = len(unified_stream)
@@ -10394,7 +11181,7 @@ def get_cash_management_transactions():
         })
     
     except Exception as e:
-        print(f"獲取分頁流水記錄時出錯: {e}")
+        cash_logger.error("獲取分頁流水記錄時出錯: %s", e)
         return jsonify({"status": "error", "message": f"系統錯誤: {str(e)}"}), 500
 
 
@@ -10406,7 +11193,7 @@ def get_cash_management_transactions_simple():
         page = request.args.get("page", 1, type=int)
         per_page = min(request.args.get("per_page", 10, type=int), 20)  # 限制更少
         
-        print(f"DEBUG: 簡化API請求 - 頁碼: {page}, 每頁: {per_page}")
+        cash_logger.debug("DEBUG: 簡化API請求 - 頁碼: %s, 每頁: %s", page, per_page)
         
         # 增加查詢數量以確保包含所有記錄類型
         limit = per_page * 3
@@ -10443,76 +11230,8 @@ def get_cash_management_transactions_simple():
                 .limit(limit)
             ).scalars().all()
         except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 簡化API ledger_entries 表格缺少欄位，嘗試修復...")
-                db.session.rollback()
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 簡化API添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 簡化API profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 簡化API添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 簡化API profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 簡化API添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 簡化API profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 簡化API添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 簡化API from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 簡化API添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 簡化API to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 簡化API欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    misc_entries = db.session.execute(
-                        db.select(LedgerEntry)
-                        .options(db.selectinload(LedgerEntry.account))
-                        .order_by(LedgerEntry.entry_date.desc())
-                        .limit(limit)
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 簡化API修復欄位失敗: {fix_error}")
-                    db.session.rollback()
-                    misc_entries = []
-            else:
-                print(f"[ERROR] 簡化API查詢LedgerEntry失敗: {e}")
-                misc_entries = []
+            cash_logger.error("[ERROR] 簡化API查詢LedgerEntry失敗: %s", e)
+            misc_entries = []
         
         unified_stream = []
         
@@ -10540,14 +11259,15 @@ def get_cash_management_transactions_simple():
                 })
         
         # 處理銷售記錄（簡化版，不計算複雜的利潤變動）
+        profits = FIFOService.calculate_profits_for_sales(sales)
         for s in sales:
             if s.customer:
                 # 簡化利潤計算
                 try:
-                    profit_info = FIFOService.calculate_profit_for_sale(s)
+                    profit_info = profits.get(s.id)
                     profit = profit_info['profit_twd'] if profit_info else 0
                 except Exception as e:
-                    print(f"DEBUG: 簡化API計算銷售{s.id}利潤失敗: {e}")
+                    cash_logger.error("DEBUG: 簡化API計算銷售%s利潤失敗: %s", s.id, e)
                     profit = 0
                 
                 # 計算RMB帳戶餘額變化
@@ -10782,7 +11502,7 @@ def get_cash_management_transactions_simple():
         end_idx = start_idx + per_page
         paginated_records = unified_stream[start_idx:end_idx]
         
-        print(f"DEBUG: 簡化API返回 {len(paginated_records)} 筆記錄")
+        cash_logger.debug("DEBUG: 簡化API返回 %s 筆記錄", len(paginated_records))
         
         return jsonify({
             "status": "success",
@@ -10800,9 +11520,7 @@ def get_cash_management_transactions_simple():
         })
         
     except Exception as e:
-        print(f"簡化API錯誤: {e}")
-        import traceback
-        traceback.print_exc()
+        cash_logger.exception("簡化API錯誤: %s", e)
         return jsonify({"status": "error", "message": f"系統錯誤: {str(e)}"}), 500
 
 
@@ -10838,78 +11556,13 @@ def get_cash_management_totals():
                 )
             ).scalars().all()
         except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 現金管理頁面 ledger_entries 表格缺少欄位，嘗試修復...")
-                db.session.rollback()  # 回滾失敗的事務
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 現金管理頁面欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    misc_entries = db.session.execute(
-                        db.select(LedgerEntry)
-                        .options(db.selectinload(LedgerEntry.account))
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 現金管理頁面修復欄位失敗: {fix_error}")
-                    misc_entries = []
-            else:
-                print(f"[ERROR] 現金管理頁面查詢LedgerEntry失敗: {e}")
-                misc_entries = []
+            cash_logger.error("[ERROR] 現金管理頁面查詢LedgerEntry失敗: %s", e)
+            misc_entries = []
         # 確保在乾淨的事務中查詢 cash_logs
         try:
             cash_logs = db.session.execute(db.select(CashLog)).scalars().all()
         except Exception as e:
-            print(f"警告: cash_logs 查詢失敗: {e}")
+            cash_logger.error("警告: cash_logs 查詢失敗: %s", e)
             db.session.rollback()
             cash_logs = []
 
@@ -11013,7 +11666,7 @@ def get_cash_management_totals():
         })
         
     except Exception as e:
-        app.logger.error(f"獲取現金管理總資產數據時發生錯誤: {e}")
+        cash_logger.error("獲取現金管理總資產數據時發生錯誤: %s", e)
         return jsonify({'error': '獲取數據失敗'}), 500
 
 
@@ -11087,7 +11740,7 @@ def api_add_user():
 
     except Exception as e:
         db.session.rollback()
-        print(f"!! Error in api_add_user: {e}")
+        logger.error("!! Error in api_add_user: %s", e)
         return (
             jsonify({"status": "error", "message": "伺服器內部錯誤，新增失敗。"}),
             500,
@@ -11115,7 +11768,7 @@ def api_delete_user(user_id):
         
         # 記錄刪除操作
         username = user_to_delete.username
-        print(f"管理員 {current_user.username} 正在刪除使用者 {username}")
+        logger.debug("管理員 %s 正在刪除使用者 %s", current_user.username, username)
         
         # 執行刪除
         db.session.delete(user_to_delete)
@@ -11267,78 +11920,13 @@ def get_account_balances_for_dropdowns():
                 )
             ).scalars().all()
         except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 現金管理頁面 ledger_entries 表格缺少欄位，嘗試修復...")
-                db.session.rollback()  # 回滾失敗的事務
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 現金管理頁面欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    misc_entries = db.session.execute(
-                        db.select(LedgerEntry)
-                        .options(db.selectinload(LedgerEntry.account))
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 現金管理頁面修復欄位失敗: {fix_error}")
-                    misc_entries = []
-            else:
-                print(f"[ERROR] 現金管理頁面查詢LedgerEntry失敗: {e}")
-                misc_entries = []
+            cash_logger.error("[ERROR] 現金管理頁面查詢LedgerEntry失敗: %s", e)
+            misc_entries = []
         # 確保在乾淨的事務中查詢 cash_logs
         try:
             cash_logs = db.session.execute(db.select(CashLog)).scalars().all()
         except Exception as e:
-            print(f"警告: cash_logs 查詢失敗: {e}")
+            cash_logger.error("警告: cash_logs 查詢失敗: %s", e)
             db.session.rollback()
             cash_logs = []
 
@@ -11525,7 +12113,7 @@ def get_account_balances_for_dropdowns():
         return owner_twd_accounts_grouped, owner_rmb_accounts_grouped
         
     except Exception as e:
-        print(f"獲取帳戶餘額時發生錯誤: {e}")
+        cash_logger.error("獲取帳戶餘額時發生錯誤: %s", e)
         return [], []
 
 
@@ -11564,78 +12152,13 @@ def get_accurate_account_balances():
                 )
             ).scalars().all()
         except Exception as e:
-            if "profit_before does not exist" in str(e) or "from_account_id does not exist" in str(e):
-                print("警告: 現金管理頁面 ledger_entries 表格缺少欄位，嘗試修復...")
-                db.session.rollback()  # 回滾失敗的事務
-                
-                # 嘗試添加缺失的欄位
-                try:
-                    # 檢查並添加利潤欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_before FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_before 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_before 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_after FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_after 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_after 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN profit_change FLOAT'))
-                        print("[OK] 現金管理頁面添加 profit_change 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 profit_change 欄位已存在")
-                        else:
-                            raise e
-                    
-                    # 檢查並添加轉帳欄位
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN from_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 from_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 from_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    try:
-                        db.session.execute(db.text('ALTER TABLE ledger_entries ADD COLUMN to_account_id INTEGER'))
-                        print("[OK] 現金管理頁面添加 to_account_id 欄位")
-                    except Exception as e:
-                        if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                            print("ℹ️ 現金管理頁面 to_account_id 欄位已存在")
-                        else:
-                            raise e
-                    
-                    db.session.commit()
-                    print("[OK] 現金管理頁面欄位修復完成，重新查詢...")
-                    
-                    # 重新查詢
-                    misc_entries = db.session.execute(
-                        db.select(LedgerEntry)
-                        .options(db.selectinload(LedgerEntry.account))
-                    ).scalars().all()
-                except Exception as fix_error:
-                    print(f"[ERROR] 現金管理頁面修復欄位失敗: {fix_error}")
-                    misc_entries = []
-            else:
-                print(f"[ERROR] 現金管理頁面查詢LedgerEntry失敗: {e}")
-                misc_entries = []
+            cash_logger.error("[ERROR] 現金管理頁面查詢LedgerEntry失敗: %s", e)
+            misc_entries = []
         # 確保在乾淨的事務中查詢 cash_logs
         try:
             cash_logs = db.session.execute(db.select(CashLog)).scalars().all()
         except Exception as e:
-            print(f"警告: cash_logs 查詢失敗: {e}")
+            cash_logger.error("警告: cash_logs 查詢失敗: %s", e)
             db.session.rollback()
             cash_logs = []
 
@@ -11738,7 +12261,7 @@ def get_accurate_account_balances():
                 'current_balance': 0  # 從0開始，基於交易紀錄計算
             }
         
-        print(f"調試：開始處理 {len(unified_stream)} 筆交易...")
+        cash_logger.debug("調試：開始處理 %s 筆交易...", len(unified_stream))
         
         # 按時間順序處理每筆交易，累積計算每個帳戶的餘額
         for i, transaction in enumerate(unified_stream):
@@ -11753,11 +12276,11 @@ def get_accurate_account_balances():
                 if acc_info['currency'] == 'TWD' and twd_change != 0:
                     old_balance = acc_info['current_balance']
                     acc_info['current_balance'] += twd_change
-                    print(f" 交易 {i+1}: {acc_info['name']} TWD {old_balance:,.2f} -> {acc_info['current_balance']:,.2f} (變動: {twd_change:,.2f})")
+                    cash_logger.debug(" 交易 %s: %s TWD %.2f -> %.2f (變動: %.2f)", i + 1, acc_info['name'], old_balance, acc_info['current_balance'], twd_change)
                 elif acc_info['currency'] == 'RMB' and rmb_change != 0:
                     old_balance = acc_info['current_balance']
                     acc_info['current_balance'] += rmb_change
-                    print(f" 交易 {i+1}: {acc_info['name']} RMB {old_balance:,.2f} -> {acc_info['current_balance']:,.2f} (變動: {rmb_change:,.2f})")
+                    cash_logger.debug(" 交易 %s: %s RMB %.2f -> %.2f (變動: %.2f)", i + 1, acc_info['name'], old_balance, acc_info['current_balance'], rmb_change)
             
             # 處理入款帳戶（通常是增加餘額）
             if deposit_account_id and deposit_account_id in account_balances:
@@ -11765,11 +12288,11 @@ def get_accurate_account_balances():
                 if acc_info['currency'] == 'TWD' and twd_change != 0:
                     old_balance = acc_info['current_balance']
                     acc_info['current_balance'] += twd_change
-                    print(f" 交易 {i+1}: {acc_info['name']} TWD {old_balance:,.2f} -> {acc_info['current_balance']:,.2f} (變動: {twd_change:,.2f})")
+                    cash_logger.debug(" 交易 %s: %s TWD %.2f -> %.2f (變動: %.2f)", i + 1, acc_info['name'], old_balance, acc_info['current_balance'], twd_change)
                 elif acc_info['currency'] == 'RMB' and rmb_change != 0:
                     old_balance = acc_info['current_balance']
                     acc_info['current_balance'] += rmb_change
-                    print(f" 交易 {i+1}: {acc_info['name']} RMB {old_balance:,.2f} -> {acc_info['current_balance']:,.2f} (變動: {rmb_change:,.2f})")
+                    cash_logger.debug(" 交易 %s: %s RMB %.2f -> %.2f (變動: %.2f)", i + 1, acc_info['name'], old_balance, acc_info['current_balance'], rmb_change)
             
             # 特殊處理：如果沒有明確的出款/入款帳戶，但有金額變動
             if not payment_account_id and not deposit_account_id:
@@ -11836,7 +12359,7 @@ def get_accurate_account_balances():
         return owner_twd_accounts_grouped, owner_rmb_accounts_grouped
         
     except Exception as e:
-        print(f"獲取準確帳戶餘額時發生錯誤: {e}")
+        cash_logger.error("獲取準確帳戶餘額時發生錯誤: %s", e)
         return [], []
 
 
@@ -11851,15 +12374,15 @@ def remote_data_recovery():
         # 檢查是否有管理員權限（這裡可以根據您的權限系統調整）
         # 例如檢查 session 或 token
         
-        print(" 開始遠程數據修復...")
+        logger.info(" 開始遠程數據修復...")
         
         # 檢查資料庫連接
         try:
             from sqlalchemy import text
             db.session.execute(text("SELECT 1"))
-            print(" 資料庫連接正常")
+            logger.info(" 資料庫連接正常")
         except Exception as db_error:
-            print(f"資料庫連接失敗: {db_error}")
+            logger.error("資料庫連接失敗: %s", db_error)
             return jsonify({
                 "status": "error",
                 "message": f"資料庫連接失敗: {str(db_error)}",
@@ -11867,12 +12390,12 @@ def remote_data_recovery():
             }), 500
         
         # 1. 修復庫存數據（基於實際的 FIFOInventory 結構）
-        print("📦 修復庫存數據...")
+        logger.info("📦 修復庫存數據...")
         try:
             inventories = FIFOInventory.query.all()
-            print(f"找到 {len(inventories)} 個庫存批次")
+            logger.info("找到 %s 個庫存批次", len(inventories))
         except Exception as inv_error:
-            print(f"查詢庫存數據失敗: {inv_error}")
+            logger.error("查詢庫存數據失敗: %s", inv_error)
             return jsonify({
                 "status": "error",
                 "message": f"查詢庫存數據失敗: {str(inv_error)}",
@@ -11901,12 +12424,12 @@ def remote_data_recovery():
             })
         
         # 2. 修復現金帳戶餘額
-        print(" 修復現金帳戶餘額...")
+        logger.info(" 修復現金帳戶餘額...")
         try:
             cash_accounts = CashAccount.query.all()
-            print(f"找到 {len(cash_accounts)} 個現金帳戶")
+            logger.info("找到 %s 個現金帳戶", len(cash_accounts))
         except Exception as cash_error:
-            print(f"查詢現金帳戶失敗: {cash_error}")
+            logger.error("查詢現金帳戶失敗: %s", cash_error)
             return jsonify({
                 "status": "error",
                 "message": f"查詢現金帳戶失敗: {str(cash_error)}",
@@ -11976,12 +12499,12 @@ def remote_data_recovery():
             })
         
         # 3. 修復客戶應收帳款
-        print("📋 修復客戶應收帳款...")
+        logger.info("📋 修復客戶應收帳款...")
         try:
             customers = Customer.query.all()
-            print(f"找到 {len(customers)} 個客戶")
+            logger.info("找到 %s 個客戶", len(customers))
         except Exception as cust_error:
-            print(f"查詢客戶數據失敗: {cust_error}")
+            logger.error("查詢客戶數據失敗: %s", cust_error)
             return jsonify({
                 "status": "error",
                 "message": f"查詢客戶數據失敗: {str(cust_error)}",
@@ -12026,7 +12549,7 @@ def remote_data_recovery():
         
         total_receivables = Customer.query.with_entities(func.sum(Customer.total_receivables_twd)).scalar() or 0
         
-        print(" 遠程數據修復完成！")
+        logger.info(" 遠程數據修復完成！")
         
         return jsonify({
             "status": "success",
@@ -12056,8 +12579,7 @@ def remote_data_recovery():
         })
 
     except Exception as e:
-        print(f"遠程數據修復失敗: {e}")
-        traceback.print_exc()
+        logger.exception("遠程數據修復失敗: %s", e)
         db.session.rollback()
         
         return jsonify({
@@ -12150,4 +12672,5 @@ if __name__ == "__main__":
     # 啟動時修復PostgreSQL欄位
     with app.app_context():
         fix_postgresql_columns()
+    startup()
     app.run(debug=True)
@@ -0,0 +1,103 @@
+"""
+應用程式日誌設定
+所有日誌經由佇列交給背景執行緒輸出，請求執行緒只負責把記錄放進佇列，
+不會因 stdout 緩慢（例如 Render 的日誌收集）而被阻塞。
+
+環境變數：
+    LOG_LEVEL              全域等級，預設 INFO（FLASK_DEBUG=1 時為 DEBUG）
+    LOG_LEVEL_FIFO         FIFO 庫存/銷售分配
+    LOG_LEVEL_CASH         現金帳戶、買入、轉帳
+    LOG_LEVEL_SETTLEMENT   應收帳款銷帳
+    LOG_LEVEL_PROFIT       利潤帳本
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+ROOT_LOGGER_NAME = "sales_system"
+SUBSYSTEMS = ("fifo", "cash", "settlement", "profit")
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+
+class ProcessQueueHandler(logging.handlers.QueueHandler):
+    """每個行程在第一次寫入時啟動自己的 QueueListener。
+
+    gunicorn 以 preload_app 載入後才 fork worker，master 的背景執行緒不會被
+    子行程繼承，因此以 pid 判斷是否需要為目前行程重新建立佇列與監聽器。
+    """
+
+    def __init__(self, target_handlers):
+        super().__init__(queue.SimpleQueue())
+        self._target_handlers = list(target_handlers)
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            # fork 前殘留在佇列中的記錄已由父行程輸出，子行程使用新的佇列
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(
+                self.queue, *self._target_handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = pid
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        super().enqueue(record)
+
+    def stop(self):
+        """停止監聽器並輸出佇列中剩餘的記錄（僅限建立它的行程）"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+def _level_from_env(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    level = logging.getLevelName(value.strip().upper())
+    return level if isinstance(level, int) else default
+
+
+def configure_logging(debug=None):
+    """設定 sales_system 日誌樹，重複呼叫不會重複加入 handler"""
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    if getattr(root, "_sales_system_configured", False):
+        return root
+
+    if debug is None:
+        debug = os.environ.get("FLASK_DEBUG", "").lower() in ("1", "true", "yes")
+    root.setLevel(_level_from_env("LOG_LEVEL", logging.DEBUG if debug else logging.INFO))
+    for subsystem in SUBSYSTEMS:
+        level = _level_from_env(f"LOG_LEVEL_{subsystem.upper()}", logging.NOTSET)
+        logging.getLogger(f"{ROOT_LOGGER_NAME}.{subsystem}").setLevel(level)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    queue_handler = ProcessQueueHandler([stream_handler])
+    root.addHandler(queue_handler)
+    # 不往 Python root logger 傳遞，避免 gunicorn/flask 的 handler 重複輸出
+    root.propagate = False
+    root._sales_system_configured = True
+    atexit.register(queue_handler.stop)
+    return root
+
+
+def get_logger(subsystem=None):
+    """取得 sales_system 或其子系統（fifo/cash/settlement/profit）的 logger"""
+    if subsystem is None:
+        return logging.getLogger(ROOT_LOGGER_NAME)
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{subsystem}")
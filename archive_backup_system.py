@@ -7,13 +7,17 @@
 """
 
 import os
+import shutil
 import sys
 import pandas as pd
 import psycopg2
 from datetime import datetime, timedelta
-from google.cloud import storage
 import logging
 
+import archive_store
+import object_store
+import streaming_backup
+
 # 設置日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -34,20 +38,21 @@ class ArchiveBackupSystem:
         self.database_url = os.getenv('DATABASE_URL')
         self.gcs_credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
         self.gcs_bucket_name = os.getenv('GCS_BUCKET_NAME')
+        self.backup_format = os.getenv('BACKUP_FORMAT', 'csv.gz')  # xlsx 為舊版整表載入模式
+        self.chunk_rows = int(os.getenv('BACKUP_CHUNK_ROWS', streaming_backup.DEFAULT_CHUNK_ROWS))
+        self.workers = int(os.getenv('BACKUP_WORKERS', streaming_backup.DEFAULT_WORKERS))
+        self.store = object_store.from_env()
+        # 分批歸檔：每段筆數、段間暫停與等鎖上限
+        self.archive_chunk_rows = int(os.getenv('ARCHIVE_CHUNK_ROWS', archive_store.DEFAULT_ARCHIVE_CHUNK_ROWS))
+        self.archive_pause_seconds = float(os.getenv('ARCHIVE_PAUSE_SECONDS', archive_store.DEFAULT_PAUSE_SECONDS))
+        self.archive_lock_timeout_ms = int(os.getenv('ARCHIVE_LOCK_TIMEOUT_MS', archive_store.DEFAULT_LOCK_TIMEOUT_MS))
         
         logger.info("=== 三合一資料管理系統初始化 ===")
         logger.info(f"保留資料: 最近 {self.KEEP_MONTHS} 個月")
         logger.info(f"歸檔界線: {self.archive_date.strftime('%Y-%m-%d')}")
         
-        # 需要歷史歸檔的資料表（可配置）
-        self.archivable_tables = {
-            'sales_records': 'created_at',      # 銷售記錄
-            'purchase_records': 'created_at',   # 採購記錄
-            'cash_logs': 'created_at',          # 現金記錄
-            'ledger_entries': 'created_at',     # 分類帳條目
-            # 'users': None,                    # 用戶表不歸檔
-            # 'customers': None,                # 客戶表不歸檔
-        }
+        # 需要歷史歸檔的資料表 → 日期欄位（可配置）
+        self.archivable_tables = dict(archive_store.ARCHIVE_TABLES)
 
     def connect_database(self):
         """連接資料庫"""
@@ -73,9 +78,14 @@ class ArchiveBackupSystem:
             """)
             tables = [row[0] for row in cursor.fetchall()]
             cursor.close()
+            # psycopg2 預設不自動提交，查詢也會開啟交易；先結束它，步驟2 才能調整 session 的隔離等級
+            self.conn.rollback()
             
             backup_files = []
             
+            if self.backup_format != 'xlsx':
+                return self._full_backup_streaming(tables)
+            
             for table in tables:
                 logger.info(f"備份資料表: {table}")
                 df = pd.read_sql_query(f"SELECT * FROM {table}", self.conn)
@@ -96,67 +106,57 @@ class ArchiveBackupSystem:
             logger.error(f"❌ 完整備份失敗: {str(e)}")
             return []
 
+    def _full_backup_streaming(self, tables):
+        """以 COPY / 分批游標串流寫出 gzip CSV（或 Parquet），附一份 Excel 摘要"""
+        output_dir = f"full_backup_{self.timestamp}"
+        results = streaming_backup.backup_database(
+            self.database_url, output_dir, self.backup_format, self.chunk_rows,
+            tables=tables, excel_summary=True, workers=self.workers,
+        )
+        backup_files = [os.path.join(output_dir, result['file']) for result in results if result['file'] and result['rows']]
+        backup_files.append(os.path.join(output_dir, "backup_summary.xlsx"))
+        self.store.upload_many(
+            [(path, f"full_backups/{self.timestamp[:8]}/{path.replace(os.sep, '/')}") for path in backup_files],
+            metadata=self._metadata("full_backups"),
+        )
+        logger.info(f"✅ 完整備份完成: {len(backup_files)} 個檔案")
+        return backup_files
+
     def step2_archive_old_data(self):
-        """步驟2: 歷史資料歸檔"""
+        """步驟2: 歷史資料歸檔（依月份分區的欄式檔 + 分區索引，歸檔後仍可依日期區間查詢）
+
+        依外鍵順序逐表處理：先在一致的快照內寫出分區檔，再以約 ARCHIVE_CHUNK_ROWS 筆為一段，
+        每段在短交易內比對內容雜湊後刪除，段與段之間暫停，營業時間也能執行；中斷後會從上次的進度繼續。
+        """
         logger.info("📦 === 步驟2: 歷史資料歸檔 ===")
         
-        archived_files = []
-        space_saved = 0
-        
-        for table, date_column in self.archivable_tables.items():
-            if not date_column:
-                continue
-                
-            try:
-                logger.info(f"處理資料表: {table}")
-                
-                # 查詢舊資料
-                archive_query = f"""
-                    SELECT * FROM {table} 
-                    WHERE {date_column} < %s
-                    ORDER BY {date_column}
-                """
-                
-                df_archive = pd.read_sql_query(
-                    archive_query, 
-                    self.conn, 
-                    params=[self.archive_date]
-                )
-                
-                if df_archive.empty:
-                    logger.info(f"⚪ {table}: 沒有需要歸檔的資料")
-                    continue
-                
-                # 保存歷史資料到 Excel
-                archive_filename = f"archive_{table}_{self.timestamp}.xlsx"
-                df_archive.to_excel(archive_filename, index=False, engine='openpyxl')
-                archived_files.append(archive_filename)
-                
-                # 上傳歷史資料到 GCS
-                gcs_path = f"archives/{self.timestamp[:6]}/{archive_filename}"
-                self.upload_to_gcs(archive_filename, gcs_path)
-                
-                # 計算要刪除的記錄數
-                record_count = len(df_archive)
-                
-                # 刪除資料庫中的舊資料
-                cursor = self.conn.cursor()
-                delete_query = f"DELETE FROM {table} WHERE {date_column} < %s"
-                cursor.execute(delete_query, [self.archive_date])
-                deleted_count = cursor.rowcount
-                self.conn.commit()
-                cursor.close()
-                
-                space_saved += deleted_count
-                
-                logger.info(f"✅ {table}: 歸檔 {record_count} 筆，刪除 {deleted_count} 筆")
-                
-            except Exception as e:
-                logger.error(f"❌ 歸檔 {table} 失敗: {str(e)}")
-                self.conn.rollback()
+        work_dir = f"archive_{self.timestamp}"
+        # 前面的步驟可能留下未結束的交易（例如步驟1 失敗時），set_session 不能在交易中呼叫
+        self.conn.rollback()
+        archiver = archive_store.ChunkedArchiver(
+            self.conn, "postgresql", self.store, self.archive_date, self.timestamp, work_dir,
+            chunk_rows=self.archive_chunk_rows, pause_seconds=self.archive_pause_seconds,
+            lock_timeout_ms=self.archive_lock_timeout_ms,
+            plan=[step for step in archive_store.ARCHIVE_PLAN if step[0] in self.archivable_tables],
+        )
+        try:
+            summary = archiver.run()
+        except Exception as e:
+            if not archiver.resumable:
+                logger.error(f"❌ 歸檔失敗，沒有任何資料被歸檔: {str(e)}")
+                raise
+            logger.error(f"❌ 歸檔中斷（下次執行會從進度繼續）: {str(e)}")
+            summary = {}
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
         
+        space_saved = sum(result["deleted"] for result in summary.values())
+        skipped = sum(result["skipped_chunks"] for result in summary.values())
+        if skipped:
+            logger.warning(f"⚠️ {skipped} 段在歸檔後有變動或等不到鎖，保留在資料庫，下次歸檔再處理")
         logger.info(f"📉 總計節省資料庫空間: 約 {space_saved} 筆記錄")
-        return archived_files
+        # 分區檔直接寫入物件儲存，沒有需要清理的本地檔案
+        return []
 
     def step3_create_query_index(self):
         """步驟3: 創建歷史資料查詢索引"""
@@ -168,9 +168,10 @@ class ArchiveBackupSystem:
                 '備份日期': self.timestamp[:8],
                 '歸檔界線': self.archive_date.strftime('%Y-%m-%d'),
                 '保留政策': f'最近 {self.KEEP_MONTHS} 個月',
-                '歸檔位置': f'gs://{self.gcs_bucket_name}/archives/{self.timestamp[:6]}/',
+                '歸檔位置': self.store.url(f'{archive_store.ARCHIVE_PREFIX}/'),
+                '分區索引': self.store.url(archive_store.INDEX_KEY),
                 '完整備份位置': f'gs://{self.gcs_bucket_name}/full_backups/{self.timestamp[:8]}/',
-                '查詢說明': '歷史資料可從 GCS archives 資料夾下載查詢'
+                '查詢說明': '歷史資料依月份分區存放，以 archive_store.ArchiveReader 依日期區間查詢'
             }
             
             # 統計當前資料庫狀態
@@ -200,8 +201,8 @@ class ArchiveBackupSystem:
                 # 查詢說明
                 query_guide = pd.DataFrame([
                     {'步驟': 1, '說明': '查詢最近6個月資料：直接使用主資料庫'},
-                    {'步驟': 2, '說明': '查詢歷史資料：從 GCS archives 下載對應檔案'},
-                    {'步驟': 3, '說明': '完整資料查詢：結合資料庫 + GCS 歷史檔案'},
+                    {'步驟': 2, '說明': '查詢歷史資料：ArchiveReader.query(資料表, 起, 迄) 只讀取重疊的月份分區'},
+                    {'步驟': 3, '說明': '完整資料查詢：/api/archive/history 與客戶交易紀錄（include_archived=1）自動合併資料庫與歸檔'},
                     {'步驟': 4, '說明': '緊急恢復：使用 full_backups 完整備份'}
                 ])
                 query_guide.to_excel(writer, sheet_name='查詢指南', index=False)
@@ -218,21 +219,17 @@ class ArchiveBackupSystem:
             logger.error(f"❌ 創建查詢索引失敗: {str(e)}")
             return None
 
+    def _metadata(self, upload_type):
+        return {
+            'source': 'archive-backup-system',
+            'timestamp': self.timestamp,
+            'type': upload_type
+        }
+
     def upload_to_gcs(self, local_file, gcs_path):
         """上傳到 GCS"""
         try:
-            client = storage.Client.from_service_account_json(self.gcs_credentials_path)
-            bucket = client.bucket(self.gcs_bucket_name)
-            blob = bucket.blob(gcs_path)
-            
-            blob.upload_from_filename(local_file)
-            blob.metadata = {
-                'source': 'archive-backup-system',
-                'timestamp': self.timestamp,
-                'type': gcs_path.split('/')[0]
-            }
-            blob.patch()
-            
+            self.store.upload(local_file, gcs_path, metadata=self._metadata(gcs_path.split('/')[0]))
             return True
         except Exception as e:
             logger.error(f"❌ 上傳失敗 {local_file}: {str(e)}")
@@ -291,6 +288,8 @@ class ArchiveBackupSystem:
             # 清理本地檔案
             if all_files:
                 self.cleanup_local_files(all_files)
+            if os.path.isdir(f"full_backup_{self.timestamp}"):
+                shutil.rmtree(f"full_backup_{self.timestamp}", ignore_errors=True)
 
 def main():
     try:
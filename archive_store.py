@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+可查詢的歷史歸檔層
+把超過保留期限的資料列依日期欄位按月分區，寫成欄式檔（Parquet，未安裝 pyarrow 時為 gzip CSV）存到物件儲存：
+
+    archives/<資料表>/year=YYYY/month=MM/part-<run_id>.parquet
+    archives/_index.json        分區索引：每個分區檔的筆數、日期與 id 範圍、SHA-256
+    archives/_progress.json     ChunkedArchiver 的進度（中斷後從下一段繼續）
+
+ArchiveReader 依索引只讀取與查詢日期區間重疊的分區（partition pruning），下載過的分區檔快取在本地；
+Parquet 另以欄位條件下推到 row group 統計值。應用程式透過 ArchiveHistoryService 把歸檔列與資料庫中的列合併。
+
+環境變數：
+    ARCHIVE_FORMAT      parquet（預設，需 pyarrow）或 csv.gz
+    ARCHIVE_CACHE_DIR   分區檔的本地快取目錄，預設為系統暫存目錄下的 archive_cache
+    ARCHIVE_CHUNK_ROWS / ARCHIVE_PAUSE_SECONDS / ARCHIVE_LOCK_TIMEOUT_MS
+                        分批刪除的每段筆數、段間暫停與等鎖上限（archive_backup_system.py 讀取）
+"""
+
+import csv
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+import streaming_backup
+from streaming_backup import DEFAULT_CHUNK_ROWS, file_sha256, quote_ident, table_columns
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PREFIX = "archives"
+INDEX_KEY = f"{ARCHIVE_PREFIX}/_index.json"
+PROGRESS_KEY = f"{ARCHIVE_PREFIX}/_progress.json"
+# 帶有 profit_before / profit_after 的利潤流水類型，與 app.ProfitService.LEDGER_ENTRY_TYPES 相同
+PROFIT_LEDGER_TYPES = ("PROFIT_EARNED", "PROFIT_WITHDRAW", "PROFIT_DEDUCT", "PROFIT_REVERSAL", "PROFIT_RECONCILE")
+# 歸檔順序（依外鍵由子到父）：(資料表, 分區日期欄位, 額外條件)。條件中的 {cutoff} 換成歸檔界線的參數，
+# {profit_types} 換成 PROFIT_LEDGER_TYPES 的 SQL 字串常值。
+# 父表只歸檔已沒有子列的資料，子表因驗證失敗留在資料庫時，父表也會跟著留下。
+ARCHIVE_PLAN = (
+    ("fifo_sales_allocations", "allocation_date",
+     "sales_record_id IN (SELECT id FROM sales_records WHERE created_at < {cutoff})"),
+    ("transactions", "transaction_date",
+     "sales_record_id IN (SELECT id FROM sales_records WHERE created_at < {cutoff})"),
+    ("sales_records", "created_at",
+     "NOT EXISTS (SELECT 1 FROM fifo_sales_allocations a WHERE a.sales_record_id = sales_records.id) "
+     "AND NOT EXISTS (SELECT 1 FROM transactions t WHERE t.sales_record_id = sales_records.id)"),
+    # 仍有庫存的批次是 FIFO 的現行狀態，只歸檔已用完且沒有分配紀錄的批次
+    ("fifo_inventory", "purchase_date",
+     "remaining_rmb <= 0 "
+     "AND NOT EXISTS (SELECT 1 FROM fifo_sales_allocations a WHERE a.fifo_inventory_id = fifo_inventory.id)"),
+    ("pending_payments", "created_at",
+     "is_settled AND purchase_record_id IN (SELECT id FROM purchase_records WHERE purchase_date < {cutoff})"),
+    ("purchase_records", "purchase_date",
+     "NOT EXISTS (SELECT 1 FROM fifo_inventory f WHERE f.purchase_record_id = purchase_records.id) "
+     "AND NOT EXISTS (SELECT 1 FROM pending_payments p WHERE p.purchase_record_id = purchase_records.id)"),
+    # 系統總利潤是利潤流水最新一筆的 profit_after（app.ProfitService.get_total_profit），最新一筆必須留在資料庫
+    ("ledger_entries", "entry_date",
+     "id < COALESCE((SELECT MAX(l.id) FROM ledger_entries l WHERE l.entry_type IN ({profit_types}) "
+     "AND l.profit_after IS NOT NULL), id + 1)"),
+    ("cash_logs", "time", None),
+)
+# 刪除這些資料表的列時，在同一交易內把 data_versions 中對應的版本加一（app.ProfitTimeSeriesService 的快取版本）
+VERSIONED_TABLES = {"sales_records": "profit_series", "fifo_sales_allocations": "profit_series"}
+# 可歸檔的資料表 → 分區用的日期欄位
+ARCHIVE_TABLES = {table: date_column for table, date_column, _ in ARCHIVE_PLAN}
+DEFAULT_ARCHIVE_CHUNK_ROWS = 5_000
+DEFAULT_PAUSE_SECONDS = 0.5
+DEFAULT_LOCK_TIMEOUT_MS = 2_000
+INDEX_TTL_SECONDS = 300
+
+
+def default_format():
+    fmt = os.getenv("ARCHIVE_FORMAT")
+    if fmt:
+        return fmt
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return "csv.gz"
+    return "parquet"
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+
+def _bound(value, dialect):
+    # SQLite 以字串保存時間，以相同格式比較
+    return value.isoformat(sep=" ") if dialect == "sqlite" else value
+
+
+def partition_key(table, month, run_id, fmt):
+    return f"{ARCHIVE_PREFIX}/{table}/year={month:%Y}/month={month:%m}/part-{run_id}.{fmt}"
+
+
+def archive_table(conn, dialect, table, date_column, cutoff, store, work_dir, run_id, fmt=None,
+                  chunk_rows=DEFAULT_CHUNK_ROWS, where=None, params=()):
+    """把 date_column < cutoff 的列依月份寫成分區檔並上傳，回傳 (分區索引項目的 list, 欄位定義)
+
+    where / params 可再限制範圍（例如只歸檔某段 id）。每個分區在寫檔前先在同一連線上取得筆數與 id 範圍，
+    呼叫端據此驗證、刪除；連線應處於一致的快照（REPEATABLE READ）中。
+    """
+    fmt = fmt or default_format()
+    mark = streaming_backup._placeholder(dialect)
+    column = quote_ident(date_column)
+    extra = f" AND ({where})" if where else ""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN({column}), MAX({column}) FROM {quote_ident(table)} WHERE {column} < {mark}{extra}",
+                   (_bound(cutoff, dialect),) + tuple(params))
+    first, last = (_as_datetime(value) for value in cursor.fetchone())
+    cursor.close()
+    columns = table_columns(conn, dialect, table)
+    if first is None:
+        return [], columns
+
+    os.makedirs(work_dir, exist_ok=True)
+    entries = []
+    month = month_start(first)
+    while month <= last:
+        upper = min(next_month(month), cutoff)
+        range_where = f"{column} >= {mark} AND {column} < {mark}{extra}"
+        range_params = (_bound(month, dialect), _bound(upper, dialect)) + tuple(params)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*), MIN(id), MAX(id), MIN({column}), MAX({column}) "
+                       f"FROM {quote_ident(table)} WHERE {range_where}", range_params)
+        count, min_id, max_id, min_date, max_date = cursor.fetchone()
+        cursor.close()
+        if count:
+            name = f"{table}-{month:%Y%m}-{run_id}"
+            result = streaming_backup.dump_table(conn, dialect, table, work_dir, fmt, chunk_rows,
+                                                 range_where, range_params, columns=columns, name=name)
+            path = os.path.join(work_dir, result["file"])
+            if result["rows"] != count:
+                raise RuntimeError(f"{table} {month:%Y-%m} 寫出 {result['rows']} 筆，與查詢的 {count} 筆不符")
+            key = partition_key(table, month, run_id, fmt)
+            store.upload(path, key, metadata={"source": "archive-store", "table": table, "rows": str(count)})
+            entries.append({
+                "partition": f"{month:%Y-%m}",
+                "key": key,
+                "format": fmt,
+                "csv_null": result.get("csv_null"),
+                "rows": count,
+                "bytes": result["bytes"],
+                "sha256": file_sha256(path),
+                "min_date": _as_datetime(min_date).isoformat(sep=" "),
+                "max_date": _as_datetime(max_date).isoformat(sep=" "),
+                "min_id": min_id,
+                "max_id": max_id,
+                "run_id": run_id,
+                "archived_at": datetime.now().isoformat(timespec="seconds"),
+            })
+            os.remove(path)
+        month = next_month(month)
+    logger.info(f"🗄️ {table}: {sum(entry['rows'] for entry in entries)} 筆寫入 {len(entries)} 個分區")
+    return entries, columns
+
+
+def load_index(store):
+    text = store.read_text(INDEX_KEY)
+    return json.loads(text) if text else {"version": 1, "tables": {}}
+
+
+def add_to_index(store, table, date_column, columns, entries):
+    """把新分區加入索引並寫回（整份索引一次覆寫）"""
+    index = load_index(store)
+    table_index = index["tables"].setdefault(table, {"date_column": date_column, "partitions": []})
+    table_index["date_column"] = date_column
+    table_index["columns"] = [list(column) for column in columns]
+    # 中斷後重跑同一次歸檔會產生相同的鍵值，以新的項目取代
+    keys = {entry["key"] for entry in entries}
+    table_index["partitions"] = [entry for entry in table_index["partitions"] if entry["key"] not in keys] + entries
+    table_index["partitions"].sort(key=lambda entry: (entry["partition"], entry["run_id"]))
+    index["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    store.upload_bytes(json.dumps(index, ensure_ascii=False, indent=2), INDEX_KEY, content_type="application/json")
+    return index
+
+
+def _csv_converter(declared, null):
+    """null 為分區檔的 NULL 標記：新的分區檔是 CSV_NULL，加入標記之前寫出的以空欄位表示 NULL"""
+    kind = streaming_backup._value_kind(declared)
+    if kind == "bool":
+        return lambda value: None if value == null else value.lower() in ("t", "true", "1")
+    if kind == "number":
+        if "int" in declared:
+            return lambda value: None if value == null else int(value)
+        return lambda value: None if value == null else float(value)
+    if "timestamp" in declared or "datetime" in declared:
+        return lambda value: None if value == null else datetime.fromisoformat(value)
+    return lambda value: None if value == null else value
+
+
+class ArchiveReader:
+    """依分區索引查詢歸檔資料"""
+
+    def __init__(self, store, cache_dir=None, index_ttl=INDEX_TTL_SECONDS):
+        self.store = store
+        self.cache_dir = cache_dir or os.getenv("ARCHIVE_CACHE_DIR") or os.path.join(tempfile.gettempdir(),
+                                                                                      "archive_cache")
+        self.index_ttl = index_ttl
+        self._index = None
+        self._index_loaded = 0
+        self._lock = threading.Lock()
+
+    def index(self):
+        with self._lock:
+            if self._index is None or time.monotonic() - self._index_loaded > self.index_ttl:
+                self._index = load_index(self.store)
+                self._index_loaded = time.monotonic()
+            return self._index
+
+    def tables(self):
+        return sorted(self.index()["tables"])
+
+    def partitions(self, table, start=None, end=None):
+        """與 [start, end) 重疊的分區；其餘分區不下載、不讀取"""
+        table_index = self.index()["tables"].get(table)
+        if not table_index:
+            return []
+        return [entry for entry in table_index["partitions"]
+                if (start is None or datetime.fromisoformat(entry["max_date"]) >= start)
+                and (end is None or datetime.fromisoformat(entry["min_date"]) < end)]
+
+    def _local_file(self, entry):
+        """分區檔不會被改寫（每次歸檔是新的 part），下載一次即可重複使用"""
+        path = os.path.join(self.cache_dir, entry["key"].replace("/", os.sep))
+        if not os.path.exists(path) or os.path.getsize(path) != entry["bytes"]:
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            if not self.store.download(entry["key"], temp_path):
+                raise FileNotFoundError(f"歸檔分區不存在: {self.store.url(entry['key'])}")
+            os.replace(temp_path, path)
+        return path
+
+    def _read_partition(self, entry, columns, date_column, start, end, filters):
+        path = self._local_file(entry)
+        if entry["format"] == "parquet":
+            import pyarrow.parquet as pq
+
+            conditions = [(name, "==", value) for name, value in filters.items()]
+            if start is not None:
+                conditions.append((date_column, ">=", start))
+            if end is not None:
+                conditions.append((date_column, "<", end))
+            return pq.read_table(path, filters=conditions or None).to_pylist()
+
+        null = entry.get("csv_null") or ""
+        converters = {name: _csv_converter(declared, null) for name, declared in columns}
+        unknown = _csv_converter("text", null)
+        rows = []
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as handle:
+            for raw in csv.DictReader(handle):
+                row = {name: converters.get(name, unknown)(value) for name, value in raw.items()}
+                if any(row.get(name) != value for name, value in filters.items()):
+                    continue
+                moment = row.get(date_column)
+                if moment is not None and ((start is not None and moment < start) or (end is not None and moment >= end)):
+                    continue
+                rows.append(row)
+        return rows
+
+    def query(self, table, start=None, end=None, limit=None, **filters):
+        """回傳 [start, end) 內、符合 filters（欄位 == 值）的歸檔列（dict），依日期欄位排序
+
+        指定 limit 時只回傳最早的 limit 筆：分區依月份由早到晚讀取，已讀到的列中早於下一個分區起始日的
+        已有 limit 筆時就停止，之後的分區不下載、不讀取。
+        """
+        table_index = self.index()["tables"].get(table)
+        if not table_index:
+            return []
+        date_column = table_index["date_column"]
+        columns = [tuple(column) for column in table_index.get("columns", [])]
+        # 未通過刪除前驗證的列會在之後的歸檔再寫一次，同一個 id 以較新的歸檔（run_id 較大）為準
+        by_id = {}
+        rows = []
+        for entry in sorted(self.partitions(table, start, end), key=lambda entry: (entry["min_date"], entry["run_id"])):
+            if limit is not None and len(rows) + len(by_id) >= limit:
+                boundary = datetime.fromisoformat(entry["min_date"])
+                settled = sum(1 for _, row in by_id.values() if row.get(date_column) is not None
+                              and row[date_column] < boundary)
+                settled += sum(1 for row in rows if row.get(date_column) is not None and row[date_column] < boundary)
+                if settled >= limit:
+                    break
+            for row in self._read_partition(entry, columns, date_column, start, end, filters):
+                if row.get("id") is None:
+                    rows.append(row)
+                elif row["id"] not in by_id or by_id[row["id"]][0] <= entry["run_id"]:
+                    by_id[row["id"]] = (entry["run_id"], row)
+        rows.extend(row for _, row in by_id.values())
+        rows.sort(key=lambda row: (row.get(date_column) is None, row.get(date_column) or datetime.min, row.get("id") or 0))
+        return rows if limit is None else rows[:limit]
+
+
+class ChunkedArchiver:
+    """分批歸檔：每張表先在一致的快照內複製到分區檔並規劃 id 區段，再逐段驗證、刪除
+
+    每段（預設 5000 筆）是一個短交易：以 SELECT ... FOR UPDATE 鎖住該段的列、重新計算內容雜湊並與複製時
+    比對，相符才刪除；列在複製後被修改、或等不到鎖（lock_timeout）時跳過該段，留待下次歸檔。
+    段與段之間暫停 pause_seconds，讓營業時間的寫入不會被長時間擋住。進度存在物件儲存的
+    archives/_progress.json，中斷後以同一個 run_id 與歸檔界線從下一段繼續。
+    """
+
+    def __init__(self, conn, dialect, store, cutoff, run_id, work_dir, fmt=None, chunk_rows=DEFAULT_ARCHIVE_CHUNK_ROWS,
+                 pause_seconds=DEFAULT_PAUSE_SECONDS, lock_timeout_ms=DEFAULT_LOCK_TIMEOUT_MS, plan=ARCHIVE_PLAN):
+        self.conn = conn
+        self.dialect = dialect
+        self.store = store
+        self.cutoff = cutoff
+        self.run_id = run_id
+        self.work_dir = work_dir
+        self.fmt = fmt or default_format()
+        self.chunk_rows = chunk_rows
+        self.pause_seconds = pause_seconds
+        self.lock_timeout_ms = lock_timeout_ms
+        self.plan = plan
+        self.progress = None
+        # 物件儲存中有這次歸檔的進度時，失敗後可以從進度繼續；還沒寫下進度就失敗則不行
+        self.resumable = False
+
+    def _qualifier(self, qualifier):
+        """把 plan 的額外條件換成 (SQL, 參數)，沒有條件時回傳 (None, ())"""
+        if not qualifier:
+            return None, ()
+        mark = streaming_backup._placeholder(self.dialect)
+        qualifier = qualifier.replace("{profit_types}", ", ".join(f"'{name}'" for name in PROFIT_LEDGER_TYPES))
+        return (qualifier.replace("{cutoff}", mark),
+                (_bound(self.cutoff, self.dialect),) * qualifier.count("{cutoff}"))
+
+    def _predicate(self, date_column, qualifier):
+        """回傳 (WHERE 條件, 參數)；與 archive_table 的範圍相同：日期早於界線且符合額外條件"""
+        extra, extra_params = self._qualifier(qualifier)
+        where = f"{quote_ident(date_column)} < {streaming_backup._placeholder(self.dialect)}"
+        if extra:
+            where += f" AND ({extra})"
+        return where, (_bound(self.cutoff, self.dialect),) + extra_params
+
+    def _set_snapshot(self, enabled):
+        if self.dialect == "postgresql":
+            self.conn.set_session(isolation_level="REPEATABLE READ" if enabled else "READ COMMITTED")
+
+    def _save_progress(self):
+        self.progress["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        self.store.upload_bytes(json.dumps(self.progress, ensure_ascii=False, indent=2), PROGRESS_KEY,
+                                content_type="application/json")
+        self.resumable = True
+
+    def _load_progress(self):
+        """未完成的進度沿用原本的 run_id 與歸檔界線；否則開始新的一次"""
+        text = self.store.read_text(PROGRESS_KEY)
+        progress = json.loads(text) if text else None
+        if progress and not progress.get("completed_at"):
+            self.run_id = progress["run_id"]
+            self.cutoff = datetime.fromisoformat(progress["cutoff"])
+            logger.info(f"↩️ 接續未完成的歸檔 {self.run_id}（界線 {progress['cutoff']}）")
+            self.resumable = True
+            return progress
+        return {"run_id": self.run_id, "cutoff": self.cutoff.isoformat(sep=" "),
+                "started_at": datetime.now().isoformat(timespec="seconds"), "tables": {}}
+
+    def copy_table(self, table, date_column, qualifier):
+        """在同一個快照內寫出分區檔並規劃刪除區段，回傳表的進度項目"""
+        where, params = self._predicate(date_column, qualifier)
+        self._set_snapshot(True)
+        try:
+            # archive_table 自己加上日期條件，這裡只傳額外條件
+            extra, extra_params = self._qualifier(qualifier)
+            entries, columns = archive_table(self.conn, self.dialect, table, date_column, self.cutoff, self.store,
+                                             self.work_dir, self.run_id, self.fmt, where=extra, params=extra_params)
+            kinds = streaming_backup.value_kinds(columns)
+            id_index = [name for name, _ in columns].index("id")
+            chunks = []
+            query = streaming_backup.select_sql(table, columns, where) + " ORDER BY id"
+            for rows in streaming_backup.iter_chunks(self.conn, self.dialect, query, params, self.chunk_rows,
+                                                     name=f"plan_{table}"):
+                chunks.append({"lo": rows[0][id_index], "hi": rows[-1][id_index], "rows": len(rows),
+                               "hash": streaming_backup.format_digest(streaming_backup.rows_digest(rows, kinds))})
+            archived = sum(entry["rows"] for entry in entries)
+            planned = sum(chunk["rows"] for chunk in chunks)
+            if archived != planned:
+                raise RuntimeError(f"{table} 歸檔 {archived} 筆與規劃刪除的 {planned} 筆不符")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self._set_snapshot(False)
+        if entries:
+            add_to_index(self.store, table, date_column, columns, entries)
+        return {"status": "copied", "columns": [list(column) for column in columns], "chunks": chunks,
+                "next_chunk": 0, "archived": archived, "deleted": 0, "skipped": []}
+
+    def delete_chunk(self, table, date_column, qualifier, columns, chunk):
+        """驗證並刪除一段，回傳刪除筆數；內容與複製時不同或等不到鎖時回傳 None（不刪除）"""
+        where, params = self._predicate(date_column, qualifier)
+        mark = streaming_backup._placeholder(self.dialect)
+        where = f"id >= {mark} AND id <= {mark} AND {where}"
+        params = (chunk["lo"], chunk["hi"]) + params
+        cursor = self.conn.cursor()
+        try:
+            if self.dialect == "postgresql":
+                cursor.execute(f"SET LOCAL lock_timeout = {int(self.lock_timeout_ms)}")
+            lock = " FOR UPDATE" if self.dialect == "postgresql" else ""
+            cursor.execute(streaming_backup.select_sql(table, columns, where) + lock, params)
+            rows = cursor.fetchall()
+            if not rows:
+                # 上次中斷在提交刪除之後、寫回進度之前
+                logger.info(f"{table} id {chunk['lo']}-{chunk['hi']}: 已不在資料庫")
+                self.conn.rollback()
+                return 0
+            digest = streaming_backup.format_digest(streaming_backup.rows_digest(rows, streaming_backup.value_kinds(columns)))
+            if len(rows) != chunk["rows"] or digest != chunk["hash"]:
+                logger.warning(f"⚠️ {table} id {chunk['lo']}-{chunk['hi']}: 複製後已變更，保留在資料庫")
+                self.conn.rollback()
+                return None
+            cursor.execute(f"DELETE FROM {quote_ident(table)} WHERE {where}", params)
+            if cursor.rowcount != chunk["rows"]:
+                logger.warning(f"⚠️ {table} id {chunk['lo']}-{chunk['hi']}: 刪除 {cursor.rowcount} 筆與預期不符，已還原")
+                self.conn.rollback()
+                return None
+            if table in VERSIONED_TABLES:
+                cursor.execute(f"UPDATE data_versions SET version = version + 1 WHERE name = {mark}",
+                               (VERSIONED_TABLES[table],))
+            self.conn.commit()
+            return chunk["rows"]
+        except Exception as e:
+            # 等不到鎖、外鍵仍被參照等情況：這段留待下次
+            logger.warning(f"⚠️ {table} id {chunk['lo']}-{chunk['hi']}: {str(e).strip()}，保留在資料庫")
+            self.conn.rollback()
+            return None
+        finally:
+            cursor.close()
+
+    def run(self):
+        """依 plan 的順序逐表歸檔，回傳 {資料表: {archived, deleted, skipped_chunks}}"""
+        # 連線可能還留著呼叫端查詢開啟的交易（psycopg2 不自動提交），set_session 不能在交易中呼叫
+        self.conn.rollback()
+        self.progress = self._load_progress()
+        summary = {}
+        for table, date_column, qualifier in self.plan:
+            state = self.progress["tables"].get(table)
+            if state is None:
+                logger.info(f"處理資料表: {table}")
+                state = self.progress["tables"][table] = self.copy_table(table, date_column, qualifier)
+                self._save_progress()
+            columns = [tuple(column) for column in state["columns"]]
+            while state["next_chunk"] < len(state["chunks"]):
+                chunk = state["chunks"][state["next_chunk"]]
+                deleted = self.delete_chunk(table, date_column, qualifier, columns, chunk)
+                if deleted is None:
+                    state["skipped"].append(state["next_chunk"])
+                else:
+                    state["deleted"] += deleted
+                state["next_chunk"] += 1
+                self._save_progress()
+                if self.pause_seconds:
+                    time.sleep(self.pause_seconds)
+            state["status"] = "done"
+            summary[table] = {"archived": state["archived"], "deleted": state["deleted"],
+                              "skipped_chunks": len(state["skipped"])}
+            logger.info(f"✅ {table}: 歸檔 {state['archived']} 筆，刪除 {state['deleted']} 筆"
+                        f"（{len(state['chunks'])} 段，略過 {len(state['skipped'])} 段）")
+        self.progress["completed_at"] = datetime.now().isoformat(timespec="seconds")
+        self._save_progress()
+        return summary
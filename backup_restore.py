@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+備份還原工具
+把 streaming_backup 產生的備份還原到資料庫：從指定的 run（預設最新一次）沿著 previous 往回找到完整基準，
+依序重播基準與之後的每一次增量。
+
+每張表的還原方式：
+    完整匯出的檔案      以 DELETE 清空資料表後載入（PostgreSQL 使用 COPY FROM STDIN）
+    增量檔案            依 id 覆蓋（先刪除同 id 的列再插入）
+    最後一次的 id 清單  刪除清單中已不存在的列（套用備份期間的刪除）
+
+目標資料庫需已有資料表結構（flask db upgrade），或加上 --create-schema 以應用程式的模型建立。
+PostgreSQL 上還原期間以 session_replication_role = replica 暫停外鍵檢查，需要足夠的權限。
+
+用法：
+    python backup_restore.py --backup-root backups --database-url sqlite:///restored.db --create-schema
+    python backup_restore.py --backup-root backups --run 20250101_020000 --database-url postgresql://.../scratch
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streaming_backup
+from streaming_backup import RUN_FILE, connect, quote_ident, table_columns
+
+logger = logging.getLogger(__name__)
+
+INSERT_CHUNK = 5_000
+
+
+def load_run(backup_root, run_id):
+    with open(os.path.join(backup_root, run_id, RUN_FILE), encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def latest_run_id(backup_root):
+    runs = sorted(name for name in os.listdir(backup_root)
+                  if os.path.exists(os.path.join(backup_root, name, RUN_FILE)))
+    if not runs:
+        raise FileNotFoundError(f"{backup_root} 中沒有任何備份")
+    return runs[-1]
+
+
+def resolve_chain(backup_root, run_id=None):
+    """回傳從完整基準到指定 run 的 run 清單（舊到新）"""
+    run = load_run(backup_root, run_id or latest_run_id(backup_root))
+    chain = [run]
+    while run["type"] != "full":
+        if not run.get("previous"):
+            raise ValueError(f"增量備份 {run['run_id']} 缺少前一次備份的紀錄")
+        run = load_run(backup_root, run["previous"])
+        chain.append(run)
+    chain.reverse()
+    return chain
+
+
+def _converters(dialect, columns, header, null=streaming_backup.CSV_NULL):
+    """CSV 讀出的都是字串：只有 NULL 標記視為 NULL（空欄位是空字串）
+
+    SQLite 目標另把布林 t/f 轉成 1/0，浮點數欄位先以 Python 轉成 float：
+    SQLite 自己把文字轉成 REAL 時偶爾差最後一位，還原後的內容雜湊就與備份不符。
+    """
+    declared = dict(columns)
+
+    def convert_bool(value):
+        return {"t": 1, "true": 1, "1": 1, "f": 0, "false": 0, "0": 0}.get(value.lower(), value)
+
+    def convert_float(value):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+    result = []
+    for name in header:
+        kind = declared.get(name, "")
+        if dialect == "sqlite" and kind.startswith("bool"):
+            result.append(lambda value: None if value == null else convert_bool(value))
+        elif dialect == "sqlite" and streaming_backup._value_kind(kind) == "number" and "int" not in kind:
+            result.append(lambda value: None if value == null else convert_float(value))
+        else:
+            result.append(lambda value: None if value == null else value)
+    return result
+
+
+def csv_null(entry):
+    """備份項目的 CSV NULL 標記；加入標記之前的舊備份以空欄位表示 NULL"""
+    return entry.get("csv_null", "")
+
+
+def iter_file_rows(path, dialect, columns, chunk_rows=INSERT_CHUNK, null=streaming_backup.CSV_NULL):
+    """逐批讀出備份檔的列，回傳 (欄位名稱, 批次產生器)；null 為 CSV 的 NULL 標記"""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path)
+        header = parquet.schema_arrow.names
+
+        def parquet_batches():
+            for batch in parquet.iter_batches(batch_size=chunk_rows):
+                data = batch.to_pydict()
+                yield [tuple(_sqlite_value(data[name][index], dialect) for name in header)
+                       for index in range(batch.num_rows)]
+
+        return header, parquet_batches()
+
+    handle = gzip.open(path, "rt", encoding="utf-8", newline="")
+    reader = csv.reader(handle)
+    header = next(reader)
+    convert = _converters(dialect, columns, header, null)
+
+    def csv_batches():
+        try:
+            batch = []
+            for row in reader:
+                batch.append(tuple(fn(value) for fn, value in zip(convert, row)))
+                if len(batch) >= chunk_rows:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            handle.close()
+
+    return header, csv_batches()
+
+
+def _sqlite_value(value, dialect):
+    if dialect == "sqlite" and hasattr(value, "isoformat") and not isinstance(value, str):
+        return value.isoformat(sep=" ") if hasattr(value, "hour") else value.isoformat()
+    return value
+
+
+class Restorer:
+    """一個還原 worker 的專屬連線"""
+
+    def __init__(self, database_url):
+        self.conn, self.dialect = connect(database_url)
+        if self.dialect == "postgresql":
+            cursor = self.conn.cursor()
+            cursor.execute("SET session_replication_role = replica")
+            cursor.close()
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    @property
+    def mark(self):
+        return "%s" if self.dialect == "postgresql" else "?"
+
+    def _insert(self, cursor, table, header, rows):
+        columns = ", ".join(quote_ident(name) for name in header)
+        if self.dialect == "postgresql":
+            from psycopg2.extras import execute_values
+
+            execute_values(cursor, f"INSERT INTO {quote_ident(table)} ({columns}) VALUES %s", rows,
+                           page_size=len(rows))
+        else:
+            marks = ", ".join("?" for _ in header)
+            cursor.executemany(f"INSERT INTO {quote_ident(table)} ({columns}) VALUES ({marks})", rows)
+
+    def load_full(self, table, path, columns, null=streaming_backup.CSV_NULL):
+        """清空資料表後載入完整匯出的檔案，回傳載入筆數"""
+        cursor = self.conn.cursor()
+        # 不用 TRUNCATE：被其他表外鍵參照的資料表即使在 replica 模式下也不能單獨 TRUNCATE，
+        # 而 DELETE 的外鍵檢查是觸發器，replica 模式下不會執行，各表可以平行清空
+        cursor.execute(f"DELETE FROM {quote_ident(table)}")
+        if self.dialect == "postgresql" and path.endswith(".csv.gz"):
+            with gzip.open(path, "rb") as handle:
+                header = next(csv.reader([handle.readline().decode("utf-8")]))
+                column_list = ", ".join(quote_ident(name) for name in header)
+                cursor.copy_expert(
+                    f"COPY {quote_ident(table)} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{null}')",
+                    handle,
+                )
+                loaded = cursor.rowcount
+        else:
+            header, batches = iter_file_rows(path, self.dialect, columns, null=null)
+            loaded = 0
+            for rows in batches:
+                self._insert(cursor, table, header, rows)
+                loaded += len(rows)
+        cursor.close()
+        return loaded
+
+    def upsert(self, table, path, columns, null=streaming_backup.CSV_NULL):
+        """依 id 覆蓋增量檔案中的列，回傳套用筆數"""
+        header, batches = iter_file_rows(path, self.dialect, columns, null=null)
+        id_index = header.index("id")
+        cursor = self.conn.cursor()
+        applied = 0
+        for rows in batches:
+            ids = [row[id_index] for row in rows]
+            marks = ", ".join(self.mark for _ in ids)
+            cursor.execute(f"DELETE FROM {quote_ident(table)} WHERE id IN ({marks})", ids)
+            self._insert(cursor, table, header, rows)
+            applied += len(rows)
+        cursor.close()
+        return applied
+
+    def apply_id_list(self, table, path):
+        """刪除 id 清單中已不存在的列，回傳刪除筆數"""
+        keep = f"_restore_keep_{table}"
+        cursor = self.conn.cursor()
+        cursor.execute(f"CREATE TEMPORARY TABLE {quote_ident(keep)} (id BIGINT PRIMARY KEY)")
+        header, batches = iter_file_rows(path, self.dialect, [("id", "integer")])
+        for rows in batches:
+            self._insert(cursor, keep, header, rows)
+        cursor.execute(f"DELETE FROM {quote_ident(table)} WHERE id NOT IN (SELECT id FROM {quote_ident(keep)})")
+        deleted = cursor.rowcount
+        cursor.execute(f"DROP TABLE {quote_ident(keep)}")
+        cursor.close()
+        return deleted
+
+    def reset_sequence(self, table, columns):
+        if self.dialect != "postgresql" or "id" not in dict(columns):
+            return
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (quote_ident(table),))
+        sequence = cursor.fetchone()[0]
+        if sequence:
+            cursor.execute(f"SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {quote_ident(table)}), 1))",
+                           (sequence,))
+        cursor.close()
+
+    def restore_table(self, backup_root, chain, table):
+        """依序重播基準與增量，回傳 {table, rows_loaded, rows_upserted, rows_deleted, seconds}"""
+        started = time.perf_counter()
+        columns = table_columns(self.conn, self.dialect, table)
+        if not columns:
+            raise ValueError(f"目標資料庫沒有資料表 {table}")
+        summary = {"table": table, "rows_loaded": 0, "rows_upserted": 0, "rows_deleted": 0, "source": None}
+        last_entry, last_run = None, None
+        try:
+            for run in chain:
+                entry = run["tables"].get(table)
+                if not entry or not entry.get("file"):
+                    continue
+                path = os.path.join(backup_root, run["run_id"], entry["file"])
+                if entry.get("hwm_from") is None:
+                    summary["rows_loaded"] = self.load_full(table, path, columns, csv_null(entry))
+                    summary["rows_upserted"] = 0
+                else:
+                    summary["rows_upserted"] += self.upsert(table, path, columns, csv_null(entry))
+                last_entry, last_run = entry, run
+            if last_entry is None:
+                raise ValueError(f"備份鏈中沒有 {table} 的成功備份")
+            if last_entry.get("ids_file"):
+                summary["rows_deleted"] = self.apply_id_list(
+                    table, os.path.join(backup_root, last_run["run_id"], last_entry["ids_file"]))
+            self.reset_sequence(table, columns)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        summary["source"] = last_run["run_id"]
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        return summary
+
+
+def create_schema(database_url):
+    """以應用程式的模型在目標資料庫建立資料表（app 在 import 時綁定 DATABASE_URL，需在新的行程中執行）"""
+    if "app" in sys.modules:
+        raise RuntimeError("app 已載入，無法改用其他資料庫建立結構")
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import app as app_module
+
+    with app_module.app.app_context():
+        app_module.db.create_all()
+
+
+def restore_backup(backup_root, database_url, run_id=None, workers=streaming_backup.DEFAULT_WORKERS, tables=None):
+    """把備份鏈還原到 database_url，回傳每表結果的 list；各資料表由 worker 池平行還原"""
+    chain = resolve_chain(backup_root, run_id)
+    target = chain[-1]
+    names = sorted(tables or [table for table, entry in target["tables"].items() if entry.get("file")])
+    logger.info(f"還原 {target['run_id']}（基準 {chain[0]['run_id']}，{len(chain) - 1} 次增量），{len(names)} 個資料表")
+
+    if database_url.startswith("sqlite"):
+        # SQLite 同時只允許一個寫入者
+        workers = 1
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    def run(table):
+        restorer = getattr(local, "restorer", None)
+        if restorer is None:
+            restorer = local.restorer = Restorer(database_url)
+            with opened_lock:
+                opened.append(restorer)
+        try:
+            result = restorer.restore_table(backup_root, chain, table)
+            logger.info(f"✅ {table}: 載入 {result['rows_loaded']} 筆，增量 {result['rows_upserted']} 筆，"
+                        f"刪除 {result['rows_deleted']} 筆（{result['seconds']} 秒）")
+        except Exception as e:
+            logger.error(f"❌ 還原資料表 {table} 失敗: {str(e)}")
+            result = {"table": table, "error": str(e)}
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names) or 1)),
+                                thread_name_prefix="restore") as pool:
+            return list(pool.map(run, names))
+    finally:
+        for restorer in opened:
+            restorer.close()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    parser = argparse.ArgumentParser(description="重播完整基準與增量備份，還原到資料庫")
+    parser.add_argument("--backup-root", default="backups", help="streaming_backup 的備份根目錄")
+    parser.add_argument("--run", help="要還原到哪一次備份（預設最新）")
+    parser.add_argument("--database-url", required=True, help="還原目標資料庫")
+    parser.add_argument("--create-schema", action="store_true", help="先以應用程式模型建立資料表")
+    parser.add_argument("--tables", help="只還原這些資料表（逗號分隔）")
+    parser.add_argument("--workers", type=int, default=streaming_backup.DEFAULT_WORKERS)
+    args = parser.parse_args(argv)
+
+    if args.create_schema:
+        create_schema(args.database_url)
+    tables = [name.strip() for name in args.tables.split(",") if name.strip()] if args.tables else None
+    results = restore_backup(args.backup_root, args.database_url, args.run, args.workers, tables)
+    failed = [result["table"] for result in results if result.get("error")]
+    logger.info(f"📥 還原完成: {len(results) - len(failed)}/{len(results)} 個資料表")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
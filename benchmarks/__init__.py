@@ -0,0 +1,5 @@
+"""
+效能基準測試工具
+datagen 依固定亂數種子產生可重現的合成資料庫，run_benchmarks 在其上計時核心計算，
+loadtest 對本機服務做並發 HTTP 壓測，query_budget 檢查各端點的 SQL 查詢次數預算。
+"""
@@ -0,0 +1,391 @@
+"""
+合成資料產生器
+以固定亂數種子產生一份可重現、帳務一致的資料庫：買入 → FIFO 庫存、售出 → FIFO 分配與利潤流水、
+銷帳、內部轉帳。所有資料在 Python 端依時間軸模擬後以批次 INSERT 寫入，十萬筆等級也能在數十秒內完成。
+
+用法：
+    python -m benchmarks.datagen --scale 10k --database-url sqlite:////tmp/bench_10k.db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+BASE_DATE = datetime(2025, 1, 1)
+INSERT_CHUNK = 5_000
+BENCH_PASSWORD = "bench123"
+COUNT_OVERRIDES = ("holders", "accounts", "customers", "channels", "purchases", "settlements", "transfers", "days")
+
+
+def scale_counts(sales):
+    """依售出筆數推算其他資料量（可再以命令列參數個別覆寫）"""
+    return {
+        "holders": max(3, min(20, sales // 5_000 + 3)),
+        "accounts": max(6, min(60, sales // 2_000 + 6)),
+        "customers": max(20, sales // 50),
+        "channels": max(5, min(50, sales // 2_000)),
+        "purchases": max(10, sales // 4),
+        "sales": sales,
+        "settlements": sales // 2,
+        "transfers": max(10, sales // 20),
+        "days": 365,
+    }
+
+
+def default_database_url(scale_name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", f"bench_{scale_name}.db")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return "sqlite:///" + path
+
+
+def load_app(database_url):
+    """以指定資料庫載入 app 模組（app 在 import 時讀取 DATABASE_URL，每個行程只能載入一次）"""
+    if "app" in sys.modules:
+        if os.environ.get("DATABASE_URL") != database_url:
+            raise RuntimeError("app 已以其他資料庫載入，請在新的行程中執行")
+        return sys.modules["app"]
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+    import app as app_module
+
+    return app_module
+
+
+class _Timeline:
+    """依時間順序模擬帳務，累積各資料表要寫入的列"""
+
+    def __init__(self, counts, rnd, password_hash):
+        self.counts = counts
+        self.rnd = rnd
+        self.rows = {name: [] for name in (
+            "users", "holders", "cash_accounts", "customers", "channels", "purchase_records",
+            "fifo_inventory", "sales_records", "fifo_sales_allocations", "ledger_entries",
+            "profit_transactions",
+        )}
+        self.rows["users"] = [
+            {"id": 1, "username": "admin", "password_hash": password_hash, "role": "admin"},
+            {"id": 2, "username": "operator", "password_hash": password_hash, "role": "operator"},
+        ]
+        self.balances = {}
+        self.profit_balances = {}
+        self.twd_accounts, self.rmb_accounts = [], []
+        self.lots = deque()
+        self.available_rmb = 0.0
+        self.open_sales = {}
+        self.total_profit = 0.0
+
+    # --- 主檔 ---------------------------------------------------------
+    def build_master_data(self):
+        counts = self.counts
+        for holder_id in range(1, counts["holders"] + 1):
+            self.rows["holders"].append({"id": holder_id, "name": f"持有人{holder_id:03d}", "is_active": True})
+        for account_id in range(1, counts["accounts"] + 1):
+            currency = "TWD" if account_id % 2 else "RMB"
+            self.rows["cash_accounts"].append({
+                "id": account_id,
+                "holder_id": (account_id - 1) // 2 % counts["holders"] + 1,
+                "name": f"{currency}帳戶{account_id:03d}",
+                "currency": currency,
+                "is_active": True,
+            })
+            (self.twd_accounts if currency == "TWD" else self.rmb_accounts).append(account_id)
+            self.balances[account_id] = 0.0
+            self.profit_balances[account_id] = 0.0
+        for customer_id in range(1, counts["customers"] + 1):
+            self.rows["customers"].append({"id": customer_id, "name": f"客戶{customer_id:05d}", "is_active": True})
+            self.open_sales[customer_id] = deque()
+        for channel_id in range(1, counts["channels"] + 1):
+            self.rows["channels"].append({"id": channel_id, "name": f"渠道{channel_id:03d}", "is_active": True})
+
+    def _ledger(self, when, entry_type, amount, description, account_id=None, **extra):
+        row = {
+            "id": len(self.rows["ledger_entries"]) + 1,
+            "entry_type": entry_type,
+            "account_id": account_id,
+            "amount": round(amount, 2),
+            "description": description,
+            "entry_date": when,
+            "operator_id": 1,
+            "profit_before": None,
+            "profit_after": None,
+            "profit_change": None,
+            "from_account_id": None,
+            "to_account_id": None,
+        }
+        row.update(extra)
+        self.rows["ledger_entries"].append(row)
+
+    # --- 事件 ---------------------------------------------------------
+    def purchase(self, when, rmb_amount=None, deposit_account_id=None):
+        rnd = self.rnd
+        rmb_amount = rmb_amount or round(rnd.uniform(5_000, 50_000), 2)
+        rate = round(rnd.uniform(4.20, 4.60), 4)
+        twd_cost = round(rmb_amount * rate, 2)
+        payment_account_id = rnd.choice(self.twd_accounts)
+        deposit_account_id = deposit_account_id or rnd.choice(self.rmb_accounts)
+        if self.balances[payment_account_id] < twd_cost:
+            # 先存入足夠的台幣，讓付款帳戶不會變成負數
+            deposit = round(twd_cost * 20, 2)
+            self._ledger(when - timedelta(microseconds=1), "DEPOSIT", deposit, "基準測試初始存款", payment_account_id)
+            self.balances[payment_account_id] += deposit
+        self.balances[payment_account_id] -= twd_cost
+        self.balances[deposit_account_id] += rmb_amount
+
+        purchase_id = len(self.rows["purchase_records"]) + 1
+        self.rows["purchase_records"].append({
+            "id": purchase_id,
+            "payment_account_id": payment_account_id,
+            "deposit_account_id": deposit_account_id,
+            "channel_id": rnd.randint(1, self.counts["channels"]),
+            "rmb_amount": rmb_amount,
+            "exchange_rate": rate,
+            "twd_cost": twd_cost,
+            "payment_status": "paid",
+            "purchase_date": when,
+            "operator_id": 1,
+        })
+        inventory = {
+            "id": purchase_id,
+            "purchase_record_id": purchase_id,
+            "rmb_amount": rmb_amount,
+            "remaining_rmb": rmb_amount,
+            "unit_cost_twd": rate,
+            "exchange_rate": rate,
+            "purchase_date": when,
+            "last_updated": when,
+        }
+        self.rows["fifo_inventory"].append(inventory)
+        self.lots.append(inventory)
+        self.available_rmb += rmb_amount
+
+    def sale(self, when):
+        rnd = self.rnd
+        rmb_amount = round(rnd.uniform(500, 10_000), 2)
+        rate = round(rnd.uniform(4.50, 4.90), 4)
+        twd_amount = round(rmb_amount * rate, 2)
+        customer_id = rnd.randint(1, self.counts["customers"])
+
+        account_id = rnd.choice(self.rmb_accounts)
+        if self.balances[account_id] < rmb_amount:
+            account_id = max(self.rmb_accounts, key=self.balances.__getitem__)
+        if self.balances[account_id] < rmb_amount or self.available_rmb < rmb_amount + 1:
+            self.purchase(when - timedelta(microseconds=1), max(rmb_amount * 5, 20_000), account_id)
+        self.balances[account_id] -= rmb_amount
+        self.available_rmb -= rmb_amount
+
+        sale_id = len(self.rows["sales_records"]) + 1
+        self.rows["sales_records"].append({
+            "id": sale_id,
+            "customer_id": customer_id,
+            "rmb_account_id": account_id,
+            "rmb_amount": rmb_amount,
+            "exchange_rate": rate,
+            "twd_amount": twd_amount,
+            "is_settled": False,
+            "created_at": when,
+            "operator_id": rnd.choice((1, 2)),
+        })
+
+        remaining, cost = rmb_amount, 0.0
+        while remaining > 1e-9:
+            lot = self.lots[0]
+            take = min(lot["remaining_rmb"], remaining)
+            lot["remaining_rmb"] = round(lot["remaining_rmb"] - take, 2)
+            lot["last_updated"] = when
+            remaining = round(remaining - take, 2)
+            allocated_cost = round(take * lot["unit_cost_twd"], 2)
+            cost += take * lot["exchange_rate"]
+            self.rows["fifo_sales_allocations"].append({
+                "id": len(self.rows["fifo_sales_allocations"]) + 1,
+                "fifo_inventory_id": lot["id"],
+                "sales_record_id": sale_id,
+                "allocated_rmb": take,
+                "allocated_cost_twd": allocated_cost,
+                "allocation_date": when,
+            })
+            if lot["remaining_rmb"] <= 0:
+                self.lots.popleft()
+
+        profit = twd_amount - cost
+        description = f"售出利潤：客戶{customer_id:05d}（售出ID {sale_id}）"
+        before = self.total_profit
+        self.total_profit = before + profit
+        self._ledger(
+            when, "PROFIT_EARNED", profit, description,
+            profit_before=before, profit_after=self.total_profit, profit_change=profit,
+        )
+        profit_before = self.profit_balances[account_id]
+        self.profit_balances[account_id] = profit_before + profit
+        self.rows["profit_transactions"].append({
+            "id": len(self.rows["profit_transactions"]) + 1,
+            "account_id": account_id,
+            "transaction_type": "PROFIT_EARNED",
+            "amount": profit,
+            "balance_before": profit_before,
+            "balance_after": self.profit_balances[account_id],
+            "related_transaction_id": sale_id,
+            "related_transaction_type": "SALES",
+            "description": description,
+            "operator_id": 1,
+            "created_at": when,
+        })
+        self.open_sales[customer_id].append(sale_id)
+
+    def settlement(self, when):
+        rnd = self.rnd
+        for _ in range(5):
+            customer_id = rnd.randint(1, self.counts["customers"])
+            if self.open_sales[customer_id]:
+                break
+        else:
+            return False
+        queue = self.open_sales[customer_id]
+        amount = 0.0
+        for _ in range(min(len(queue), rnd.randint(1, 3))):
+            sale = self.rows["sales_records"][queue.popleft() - 1]
+            sale["is_settled"] = True
+            amount += sale["twd_amount"]
+        account_id = rnd.choice(self.twd_accounts)
+        self.balances[account_id] += amount
+        self._ledger(when, "SETTLEMENT", amount, f"客戶 客戶{customer_id:05d} 銷帳", account_id)
+        return True
+
+    def transfer(self, when):
+        rnd = self.rnd
+        accounts = self.twd_accounts if rnd.random() < 0.5 else self.rmb_accounts
+        from_id, to_id = rnd.sample(accounts, 2)
+        amount = round(self.balances[from_id] * 0.1, 2)
+        if amount <= 0:
+            return False
+        self.balances[from_id] -= amount
+        self.balances[to_id] += amount
+        self._ledger(
+            when, "TRANSFER", amount, f"從 帳戶{from_id:03d} 轉入至 帳戶{to_id:03d}",
+            from_account_id=from_id, to_account_id=to_id,
+        )
+        return True
+
+    def run(self):
+        counts, rnd = self.counts, self.rnd
+        span = counts["days"] * 86_400
+        events = []
+        for kind in ("purchases", "sales", "settlements", "transfers"):
+            events.extend((rnd.uniform(0, span), kind) for _ in range(counts[kind]))
+        events.sort()
+        handlers = {
+            "purchases": lambda when: self.purchase(when),
+            "sales": self.sale,
+            "settlements": self.settlement,
+            "transfers": self.transfer,
+        }
+        for offset, kind in events:
+            handlers[kind](BASE_DATE + timedelta(seconds=offset))
+
+        receivables = {customer_id: 0.0 for customer_id in self.open_sales}
+        for customer_id, queue in self.open_sales.items():
+            for sale_id in queue:
+                receivables[customer_id] += self.rows["sales_records"][sale_id - 1]["twd_amount"]
+        for customer in self.rows["customers"]:
+            customer["total_receivables_twd"] = round(receivables[customer["id"]], 2)
+        for account in self.rows["cash_accounts"]:
+            account["balance"] = round(self.balances[account["id"]], 2)
+            account["profit_balance"] = round(self.profit_balances[account["id"]], 2)
+
+
+def _reset_sequences(db, tables):
+    """明確指定 id 寫入後，PostgreSQL 的序列需要推進到最大 id"""
+    if db.engine.dialect.name != "postgresql":
+        return
+    for table in tables:
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 1))"
+        ))
+
+
+def generate(app_module, counts, seed=42, reset=True):
+    """建立資料表並寫入合成資料，回傳各資料表筆數"""
+    from werkzeug.security import generate_password_hash
+
+    db = app_module.db
+    rnd = random.Random(seed)
+    timeline = _Timeline(counts, rnd, generate_password_hash(BENCH_PASSWORD))
+    timeline.build_master_data()
+    timeline.run()
+
+    tables = {
+        "users": app_module.User.__table__,
+        "holders": app_module.Holder.__table__,
+        "cash_accounts": app_module.CashAccount.__table__,
+        "customers": app_module.Customer.__table__,
+        "channels": app_module.Channel.__table__,
+        "purchase_records": app_module.PurchaseRecord.__table__,
+        "fifo_inventory": app_module.FIFOInventory.__table__,
+        "sales_records": app_module.SalesRecord.__table__,
+        "fifo_sales_allocations": app_module.FIFOSalesAllocation.__table__,
+        "ledger_entries": app_module.LedgerEntry.__table__,
+        "profit_transactions": app_module.ProfitTransaction.__table__,
+    }
+    with app_module.app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+        for name, table in tables.items():
+            rows = timeline.rows[name]
+            for start in range(0, len(rows), INSERT_CHUNK):
+                db.session.execute(table.insert(), rows[start:start + INSERT_CHUNK])
+        _reset_sequences(db, tables.values())
+        app_module.ProfitCubeService.rebuild()
+        db.session.commit()
+        app_module.ProfitTimeSeriesService.invalidate()
+    return {name: len(rows) for name, rows in timeline.rows.items()}
+
+
+def add_count_arguments(parser):
+    """其他腳本共用的資料量參數"""
+    parser.add_argument("--scale", default="1k", help=f"售出筆數：{'/'.join(SCALES)} 或整數")
+    parser.add_argument("--seed", type=int, default=42)
+    for name in COUNT_OVERRIDES:
+        parser.add_argument(f"--{name}", type=int, help=f"覆寫 {name} 數量")
+
+
+def counts_from_args(args):
+    sales = SCALES.get(args.scale) or int(args.scale)
+    counts = scale_counts(sales)
+    for name in counts:
+        value = getattr(args, name, None)
+        if value is not None:
+            counts[name] = value
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="產生基準測試用的合成資料庫")
+    add_count_arguments(parser)
+    parser.add_argument("--database-url", help="預設為 benchmarks/data/bench_<scale>.db（SQLite）")
+    parser.add_argument("--force", action="store_true", help="允許清空非 SQLite 資料庫")
+    args = parser.parse_args(argv)
+
+    database_url = args.database_url or default_database_url(args.scale)
+    if not database_url.startswith("sqlite") and not args.force:
+        parser.error("會清空目標資料庫；對非 SQLite 資料庫請加上 --force")
+    counts = counts_from_args(args)
+    app_module = load_app(database_url)
+    started = time.perf_counter()
+    written = generate(app_module, counts, seed=args.seed)
+    print(f"✅ 已產生 {database_url}（{time.perf_counter() - started:.1f} 秒）")
+    for name, count in written.items():
+        print(f"   {name}: {count:,}")
+    print(f"   登入帳號: admin / {BENCH_PASSWORD}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
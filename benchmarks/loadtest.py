@@ -0,0 +1,397 @@
+"""
+並發 HTTP 壓力測試
+以 datagen 產生的合成資料庫啟動本機服務（預設 gunicorn 4 個 worker），由多個執行緒各自登入後，
+依設定比例重放售出錄入、買入、銷帳、現金流水與儀表板請求，輸出各端點的吞吐量、p50/p95/p99 延遲與錯誤率。
+
+--concurrency 可給多個並發數（例如 4,8,16,32），逐級加壓，用來找出銷帳開始互相爭用的拐點。
+
+用法：
+    python -m benchmarks.loadtest --scale 10k --concurrency 4,8,16,32 --duration 30
+    python -m benchmarks.loadtest --url http://127.0.0.1:5000 --database-url postgresql://... --reuse
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import requests
+from sqlalchemy import create_engine, text
+
+from benchmarks import datagen
+from benchmarks.run_benchmarks import REPO_ROOT, _git, _mask_url
+
+DEFAULT_MIX = "sales_entry=35,buy_in=10,settlement=20,cash_transactions=20,dashboard=15"
+READY_TIMEOUT = 60
+
+
+class Fixtures:
+    """從資料庫讀出請求會用到的 id，讓產生的請求都能通過驗證"""
+
+    def __init__(self, database_url):
+        engine = create_engine(database_url)
+        try:
+            with engine.connect() as conn:
+                self.customers = [row[0] for row in conn.execute(text(
+                    "SELECT id FROM customers WHERE is_active AND total_receivables_twd > 1000"
+                ))]
+                self.all_customers = [row[0] for row in conn.execute(text(
+                    "SELECT id FROM customers WHERE is_active"
+                ))]
+                self.rmb_accounts = [row[0] for row in conn.execute(text(
+                    "SELECT id FROM cash_accounts WHERE is_active AND currency = 'RMB' AND balance > 50000"
+                ))]
+                self.twd_accounts = [row[0] for row in conn.execute(text(
+                    "SELECT id FROM cash_accounts WHERE is_active AND currency = 'TWD' AND balance > 50000"
+                ))]
+                self.settle_accounts = [row[0] for row in conn.execute(text(
+                    "SELECT id FROM cash_accounts WHERE is_active AND currency = 'TWD'"
+                ))]
+                self.channels = [row[0] for row in conn.execute(text(
+                    "SELECT id FROM channels WHERE is_active"
+                ))]
+        finally:
+            engine.dispose()
+        missing = [name for name in ("all_customers", "rmb_accounts", "settle_accounts", "channels")
+                   if not getattr(self, name)]
+        if missing:
+            raise RuntimeError(f"資料庫缺少壓測所需資料：{', '.join(missing)}")
+
+
+# --- 請求組成 -----------------------------------------------------------
+# 每個操作回傳 (method, path, kwargs)；rnd 為各執行緒自己的亂數產生器
+
+def op_sales_entry(rnd, fx):
+    rmb_amount = round(rnd.uniform(100, 2_000), 2)
+    rate = round(rnd.uniform(4.60, 4.80), 4)
+    return "POST", "/api/sales-entry", {"json": {
+        "customer_id": str(rnd.choice(fx.all_customers)),
+        "rmb_account_id": str(rnd.choice(fx.rmb_accounts)),
+        "rmb_amount": rmb_amount,
+        "exchange_rate": rate,
+    }}
+
+
+def op_buy_in(rnd, fx):
+    return "POST", "/api/buy-in", {"json": {
+        "action": "record_purchase",
+        "payment_account_id": rnd.choice(fx.twd_accounts or fx.settle_accounts),
+        "deposit_account_id": rnd.choice(fx.rmb_accounts),
+        "rmb_amount": round(rnd.uniform(5_000, 20_000), 2),
+        "exchange_rate": round(rnd.uniform(4.20, 4.60), 4),
+        "channel_id": str(rnd.choice(fx.channels)),
+        "payment_status": "paid",
+    }}
+
+
+def op_settlement(rnd, fx):
+    # 小額銷帳，讓同一客戶能被反覆銷帳而不超過應收餘額
+    return "POST", "/api/settlement", {"json": {
+        "customer_id": rnd.choice(fx.customers or fx.all_customers),
+        "amount": round(rnd.uniform(10, 500), 2),
+        "account_id": rnd.choice(fx.settle_accounts),
+        "note": "壓力測試",
+    }}
+
+
+def op_cash_transactions(rnd, fx):
+    return "GET", "/api/cash_management/transactions", {"params": {
+        "page": rnd.choice((1, 1, 1, 2, 3)), "per_page": 20,
+    }}
+
+
+def op_dashboard(rnd, fx):
+    return "GET", "/dashboard", {}
+
+
+OPERATIONS = {
+    "sales_entry": op_sales_entry,
+    "buy_in": op_buy_in,
+    "settlement": op_settlement,
+    "cash_transactions": op_cash_transactions,
+    "dashboard": op_dashboard,
+}
+
+
+def parse_mix(spec):
+    """'sales_entry=35,dashboard=15' → [(名稱, 權重)]"""
+    mix = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"未知的操作 {name}，可用：{', '.join(OPERATIONS)}")
+        mix.append((name, float(weight or 1)))
+    if not mix:
+        raise ValueError("請求組成不可為空")
+    return mix
+
+
+# --- 統計 ---------------------------------------------------------------
+
+def percentile(ordered, fraction):
+    """最近秩百分位數（ordered 需已排序）"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize_endpoint(samples, elapsed):
+    latencies = sorted(latency for latency, _ok, _status in samples)
+    errors = sum(1 for _latency, ok, _status in samples if not ok)
+    statuses = defaultdict(int)
+    for _latency, _ok, status in samples:
+        statuses[str(status)] += 1
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+        "max_ms": _ms(latencies[-1] if latencies else None),
+        "statuses": dict(statuses),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+# --- 虛擬使用者 ---------------------------------------------------------
+
+def login(base_url, username, password, timeout):
+    session = requests.Session()
+    response = session.post(f"{base_url}/login", data={"username": username, "password": password},
+                            timeout=timeout)
+    if response.status_code != 200 or not response.url.rstrip("/").endswith("/dashboard"):
+        raise RuntimeError(f"登入失敗（{response.status_code} {response.url}）")
+    return session
+
+
+def _is_ok(response):
+    if response.status_code >= 400:
+        return False
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+        try:
+            payload = response.json()
+        except ValueError:
+            return False
+        if isinstance(payload, dict) and payload.get("status") == "error":
+            return False
+    return True
+
+
+def virtual_user(index, args, fixtures, mix, ready, go, timing, results, lock):
+    """登入後等所有使用者就緒才開始計時，避免登入時間算進第一輪"""
+    rnd = random.Random(args.seed * 1_000 + index)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    local = defaultdict(list)
+    session = login(args.url, args.username, args.password, args.timeout)
+    ready.wait()
+    go.wait()
+    warmup_end, deadline = timing["warmup_end"], timing["deadline"]
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        name = rnd.choices(names, weights)[0]
+        method, path, kwargs = OPERATIONS[name](rnd, fixtures)
+        began = time.perf_counter()
+        try:
+            response = session.request(method, args.url + path, timeout=args.timeout, **kwargs)
+            ok, status = _is_ok(response), response.status_code
+        except requests.RequestException as exc:
+            ok, status = False, type(exc).__name__
+        finished = time.perf_counter()
+        if began >= warmup_end:
+            local[name].append((finished - began, ok, status))
+        if args.think_ms:
+            time.sleep(rnd.uniform(0, 2 * args.think_ms) / 1000)
+    with lock:
+        for name, samples in local.items():
+            results[name].extend(samples)
+
+
+def run_level(args, fixtures, mix, concurrency):
+    """以指定並發數執行一輪，回傳這一輪的報告"""
+    results = defaultdict(list)
+    lock = threading.Lock()
+    ready = threading.Barrier(concurrency + 1)
+    go = threading.Event()
+    timing = {}
+    errors = []
+
+    def target(index):
+        try:
+            virtual_user(index, args, fixtures, mix, ready, go, timing, results, lock)
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as exc:
+            errors.append(f"使用者 {index}: {exc}")
+            ready.abort()
+
+    threads = [threading.Thread(target=target, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        pass
+    begin = time.perf_counter()
+    timing["warmup_end"] = begin + args.warmup
+    timing["deadline"] = begin + args.warmup + args.duration
+    go.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError("; ".join(errors[:3]))
+
+    measured = args.duration
+    endpoints = {name: summarize_endpoint(samples, measured) for name, samples in results.items()}
+    everything = [sample for samples in results.values() for sample in samples]
+    return {"concurrency": concurrency, "seconds": round(measured, 2),
+            "total": summarize_endpoint(everything, measured), "endpoints": endpoints}
+
+
+# --- 服務啟動 -----------------------------------------------------------
+
+def start_server(args, database_url):
+    env = dict(os.environ, DATABASE_URL=database_url, PERF_METRICS=os.environ.get("PERF_METRICS", "0"))
+    env.setdefault("LOG_LEVEL", "WARNING")
+    if args.server == "gunicorn":
+        command = ["gunicorn", "app:app", "-c", "gunicorn.conf.py", "-w", str(args.workers),
+                   "-b", f"127.0.0.1:{args.port}", "--log-level", "warning"]
+    else:
+        # Windows 無法使用 gunicorn：改用單一行程、多執行緒的開發伺服器
+        command = [sys.executable, "-c",
+                   "import app; app.startup(); "
+                   f"app.app.run(host='127.0.0.1', port={args.port}, threaded=True, use_reloader=False)"]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服務啟動失敗（exit {process.returncode}）")
+        try:
+            requests.get(f"{args.url}/login", timeout=2)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError(f"服務在 {READY_TIMEOUT} 秒內未就緒")
+
+
+def stop_server(process):
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def seed_database(args, database_url):
+    command = [sys.executable, "-m", "benchmarks.datagen", "--scale", args.scale, "--seed", str(args.seed),
+               "--database-url", database_url]
+    for name in datagen.COUNT_OVERRIDES:
+        if getattr(args, name) is not None:
+            command += [f"--{name}", str(getattr(args, name))]
+    if not database_url.startswith("sqlite"):
+        command.append("--force")
+    env = dict(os.environ, PERF_METRICS="0")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    if subprocess.run(command, cwd=REPO_ROOT, env=env).returncode != 0:
+        raise RuntimeError("產生合成資料失敗")
+
+
+def print_level(level):
+    print(f"\n[並發 {level['concurrency']}]  {level['seconds']} 秒")
+    print(f"   {'端點':<20}{'請求':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'錯誤率':>9}")
+    rows = sorted(level["endpoints"].items()) + [("TOTAL", level["total"])]
+    for name, stats in rows:
+        print(f"   {name:<20}{stats['requests']:>8}{stats['throughput_rps']:>10.1f}"
+              f"{stats['p50_ms'] or 0:>10.1f}{stats['p95_ms'] or 0:>10.1f}{stats['p99_ms'] or 0:>10.1f}"
+              f"{stats['error_rate'] * 100:>8.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="主要端點的並發 HTTP 壓力測試")
+    datagen.add_count_arguments(parser)
+    parser.add_argument("--database-url", help="預設為 benchmarks/data/load_<scale>.db（SQLite）")
+    parser.add_argument("--reuse", action="store_true", help="沿用既有資料庫，不重新產生")
+    parser.add_argument("--url", help="壓測已在執行的服務（不自行啟動）；仍需 --database-url 讀取測試資料")
+    parser.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn" if os.name != "nt" else "flask")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker 數")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--concurrency", default="8", help="並發使用者數，可用逗號分隔逐級加壓")
+    parser.add_argument("--duration", type=float, default=30.0, help="每一級的量測秒數")
+    parser.add_argument("--warmup", type=float, default=3.0, help="每一級開始時不計入統計的秒數")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="每個請求之間的平均停頓（毫秒）")
+    parser.add_argument("--timeout", type=float, default=30.0, help="單一請求逾時秒數")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"請求組成權重，預設 {DEFAULT_MIX}")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default=datagen.BENCH_PASSWORD)
+    parser.add_argument("--output", default="loadtest_report.json")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+        levels = [int(value) for value in args.concurrency.split(",") if value.strip()]
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.url and not args.database_url:
+        parser.error("使用 --url 時需一併指定 --database-url")
+
+    database_url = args.database_url or datagen.default_database_url(args.scale).replace("bench_", "load_")
+    external = bool(args.url)
+    args.url = (args.url or f"http://127.0.0.1:{args.port}").rstrip("/")
+
+    if not args.reuse and not external:
+        print(f"▶ 產生 {args.scale} 合成資料 ...", flush=True)
+        seed_database(args, database_url)
+    fixtures = Fixtures(database_url)
+
+    process = None
+    if not external:
+        print(f"▶ 啟動 {args.server}（{args.workers if args.server == 'gunicorn' else 1} 個 worker）...", flush=True)
+        process = start_server(args, database_url)
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "database": _mask_url(database_url),
+        "scale": args.scale,
+        "server": "external" if external else args.server,
+        "workers": None if external else args.workers,
+        "mix": dict(mix),
+        "levels": [],
+    }
+    try:
+        for concurrency in levels:
+            level = run_level(args, fixtures, mix, concurrency)
+            report["levels"].append(level)
+            print_level(level)
+    finally:
+        if process:
+            stop_server(process)
+
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    print(f"\n✅ 報告已寫入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
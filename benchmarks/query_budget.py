@@ -0,0 +1,225 @@
+"""
+端點查詢次數預算檢查
+對每個端點宣告 SQL 查詢次數上限，並在兩個資料量下各請求一次：超過預算，或查詢次數隨資料量增加
+（典型的 N+1，例如逐筆 calculate_profit_for_sale、逐批延遲載入 sales_allocations）都會以 exit 1 結束，
+可放進 CI 當作回歸檢查；同樣的預算也由 test_query_budget.py 以 pytest 檢查。
+
+每個資料量在獨立的子行程中執行（app 在 import 時就綁定資料庫）。
+
+用法：
+    python -m benchmarks.query_budget
+    python -m benchmarks.query_budget --scales 500,5000 --only dashboard,cash_transactions
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from benchmarks import datagen
+from benchmarks.run_benchmarks import REPO_ROOT
+
+# 名稱 → 請求與查詢次數上限；大資料量的查詢次數必須與小資料量相同（不允許任何差異）。
+# known_issue 標記已知、尚未修正的 N+1：違規時一樣算失敗並附上說明；只有明確加上 --allow-known 才暫時不計，
+# test_query_budget.py 則把這些端點標成 strict xfail。
+BUDGETS = {
+    "dashboard": {"method": "GET", "path": "/dashboard", "max_queries": 8},
+    "sales_entry_page": {"method": "GET", "path": "/sales-entry", "max_queries": 12},
+    "buy_in_page": {"method": "GET", "path": "/buy-in", "max_queries": 12},
+    "cash_management_page": {"method": "GET", "path": "/cash_management", "max_queries": 22},
+    "cash_transactions": {"method": "GET", "path": "/api/cash_management/transactions", "max_queries": 22},
+    "cash_totals": {"method": "GET", "path": "/api/cash_management/totals", "max_queries": 12},
+    "total_profit": {"method": "GET", "path": "/api/total-profit", "max_queries": 3},
+    "profit_history": {"method": "GET", "path": "/api/profit/history", "max_queries": 6},
+    "receivables_aging": {"method": "GET", "path": "/api/accounts-receivable/aging", "max_queries": 4},
+    "customer_transactions": {
+        "method": "GET", "path": "/api/customer/transactions/{customer_id}", "max_queries": 8,
+    },
+    "fifo_inventory_status": {"method": "GET", "path": "/api/fifo-inventory/status", "max_queries": 12},
+    "api_sales_entry": {"method": "POST", "path": "/api/sales-entry", "max_queries": 40, "json": {
+        "customer_id": "{customer_id}", "rmb_account_id": "{rmb_account_id}",
+        "rmb_amount": 500, "exchange_rate": 4.7,
+    }},
+    "api_settlement": {"method": "POST", "path": "/api/settlement", "max_queries": 30, "json": {
+        "customer_id": "{customer_id}", "amount": 100, "account_id": "{twd_account_id}", "note": "查詢預算檢查",
+    }},
+}
+
+MASTER_DATA = ("holders", "accounts", "customers", "channels")
+
+
+@contextmanager
+def count_queries(engine):
+    """在 with 區塊內累計送到資料庫的語句；yield 出的 list 收集每一條 SQL"""
+    from sqlalchemy import event
+
+    statements = []
+
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(" ".join(statement.split()))
+
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _placeholders(m):
+    """挑出請求會用到的 id（應收最多的客戶、餘額最多的 RMB / TWD 帳戶）"""
+    db = m.db
+    customer_id = db.session.execute(
+        db.select(m.Customer.id).order_by(m.Customer.total_receivables_twd.desc()).limit(1)
+    ).scalar_one()
+    accounts = {
+        currency: db.session.execute(
+            db.select(m.CashAccount.id).filter_by(currency=currency).order_by(m.CashAccount.balance.desc()).limit(1)
+        ).scalar_one()
+        for currency in ("RMB", "TWD")
+    }
+    return {"customer_id": customer_id, "rmb_account_id": accounts["RMB"], "twd_account_id": accounts["TWD"]}
+
+
+def _fill(value, ids):
+    if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
+        return str(ids[value[1:-1]])
+    return value
+
+
+def measure(m, names):
+    """登入後逐一請求端點，回傳 {名稱: {"queries", "status", "statements"}}"""
+    with m.app.app_context():
+        ids = _placeholders(m)
+        engine = m.db.engine
+    client = m.app.test_client()
+    client.post("/login", data={"username": "admin", "password": datagen.BENCH_PASSWORD})
+
+    results = {}
+    for name in names:
+        spec = BUDGETS[name]
+        path = spec["path"].format(**ids)
+        payload = {key: _fill(value, ids) for key, value in spec.get("json", {}).items()} or None
+        # 先請求一次暖機（模板編譯、快取），再計算第二次的查詢數
+        client.open(path, method=spec["method"], json=payload)
+        with count_queries(engine) as statements:
+            response = client.open(path, method=spec["method"], json=payload)
+        results[name] = {"queries": len(statements), "status": response.status_code, "statements": statements}
+    return results
+
+
+def run_single(args):
+    """子行程：產生一個資料量的資料庫並量測查詢次數"""
+    counts = datagen.counts_from_args(args)
+    database_url = args.database_url or datagen.default_database_url(args.scale).replace("bench_", "budget_")
+    m = datagen.load_app(database_url)
+    datagen.generate(m, counts, seed=args.seed)
+    return measure(m, args.only.split(","))
+
+
+def check(results, small, large, verbose=False, allow_known=False):
+    """比對預算與兩個資料量的查詢次數，回傳 (違規數, 暫不計的已知問題數)
+
+    known_issue 端點只有在 allow_known 時才不計入違規。
+    """
+    violations = 0
+    tolerated_count = 0
+    print(f"   {'端點':<24}{'上限':>6}{small:>10}{large:>10}")
+    for name in results[small]:
+        budget = BUDGETS[name]
+        small_count = results[small][name]["queries"]
+        large_count = results[large][name]["queries"]
+        problems = []
+        if max(small_count, large_count) > budget["max_queries"]:
+            problems.append("超過預算")
+        if large_count > small_count:
+            problems.append("隨資料量增加")
+        for scale in (small, large):
+            if results[scale][name]["status"] >= 400:
+                problems.append(f"{scale} 回應 {results[scale][name]['status']}")
+        tolerated = bool(problems and budget.get("known_issue") and allow_known)
+        marker = "⚠️" if tolerated else "❌" if problems else "✅"
+        violations += bool(problems) and not tolerated
+        tolerated_count += tolerated
+        if problems and budget.get("known_issue"):
+            problems.append(f"已知問題：{budget['known_issue']}")
+        print(f" {marker} {name:<24}{budget['max_queries']:>6}{small_count:>10}{large_count:>10}  {'、'.join(problems)}")
+        if problems and verbose:
+            for statement in results[large][name]["statements"]:
+                print(f"        {statement[:160]}")
+    return violations, tolerated_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="端點 SQL 查詢次數的預算與 N+1 回歸檢查")
+    datagen.add_count_arguments(parser)
+    parser.add_argument("--scales", default="1k,10k", help="兩個逗號分隔的資料量（小,大）")
+    parser.add_argument("--only", default=",".join(BUDGETS), help="只檢查這些端點（逗號分隔）")
+    parser.add_argument("--database-url", help="可含 {scale}；預設為 benchmarks/data/budget_<scale>.db")
+    parser.add_argument("--verbose", action="store_true", help="列出違規端點在大資料量下執行的 SQL")
+    parser.add_argument("--allow-known", action="store_true",
+                        help="標記為已知問題的端點違規時暫不算失敗（仍會列出，且不會顯示通過）")
+    parser.add_argument("--output", help="另存 JSON 結果")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.only.split(",") if name not in BUDGETS]
+    if unknown:
+        parser.error(f"未知的端點 {', '.join(unknown)}，可用：{', '.join(BUDGETS)}")
+
+    if args.single:
+        result = run_single(args)
+        with open(args.result_file, "w", encoding="utf-8") as handle:
+            json.dump(result, handle, ensure_ascii=False)
+        return 0
+
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    if len(scales) != 2:
+        parser.error("--scales 需要剛好兩個資料量")
+    # 主檔（持有人、帳戶、客戶、渠道）固定用小資料量的筆數，讓兩次量測只差在交易筆數
+    args.scale = scales[0]
+    small_counts = datagen.counts_from_args(args)
+    for name in MASTER_DATA:
+        if getattr(args, name) is None:
+            setattr(args, name, small_counts[name])
+
+    results = {}
+    for scale in scales:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as handle:
+            result_path = handle.name
+        command = [sys.executable, "-m", "benchmarks.query_budget", "--single", "--scale", scale,
+                   "--seed", str(args.seed), "--only", args.only, "--result-file", result_path]
+        for name in datagen.COUNT_OVERRIDES:
+            if getattr(args, name) is not None:
+                command += [f"--{name}", str(getattr(args, name))]
+        if args.database_url:
+            command += ["--database-url", args.database_url.replace("{scale}", scale)]
+        print(f"▶ {scale} ...", flush=True)
+        env = dict(os.environ, PERF_METRICS="0")
+        env.setdefault("LOG_LEVEL", "WARNING")
+        completed = subprocess.run(command, cwd=REPO_ROOT, env=env)
+        if completed.returncode != 0:
+            print(f"❌ 資料量 {scale} 執行失敗（exit {completed.returncode}）")
+            return 1
+        with open(result_path, encoding="utf-8") as handle:
+            results[scale] = json.load(handle)
+        os.remove(result_path)
+
+    violations, tolerated = check(results, scales[0], scales[1], verbose=args.verbose, allow_known=args.allow_known)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, ensure_ascii=False, indent=2)
+    if violations:
+        print(f"\n❌ {violations} 個端點未通過查詢預算")
+        return 1
+    if tolerated:
+        print(f"\n⚠️ {tolerated} 個已知問題端點未通過查詢預算（--allow-known 未計入失敗）")
+        return 0
+    print("\n✅ 所有端點都在查詢預算內，且不隨資料量增加")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
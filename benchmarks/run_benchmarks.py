@@ -0,0 +1,344 @@
+"""
+核心計算的基準測試
+在 datagen 產生的合成資料上計時 FIFO 分配、利潤計算、帳戶餘額重算、總利潤 API 與逐筆 / 批次銷帳，
+輸出 JSON 報告供不同 commit 之間比較。
+
+每個資料量在獨立的子行程中執行（app 在 import 時就綁定資料庫）。
+
+用法：
+    python -m benchmarks.run_benchmarks --scales 1k,10k,100k --output bench_report.json
+    python -m benchmarks.run_benchmarks --compare base.json bench_report.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import datagen
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 每項基準預設的重複次數（--repeat 可統一覆寫）
+DEFAULT_REPEATS = {
+    "allocate_inventory_for_sale": 20,
+    "calculate_profit_for_sale": 200,
+    "calculate_account_balances_from_transactions": 5,
+    "get_accurate_account_balances": 3,
+    "api_total_profit": 50,
+    "api_settlement_loop": 5,
+    "api_settlement_batch": 5,
+}
+# 銷帳基準每次處理的客戶數：逐筆呼叫 /api/settlement 與一次呼叫 /api/settlement/batch 處理相同的項目
+SETTLEMENT_ITEMS = 50
+
+
+def summarize(samples):
+    """以毫秒表示的耗時統計"""
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p95_ms": round(ordered[p95_index] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _measure(repeat, run, setup=None, teardown=None):
+    samples = []
+    for index in range(repeat):
+        state = setup(index) if setup else None
+        started = time.perf_counter()
+        run(state)
+        samples.append(time.perf_counter() - started)
+        if teardown:
+            teardown(state)
+    return summarize(samples)
+
+
+def _unified_stream(m):
+    """依現金管理頁面的格式組出交易流（新的在前），供 calculate_account_balances_from_transactions 使用"""
+    db = m.db
+    names = dict(db.session.execute(db.select(m.CashAccount.id, m.CashAccount.name)).all())
+    stream = []
+    for p in db.session.execute(db.select(m.PurchaseRecord)).scalars():
+        stream.append({
+            "type": "買入", "date": p.purchase_date.isoformat(),
+            "payment_account": names.get(p.payment_account_id, "N/A"),
+            "deposit_account": names.get(p.deposit_account_id, "N/A"),
+            "twd_change": -p.twd_cost, "rmb_change": p.rmb_amount,
+        })
+    for s in db.session.execute(db.select(m.SalesRecord)).scalars():
+        stream.append({
+            "type": "售出", "date": s.created_at.isoformat(),
+            "payment_account": names.get(s.rmb_account_id, "N/A"), "deposit_account": "N/A",
+            "twd_change": 0, "rmb_change": -s.rmb_amount,
+        })
+    for entry in db.session.execute(
+        db.select(m.LedgerEntry).filter(m.LedgerEntry.entry_type.in_(("SETTLEMENT", "DEPOSIT")))
+    ).scalars():
+        stream.append({
+            "type": entry.entry_type, "date": entry.entry_date.isoformat(),
+            "payment_account": "N/A", "deposit_account": names.get(entry.account_id, "N/A"),
+            "twd_change": entry.amount, "rmb_change": 0,
+        })
+    stream.sort(key=lambda item: item["date"], reverse=True)
+    return stream
+
+
+def run_scale(m, repeats, seed):
+    """在已載入的資料庫上執行全部基準，回傳 {名稱: 統計}"""
+    db = m.db
+    rnd = random.Random(seed)
+    results = {}
+    with m.app.app_context():
+        sale_ids = db.session.execute(db.select(m.SalesRecord.id)).scalars().all()
+        customer_ids = db.session.execute(db.select(m.Customer.id)).scalars().all()
+
+        def new_sale(_index):
+            account = db.session.execute(
+                db.select(m.CashAccount).filter_by(currency="RMB").order_by(m.CashAccount.balance.desc()).limit(1)
+            ).scalar_one()
+            sale = m.SalesRecord(
+                customer_id=rnd.choice(customer_ids), rmb_account_id=account.id,
+                rmb_amount=5_000.0, exchange_rate=4.7, twd_amount=23_500.0, operator_id=1,
+            )
+            db.session.add(sale)
+            db.session.flush()
+            return sale
+
+        results["allocate_inventory_for_sale"] = _measure(
+            repeats["allocate_inventory_for_sale"],
+            m.FIFOService.allocate_inventory_for_sale,
+            setup=new_sale,
+            teardown=lambda _sale: db.session.rollback(),
+        )
+
+        def load_sale(_index):
+            sale = db.session.get(m.SalesRecord, rnd.choice(sale_ids))
+            db.session.expire_all()
+            return sale
+
+        results["calculate_profit_for_sale"] = _measure(
+            repeats["calculate_profit_for_sale"], m.FIFOService.calculate_profit_for_sale, setup=load_sale,
+        )
+
+        holders = db.session.execute(db.select(m.Holder)).scalars().all()
+        accounts = db.session.execute(db.select(m.CashAccount)).scalars().all()
+        stream = _unified_stream(m)
+        results["calculate_account_balances_from_transactions"] = _measure(
+            repeats["calculate_account_balances_from_transactions"],
+            lambda _state: m.calculate_account_balances_from_transactions(holders, accounts, stream),
+        )
+        results["calculate_account_balances_from_transactions"]["stream_length"] = len(stream)
+
+        def accurate_balances(_state):
+            db.session.expire_all()
+            m.get_accurate_account_balances()
+
+        results["get_accurate_account_balances"] = _measure(
+            repeats["get_accurate_account_balances"], accurate_balances,
+        )
+        db.session.rollback()
+
+    client = m.app.test_client()
+    client.post("/login", data={"username": "admin", "password": datagen.BENCH_PASSWORD})
+
+    def total_profit(_state):
+        response = client.get("/api/total-profit")
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/total-profit 回應 {response.status_code}")
+
+    results["api_total_profit"] = _measure(repeats["api_total_profit"], total_profit)
+
+    # 日終收款：應收最多的 SETTLEMENT_ITEMS 位客戶各銷帳 1 元（金額很小，重複執行不影響資料分布）
+    with m.app.app_context():
+        settle_customers = db.session.execute(
+            db.select(m.Customer.id)
+            .filter(m.Customer.total_receivables_twd >= 100)
+            .order_by(m.Customer.total_receivables_twd.desc())
+            .limit(SETTLEMENT_ITEMS)
+        ).scalars().all()
+        twd_account = db.session.execute(
+            db.select(m.CashAccount.id).filter_by(currency="TWD").order_by(m.CashAccount.id).limit(1)
+        ).scalar_one()
+    items = [{"customer_id": customer_id, "amount": 1, "account_id": twd_account, "note": "基準測試"}
+             for customer_id in settle_customers]
+
+    def settle_loop(_state):
+        for item in items:
+            response = client.post("/api/settlement", json=item)
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/settlement 回應 {response.status_code}")
+
+    def settle_batch(_state):
+        response = client.post("/api/settlement/batch", json={"items": items})
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/settlement/batch 回應 {response.status_code}")
+
+    results["api_settlement_loop"] = _measure(repeats["api_settlement_loop"], settle_loop)
+    results["api_settlement_batch"] = _measure(repeats["api_settlement_batch"], settle_batch)
+    for name in ("api_settlement_loop", "api_settlement_batch"):
+        results[name]["items"] = len(items)
+    results["api_settlement_batch"]["speedup_vs_loop"] = round(
+        results["api_settlement_loop"]["median_ms"] / results["api_settlement_batch"]["median_ms"], 2
+    )
+    return results
+
+
+def _git(*args):
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _mask_url(url):
+    if "@" not in url:
+        return url
+    scheme, rest = url.split("://", 1)
+    return f"{scheme}://***@{rest.split('@', 1)[1]}"
+
+
+def run_single(args):
+    """子行程：產生（或沿用）一個資料量的資料庫並執行基準"""
+    counts = datagen.counts_from_args(args)
+    database_url = args.database_url or datagen.default_database_url(args.scale)
+    m = datagen.load_app(database_url)
+
+    generation_seconds = None
+    if not args.reuse:
+        started = time.perf_counter()
+        rows = datagen.generate(m, counts, seed=args.seed)
+        generation_seconds = round(time.perf_counter() - started, 2)
+    else:
+        with m.app.app_context():
+            rows = {
+                table.name: m.db.session.execute(m.db.select(m.db.func.count()).select_from(table)).scalar()
+                for table in m.db.metadata.sorted_tables
+            }
+
+    repeats = {name: args.repeat or default for name, default in DEFAULT_REPEATS.items()}
+    with m.app.app_context():
+        dialect = m.db.engine.dialect.name
+    return {
+        "scale": args.scale,
+        "database": _mask_url(database_url),
+        "dialect": dialect,
+        "counts": counts,
+        "rows": rows,
+        "generation_seconds": generation_seconds,
+        "benchmarks": run_scale(m, repeats, args.seed),
+    }
+
+
+def run_all(args):
+    """父行程：逐一以子行程執行各資料量，合併為一份報告"""
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "scales": {},
+    }
+    for scale in [s.strip() for s in args.scales.split(",") if s.strip()]:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as handle:
+            result_path = handle.name
+        command = [sys.executable, "-m", "benchmarks.run_benchmarks", "--single", "--scale", scale,
+                   "--seed", str(args.seed), "--result-file", result_path]
+        if args.repeat:
+            command += ["--repeat", str(args.repeat)]
+        for name in datagen.COUNT_OVERRIDES:
+            if getattr(args, name) is not None:
+                command += [f"--{name}", str(getattr(args, name))]
+        if args.reuse:
+            command.append("--reuse")
+        if args.database_url:
+            command += ["--database-url", args.database_url.replace("{scale}", scale)]
+        print(f"▶ {scale} ...", flush=True)
+        env = dict(os.environ, PERF_METRICS="0")
+        env.setdefault("LOG_LEVEL", "WARNING")
+        completed = subprocess.run(command, cwd=REPO_ROOT, env=env)
+        if completed.returncode != 0:
+            print(f"❌ 資料量 {scale} 執行失敗（exit {completed.returncode}）")
+            return None
+        with open(result_path, encoding="utf-8") as handle:
+            report["scales"][scale] = json.load(handle)
+        os.remove(result_path)
+        for name, stats in report["scales"][scale]["benchmarks"].items():
+            speedup = f"   ×{stats['speedup_vs_loop']} vs 逐筆" if "speedup_vs_loop" in stats else ""
+            print(f"   {name:<46} median {stats['median_ms']:>10.3f} ms   p95 {stats['p95_ms']:>10.3f} ms{speedup}")
+    return report
+
+
+def compare(base_path, new_path, threshold):
+    """比較兩份報告的中位數；任何項目變慢超過 threshold 倍時回傳 1"""
+    with open(base_path, encoding="utf-8") as handle:
+        base = json.load(handle)
+    with open(new_path, encoding="utf-8") as handle:
+        new = json.load(handle)
+    print(f"基準 {base.get('commit')} → 新 {new.get('commit')}")
+    regressions = 0
+    for scale, new_scale in new["scales"].items():
+        base_scale = base["scales"].get(scale)
+        if not base_scale:
+            continue
+        print(f"\n[{scale}]")
+        for name, stats in new_scale["benchmarks"].items():
+            base_stats = base_scale["benchmarks"].get(name)
+            if not base_stats or not base_stats["median_ms"]:
+                continue
+            ratio = stats["median_ms"] / base_stats["median_ms"]
+            marker = "⚠️" if ratio > threshold else "  "
+            regressions += ratio > threshold
+            print(f" {marker} {name:<46} {base_stats['median_ms']:>10.3f} → {stats['median_ms']:>10.3f} ms  ×{ratio:.2f}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FIFO / 利潤 / 餘額計算的基準測試")
+    datagen.add_count_arguments(parser)
+    parser.add_argument("--scales", default="1k,10k,100k", help="逗號分隔的資料量")
+    parser.add_argument("--repeat", type=int, help="統一覆寫每項基準的重複次數")
+    parser.add_argument("--database-url", help="可含 {scale}；預設為 benchmarks/data/bench_<scale>.db")
+    parser.add_argument("--reuse", action="store_true", help="沿用既有資料庫，不重新產生")
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="比較兩份報告")
+    parser.add_argument("--threshold", type=float, default=1.25, help="--compare 判定變慢的倍數")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    if args.single:
+        result = run_single(args)
+        with open(args.result_file, "w", encoding="utf-8") as handle:
+            json.dump(result, handle, ensure_ascii=False)
+        return 0
+
+    report = run_all(args)
+    if report is None:
+        return 1
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    print(f"\n✅ 報告已寫入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -73,6 +73,30 @@ def check_backup_health():
             from datetime import timedelta
             check_date = (datetime.now(timezone.utc) - timedelta(days=i+1)).strftime('%Y%m%d')
         
+        # 4. 最新一次串流備份的 manifest 與還原驗證結果
+        print(f"\n🧾 最新串流備份:")
+        manifests = [blob for blob in bucket.list_blobs(prefix='database_backups/runs/')
+                     if blob.name.endswith('/manifest.json')]
+        if manifests:
+            latest = max(manifests, key=lambda x: x.name)
+            manifest = json.loads(latest.download_as_text())
+            total_rows = sum(entry.get('rows') or 0 for entry in manifest['tables'].values())
+            failed = [table for table, entry in manifest['tables'].items() if not entry.get('ok')]
+            print(f"  {manifest['run_id']} ({manifest['type']}，基準 {manifest['baseline']})")
+            print(f"  資料表: {len(manifest['tables']) - len(failed)}/{len(manifest['tables'])}，共 {total_rows} 筆，"
+                  f"{len(manifest['files'])} 個檔案")
+            print(f"  結構版本: {manifest.get('schema_version', {}).get('alembic')}")
+        else:
+            print("  ❌ 沒有找到任何 manifest")
+
+        try:
+            verify = json.loads(bucket.blob('health/verify_status.json').download_as_text())
+            marker = "✅" if verify.get('ok') else "❌"
+            print(f"  {marker} 還原驗證: {verify['run_id']}（{verify['verified_at']}）"
+                  f"{'' if verify.get('ok') else '，不符: ' + ', '.join(verify.get('mismatched', []))}")
+        except Exception:
+            print("  ⚠️ 尚未執行還原驗證（python verify_backup.py --gcs）")
+
         print("\n🎯 檢查完成")
         
     except Exception as e:
@@ -2,18 +2,31 @@
 """
 PostgreSQL 資料庫備份腳本
 從 Render PostgreSQL 資料庫備份資料到 Google Cloud Storage
+
+BACKUP_FORMAT 決定資料檔格式：
+    csv.gz（預設）/ parquet  以 streaming_backup 串流寫出（COPY ... TO STDOUT），不把整張表載入記憶體
+    xlsx                     舊版：pandas 讀整張表後寫成 Excel（上限約 100 萬筆）
+BACKUP_EXCEL_SUMMARY=0 可關閉串流模式附帶的 Excel 摘要。
+BACKUP_WORKERS 為串流模式平行備份的連線數（預設 4），各連線共用同一個匯出的快照。
+串流模式預設做增量備份（BACKUP_INCREMENTAL=0 關閉）：只追加的資料表依高水位只備份新列，
+每 BACKUP_FULL_EVERY 次（預設 7）做一次完整基準；還原請用 backup_restore.py。
+每次執行另寫出 manifest.json（筆數、檔案 SHA-256、結構版本、內容雜湊），以 verify_backup.py 驗證可還原。
+檔案經由 object_store 平行上傳（UPLOAD_WORKERS，預設 4），OBJECT_STORE=local 時改寫到本地目錄，可離線執行。
 """
 
 import os
+import shutil
 import sys
 import pandas as pd
 import psycopg2
 from datetime import datetime, timedelta, timezone
-from google.cloud import storage
 from zoneinfo import ZoneInfo
 import json
 import logging
 
+import object_store
+import streaming_backup
+
 # 設置日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -22,6 +35,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 增量備份的高水位狀態（每次執行前下載、完成後覆寫）
+# 串流模式的 GCS 目錄與本地 backup_runs/ 結構相同，整個 runs/ 下載後即可直接交給 backup_restore.py
+RUNS_GCS_PREFIX = "database_backups/runs"
+STATE_GCS_PATH = f"{RUNS_GCS_PREFIX}/incremental_state.json"
+
 class DatabaseBackup:
     def __init__(self):
         self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -30,18 +48,36 @@ class DatabaseBackup:
         self.database_url = os.getenv('DATABASE_URL')
         self.gcs_credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
         self.gcs_bucket_name = os.getenv('GCS_BUCKET_NAME')
+        self.backup_format = os.getenv('BACKUP_FORMAT', 'csv.gz')
+        self.chunk_rows = int(os.getenv('BACKUP_CHUNK_ROWS', streaming_backup.DEFAULT_CHUNK_ROWS))
+        self.workers = int(os.getenv('BACKUP_WORKERS', streaming_backup.DEFAULT_WORKERS))
+        self.excel_summary = os.getenv('BACKUP_EXCEL_SUMMARY', '1') != '0'
+        self.incremental = os.getenv('BACKUP_INCREMENTAL', '1') != '0'
+        self.full_every = int(os.getenv('BACKUP_FULL_EVERY', streaming_backup.DEFAULT_FULL_EVERY))
+        self.state_file = None
+        self.fingerprint = os.getenv('BACKUP_FINGERPRINT', '1') != '0'
+        self.upload_metadata = {
+            'source': 'database-backup',
+            'timestamp': self.timestamp,
+            'backup_type': 'postgresql'
+        }
+        self._store = None
         
         logger.info("=== 資料庫備份初始化 ===")
         logger.info(f"時間戳: {self.timestamp}")
         logger.info(f"GCS 儲存桶: {self.gcs_bucket_name}")
+        logger.info(f"備份格式: {self.backup_format}")
         
         # 驗證環境變數
         if not self.database_url:
             raise ValueError("DATABASE_URL 環境變數未設置")
-        if not self.gcs_credentials_path:
-            raise ValueError("GOOGLE_APPLICATION_CREDENTIALS 環境變數未設置")
-        if not self.gcs_bucket_name:
-            raise ValueError("GCS_BUCKET_NAME 環境變數未設置")
+        if os.getenv('OBJECT_STORE', 'gcs') == 'gcs':
+            if not self.gcs_credentials_path and not os.getenv('GCS_CREDENTIALS_JSON'):
+                raise ValueError("GOOGLE_APPLICATION_CREDENTIALS 環境變數未設置")
+            if not self.gcs_bucket_name:
+                raise ValueError("GCS_BUCKET_NAME 環境變數未設置")
+        if self.backup_format not in ('xlsx',) + streaming_backup.FORMATS:
+            raise ValueError(f"不支援的 BACKUP_FORMAT: {self.backup_format}")
 
     def connect_database(self):
         """連接到 PostgreSQL 資料庫"""
@@ -99,6 +135,56 @@ class DatabaseBackup:
             logger.error(f"❌ 備份資料表 {table_name} 失敗: {str(e)}")
             return None
 
+    def backup_tables_streaming(self, tables):
+        """以串流方式備份所有資料表到本地暫存目錄，回傳 (backup_results, 檔案清單)
+
+        增量模式的高水位狀態存放在 GCS，執行前下載、完成後上傳，Render cron 的暫存磁碟不需保留任何東西。
+        """
+        backup_root = "backup_runs"
+        os.makedirs(backup_root, exist_ok=True)
+        state_path = os.path.join(backup_root, streaming_backup.STATE_FILE)
+        if self.incremental:
+            self.download_from_gcs(STATE_GCS_PATH, state_path)
+        run = streaming_backup.run_backup(
+            self.database_url, backup_root, self.backup_format, self.chunk_rows, self.workers,
+            excel_summary=self.excel_summary, incremental=self.incremental, full_every=self.full_every,
+            tables=tables, run_id=self.timestamp, fingerprint=self.fingerprint,
+        )
+        logger.info(f"📦 備份類型: {'完整基準' if run['type'] == 'full' else '增量'}（基準 {run['baseline']}）")
+
+        output_dir = os.path.join(backup_root, run['run_id'])
+        backup_results = {}
+        local_files = []
+        for table, result in run['tables'].items():
+            path = os.path.join(output_dir, result['file']) if result['file'] else None
+            backup_results[table] = {'success': bool(path), 'filename': path, 'rows': result['rows']}
+            if path:
+                local_files.append(path)
+            if result.get('ids_file'):
+                local_files.append(os.path.join(output_dir, result['ids_file']))
+        for extra in ("backup_summary.xlsx", streaming_backup.RUN_FILE, streaming_backup.MANIFEST_FILE):
+            if os.path.exists(os.path.join(output_dir, extra)):
+                local_files.append(os.path.join(output_dir, extra))
+        self.state_file = state_path if self.incremental else None
+        return backup_results, local_files
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = object_store.from_env()
+        return self._store
+
+    def download_from_gcs(self, gcs_path, local_file):
+        """從 GCS 下載檔案；檔案不存在時回傳 False"""
+        try:
+            if not self.store.download(gcs_path, local_file):
+                logger.info(f"ℹ️ GCS 上沒有 {gcs_path}")
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"❌ 下載 {gcs_path} 失敗: {str(e)}")
+            return False
+
     def create_summary_report(self, backup_results):
         """創建備份摘要報告"""
         try:
@@ -159,21 +245,8 @@ class DatabaseBackup:
     def upload_to_gcs(self, local_file, gcs_path):
         """上傳檔案到 GCS"""
         try:
-            client = storage.Client.from_service_account_json(self.gcs_credentials_path)
-            bucket = client.bucket(self.gcs_bucket_name)
-            blob = bucket.blob(gcs_path)
-            
-            blob.upload_from_filename(local_file)
-            
-            # 設置元數據
-            blob.metadata = {
-                'source': 'database-backup',
-                'timestamp': self.timestamp,
-                'backup_type': 'postgresql'
-            }
-            blob.patch()
-            
-            logger.info(f"✅ 檔案上傳成功: gs://{self.gcs_bucket_name}/{gcs_path}")
+            self.store.upload(local_file, gcs_path, metadata=self.upload_metadata)
+            logger.info(f"✅ 檔案上傳成功: {self.store.url(gcs_path)}")
             return True
             
         except Exception as e:
@@ -282,34 +355,46 @@ class DatabaseBackup:
             # 3. 備份每個資料表
             backup_results = {}
             
-            for table in tables:
-                filename = self.backup_table_to_excel(table)
-                if filename:
-                    backup_results[table] = {
-                        'success': True,
-                        'filename': filename
-                    }
-                    local_files.append(filename)
-                else:
-                    backup_results[table] = {
-                        'success': False,
-                        'filename': None
-                    }
-            
-            # 4. 創建摘要報告
-            summary_file = self.create_summary_report(backup_results)
-            if summary_file:
-                local_files.append(summary_file)
-            
-            # 5. 上傳所有檔案到 GCS
-            upload_success = 0
+            if self.backup_format != 'xlsx':
+                backup_results, local_files = self.backup_tables_streaming(tables)
+            else:
+                for table in tables:
+                    filename = self.backup_table_to_excel(table)
+                    if filename:
+                        backup_results[table] = {
+                            'success': True,
+                            'filename': filename
+                        }
+                        local_files.append(filename)
+                    else:
+                        backup_results[table] = {
+                            'success': False,
+                            'filename': None
+                        }
+                
+                # 4. 創建摘要報告
+                summary_file = self.create_summary_report(backup_results)
+                if summary_file:
+                    local_files.append(summary_file)
+            
+            # 5. 平行上傳所有檔案到 GCS（串流模式的檔案放在 runs/<時間戳>/ 之下）
+            uploads = []
             for file in local_files:
-                gcs_path = f"database_backups/{self.timestamp[:8]}/{file}"
-                if self.upload_to_gcs(file, gcs_path):
-                    upload_success += 1
+                relative = file.replace(os.sep, '/')
+                if relative.startswith("backup_runs/"):
+                    gcs_path = f"{RUNS_GCS_PREFIX}/{relative[len('backup_runs/'):]}"
+                else:
+                    gcs_path = f"database_backups/{self.timestamp[:8]}/{relative}"
+                uploads.append((file, gcs_path))
+            upload_results = self.store.upload_many(uploads, metadata=self.upload_metadata)
+            upload_success = sum(1 for result in upload_results if result['ok'])
 
             logger.info(f"📤 成功上傳 {upload_success}/{len(local_files)} 個檔案")
 
+            # 所有檔案都上傳成功才更新高水位，否則下次會從舊的高水位重新備份
+            if self.state_file and upload_success == len(local_files):
+                self.upload_to_gcs(self.state_file, STATE_GCS_PATH)
+
             # 6. 上傳健康狀態檔
             self.write_and_upload_status(backup_results, upload_success, len(local_files))
             
@@ -331,6 +416,8 @@ class DatabaseBackup:
             
             # 額外清理臨時目錄
             self.cleanup_temp_directories()
+            if os.path.isdir("backup_runs"):
+                shutil.rmtree("backup_runs", ignore_errors=True)
 
 def main():
     try:
@@ -0,0 +1,20 @@
+# Gunicorn 設定檔（gunicorn 會自動讀取目前目錄下的 gunicorn.conf.py）
+#
+# preload_app：在 master 行程載入應用並執行一次 startup()（建立預設資料、檢查資料庫結構），
+# 之後 fork 出的 worker 直接繼承，不會在每個 worker 的第一個請求才初始化。
+
+preload_app = True
+
+
+def on_starting(server):
+    """master 行程啟動（應用已預先載入）時執行一次初始化"""
+    from app import startup
+
+    startup()
+
+
+def post_worker_init(worker):
+    """未啟用 preload_app 時，由每個 worker 在接受請求前各自初始化（已初始化則直接略過）"""
+    from app import startup
+
+    startup()
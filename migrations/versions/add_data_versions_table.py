@@ -0,0 +1,37 @@
+"""Add data_versions table
+
+Revision ID: add_data_versions_table
+Revises: backfill_ledger_entry_date
+Create Date: 2025-11-04 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_data_versions_table'
+down_revision = 'backfill_ledger_entry_date'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 各 worker 的利潤時間序列快取以 profit_series 的版本判斷是否失效（見 ProfitTimeSeriesService）
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if not inspector.has_table('data_versions'):
+        op.create_table('data_versions',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+        )
+
+    exists = bind.execute(sa.text("SELECT 1 FROM data_versions WHERE name = 'profit_series'")).first()
+    if not exists:
+        op.execute("INSERT INTO data_versions (name, version) VALUES ('profit_series', 0)")
+
+
+def downgrade():
+    op.drop_table('data_versions')
@@ -0,0 +1,59 @@
+"""Add composite indexes for hot query paths
+
+Revision ID: add_hot_query_indexes
+Revises: add_profit_cube_table
+Create Date: 2025-10-31 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_hot_query_indexes'
+down_revision = 'add_profit_cube_table'
+branch_labels = None
+depends_on = None
+
+
+# (索引名稱, 資料表, 欄位, 部分索引條件)
+HOT_QUERY_INDEXES = (
+    ('ix_sales_records_customer_settled_created', 'sales_records', ['customer_id', 'is_settled', 'created_at'], None),
+    ('ix_sales_records_created_at', 'sales_records', ['created_at'], None),
+    ('ix_purchase_records_purchase_date', 'purchase_records', ['purchase_date'], None),
+    ('ix_ledger_entries_entry_date', 'ledger_entries', ['entry_date'], None),
+    ('ix_ledger_entries_account_id_entry_date', 'ledger_entries', ['account_id', 'entry_date'], None),
+    ('ix_fifo_sales_allocations_sales_record_id', 'fifo_sales_allocations', ['sales_record_id'], None),
+    ('ix_fifo_sales_allocations_fifo_inventory_id', 'fifo_sales_allocations', ['fifo_inventory_id'], None),
+    ('ix_fifo_inventory_available_purchase_date', 'fifo_inventory', ['purchase_date'], 'remaining_rmb > 0'),
+)
+
+
+def _existing_indexes(bind, table_name):
+    return {index['name'] for index in sa.inspect(bind).get_indexes(table_name)}
+
+
+def upgrade():
+    bind = op.get_bind()
+    is_postgresql = bind.dialect.name == 'postgresql'
+
+    for name, table_name, columns, where in HOT_QUERY_INDEXES:
+        if name in _existing_indexes(bind, table_name):
+            continue
+        kwargs = {}
+        if where:
+            kwargs['postgresql_where'] = sa.text(where)
+            kwargs['sqlite_where'] = sa.text(where)
+        if is_postgresql:
+            # 線上資料表使用 CONCURRENTLY 建立，避免長時間鎖住寫入
+            with op.get_context().autocommit_block():
+                op.create_index(name, table_name, columns, postgresql_concurrently=True, **kwargs)
+        else:
+            op.create_index(name, table_name, columns, **kwargs)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for name, table_name, _columns, _where in reversed(HOT_QUERY_INDEXES):
+        if name in _existing_indexes(bind, table_name):
+            op.drop_index(name, table_name=table_name)
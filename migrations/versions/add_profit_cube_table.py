@@ -0,0 +1,50 @@
+"""Add profit_cube analytics table
+
+Revision ID: add_profit_cube_table
+Revises: add_profit_history_index
+Create Date: 2025-10-30 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_profit_cube_table'
+down_revision = 'add_profit_history_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 衍生資料表，部署時由 flask seed-profit-cube 回填歷史資料（也可手動執行 flask rebuild-profit-cube）
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if not inspector.has_table('profit_cube'):
+        op.create_table('profit_cube',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('customer_id', sa.Integer(), nullable=False),
+        sa.Column('channel_id', sa.Integer(), nullable=True),
+        sa.Column('account_id', sa.Integer(), nullable=True),
+        sa.Column('profit_twd', sa.Float(), nullable=False),
+        sa.Column('revenue_twd', sa.Float(), nullable=False),
+        sa.Column('cost_twd', sa.Float(), nullable=False),
+        sa.Column('rmb_volume', sa.Float(), nullable=False),
+        sa.Column('margin', sa.Float(), nullable=False),
+        sa.Column('sales_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_profit_cube_day_customer', 'profit_cube', ['day', 'customer_id'])
+        op.create_index('ix_profit_cube_channel_day', 'profit_cube', ['channel_id', 'day'])
+        op.create_index('ix_profit_cube_account_day', 'profit_cube', ['account_id', 'day'])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if inspector.has_table('profit_cube'):
+        op.drop_table('profit_cube')
@@ -0,0 +1,48 @@
+"""Add partial (entry_date, id) index for the profit history cursor
+
+Revision ID: add_profit_history_cursor_index
+Revises: add_data_versions_table
+Create Date: 2025-11-04 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_profit_history_cursor_index'
+down_revision = 'add_data_versions_table'
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = 'ix_ledger_entries_profit_history'
+# 與 app.PROFIT_HISTORY_INDEX_WHERE 相同；查詢條件需逐字包含此條件才會使用索引
+INDEX_WHERE = (
+    "entry_type IN ('PROFIT_EARNED', 'PROFIT_WITHDRAW', 'PROFIT_DEDUCT', 'PROFIT_REVERSAL', 'PROFIT_RECONCILE') "
+    "AND entry_date IS NOT NULL"
+)
+
+
+def _existing_indexes(bind):
+    return {index['name'] for index in sa.inspect(bind).get_indexes('ledger_entries')}
+
+
+def upgrade():
+    bind = op.get_bind()
+    if INDEX_NAME in _existing_indexes(bind):
+        return
+    kwargs = {'postgresql_where': sa.text(INDEX_WHERE), 'sqlite_where': sa.text(INDEX_WHERE)}
+    if bind.dialect.name == 'postgresql':
+        # 線上資料表使用 CONCURRENTLY 建立，避免長時間鎖住寫入
+        with op.get_context().autocommit_block():
+            op.create_index(INDEX_NAME, 'ledger_entries', ['entry_date', 'id'], postgresql_concurrently=True,
+                            **kwargs)
+    else:
+        op.create_index(INDEX_NAME, 'ledger_entries', ['entry_date', 'id'], **kwargs)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if INDEX_NAME in _existing_indexes(bind):
+        op.drop_index(INDEX_NAME, table_name='ledger_entries')
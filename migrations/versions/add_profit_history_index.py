@@ -0,0 +1,62 @@
+"""Classify legacy profit ledger rows and index (entry_type, entry_date)
+
+Revision ID: add_profit_history_index
+Revises: add_profit_balance_to_cash_accounts
+Create Date: 2025-10-29 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_profit_history_index'
+down_revision = 'add_profit_balance_to_cash_accounts'
+branch_labels = None
+depends_on = None
+
+
+PROFIT_ENTRY_TYPES = (
+    'PROFIT_EARNED',
+    'PROFIT_WITHDRAW',
+    'PROFIT_DEDUCT',
+    'PROFIT_REVERSAL',
+    'PROFIT_RECONCILE',
+)
+
+# 舊資料僅能從描述辨識為利潤記錄，一次性改為正確的 entry_type
+LEGACY_DESCRIPTION_TYPES = (
+    ('%利潤提款%', 'PROFIT_WITHDRAW'),
+    ('%利潤扣除%', 'PROFIT_DEDUCT'),
+    ('%售出利潤%', 'PROFIT_EARNED'),
+)
+
+
+def upgrade():
+    ledger_entries = sa.table(
+        'ledger_entries',
+        sa.column('entry_type', sa.String),
+        sa.column('description', sa.String),
+    )
+    for pattern, entry_type in LEGACY_DESCRIPTION_TYPES:
+        op.execute(
+            ledger_entries.update()
+            .where(ledger_entries.c.description.like(pattern))
+            .where(ledger_entries.c.entry_type.notin_(PROFIT_ENTRY_TYPES))
+            .values(entry_type=entry_type)
+        )
+
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    existing_indexes = {index['name'] for index in inspector.get_indexes('ledger_entries')}
+    if 'ix_ledger_entries_entry_type_entry_date' not in existing_indexes:
+        op.create_index(
+            'ix_ledger_entries_entry_type_entry_date',
+            'ledger_entries',
+            ['entry_type', 'entry_date'],
+        )
+
+
+def downgrade():
+    # entry_type 的回填無法還原（原類型未保存），只移除索引
+    op.drop_index('ix_ledger_entries_entry_type_entry_date', table_name='ledger_entries')
@@ -0,0 +1,44 @@
+"""Backfill NULL ledger_entries.entry_date
+
+Revision ID: backfill_ledger_entry_date
+Revises: add_hot_query_indexes
+Create Date: 2025-11-03 09:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'backfill_ledger_entry_date'
+down_revision = 'add_hot_query_indexes'
+branch_labels = None
+depends_on = None
+
+
+# 利潤歷史以 (entry_date, id) 游標分頁，entry_date 為 NULL 的舊資料無法以游標取得。
+# 流水 id 依時間遞增：以前一筆有日期的流水補上，最早的幾筆則以後一筆補上。
+BACKFILL_STATEMENTS = (
+    """
+    UPDATE ledger_entries SET entry_date = (
+        SELECT MAX(earlier.entry_date) FROM ledger_entries earlier
+        WHERE earlier.id < ledger_entries.id AND earlier.entry_date IS NOT NULL
+    ) WHERE entry_date IS NULL
+    """,
+    """
+    UPDATE ledger_entries SET entry_date = (
+        SELECT MIN(later.entry_date) FROM ledger_entries later
+        WHERE later.id > ledger_entries.id AND later.entry_date IS NOT NULL
+    ) WHERE entry_date IS NULL
+    """,
+    "UPDATE ledger_entries SET entry_date = CURRENT_TIMESTAMP WHERE entry_date IS NULL",
+)
+
+
+def upgrade():
+    for statement in BACKFILL_STATEMENTS:
+        op.execute(statement)
+
+
+def downgrade():
+    # 補上的日期無法與原本就有的日期區分，不還原
+    pass
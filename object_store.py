@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+物件儲存抽象層
+備份、歸檔與 cron 腳本透過同一個介面上傳 / 下載檔案，後端可切換：
+    gcs     Google Cloud Storage（預設）：整個行程共用一個 Client；大檔以分段的可續傳上傳（resumable upload），
+            中途失敗時向 GCS 查詢已收到的位置並從該處續傳，不必從頭重傳
+    local   本地目錄：離線執行與測試用，鍵值即相對路徑
+
+所有操作遇到暫時性錯誤（網路、429、5xx）會以指數退避加隨機抖動重試；upload_many 以有上限的執行緒池平行上傳。
+
+環境變數：
+    OBJECT_STORE                    gcs（預設）或 local
+    OBJECT_STORE_ROOT               local 後端的根目錄，預設 object_store
+    GCS_BUCKET_NAME                 gcs 後端的儲存桶
+    GOOGLE_APPLICATION_CREDENTIALS  服務帳戶金鑰檔路徑（或以 GCS_CREDENTIALS_JSON 直接提供 JSON 內容）
+    UPLOAD_WORKERS                  平行上傳的執行緒數，預設 4
+    UPLOAD_CHUNK_MB                 可續傳上傳每段的大小（MB，會調整成 256 KB 的倍數），預設 8
+
+用法：
+    store = object_store.from_env()
+    store.upload("backup.csv.gz", "database_backups/20250101/backup.csv.gz", metadata={"source": "database-backup"})
+    results = store.upload_many([(path, key) for path, key in files])
+"""
+
+import abc
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_CHUNK_MB = 8
+DEFAULT_ATTEMPTS = 5
+# 可續傳上傳每段必須是 256 KB 的倍數；小於一段的檔案直接單次上傳
+CHUNK_ALIGNMENT = 256 * 1024
+
+
+def is_retryable(error):
+    """網路錯誤、408、429 與 5xx 重試；其他 4xx、找不到本地檔案等錯誤直接失敗"""
+    if isinstance(error, (FileNotFoundError, IsADirectoryError, ValueError)):
+        return False
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(code, int):
+        return code in (408, 429) or code >= 500
+    return True
+
+
+def with_retry(operation, description, attempts=DEFAULT_ATTEMPTS, base_delay=1.0, max_delay=30.0):
+    """執行 operation()，暫時性錯誤以指數退避（加隨機抖動）重試，最後一次失敗時拋出原本的例外"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return operation()
+        except Exception as e:
+            if attempt == attempts or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            logger.warning(f"⚠️ {description} 失敗（第 {attempt} 次）：{str(e)}，{delay:.1f} 秒後重試")
+            time.sleep(delay)
+
+
+class ObjectStore(abc.ABC):
+    """儲存後端介面；子類別必須實作 _put / upload_bytes / download / exists / list / read_text，缺一個就無法建立"""
+
+    name = "base"
+
+    def __init__(self, workers=DEFAULT_UPLOAD_WORKERS, attempts=DEFAULT_ATTEMPTS):
+        self.workers = workers
+        self.attempts = attempts
+
+    def url(self, key):
+        return key
+
+    @abc.abstractmethod
+    def _put(self, local_path, key, metadata=None, content_type=None, public=False):
+        """上傳單一檔案（不含重試，由 upload 包上重試）"""
+
+    def upload(self, local_path, key, metadata=None, content_type=None, public=False):
+        """上傳一個檔案（含重試），回傳上傳的位元組數"""
+        with_retry(lambda: self._put(local_path, key, metadata, content_type, public),
+                   f"上傳 {local_path}", self.attempts)
+        return os.path.getsize(local_path)
+
+    def upload_many(self, items, metadata=None, workers=None):
+        """平行上傳 [(本地路徑, 鍵值)]，回傳與 items 同順序的 [{key, ok, bytes, seconds, error}]
+
+        單一檔案失敗（重試用盡）不影響其他檔案，由呼叫端依 ok 判斷。
+        """
+        def upload_one(item):
+            local_path, key = item
+            started = time.perf_counter()
+            try:
+                size = self.upload(local_path, key, metadata)
+                logger.info(f"✅ 檔案上傳成功: {self.url(key)}")
+                return {"key": key, "ok": True, "bytes": size,
+                        "seconds": round(time.perf_counter() - started, 3), "error": None}
+            except Exception as e:
+                logger.error(f"❌ 檔案上傳失敗 {local_path}: {str(e)}")
+                return {"key": key, "ok": False, "bytes": 0,
+                        "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+
+        items = list(items)
+        workers = max(1, min(workers or self.workers, len(items) or 1))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as pool:
+            return list(pool.map(upload_one, items))
+
+    @abc.abstractmethod
+    def upload_bytes(self, data, key, content_type=None):
+        """上傳記憶體中的內容（含重試）"""
+
+    @abc.abstractmethod
+    def download(self, key, local_path):
+        """下載到 local_path；物件不存在時回傳 False"""
+
+    @abc.abstractmethod
+    def exists(self, key):
+        """物件是否存在"""
+
+    @abc.abstractmethod
+    def list(self, prefix=""):
+        """回傳以 prefix 開頭的所有鍵值（依名稱排序）"""
+
+    @abc.abstractmethod
+    def read_text(self, key):
+        """讀取文字物件；不存在時回傳 None"""
+
+
+class LocalObjectStore(ObjectStore):
+    """以本地目錄模擬物件儲存：先寫暫存檔再改名，讀取端不會看到寫到一半的檔案"""
+
+    name = "local"
+
+    def __init__(self, root, **kwargs):
+        super().__init__(**kwargs)
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"鍵值超出儲存根目錄: {key}")
+        return path
+
+    def url(self, key):
+        return self._path(key)
+
+    def _write(self, key, writer):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        writer(temp_path)
+        os.replace(temp_path, path)
+
+    def _put(self, local_path, key, metadata=None, content_type=None, public=False):
+        self._write(key, lambda temp_path: shutil.copyfile(local_path, temp_path))
+        if metadata:
+            with open(self._path(key) + ".metadata.json", "w", encoding="utf-8") as handle:
+                json.dump(metadata, handle, ensure_ascii=False)
+
+    def upload_bytes(self, data, key, content_type=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        def write(temp_path):
+            with open(temp_path, "wb") as handle:
+                handle.write(data)
+
+        self._write(key, write)
+
+    def download(self, key, local_path):
+        if not self.exists(key):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+        shutil.copyfile(self._path(key), local_path)
+        return True
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def list(self, prefix=""):
+        keys = []
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                if filename.endswith((".tmp", ".metadata.json")):
+                    continue
+                key = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def read_text(self, key):
+        if not self.exists(key):
+            return None
+        with open(self._path(key), encoding="utf-8") as handle:
+            return handle.read()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def gcs_client(credentials_path=None, credentials_json=None):
+    """整個行程共用的 storage.Client（依憑證快取），不再每個檔案建立一次"""
+    cache_key = credentials_path or credentials_json or "default"
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            from google.cloud import storage
+
+            if credentials_path and os.path.exists(credentials_path):
+                client = storage.Client.from_service_account_json(credentials_path)
+            elif credentials_json:
+                client = storage.Client.from_service_account_info(json.loads(credentials_json))
+            else:
+                client = storage.Client()
+            _clients[cache_key] = client
+        return client
+
+
+class GCSObjectStore(ObjectStore):
+    """Google Cloud Storage 後端"""
+
+    name = "gcs"
+
+    def __init__(self, bucket_name, credentials_path=None, credentials_json=None,
+                 chunk_size=DEFAULT_CHUNK_MB * 1024 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        if not bucket_name:
+            raise ValueError("GCS_BUCKET_NAME 環境變數未設置")
+        self.client = gcs_client(credentials_path, credentials_json)
+        self.bucket = self.client.bucket(bucket_name)
+        self.chunk_size = max(CHUNK_ALIGNMENT, chunk_size // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT)
+        self._local = threading.local()
+
+    def url(self, key):
+        return f"gs://{self.bucket.name}/{key}"
+
+    @property
+    def _session(self):
+        """可續傳上傳用的 HTTP session（每個執行緒一個；session URL 本身即授權，不需要憑證）"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+
+            session = self._local.session = requests.Session()
+        return session
+
+    def _put(self, local_path, key, metadata=None, content_type=None, public=False):
+        blob = self.bucket.blob(key)
+        # 中繼資料隨上傳請求一併送出，不再另外 patch
+        blob.metadata = metadata
+        size = os.path.getsize(local_path)
+        if size <= self.chunk_size:
+            blob.upload_from_filename(local_path, content_type=content_type)
+        else:
+            self._resumable_upload(blob, local_path, size, content_type)
+        if public:
+            blob.make_public()
+
+    def _resumable_upload(self, blob, local_path, size, content_type=None):
+        """分段上傳；某段傳送中斷時先向 GCS 查詢已保存的位置，再從該處續傳（每段最多重試 attempts 次）"""
+        session_url = blob.create_resumable_upload_session(
+            content_type=content_type or "application/octet-stream", size=size)
+        state = {"offset": 0, "confirmed": True}
+        with open(local_path, "rb") as handle:
+            def send_next():
+                if not state["confirmed"]:
+                    # 上一次傳送失敗，不知道 GCS 收到多少：先查詢實際位置
+                    state["offset"] = self._query_offset(session_url, size)
+                    state["confirmed"] = True
+                    if state["offset"] is None:
+                        return None
+                offset = state["offset"]
+                handle.seek(offset)
+                chunk = handle.read(self.chunk_size)
+                state["confirmed"] = False
+                response = self._session.put(
+                    session_url, data=chunk, timeout=120,
+                    headers={"Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}"})
+                state["offset"] = self._committed_offset(response)
+                state["confirmed"] = True
+                return state["offset"]
+
+            while with_retry(send_next, f"上傳 {local_path}（位置 {state['offset']}）", self.attempts) is not None:
+                pass
+
+    def _committed_offset(self, response):
+        """308 表示尚未完成，回傳下一個要送的位置；200 / 201 表示完成，回傳 None"""
+        if response.status_code in (200, 201):
+            return None
+        if response.status_code == 308:
+            received = response.headers.get("Range")
+            return int(received.rsplit("-", 1)[1]) + 1 if received else 0
+        response.raise_for_status()
+        raise RuntimeError(f"可續傳上傳回應非預期的狀態碼 {response.status_code}")
+
+    def _query_offset(self, session_url, size):
+        response = self._session.put(session_url, data=b"", timeout=60,
+                                     headers={"Content-Range": f"bytes */{size}"})
+        return self._committed_offset(response)
+
+    def upload_bytes(self, data, key, content_type=None):
+        blob = self.bucket.blob(key)
+        with_retry(lambda: blob.upload_from_string(data, content_type=content_type), f"上傳 {key}", self.attempts)
+
+    def download(self, key, local_path):
+        blob = self.bucket.blob(key)
+        if not with_retry(blob.exists, f"查詢 {key}", self.attempts):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+        with_retry(lambda: blob.download_to_filename(local_path), f"下載 {key}", self.attempts)
+        return True
+
+    def exists(self, key):
+        return with_retry(self.bucket.blob(key).exists, f"查詢 {key}", self.attempts)
+
+    def list(self, prefix=""):
+        return sorted(with_retry(lambda: [blob.name for blob in self.bucket.list_blobs(prefix=prefix)],
+                                 f"列出 {prefix}", self.attempts))
+
+    def read_text(self, key):
+        blob = self.bucket.blob(key)
+        if not with_retry(blob.exists, f"查詢 {key}", self.attempts):
+            return None
+        return with_retry(blob.download_as_text, f"下載 {key}", self.attempts)
+
+
+def from_env(backend=None, bucket_name=None):
+    """依環境變數建立儲存後端（見模組說明）"""
+    backend = backend or os.getenv("OBJECT_STORE", "gcs")
+    options = {
+        "workers": int(os.getenv("UPLOAD_WORKERS", DEFAULT_UPLOAD_WORKERS)),
+    }
+    if backend == "local":
+        return LocalObjectStore(os.getenv("OBJECT_STORE_ROOT", "object_store"), **options)
+    if backend == "gcs":
+        return GCSObjectStore(
+            bucket_name or os.getenv("GCS_BUCKET_NAME"),
+            credentials_path=os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
+            credentials_json=os.getenv("GCS_CREDENTIALS_JSON"),
+            chunk_size=int(os.getenv("UPLOAD_CHUNK_MB", DEFAULT_CHUNK_MB)) * 1024 * 1024,
+            **options,
+        )
+    raise ValueError(f"不支援的 OBJECT_STORE: {backend}（可用 gcs、local）")
@@ -0,0 +1,209 @@
+"""
+請求效能統計
+以 SQLAlchemy cursor 事件計算每個請求的查詢次數與資料庫耗時，並記錄各端點的
+延遲分佈，存放在目前行程的記憶體中（gunicorn 每個 worker 各自一份）。
+回應會附上 Server-Timing 標頭，可在瀏覽器開發者工具中看到 db / render / app 的耗時。
+
+環境變數：
+    PERF_METRICS=0          停用統計
+    PERF_METRICS_WINDOW     每個端點保留最近幾次請求用於計算百分位數，預設 500
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 延遲直方圖的上界（毫秒），最後一格為超過最大上界的請求
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class EndpointStats:
+    """單一端點的累計統計"""
+
+    __slots__ = (
+        "endpoint", "method", "count", "errors", "total_ms", "max_ms", "db_ms",
+        "queries", "max_queries", "buckets", "recent", "slowest_query_ms", "slowest_query",
+    )
+
+    def __init__(self, endpoint, method, window):
+        self.endpoint = endpoint
+        self.method = method
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.recent = deque(maxlen=window)
+        self.slowest_query_ms = 0.0
+        self.slowest_query = None
+
+    def add(self, status, total_ms, db_ms, query_count, slowest_query):
+        self.count += 1
+        if status >= 500:
+            self.errors += 1
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, total_ms)
+        self.db_ms += db_ms
+        self.queries += query_count
+        self.max_queries = max(self.max_queries, query_count)
+        for index, upper in enumerate(LATENCY_BUCKETS_MS):
+            if total_ms <= upper:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.recent.append(total_ms)
+        if slowest_query and slowest_query[0] > self.slowest_query_ms:
+            self.slowest_query_ms, self.slowest_query = slowest_query
+
+    def to_dict(self):
+        recent = sorted(self.recent)
+        count = self.count or 1
+        return {
+            "endpoint": self.endpoint,
+            "method": self.method,
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / count, 2),
+            "p50_ms": round(_percentile(recent, 0.50), 2),
+            "p95_ms": round(_percentile(recent, 0.95), 2),
+            "p99_ms": round(_percentile(recent, 0.99), 2),
+            "max_ms": round(self.max_ms, 2),
+            "total_ms": round(self.total_ms, 2),
+            "avg_db_ms": round(self.db_ms / count, 2),
+            "db_share": round(self.db_ms / self.total_ms, 3) if self.total_ms else 0.0,
+            "avg_queries": round(self.queries / count, 2),
+            "max_queries": self.max_queries,
+            "histogram": [
+                {"le_ms": upper, "count": bucket}
+                for upper, bucket in zip(list(LATENCY_BUCKETS_MS) + [None], self.buckets)
+            ],
+            "slowest_query_ms": round(self.slowest_query_ms, 2),
+            "slowest_query": self.slowest_query,
+        }
+
+
+class PerfStore:
+    """各端點統計的執行緒安全容器"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.started_at = time.time()
+
+    def record(self, endpoint, method, status, total_ms, db_ms, query_count, slowest_query=None):
+        key = (endpoint, method)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = EndpointStats(endpoint, method, self.window)
+            stats.add(status, total_ms, db_ms, query_count, slowest_query)
+
+    def snapshot(self):
+        """依總耗時由高到低排序的端點統計"""
+        with self._lock:
+            rows = [stats.to_dict() for stats in self._stats.values()]
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return {
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "generated_at": time.time(),
+            "window": self.window,
+            "endpoints": rows,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.started_at = time.time()
+
+
+perf_store = PerfStore(window=int(os.environ.get("PERF_METRICS_WINDOW", "500")))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and "_perf_start" in g:
+        context._perf_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_perf_query_start", None)
+    if started is None or not has_request_context() or "_perf_start" not in g:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    g._perf_queries += 1
+    g._perf_db_ms += elapsed_ms
+    if elapsed_ms > g._perf_slowest[0]:
+        g._perf_slowest = (elapsed_ms, " ".join(statement.split())[:300])
+
+
+def _before_render(sender, template, context, **extra):
+    if "_perf_start" in g:
+        g._perf_render_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    started = g.pop("_perf_render_start", None)
+    if started is not None:
+        g._perf_render_ms += (time.perf_counter() - started) * 1000
+
+
+def _start_request():
+    g._perf_start = time.perf_counter()
+    g._perf_queries = 0
+    g._perf_db_ms = 0.0
+    g._perf_render_ms = 0.0
+    g._perf_slowest = (0.0, None)
+
+
+def _finish_request(response):
+    started = g.get("_perf_start")
+    if started is None or request.endpoint == "static":
+        return response
+    total_ms = (time.perf_counter() - started) * 1000
+    db_ms = g._perf_db_ms
+    render_ms = g._perf_render_ms
+    app_ms = max(total_ms - db_ms - render_ms, 0.0)
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={db_ms:.1f};desc="{g._perf_queries} queries", '
+        f"render;dur={render_ms:.1f}, app;dur={app_ms:.1f}, total;dur={total_ms:.1f}",
+    )
+    endpoint = request.endpoint or "<unmatched>"
+    perf_store.record(
+        endpoint, request.method, response.status_code, total_ms, db_ms,
+        g._perf_queries, g._perf_slowest if g._perf_slowest[1] else None,
+    )
+    return response
+
+
+def init_app(app):
+    """註冊請求計時與查詢統計；PERF_METRICS=0 時不做任何事"""
+    if os.environ.get("PERF_METRICS", "1").lower() in ("0", "false", "no"):
+        return False
+    if getattr(app, "_perf_metrics_installed", False):
+        return True
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app._perf_metrics_installed = True
+    return True
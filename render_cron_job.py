@@ -10,7 +10,7 @@ import pandas as pd
 import time
 from datetime import datetime
 # Selenium imports removed - using simplified version
-from google.cloud import storage
+import object_store
 import logging
 
 # 設置日誌
@@ -54,6 +54,9 @@ class RenderCronJob:
         if not self.gcs_bucket_name:
             raise ValueError("GCS_BUCKET_NAME 環境變數未設置")
         
+        # 整個 cron job 共用一個 GCS Client（GCS_CREDENTIALS_JSON 直接載入，不寫暫存檔）
+        self.store = object_store.from_env()
+        
         logger.info(f"初始化完成 - 時間戳: {self.timestamp}")
         logger.info(f"目標網址: {self.target_url}")
         logger.info(f"GCS 儲存桶: {self.gcs_bucket_name}")
@@ -105,34 +108,10 @@ class RenderCronJob:
         try:
             logger.info(f"正在上傳檔案到 GCS: {local_file_path}")
             
-            # 初始化 GCS 客戶端
-            if self.gcs_credentials_path and os.path.exists(self.gcs_credentials_path):
-                client = storage.Client.from_service_account_json(self.gcs_credentials_path)
-            elif self.gcs_credentials_json:
-                import json
-                import tempfile
-                # 創建臨時檔案存放認證資訊
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-                    json.dump(json.loads(self.gcs_credentials_json), temp_file)
-                    temp_credentials_path = temp_file.name
-                client = storage.Client.from_service_account_json(temp_credentials_path)
-                # 清理臨時檔案
-                os.unlink(temp_credentials_path)
-            else:
-                raise ValueError("無法找到有效的 GCS 認證資訊")
-            
-            bucket = client.bucket(self.gcs_bucket_name)
-            
-            # 創建 blob 對象
-            blob = bucket.blob(gcs_file_name)
-            
-            # 上傳檔案
-            blob.upload_from_filename(local_file_path)
-            
-            # 設置公開讀取權限（可選）
-            blob.make_public()
+            # 共用的儲存後端（含重試）；設置公開讀取權限（可選）
+            self.store.upload(local_file_path, gcs_file_name, public=True)
             
-            logger.info(f"檔案上傳成功: gs://{self.gcs_bucket_name}/{gcs_file_name}")
+            logger.info(f"檔案上傳成功: {self.store.url(gcs_file_name)}")
             return True
             
         except Exception as e:
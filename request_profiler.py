@@ -0,0 +1,168 @@
+"""
+管理員請求剖析
+管理員在任何網址加上 ?_profile=1（或送出 X-Profile: 1 標頭）時，該請求會在 cProfile 下執行，
+結果（依累計時間排序的函式列表與可供 snakeviz/pstats 讀取的 .prof 檔）存放在 PROFILE_DIR，
+回應附上 X-Profile-Id 標頭，可從 /admin/profiles 瀏覽。
+
+環境變數：
+    PROFILE_DIR     剖析結果目錄，預設 instance/profiles
+    PROFILE_KEEP    最多保留幾份剖析結果，預設 50
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request
+
+TOP_FUNCTIONS = 60
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}-[0-9]{6}-[A-Za-z0-9_.]+-[0-9a-f]{8}$")
+
+
+def profile_dir(app):
+    return os.environ.get("PROFILE_DIR") or os.path.join(app.instance_path, "profiles")
+
+
+def _short_path(path):
+    """把 site-packages / 專案路徑縮短，方便在頁面上閱讀"""
+    for marker in ("site-packages" + os.sep, "lib" + os.sep + "python"):
+        index = path.rfind(marker)
+        if index >= 0:
+            return path[index + len(marker):]
+    base = os.path.dirname(os.path.abspath(__file__)) + os.sep
+    return path[len(base):] if path.startswith(base) else path
+
+
+def summarize(profiler, limit=TOP_FUNCTIONS):
+    """依累計時間排序的前 limit 個函式"""
+    stats = pstats.Stats(profiler).stats
+    rows = []
+    for (filename, line, function), (primitive_calls, calls, tottime, cumtime, _callers) in stats.items():
+        rows.append({
+            "function": function,
+            "location": f"{_short_path(filename)}:{line}" if line else _short_path(filename),
+            "ncalls": calls if calls == primitive_calls else f"{calls}/{primitive_calls}",
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumtime_ms"], reverse=True)
+    return rows[:limit]
+
+
+def _profile_requested(is_admin):
+    flag = request.args.get("_profile") or request.headers.get("X-Profile")
+    return flag in ("1", "true", "yes") and is_admin()
+
+
+def list_profiles(directory):
+    """已儲存的剖析摘要（新到舊），不含函式列表"""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as handle:
+                summary = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        summary.pop("functions", None)
+        profiles.append(summary)
+    return profiles
+
+
+def load_profile(directory, profile_id):
+    if not PROFILE_ID_PATTERN.match(profile_id or ""):
+        return None
+    try:
+        with open(os.path.join(directory, f"{profile_id}.json"), encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def profile_stats_path(directory, profile_id):
+    if not PROFILE_ID_PATTERN.match(profile_id or ""):
+        return None
+    path = os.path.join(directory, f"{profile_id}.prof")
+    return path if os.path.isfile(path) else None
+
+
+def _prune(directory, keep):
+    summaries = sorted(
+        (name for name in os.listdir(directory) if name.endswith(".json")),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name)),
+    )
+    for name in summaries[:-keep] if keep > 0 else []:
+        stem = name[:-len(".json")]
+        for suffix in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(directory, stem + suffix))
+            except OSError:
+                pass
+
+
+def init_app(app, is_admin, logger=None):
+    """註冊剖析掛勾；is_admin() 用於判斷目前使用者是否可以剖析"""
+
+    def start_profile():
+        if not _profile_requested(is_admin):
+            return
+        g._profile_started = time.perf_counter()
+        g._profiler = cProfile.Profile()
+        try:
+            g._profiler.enable()
+        except ValueError:
+            # 同一執行緒已有其他剖析器在執行
+            g._profiler = None
+
+    def finish_profile(response):
+        profiler = g.pop("_profiler", None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        elapsed_ms = (time.perf_counter() - g.pop("_profile_started")) * 1000
+        directory = profile_dir(app)
+        os.makedirs(directory, exist_ok=True)
+        endpoint = re.sub(r"[^A-Za-z0-9_.]", "_", request.endpoint or "unmatched")
+        profile_id = f"{datetime.now():%Y%m%d-%H%M%S}-{endpoint}-{uuid.uuid4().hex[:8]}"
+        summary = {
+            "id": profile_id,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "status": response.status_code,
+            "total_ms": round(elapsed_ms, 2),
+            "pid": os.getpid(),
+            "functions": summarize(profiler),
+        }
+        try:
+            profiler.dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+            with open(os.path.join(directory, f"{profile_id}.json"), "w", encoding="utf-8") as handle:
+                json.dump(summary, handle, ensure_ascii=False)
+            _prune(directory, int(os.environ.get("PROFILE_KEEP", "50")))
+        except OSError as e:
+            if logger is not None:
+                logger.error("儲存剖析結果失敗: %s", e)
+            return response
+        response.headers["X-Profile-Id"] = profile_id
+        if logger is not None:
+            logger.info("已剖析 %s %s（%.1f ms）: %s", request.method, request.path, elapsed_ms, profile_id)
+        return response
+
+    def discard_profile(exc):
+        # after_request 未執行（例如未處理的例外）時確保剖析器停止
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+
+    # 最先開始、最後結束，盡量涵蓋其他 before/after_request 掛勾
+    app.before_request_funcs.setdefault(None, []).insert(0, start_profile)
+    app.after_request_funcs.setdefault(None, []).insert(0, finish_profile)
+    app.teardown_request(discard_profile)
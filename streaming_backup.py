@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+"""
+串流資料庫備份
+逐表把資料以串流方式寫成 gzip 壓縮的 CSV（或 Parquet 欄式檔），不把整張表載入記憶體：
+PostgreSQL 使用 COPY ... TO STDOUT，SQLite 與 Parquet 格式則以分批讀取的游標逐批寫出。
+Excel 只保留為選用的人工閱讀摘要（每表筆數、檔案大小），不再承載資料本身。
+多張表由 worker 池平行備份，PostgreSQL 上共用 pg_export_snapshot() 匯出的快照，結果仍是同一時間點的一致備份。
+
+環境變數：
+    DATABASE_URL            來源資料庫（postgresql://... 或 sqlite:///...）
+    BACKUP_FORMAT           csv.gz（預設）或 parquet（需安裝 pyarrow）
+    BACKUP_CHUNK_ROWS       分批讀取的筆數，預設 10000
+    BACKUP_EXCEL_SUMMARY    1 時另外產生 Excel 摘要（需安裝 pandas、openpyxl）
+    BACKUP_WORKERS          平行備份的 worker 數（每個各用一條連線），預設 4
+    BACKUP_INCREMENTAL      1 時啟用增量備份（依 INCREMENTAL_TABLES 的高水位只備份新增 / 變更的列）
+    BACKUP_FULL_EVERY       增量模式下每幾次備份做一次完整基準，預設 7
+    BACKUP_FINGERPRINT      0 時 manifest 不計算每表的內容雜湊（省下一次整表讀取，驗證只比對筆數與檔案）
+
+用法：
+    python streaming_backup.py --output-dir backups
+    python streaming_backup.py --database-url sqlite:///instance/sales_system_v4.db --format parquet
+    python streaming_backup.py --incremental --output-dir backups    # 還原：python backup_restore.py
+                                                                     # 驗證：python verify_backup.py
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv.gz", "parquet")
+DEFAULT_CHUNK_ROWS = 10_000
+DEFAULT_WORKERS = 4
+DEFAULT_FULL_EVERY = 7
+DEFAULT_LAG_SECONDS = 600
+STATE_FILE = "incremental_state.json"
+RUN_FILE = "run.json"
+MANIFEST_FILE = "manifest.json"
+# 增量備份的高水位欄位：append 為只追加的資料表（以 id 判斷新列），changed 為有更新時間欄位的資料表
+# （新增與更新都會改變該欄位）。其他資料表（主檔，以及會被更新卻沒有更新時間欄位的 sales_records、
+# purchase_records、ledger_entries（管理員修正與 fix_old_transfer_records.py 會直接改寫）等）每次都完整備份。
+INCREMENTAL_TABLES = {
+    "profit_transactions": ("id", "append"),
+    "fifo_sales_allocations": ("id", "append"),
+    "cash_logs": ("id", "append"),
+    "transactions": ("id", "append"),
+    "delete_audit_logs": ("id", "append"),
+    "fifo_inventory": ("last_updated", "changed"),
+    "profit_cube": ("updated_at", "changed"),
+}
+# CSV 中的 NULL 標記（COPY ... WITH (FORMAT csv, NULL '\N') 與 _write_csv_chunks 相同），空欄位則是空字串。
+# Python 的 csv 讀取分不出欄位是否加了引號，所以不用 COPY 預設的「未加引號的空欄位」表示 NULL；
+# 代價是內容恰好為 \N 的文字欄位以 Python 讀回時會成為 NULL。
+CSV_NULL = "\\N"
+
+
+def connect(database_url):
+    """依網址開啟連線，回傳 (connection, dialect)；dialect 為 'postgresql' 或 'sqlite'"""
+    if database_url.startswith("sqlite:///"):
+        path = database_url[len("sqlite:///"):]
+        conn = sqlite3.connect(path, check_same_thread=False)
+        return conn, "sqlite"
+    import psycopg2
+
+    if database_url.startswith("postgres://"):
+        database_url = "postgresql://" + database_url[len("postgres://"):]
+    return psycopg2.connect(database_url), "postgresql"
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def list_tables(conn, dialect):
+    """列出所有使用者資料表（依名稱排序）"""
+    cursor = conn.cursor()
+    if dialect == "postgresql":
+        cursor.execute("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_schema = 'public' AND table_type = 'BASE TABLE'
+            ORDER BY table_name
+        """)
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    tables = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return tables
+
+
+def table_columns(conn, dialect, table):
+    """回傳 [(欄位名稱, 宣告型別)]，依資料表欄位順序"""
+    cursor = conn.cursor()
+    if dialect == "postgresql":
+        cursor.execute("""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = %s
+            ORDER BY ordinal_position
+        """, (table,))
+        columns = [(name, data_type.lower()) for name, data_type in cursor.fetchall()]
+    else:
+        cursor.execute(f"PRAGMA table_info({quote_ident(table)})")
+        columns = [(row[1], (row[2] or "").lower()) for row in cursor.fetchall()]
+    cursor.close()
+    return columns
+
+
+def _format_value(value):
+    """CSV 欄位值：與 PostgreSQL COPY CSV 相同的表示方式（布林 t/f、日期 ISO 格式、NULL 為 CSV_NULL）"""
+    if value is None:
+        return CSV_NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (date, Decimal)):
+        return str(value)
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return value
+
+
+def iter_chunks(conn, dialect, query, params=(), chunk_rows=DEFAULT_CHUNK_ROWS, name=None):
+    """分批讀取查詢結果；PostgreSQL 使用具名（伺服器端）游標，不會一次把結果送到用戶端"""
+    if dialect == "postgresql":
+        cursor = conn.cursor(name=name or f"backup_{os.getpid()}_{time.monotonic_ns()}")
+        cursor.itersize = chunk_rows
+    else:
+        cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def _value_kind(declared):
+    if declared.startswith("bool"):
+        return "bool"
+    if any(token in declared for token in ("int", "numeric", "decimal", "real", "double", "float")):
+        return "number"
+    return "text"
+
+
+def _canonical(value, kind):
+    """與資料庫種類無關的欄位表示：PostgreSQL 的 Decimal / bool 與 SQLite 還原後的 float / 0-1 得到相同字串"""
+    if value is None:
+        return "\\N"
+    if kind == "bool":
+        return "1" if str(value).lower() in ("1", "t", "true") else "0"
+    if kind == "number":
+        try:
+            return format(Decimal(str(value)).normalize(), "f")
+        except InvalidOperation:
+            return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return str(value)
+
+
+def value_kinds(columns):
+    return [_value_kind(declared) for _, declared in columns]
+
+
+def rows_digest(rows, kinds):
+    """一批列的雜湊總和（整數）：每列正規化後取 SHA-256 再相加，可跨批次累加"""
+    total = 0
+    for row in rows:
+        line = "\x1f".join(_canonical(value, kind) for value, kind in zip(row, kinds))
+        total += int.from_bytes(hashlib.sha256(line.encode("utf-8")).digest(), "big")
+    return total
+
+
+def format_digest(total):
+    return format(total % (1 << 256), "064x")
+
+
+def table_fingerprint(conn, dialect, table, columns, chunk_rows=DEFAULT_CHUNK_ROWS, where=None, params=()):
+    """回傳 (筆數, 內容雜湊)；每列正規化後取 SHA-256 再全部相加，與列的順序和資料庫種類無關
+
+    columns 的宣告型別決定正規化方式，驗證還原結果時要傳入備份當時（manifest 中）的欄位。
+    """
+    kinds = value_kinds(columns)
+    total = rows = 0
+    for chunk in iter_chunks(conn, dialect, select_sql(table, columns, where), params, chunk_rows=chunk_rows):
+        total += rows_digest(chunk, kinds)
+        rows += len(chunk)
+    return rows, format_digest(total)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def select_sql(table, columns, where=None):
+    query = f"SELECT {', '.join(quote_ident(name) for name, _ in columns)} FROM {quote_ident(table)}"
+    return f"{query} WHERE {where}" if where else query
+
+
+def _copy_postgres_csv(conn, table, columns, handle, where=None, params=()):
+    cursor = conn.cursor()
+    try:
+        # COPY 不接受參數，先由 psycopg2 把參數安全地代入查詢
+        query = cursor.mogrify(select_sql(table, columns, where), params).decode()
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{CSV_NULL}')", handle)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def _write_csv_chunks(conn, dialect, table, columns, handle, chunk_rows, where=None, params=()):
+    text = io.TextIOWrapper(handle, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow([name for name, _ in columns])
+    rows_written = 0
+    query = select_sql(table, columns, where)
+    for rows in iter_chunks(conn, dialect, query, params, chunk_rows):
+        writer.writerows([_format_value(value) for value in row] for row in rows)
+        rows_written += len(rows)
+    text.flush()
+    text.detach()
+    return rows_written
+
+
+def arrow_schema(columns):
+    """依資料庫宣告型別建立 pyarrow schema；無法判斷的型別一律存成字串"""
+    import pyarrow as pa
+
+    fields = []
+    for name, declared in columns:
+        if "int" in declared or declared == "serial":
+            arrow_type = pa.int64()
+        elif any(word in declared for word in ("float", "real", "double", "numeric", "decimal")):
+            arrow_type = pa.float64()
+        elif declared.startswith("bool"):
+            arrow_type = pa.bool_()
+        elif "timestamp" in declared or "datetime" in declared:
+            arrow_type = pa.timestamp("us")
+        elif declared == "date":
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _coerce(value, arrow_type):
+    """SQLite 以字串保存日期時間、以整數保存布林，寫入 Parquet 前轉回對應型別"""
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if pa.types.is_timestamp(arrow_type) and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if pa.types.is_date32(arrow_type) and isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if pa.types.is_boolean(arrow_type):
+        return bool(value)
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    if pa.types.is_string(arrow_type) and not isinstance(value, str):
+        return str(_format_value(value))
+    return value
+
+
+def rows_to_arrow(rows, schema):
+    import pyarrow as pa
+
+    types = [field.type for field in schema]
+    arrays = [
+        pa.array([_coerce(row[index], arrow_type) for row in rows], type=arrow_type)
+        for index, arrow_type in enumerate(types)
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _write_parquet_chunks(conn, dialect, table, columns, path, chunk_rows, where=None, params=()):
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(columns)
+    query = select_sql(table, columns, where)
+    rows_written = 0
+    # 每批寫成一個 row group，記憶體用量只與 chunk_rows 有關
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for rows in iter_chunks(conn, dialect, query, params, chunk_rows):
+            writer.write_table(rows_to_arrow(rows, schema))
+            rows_written += len(rows)
+    return rows_written
+
+
+def dump_table(conn, dialect, table, output_dir, fmt="csv.gz", chunk_rows=DEFAULT_CHUNK_ROWS,
+               where=None, params=(), columns=None, name=None):
+    """以串流方式備份單一資料表，回傳 {table, file, rows, bytes, seconds}
+
+    where / params 可限制匯出的列（增量備份用），columns 可只匯出部分欄位，name 為檔名（不含副檔名）。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的備份格式 {fmt}，可用：{', '.join(FORMATS)}")
+    started = time.perf_counter()
+    columns = columns or table_columns(conn, dialect, table)
+    path = os.path.join(output_dir, f"{name or table}.{fmt}")
+    if fmt == "parquet":
+        rows = _write_parquet_chunks(conn, dialect, table, columns, path, chunk_rows, where, params)
+    else:
+        with gzip.open(path, "wb", compresslevel=6) as handle:
+            if dialect == "postgresql":
+                rows = _copy_postgres_csv(conn, table, columns, handle, where, params)
+            else:
+                rows = _write_csv_chunks(conn, dialect, table, columns, handle, chunk_rows, where, params)
+    result = {
+        "table": table,
+        "file": os.path.basename(path),
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if fmt == "csv.gz":
+        # 還原時依此辨識 NULL；沒有這一項的舊備份以空欄位表示 NULL
+        result["csv_null"] = CSV_NULL
+    return result
+
+
+def _placeholder(dialect):
+    return "%s" if dialect == "postgresql" else "?"
+
+
+def _hwm_value(value):
+    """高水位存進 JSON：時間一律轉成 ISO 字串"""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return value
+
+
+def dump_incremental(conn, dialect, table, column, mode, hwm_from, output_dir, fmt="csv.gz",
+                     chunk_rows=DEFAULT_CHUNK_ROWS, lag_seconds=DEFAULT_LAG_SECONDS):
+    """只匯出高水位之後的列，另外匯出目前所有 id（還原時用來套用刪除）
+
+    高水位上限在同一個快照內取得，匯出範圍是 (hwm_from, hwm_to]；changed 模式把下限往前推 lag_seconds，
+    涵蓋較晚才提交、時間戳卻較早的交易，重複的列在還原時依 id 覆蓋。hwm_from 為 None 時匯出整張表。
+    """
+    mark = _placeholder(dialect)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MAX({quote_ident(column)}) FROM {quote_ident(table)}")
+    hwm_to = cursor.fetchone()[0]
+    cursor.close()
+
+    where, params = None, ()
+    if hwm_from is not None and hwm_to is not None:
+        if mode == "append":
+            where, params = f"{quote_ident(column)} > {mark} AND {quote_ident(column)} <= {mark}", (hwm_from, hwm_to)
+        else:
+            since = datetime.fromisoformat(str(hwm_from)) - timedelta(seconds=lag_seconds)
+            upper = hwm_to if isinstance(hwm_to, datetime) else datetime.fromisoformat(str(hwm_to))
+            if dialect == "sqlite":
+                # SQLite 以字串保存時間，以相同格式比較
+                since, upper = since.isoformat(sep=" "), upper.isoformat(sep=" ")
+            where = (f"({quote_ident(column)} >= {mark} AND {quote_ident(column)} <= {mark}) "
+                     f"OR {quote_ident(column)} IS NULL")
+            params = (since, upper)
+    result = dump_table(conn, dialect, table, output_dir, fmt, chunk_rows, where, params)
+    if hwm_from is not None:
+        ids = dump_table(conn, dialect, table, output_dir, "csv.gz", chunk_rows,
+                         columns=[("id", "integer")], name=f"{table}.ids")
+        result.update(ids_file=ids["file"], ids_rows=ids["rows"], bytes=result["bytes"] + ids["bytes"])
+    result.update(mode=mode, column=column, hwm_from=hwm_from,
+                  hwm_to=_hwm_value(hwm_to) if hwm_to is not None else hwm_from)
+    return result
+
+
+def write_excel_summary(results, path, title="資料庫備份摘要"):
+    """人工閱讀用的 Excel 摘要：每表一列（筆數、檔案、大小、耗時），不含資料本身"""
+    import pandas as pd
+
+    rows = [{
+        "資料表名稱": result["table"],
+        "記錄數量": result.get("rows"),
+        "備份檔案": result.get("file") or "無",
+        "檔案大小(KB)": round(result.get("bytes", 0) / 1024, 1),
+        "耗時(秒)": result.get("seconds"),
+        "備份狀態": "成功" if result.get("file") else f"失敗：{result.get('error', '')}",
+    } for result in results]
+    rows.append({
+        "資料表名稱": "=== 總計 ===",
+        "記錄數量": sum(result.get("rows") or 0 for result in results),
+        "備份檔案": f"共 {sum(1 for result in results if result.get('file'))} 個檔案",
+        "檔案大小(KB)": round(sum(result.get("bytes", 0) for result in results) / 1024, 1),
+        "耗時(秒)": round(sum(result.get("seconds") or 0 for result in results), 3),
+        "備份狀態": title,
+    })
+    pd.DataFrame(rows).to_excel(path, index=False, engine="openpyxl")
+    return path
+
+
+class SnapshotWorker:
+    """一個備份 worker 的專屬連線
+
+    PostgreSQL 上每個 worker 以 REPEATABLE READ 唯讀交易匯入協調連線以 pg_export_snapshot()
+    匯出的快照，所有 worker 看到的是同一個時間點的資料；某張表失敗 rollback 後，下一張表會重新匯入快照。
+    """
+
+    def __init__(self, database_url, snapshot_id=None):
+        self.conn, self.dialect = connect(database_url)
+        self.snapshot_id = snapshot_id
+        self._needs_snapshot = True
+        if self.dialect == "postgresql":
+            self.conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    def dump(self, table, output_dir, fmt, chunk_rows, incremental=None, fingerprint=False):
+        """匯出一張表並附上檔案的 SHA-256；fingerprint 時另在同一快照內計算整表的筆數與內容雜湊"""
+        if self.snapshot_id and self._needs_snapshot:
+            cursor = self.conn.cursor()
+            cursor.execute("SET TRANSACTION SNAPSHOT %s", (self.snapshot_id,))
+            cursor.close()
+            self._needs_snapshot = False
+        try:
+            if incremental:
+                result = dump_incremental(self.conn, self.dialect, table, output_dir=output_dir, fmt=fmt,
+                                          chunk_rows=chunk_rows, **incremental)
+            else:
+                result = dump_table(self.conn, self.dialect, table, output_dir, fmt, chunk_rows)
+            result["sha256"] = file_sha256(os.path.join(output_dir, result["file"]))
+            if result.get("ids_file"):
+                result["ids_sha256"] = file_sha256(os.path.join(output_dir, result["ids_file"]))
+            if fingerprint:
+                columns = table_columns(self.conn, self.dialect, table)
+                result["columns"] = columns
+                result["table_rows"], result["content_hash"] = table_fingerprint(
+                    self.conn, self.dialect, table, columns, chunk_rows)
+            return result
+        except Exception:
+            self.conn.rollback()
+            self._needs_snapshot = True
+            raise
+
+    def close(self):
+        self.conn.close()
+
+
+def _table_size_order(conn, dialect, tables):
+    """大表先做，讓平行備份時最慢的表不會排在最後才開始"""
+    if dialect != "postgresql":
+        return list(tables)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.relname, pg_total_relation_size(c.oid) FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind = 'r'
+    """)
+    sizes = dict(cursor.fetchall())
+    cursor.close()
+    return sorted(tables, key=lambda table: sizes.get(table, 0), reverse=True)
+
+
+def backup_database(database_url, output_dir, fmt="csv.gz", chunk_rows=DEFAULT_CHUNK_ROWS,
+                    tables=None, excel_summary=False, workers=1, incremental=None, fingerprint=False):
+    """備份所有（或指定的）資料表到 output_dir，回傳每表結果的 list（依資料表名稱排序）
+
+    incremental 為 {資料表: dump_incremental 的參數（column, mode, hwm_from, lag_seconds）}，
+    列在其中的資料表只匯出高水位之後的列。fingerprint 時每表另外記錄整表筆數與內容雜湊（見 table_fingerprint）。
+
+    workers > 1 時以執行緒池平行備份，每個 worker 使用自己的連線。PostgreSQL 上協調連線在整個備份期間
+    保持一個 REPEATABLE READ 交易並匯出快照，讓所有 worker 的資料一致；SQLite 沒有快照匯出，
+    平行備份只適用於備份期間沒有寫入的資料庫。單表失敗不影響其他表。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    coordinator, dialect = connect(database_url)
+    snapshot_id = None
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    def run(table):
+        worker = getattr(local, "worker", None)
+        if worker is None:
+            worker = local.worker = SnapshotWorker(database_url, snapshot_id)
+            with opened_lock:
+                opened.append(worker)
+        try:
+            result = worker.dump(table, output_dir, fmt, chunk_rows, (incremental or {}).get(table), fingerprint)
+            logger.info(f"✅ {table}: {result['rows']} 筆 -> {result['file']} "
+                        f"({result['bytes'] / 1024:.1f} KB, {result['seconds']} 秒)")
+        except Exception as e:
+            logger.error(f"❌ 備份資料表 {table} 失敗: {str(e)}")
+            result = {"table": table, "file": None, "rows": None, "bytes": 0, "seconds": None, "error": str(e)}
+        result["worker"] = threading.current_thread().name
+        return result
+
+    started = time.perf_counter()
+    try:
+        if dialect == "postgresql":
+            coordinator.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            cursor = coordinator.cursor()
+            cursor.execute("SELECT pg_export_snapshot()")
+            snapshot_id = cursor.fetchone()[0]
+            cursor.close()
+        ordered = _table_size_order(coordinator, dialect, tables or list_tables(coordinator, dialect))
+        workers = max(1, min(workers, len(ordered) or 1))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup") as pool:
+            results = list(pool.map(run, ordered))
+    finally:
+        for worker in opened:
+            worker.close()
+        # 所有 worker 結束後才關閉協調連線，匯出的快照在此之前都有效
+        coordinator.close()
+
+    elapsed = time.perf_counter() - started
+    timed = sorted((result for result in results if result["seconds"] is not None),
+                   key=lambda result: result["seconds"], reverse=True)
+    logger.info(f"⏱️ {len(results)} 個資料表，{workers} 個 worker，總耗時 {elapsed:.2f} 秒"
+                f"（各表合計 {sum(result['seconds'] for result in timed):.2f} 秒）")
+    for result in timed[:5]:
+        logger.info(f"   {result['table']:<28}{result['seconds']:>8.2f} 秒  {result['rows']} 筆  [{result['worker']}]")
+
+    results.sort(key=lambda result: result["table"])
+    if excel_summary:
+        write_excel_summary(results, os.path.join(output_dir, "backup_summary.xlsx"))
+    return results
+
+
+def load_state(backup_root):
+    path = os.path.join(backup_root, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _write_json(path, data):
+    """先寫暫存檔再改名，中途失敗不會留下半份 JSON"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        json.dump(data, handle, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def schema_version(database_url, results):
+    """Alembic 版本（沒有遷移紀錄時為 None）與欄位定義的雜湊"""
+    conn, dialect = connect(database_url)
+    try:
+        alembic = None
+        if "alembic_version" in list_tables(conn, dialect):
+            cursor = conn.cursor()
+            cursor.execute("SELECT version_num FROM alembic_version")
+            alembic = ",".join(sorted(row[0] for row in cursor.fetchall())) or None
+            cursor.close()
+    finally:
+        conn.close()
+    lines = sorted(f"{result['table']}.{name}:{declared}"
+                   for result in results for name, declared in result.get("columns") or ())
+    return {"alembic": alembic, "columns_sha256": hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()}
+
+
+def write_manifest(run, output_dir, database_url):
+    """寫出 manifest.json：結構版本、每表的整表筆數 / 內容雜湊 / 欄位，以及本次每個檔案的筆數與 SHA-256"""
+    results = list(run["tables"].values())
+    files = {}
+    for result in results:
+        if result.get("file"):
+            files[result["file"]] = {"table": result["table"], "rows": result["rows"],
+                                     "bytes": os.path.getsize(os.path.join(output_dir, result["file"])),
+                                     "sha256": result.get("sha256")}
+        if result.get("ids_file"):
+            files[result["ids_file"]] = {"table": result["table"], "rows": result["ids_rows"],
+                                         "bytes": os.path.getsize(os.path.join(output_dir, result["ids_file"])),
+                                         "sha256": result.get("ids_sha256")}
+    for extra in (RUN_FILE, "backup_summary.xlsx"):
+        path = os.path.join(output_dir, extra)
+        if os.path.exists(path):
+            files[extra] = {"table": None, "rows": None, "bytes": os.path.getsize(path), "sha256": file_sha256(path)}
+    manifest = {
+        "run_id": run["run_id"],
+        "type": run["type"],
+        "baseline": run["baseline"],
+        "previous": run["previous"],
+        "format": run["format"],
+        "created_at": run["created_at"],
+        "schema_version": schema_version(database_url, results),
+        "tables": {
+            result["table"]: {"rows": result.get("table_rows"), "content_hash": result.get("content_hash"),
+                              "columns": result.get("columns"), "ok": bool(result.get("file"))}
+            for result in results
+        },
+        "files": files,
+    }
+    _write_json(os.path.join(output_dir, MANIFEST_FILE), manifest)
+    return manifest
+
+
+def run_backup(database_url, backup_root, fmt="csv.gz", chunk_rows=DEFAULT_CHUNK_ROWS, workers=DEFAULT_WORKERS,
+               excel_summary=False, incremental=False, full_every=DEFAULT_FULL_EVERY, force_full=False,
+               lag_seconds=DEFAULT_LAG_SECONDS, tables=None, run_id=None, fingerprint=True):
+    """執行一次備份，寫出 <backup_root>/<run_id>/ 下的 run.json、manifest.json 並更新增量狀態，回傳 run 資訊
+
+    incremental=False 時每次都是完整備份；否則在沒有基準、距上次基準已 full_every 次、或 force_full 時
+    做完整基準備份，其餘只備份 INCREMENTAL_TABLES 的新增 / 變更列（其他資料表仍完整備份）。
+    fingerprint 時 manifest 另記錄每表的內容雜湊，供 verify_backup.py 比對還原結果。
+    """
+    run_id = run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir = os.path.join(backup_root, run_id)
+    state = load_state(backup_root) if incremental else None
+    full = (not incremental or force_full or state is None
+            or state.get("runs_since_baseline", 0) + 1 >= full_every)
+
+    table_state = (state or {}).get("tables", {})
+    plan = {
+        table: {"column": column, "mode": mode, "lag_seconds": lag_seconds,
+                # 沒有高水位（首次或上次失敗）的資料表這次整表匯出
+                "hwm_from": None if full else table_state.get(table, {}).get("hwm")}
+        for table, (column, mode) in INCREMENTAL_TABLES.items()
+    }
+    results = backup_database(database_url, output_dir, fmt, chunk_rows, tables, excel_summary, workers,
+                              incremental=plan if incremental else None, fingerprint=fingerprint)
+
+    run = {
+        "run_id": run_id,
+        "type": "full" if full else "incremental",
+        "baseline": run_id if full else state["baseline"],
+        "previous": None if full else state["chain"][-1],
+        "format": fmt,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "tables": {result["table"]: result for result in results},
+    }
+    _write_json(os.path.join(output_dir, RUN_FILE), run)
+    write_manifest(run, output_dir, database_url)
+
+    if incremental:
+        new_state = {
+            "baseline": run["baseline"],
+            "chain": [run_id] if full else state["chain"] + [run_id],
+            "runs_since_baseline": 0 if full else state.get("runs_since_baseline", 0) + 1,
+            "tables": {} if full else dict(table_state),
+        }
+        for table, result in run["tables"].items():
+            # 失敗的資料表保留舊的高水位，下次從同一點重新匯出
+            if result.get("file") and result.get("hwm_to") is not None:
+                new_state["tables"][table] = {"hwm": result["hwm_to"], "column": result["column"],
+                                              "mode": result["mode"], "run_id": run_id}
+        os.makedirs(backup_root, exist_ok=True)
+        _write_json(os.path.join(backup_root, STATE_FILE), new_state)
+    return run
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    parser = argparse.ArgumentParser(description="串流備份資料庫到 gzip CSV 或 Parquet 檔")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--output-dir", default="backups",
+                        help="備份根目錄，每次執行建立一個時間戳子目錄，增量狀態存在根目錄")
+    parser.add_argument("--format", choices=FORMATS, default=os.getenv("BACKUP_FORMAT", "csv.gz"))
+    parser.add_argument("--chunk-rows", type=int, default=int(os.getenv("BACKUP_CHUNK_ROWS", DEFAULT_CHUNK_ROWS)))
+    parser.add_argument("--tables", help="只備份這些資料表（逗號分隔）")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BACKUP_WORKERS", DEFAULT_WORKERS)),
+                        help="平行備份的 worker（連線）數")
+    parser.add_argument("--excel-summary", action="store_true",
+                        default=os.getenv("BACKUP_EXCEL_SUMMARY") == "1", help="另外產生 Excel 摘要")
+    parser.add_argument("--incremental", action="store_true", default=os.getenv("BACKUP_INCREMENTAL") == "1",
+                        help="依高水位只備份新增 / 變更的列，定期做完整基準備份")
+    parser.add_argument("--full", action="store_true", help="強制這次做完整基準備份")
+    parser.add_argument("--full-every", type=int, default=int(os.getenv("BACKUP_FULL_EVERY", DEFAULT_FULL_EVERY)),
+                        help="每幾次備份做一次完整基準")
+    parser.add_argument("--lag-seconds", type=int, default=DEFAULT_LAG_SECONDS,
+                        help="以時間為高水位時往前重疊的秒數")
+    parser.add_argument("--no-fingerprint", action="store_true", default=os.getenv("BACKUP_FINGERPRINT") == "0",
+                        help="manifest 不計算每表的內容雜湊")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("請以 --database-url 或 DATABASE_URL 指定資料庫")
+
+    tables = [name.strip() for name in args.tables.split(",") if name.strip()] if args.tables else None
+    run = run_backup(args.database_url, args.output_dir, args.format, args.chunk_rows, args.workers,
+                     args.excel_summary, args.incremental, args.full_every, args.full, args.lag_seconds, tables,
+                     fingerprint=not args.no_fingerprint)
+    failed = [table for table, result in run["tables"].items() if not result["file"]]
+    logger.info(f"📦 {'完整' if run['type'] == 'full' else '增量'}備份完成: "
+                f"{os.path.join(args.output_dir, run['run_id'])}（{len(run['tables']) - len(failed)}/{len(run['tables'])} 個資料表）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
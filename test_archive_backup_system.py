@@ -0,0 +1,207 @@
+"""
+三合一資料管理系統（archive_backup_system.py）的步驟1 → 步驟2 測試
+在同一條連線上先做完整備份、再做分批歸檔，確認歸檔不會因為步驟1 留下的交易而失敗。
+
+本地沒有 PostgreSQL，以 PsycopgLikeConnection 在 SQLite 上模擬 psycopg2 的交易行為：
+任何查詢都會開啟交易，交易中呼叫 set_session 會拋出 psycopg2.ProgrammingError。
+
+用法：
+    python -m pytest -q test_archive_backup_system.py
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+
+import psycopg2
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import archive_store  # noqa: E402
+
+
+class _PsycopgLikeCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn._db.cursor()
+        self.itersize = None
+
+    def execute(self, query, params=()):
+        self._conn.in_transaction = True
+        if query.lstrip().upper().startswith("SET LOCAL"):
+            return
+        query = query.replace("%s", "?").replace(" FOR UPDATE", "")
+        self._cursor.execute(query, tuple(params or ()))
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class PsycopgLikeConnection:
+    """SQLite 連線，但交易規則與 psycopg2 相同（查詢即開啟交易、交易中不能 set_session）"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute("ATTACH DATABASE ':memory:' AS information_schema")
+        self._db.execute("CREATE TABLE information_schema.tables (table_schema, table_name, table_type)")
+        self._db.execute("CREATE TABLE information_schema.columns "
+                         "(table_schema, table_name, column_name, data_type, ordinal_position)")
+        for (table,) in self._db.execute(
+                "SELECT name FROM main.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall():
+            self._db.execute("INSERT INTO information_schema.tables VALUES ('public', ?, 'BASE TABLE')", (table,))
+            for position, name, declared, *_ in self._db.execute(f'PRAGMA main.table_info("{table}")').fetchall():
+                self._db.execute("INSERT INTO information_schema.columns VALUES ('public', ?, ?, ?, ?)",
+                                 (table, name, declared or "text", position))
+        self._db.commit()
+        self.in_transaction = False
+        self.isolation_level = None
+
+    def cursor(self, name=None):
+        return _PsycopgLikeCursor(self)
+
+    def set_session(self, isolation_level=None, **_):
+        if self.in_transaction:
+            raise psycopg2.ProgrammingError("set_session cannot be used inside a transaction")
+        self.isolation_level = isolation_level
+
+    def commit(self):
+        self._db.commit()
+        self.in_transaction = False
+
+    def rollback(self):
+        self._db.rollback()
+        self.in_transaction = False
+
+    def close(self):
+        self._db.close()
+
+
+@pytest.fixture(scope="module")
+def seed_database(tmp_path_factory):
+    """以 benchmarks.datagen 產生一份小型、帳務一致的資料庫"""
+    path = tmp_path_factory.mktemp("seed") / "seed.db"
+    subprocess.run([sys.executable, "-m", "benchmarks.datagen", "--scale", "300", "--days", "120",
+                    "--database-url", f"sqlite:///{path}"], cwd=ROOT, check=True, capture_output=True)
+    return path
+
+
+@pytest.fixture
+def system(seed_database, tmp_path, monkeypatch):
+    db_path = tmp_path / "archive.db"
+    db_path.write_bytes(seed_database.read_bytes())
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+    monkeypatch.setenv("OBJECT_STORE", "local")
+    monkeypatch.setenv("OBJECT_STORE_ROOT", str(tmp_path / "store"))
+    monkeypatch.setenv("ARCHIVE_FORMAT", "parquet")
+    monkeypatch.setenv("ARCHIVE_PAUSE_SECONDS", "0")
+    monkeypatch.setenv("BACKUP_WORKERS", "1")
+    import archive_backup_system
+
+    archive_system = archive_backup_system.ArchiveBackupSystem()
+    archive_system.archive_date = datetime(2025, 3, 1)
+    archive_system.conn = PsycopgLikeConnection(str(db_path))
+    yield archive_system
+    archive_system.conn.close()
+
+
+def _count(system, table, where="1 = 1"):
+    return system.conn._db.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}").fetchone()[0]
+
+
+def test_step1_then_step2_on_one_connection(system):
+    """步驟1 的查詢留下交易時，步驟2 仍能設定快照隔離等級並完成歸檔"""
+    old_sales = _count(system, "sales_records", "created_at < '2025-03-01'")
+    assert old_sales > 0
+
+    assert system.step1_full_backup()
+    system.step2_archive_old_data()
+
+    progress = json.loads(system.store.read_text(archive_store.PROGRESS_KEY))
+    assert progress["completed_at"]
+    assert progress["tables"]["sales_records"]["deleted"] > 0
+    assert _count(system, "sales_records", "created_at < '2025-03-01'") < old_sales
+    assert system.conn._db.execute("PRAGMA foreign_key_check").fetchall() == []
+
+
+def test_archiver_ends_open_transaction(system):
+    """ChunkedArchiver 收到仍在交易中的連線時，先結束交易再切換隔離等級"""
+    system.conn.cursor().execute("SELECT 1")
+    archiver = archive_store.ChunkedArchiver(
+        system.conn, "postgresql", system.store, system.archive_date, system.timestamp, "archive_work",
+        pause_seconds=0, plan=[step for step in archive_store.ARCHIVE_PLAN if step[0] == "ledger_entries"])
+    summary = archiver.run()
+    assert summary["ledger_entries"]["deleted"] == summary["ledger_entries"]["archived"] > 0
+
+
+def _total_profit(system):
+    """與 app.ProfitService.get_total_profit 相同：利潤流水最新一筆的 profit_after"""
+    marks = ", ".join("?" for _ in archive_store.PROFIT_LEDGER_TYPES)
+    row = system.conn._db.execute(
+        f"SELECT profit_after FROM ledger_entries WHERE entry_type IN ({marks}) AND profit_after IS NOT NULL "
+        "ORDER BY id DESC LIMIT 1", archive_store.PROFIT_LEDGER_TYPES).fetchone()
+    return row[0] if row else 0.0
+
+
+def test_total_profit_survives_archival(system):
+    """歸檔界線晚於最後一筆利潤流水時，最新一筆仍留在資料庫，系統總利潤不變"""
+    total = _total_profit(system)
+    assert total
+    system.archive_date = datetime(2100, 1, 1)
+    archiver = archive_store.ChunkedArchiver(
+        system.conn, "sqlite", system.store, system.archive_date, system.timestamp, "archive_work",
+        pause_seconds=0, plan=[step for step in archive_store.ARCHIVE_PLAN if step[0] == "ledger_entries"])
+    summary = archiver.run()
+    assert summary["ledger_entries"]["deleted"] > 0
+    assert _total_profit(system) == total
+
+
+def test_archive_query_limit_stops_reading_partitions(system, tmp_path, monkeypatch):
+    """指定 limit 時回傳與完整查詢相同的最早幾筆，且取滿後不再讀取之後的月份分區"""
+    archiver = archive_store.ChunkedArchiver(
+        system.conn, "sqlite", system.store, system.archive_date, system.timestamp, "archive_work",
+        pause_seconds=0, plan=[step for step in archive_store.ARCHIVE_PLAN if step[0] == "ledger_entries"])
+    archiver.run()
+    reader = archive_store.ArchiveReader(system.store, cache_dir=str(tmp_path / "cache"))
+    partitions = reader.partitions("ledger_entries")
+    assert len(partitions) > 1
+    expected = reader.query("ledger_entries")[:10]
+
+    read = []
+    read_partition = reader._read_partition
+    monkeypatch.setattr(reader, "_read_partition", lambda entry, *args: read.append(entry) or read_partition(entry, *args))
+    assert reader.query("ledger_entries", limit=10) == expected
+    assert len(read) < len(partitions)
+
+
+def test_failure_before_progress_is_not_resumable(system, monkeypatch):
+    """還沒寫下任何進度就失敗時，步驟2 回報失敗而不是「下次從進度繼續」"""
+    def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(archive_store, "archive_table", broken)
+    with pytest.raises(RuntimeError):
+        system.step2_archive_old_data()
+    assert system.store.read_text(archive_store.PROGRESS_KEY) is None
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,99 @@
+"""
+備份 → 還原 → 驗證（streaming_backup.py、backup_restore.py、verify_backup.py）的往返測試
+確認空字串與 NULL 在 CSV 備份中可以區分：空字串還原後仍是空字串，verify-backup 不會回報內容雜湊不符。
+
+用法：
+    python -m pytest -q test_verify_backup.py
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import backup_restore  # noqa: E402
+import streaming_backup  # noqa: E402
+import verify_backup  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def seed_database(tmp_path_factory):
+    """以 benchmarks.datagen 產生一份小型、帳務一致的資料庫"""
+    path = tmp_path_factory.mktemp("seed") / "seed.db"
+    subprocess.run([sys.executable, "-m", "benchmarks.datagen", "--scale", "300", "--days", "120",
+                    "--database-url", f"sqlite:///{path}"], cwd=ROOT, check=True, capture_output=True)
+    return path
+
+
+@pytest.fixture
+def database(seed_database, tmp_path):
+    """資料庫副本：一筆流水的描述是空字串、一筆是 NULL、一筆內容含逗號與引號"""
+    path = tmp_path / "source.db"
+    path.write_bytes(seed_database.read_bytes())
+    conn = sqlite3.connect(path)
+    ids = [row[0] for row in conn.execute("SELECT id FROM ledger_entries ORDER BY id LIMIT 3")]
+    conn.execute("UPDATE ledger_entries SET description = '' WHERE id = ?", (ids[0],))
+    conn.execute("UPDATE ledger_entries SET description = NULL WHERE id = ?", (ids[1],))
+    conn.execute("UPDATE ledger_entries SET description = 'a, \"b\"' WHERE id = ?", (ids[2],))
+    conn.commit()
+    conn.close()
+    return path, ids
+
+
+def _descriptions(path, ids):
+    conn = sqlite3.connect(path)
+    marks = ", ".join("?" for _ in ids)
+    rows = dict(conn.execute(f"SELECT id, description FROM ledger_entries WHERE id IN ({marks})", ids).fetchall())
+    conn.close()
+    return [rows[row_id] for row_id in ids]
+
+
+def test_verify_backup_with_empty_strings(database, tmp_path):
+    """CSV 備份中空字串與 NULL 各自還原，驗證通過"""
+    path, _ = database
+    backup_root = tmp_path / "backups"
+    streaming_backup.run_backup(f"sqlite:///{path}", str(backup_root), workers=1, run_id="20250101_020000")
+    report = verify_backup.verify_backup(str(backup_root), workers=1)
+    assert report["ok"], report["mismatched"]
+
+
+def test_restore_keeps_empty_strings(database, tmp_path):
+    """完整基準與之後的增量都保留空字串、NULL 與需要引號的內容"""
+    path, ids = database
+    expected = _descriptions(path, ids)
+    assert expected == ["", None, 'a, "b"']
+    backup_root = tmp_path / "backups"
+    streaming_backup.run_backup(f"sqlite:///{path}", str(backup_root), workers=1, incremental=True,
+                                run_id="20250101_020000")
+    streaming_backup.run_backup(f"sqlite:///{path}", str(backup_root), workers=1, incremental=True,
+                                run_id="20250102_020000")
+
+    target = tmp_path / "restored.db"
+    target.write_bytes(path.read_bytes())
+    conn = sqlite3.connect(target)
+    conn.execute("UPDATE ledger_entries SET description = 'changed'")
+    conn.commit()
+    conn.close()
+    results = backup_restore.restore_backup(str(backup_root), f"sqlite:///{target}", workers=1)
+    assert not [result for result in results if result.get("error")]
+    assert _descriptions(target, ids) == expected
+
+
+def test_legacy_backup_reads_empty_field_as_null(tmp_path):
+    """加入 NULL 標記之前的備份（沒有 csv_null）仍以空欄位表示 NULL"""
+    assert backup_restore.csv_null({}) == ""
+    convert = backup_restore._converters("sqlite", [("description", "text")], ["description"],
+                                         backup_restore.csv_null({}))
+    assert convert[0]("") is None
+    convert = backup_restore._converters("sqlite", [("description", "text")], ["description"])
+    assert convert[0]("") == ""
+    assert convert[0](streaming_backup.CSV_NULL) is None
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
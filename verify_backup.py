@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+備份還原驗證（verify-backup）
+不需要人工演練就能確認備份可以還原：
+    1. 依 manifest.json 檢查備份鏈中每個檔案的 SHA-256
+    2. 把備份平行還原到暫存的本地資料庫（預設每張表一個 SQLite 檔，資料表依 manifest 記錄的欄位建立）
+    3. 比對每表的筆數與內容雜湊是否與 manifest 相同
+
+內容雜湊與資料庫種類無關（見 streaming_backup.table_fingerprint），PostgreSQL 的備份也能在本地 SQLite 驗證。
+以 --gcs 直接從 GCS 的 database_backups/runs/ 下載需要的備份，並把結果寫到 health/verify_status.json。
+
+用法：
+    python verify_backup.py --backup-root backups
+    python verify_backup.py --gcs --output verify_report.json
+    python verify_backup.py --backup-root backups --run 20250101_020000 --database-url postgresql://.../scratch
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import backup_restore
+import object_store
+import streaming_backup
+from streaming_backup import MANIFEST_FILE, connect, file_sha256, quote_ident, table_fingerprint
+
+logger = logging.getLogger(__name__)
+
+GCS_RUNS_PREFIX = "database_backups/runs"
+GCS_STATUS_PATH = "health/verify_status.json"
+
+
+def load_manifest(backup_root, run_id):
+    with open(os.path.join(backup_root, run_id, MANIFEST_FILE), encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def download_chain(store, prefix, dest, run_id=None):
+    """從物件儲存下載到指定 run 為止的整條備份鏈（沿 previous 找到完整基準），回傳 run_id"""
+    if run_id is None:
+        runs = sorted(key[len(prefix) + 1:].split("/")[0]
+                      for key in store.list(f"{prefix}/") if key.endswith(f"/{MANIFEST_FILE}"))
+        if not runs:
+            raise FileNotFoundError(f"{store.url(prefix)}/ 中沒有任何備份")
+        run_id = runs[-1]
+    current = run_id
+    while current:
+        for key in store.list(f"{prefix}/{current}/"):
+            store.download(key, os.path.join(dest, current, key[len(prefix) + len(current) + 2:]))
+        run = backup_restore.load_run(dest, current)
+        current = run.get("previous") if run["type"] != "full" else None
+    return run_id
+
+
+def check_files(backup_root, chain, workers):
+    """比對備份鏈中每個檔案的 SHA-256，回傳問題清單"""
+    expected = []
+    for run in chain:
+        manifest = load_manifest(backup_root, run["run_id"])
+        for name, entry in manifest["files"].items():
+            if entry.get("sha256"):
+                expected.append((os.path.join(backup_root, run["run_id"], name), entry["sha256"]))
+
+    def check(item):
+        path, sha256 = item
+        if not os.path.exists(path):
+            return f"缺少檔案 {path}"
+        if file_sha256(path) != sha256:
+            return f"SHA-256 不符 {path}"
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sha256") as pool:
+        problems = [problem for problem in pool.map(check, expected) if problem]
+    logger.info(f"🔐 檢查 {len(expected)} 個檔案的 SHA-256，{len(problems)} 個問題")
+    return problems
+
+
+def _scratch_type(declared):
+    """SQLite 接受任意型別名稱並依名稱決定親和性，只需去掉不合語法的字元"""
+    return re.sub(r"[^a-z0-9 (),]", "", declared.lower()).strip() or "text"
+
+
+def create_scratch_table(conn, table, columns):
+    column_sql = ", ".join(f"{quote_ident(name)} {_scratch_type(declared)}" for name, declared in columns)
+    conn.execute(f"CREATE TABLE {quote_ident(table)} ({column_sql})")
+    conn.commit()
+
+
+def _columns_from_file(backup_root, chain, table):
+    """manifest 沒有欄位定義（未計算內容雜湊）時，從最早的備份檔讀出欄位名稱"""
+    for run in chain:
+        entry = run["tables"].get(table)
+        if entry and entry.get("file"):
+            path = os.path.join(backup_root, run["run_id"], entry["file"])
+            if path.endswith(".parquet"):
+                import pyarrow.parquet as pq
+
+                header = pq.read_schema(path).names
+            else:
+                with gzip.open(path, "rt", encoding="utf-8", newline="") as handle:
+                    header = next(csv.reader(handle))
+            return [(name, "text") for name in header]
+    return []
+
+
+def verify_table(database_url, backup_root, chain, table, expected, restore=True, columns=None):
+    """（必要時先還原）並計算單表的筆數與內容雜湊，回傳比對結果"""
+    started = time.perf_counter()
+    result = {"table": table, "expected_rows": expected.get("rows"), "expected_hash": expected.get("content_hash")}
+    try:
+        if restore:
+            restorer = backup_restore.Restorer(database_url)
+            try:
+                restorer.restore_table(backup_root, chain, table)
+            finally:
+                restorer.close()
+        conn, dialect = connect(database_url)
+        try:
+            result["rows"], result["content_hash"] = table_fingerprint(conn, dialect, table, columns)
+        finally:
+            conn.close()
+        problems = []
+        if result["expected_rows"] is not None and result["rows"] != result["expected_rows"]:
+            problems.append(f"筆數 {result['rows']} ≠ {result['expected_rows']}")
+        if result["expected_hash"] and result["content_hash"] != result["expected_hash"]:
+            problems.append("內容雜湊不符")
+        result["problems"] = problems
+    except Exception as e:
+        result["problems"] = [f"還原失敗: {str(e)}"]
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def verify_backup(backup_root, run_id=None, database_url=None, workers=streaming_backup.DEFAULT_WORKERS,
+                  scratch_dir=None):
+    """驗證一次備份（預設最新），回傳報告 dict；report["ok"] 為整體結果
+
+    database_url 為 None 時在 scratch_dir（預設暫存目錄）為每張表建立一個 SQLite 檔，各表互不鎖定，
+    可以平行還原；指定 database_url 時使用 backup_restore.restore_backup 還原到該資料庫（需已有資料表）。
+    """
+    started = time.perf_counter()
+    chain = backup_restore.resolve_chain(backup_root, run_id)
+    target = chain[-1]
+    manifest = load_manifest(backup_root, target["run_id"])
+    report = {
+        "run_id": target["run_id"],
+        "baseline": chain[0]["run_id"],
+        "chain_length": len(chain),
+        "schema_version": manifest.get("schema_version"),
+        "verified_at": datetime.now().isoformat(timespec="seconds"),
+        "file_problems": check_files(backup_root, chain, workers),
+        "failed_backups": sorted(table for table, entry in manifest["tables"].items() if not entry.get("ok")),
+        "tables": [],
+    }
+    names = sorted(table for table, entry in manifest["tables"].items() if entry.get("ok"))
+    columns = {table: [tuple(column) for column in manifest["tables"][table].get("columns") or ()]
+               or _columns_from_file(backup_root, chain, table) for table in names}
+
+    if database_url:
+        restored = backup_restore.restore_backup(backup_root, database_url, target["run_id"], workers, names)
+        errors = {result["table"]: result["error"] for result in restored if result.get("error")}
+
+        def run(table):
+            if table in errors:
+                return {"table": table, "problems": [f"還原失敗: {errors[table]}"]}
+            return verify_table(database_url, backup_root, chain, table, manifest["tables"][table],
+                                restore=False, columns=columns[table])
+    else:
+        own_dir = scratch_dir is None
+        scratch_dir = scratch_dir or tempfile.mkdtemp(prefix="verify_backup_")
+
+        def run(table):
+            url = f"sqlite:///{os.path.join(scratch_dir, table + '.db')}"
+            conn, _ = connect(url)
+            try:
+                create_scratch_table(conn, table, columns[table])
+            finally:
+                conn.close()
+            return verify_table(url, backup_root, chain, table, manifest["tables"][table], columns=columns[table])
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names) or 1)),
+                                thread_name_prefix="verify") as pool:
+            report["tables"] = list(pool.map(run, names))
+    finally:
+        if not database_url and own_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    mismatched = [result["table"] for result in report["tables"] if result["problems"]]
+    report["mismatched"] = mismatched
+    report["ok"] = not (mismatched or report["file_problems"] or report["failed_backups"])
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def print_report(report):
+    print(f"🔍 備份 {report['run_id']}（基準 {report['baseline']}，共 {report['chain_length']} 次）")
+    schema = report.get("schema_version") or {}
+    print(f"   結構版本: alembic={schema.get('alembic')} 欄位雜湊={str(schema.get('columns_sha256'))[:12]}")
+    for problem in report["file_problems"]:
+        print(f" ❌ {problem}")
+    for table in report["failed_backups"]:
+        print(f" ❌ {table}: 備份時失敗，沒有可還原的檔案")
+    print(f"   {'資料表':<28}{'預期筆數':>10}{'還原筆數':>10}  雜湊")
+    for result in report["tables"]:
+        marker = "❌" if result["problems"] else "✅"
+        hash_state = "—" if not result.get("expected_hash") else "相符" if not result["problems"] else "不符"
+        print(f" {marker} {result['table']:<28}{str(result.get('expected_rows')):>10}{str(result.get('rows')):>10}"
+              f"  {hash_state}  {'、'.join(result['problems'])}")
+    print(f"{'✅ 備份可完整還原' if report['ok'] else '❌ 備份驗證失敗'}（{report['seconds']} 秒）")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    parser = argparse.ArgumentParser(description="把備份還原到暫存資料庫，比對筆數與內容雜湊")
+    parser.add_argument("--backup-root", default="backups", help="streaming_backup 的備份根目錄")
+    parser.add_argument("--run", help="要驗證的備份（預設最新）")
+    parser.add_argument("--database-url", help="還原到這個資料庫（需已有資料表）；預設為暫存的本地 SQLite")
+    parser.add_argument("--workers", type=int, default=streaming_backup.DEFAULT_WORKERS)
+    parser.add_argument("--gcs", action="store_true",
+                        help=f"從物件儲存（OBJECT_STORE，預設 GCS）的 {GCS_RUNS_PREFIX}/ 下載備份，並上傳驗證結果")
+    parser.add_argument("--output", help="另存 JSON 報告")
+    args = parser.parse_args(argv)
+
+    store = None
+    download_dir = None
+    backup_root = args.backup_root
+    run_id = args.run
+    if args.gcs:
+        store = object_store.from_env()
+        download_dir = backup_root = tempfile.mkdtemp(prefix="verify_download_")
+        run_id = download_chain(store, GCS_RUNS_PREFIX, download_dir, run_id)
+
+    try:
+        report = verify_backup(backup_root, run_id, args.database_url, args.workers)
+    finally:
+        if download_dir:
+            shutil.rmtree(download_dir, ignore_errors=True)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+    if store is not None:
+        store.upload_bytes(json.dumps(report, ensure_ascii=False, indent=2), GCS_STATUS_PATH,
+                           content_type="application/json")
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())